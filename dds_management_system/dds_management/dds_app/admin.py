@@ -1,5 +1,167 @@
+from datetime import date
+
+from django.conf import settings
 from django.contrib import admin
-from .models import Status, TransactionType, Category, Subcategory, Transaction
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Max, Min
+from django.utils.functional import cached_property
+
+from .budgets import refresh_budget
+from .cache import make_key
+from .models import (
+    Organization, Status, TransactionType, Category, Subcategory, Transaction, Budget, MonthlyAggregate,
+    SubcategoryStats, AmountAnomaly, ExchangeRate,
+)
+from .tenancy import scope
+
+# Режим производительности списка транзакций в админке (DDS_ADMIN_PERFORMANCE_MODE,
+# по умолчанию включен): счетчик строк из статистики или кэша, без общего
+# COUNT(*), фильтр по периоду вместо date_hierarchy и списки фильтров из
+# кэша. При выключенном режиме список работает как стандартный: точные
+# счетчики и date_hierarchy.
+#
+# Счетчики и списки для фильтров кэшируются под поколениями моделей
+# (dds_app.cache), поэтому сбрасываются первой же записью в таблицу и не
+# требуют отдельной инвалидации.
+
+# Начиная с этого размера таблицы без фильтров показывается оценка из
+# статистики базы, а не точный COUNT(*)
+ESTIMATE_THRESHOLD = 100000
+
+
+def performance_mode():
+    return getattr(settings, 'DDS_ADMIN_PERFORMANCE_MODE', True)
+
+
+def estimate_count(model):
+    """Оценка числа строк таблицы из статистики планировщика (None, если ее нет)."""
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'sqlite':
+            # sqlite_stat1 заполняется командой ANALYZE
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    if not row or row[0] is None:
+        return None
+    value = int(str(row[0]).split()[0])
+    return value if value > 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор без COUNT(*) на каждую страницу.
+
+    Для списка без фильтров на больших таблицах берется оценка из статистики,
+    в остальных случаях - точный счетчик, закэшированный до следующей записи
+    в модель.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        model = queryset.model
+        if not queryset.query.where:
+            estimate = estimate_count(model)
+            if estimate is not None and estimate >= ESTIMATE_THRESHOLD:
+                return estimate
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        key = make_key('admin_count', f'{sql}|{params!r}', (model,))
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count)
+        return count
+
+
+def get_date_range(model, field):
+    """(min, max) значения поля дат: два поиска по индексу, кэшируется до записи в модель."""
+    key = make_key('admin_date_range', f'{model._meta.label_lower}.{field}', (model,))
+    bounds = cache.get(key)
+    if bounds is None:
+        result = model.objects.aggregate(first=Min(field), last=Max(field))
+        bounds = (result['first'], result['last'])
+        cache.set(key, bounds)
+    return bounds
+
+
+class PeriodListFilter(admin.SimpleListFilter):
+    """Замена date_hierarchy: годы из диапазона дат, для выбранного года - месяцы.
+
+    date_hierarchy строит варианты запросами DISTINCT по всей таблице;
+    здесь они выводятся из минимальной и максимальной даты.
+    """
+    title = 'период'
+    parameter_name = 'period'
+    field_name = 'date'
+
+    def lookups(self, request, model_admin):
+        first, last = get_date_range(model_admin.model, self.field_name)
+        if first is None:
+            return []
+        choices = []
+        selected_year = (self.value() or '')[:4]
+        for year in range(last.year, first.year - 1, -1):
+            choices.append((str(year), str(year)))
+            if str(year) == selected_year:
+                months = range(
+                    last.month if year == last.year else 12,
+                    (first.month if year == first.year else 1) - 1,
+                    -1,
+                )
+                choices.extend((f'{year}-{month:02d}', f'{year}-{month:02d}') for month in months)
+        return choices
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if not value:
+            return queryset
+        try:
+            if len(value) == 4:
+                start = date(int(value), 1, 1)
+                end = date(start.year + 1, 1, 1)
+            else:
+                start = date(int(value[:4]), int(value[5:7]), 1)
+                end = date(start.year + start.month // 12, start.month % 12 + 1, 1)
+        except ValueError:
+            return queryset.none()
+        # Диапазон, а не __year/__month, чтобы работал индекс по дате
+        return queryset.filter(**{f'{self.field_name}__gte': start, f'{self.field_name}__lt': end})
+
+
+class CachedRelatedFieldListFilter(admin.RelatedFieldListFilter):
+    """Фильтр по внешнему ключу со списком значений из кэша справочника."""
+
+    def field_choices(self, field, request, model_admin):
+        related_model = field.remote_field.model
+        ordering = self.field_admin_ordering(field, request, model_admin)
+        key = make_key('admin_choices', f'{related_model._meta.label_lower}:{ordering}', (related_model,))
+        choices = cache.get(key)
+        if choices is None:
+            choices = field.get_choices(include_blank=False, ordering=ordering)
+            cache.set(key, choices)
+        return choices
+
+
+# Организации видны целиком; остальные модели - только текущей организации
+# (TenantManager; организация запоминается в сессии при переходе на страницу
+# приложения с ?organization=<код>)
+@admin.register(Organization)
+class OrganizationAdmin(admin.ModelAdmin):
+    list_display = ['name', 'slug']
+    search_fields = ['name', 'slug']
+    prepopulated_fields = {'slug': ['name']}
 
 @admin.register(Status)
 class StatusAdmin(admin.ModelAdmin):
@@ -25,7 +187,91 @@ class SubcategoryAdmin(admin.ModelAdmin):
 
 @admin.register(Transaction)
 class TransactionAdmin(admin.ModelAdmin):
-    list_display = ['date', 'transaction_type', 'category', 'subcategory', 'amount', 'status']
+    list_display = ['date', 'transaction_type', 'category', 'subcategory', 'amount', 'currency', 'base_amount',
+                    'status']
     list_filter = ['date', 'transaction_type', 'status', 'category']
+    performance_list_filter = [
+        PeriodListFilter,
+        'date',
+        ('transaction_type', CachedRelatedFieldListFilter),
+        ('status', CachedRelatedFieldListFilter),
+        ('category', CachedRelatedFieldListFilter),
+    ]
+    list_select_related = ['transaction_type', 'category', 'subcategory', 'status']
     search_fields = ['comment', 'amount']
-    date_hierarchy = 'date'
\ No newline at end of file
+
+    # Настройки, зависящие от режима, читаются при каждом запросе
+
+    @property
+    def date_hierarchy(self):
+        return None if performance_mode() else 'date'
+
+    @property
+    def show_full_result_count(self):
+        # Общее число строк без фильтров - лишний COUNT(*) на каждой странице
+        return not performance_mode()
+
+    def get_list_filter(self, request):
+        return self.performance_list_filter if performance_mode() else self.list_filter
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        paginator = EstimatedCountPaginator if performance_mode() else self.paginator
+        return paginator(queryset, per_page, orphans, allow_empty_first_page)
+
+@admin.register(ExchangeRate)
+class ExchangeRateAdmin(admin.ModelAdmin):
+    # Изменение курса пересчитывает суммы затронутых транзакций (dds_app.currencies)
+    list_display = ['currency', 'date', 'rate']
+    list_filter = ['currency']
+    date_hierarchy = 'date'
+
+@admin.register(Budget)
+class BudgetAdmin(admin.ModelAdmin):
+    list_display = ['month', 'category', 'subcategory', 'amount', 'overrun_at']
+    list_filter = ['month', ('category', CachedRelatedFieldListFilter)]
+    list_select_related = ['category', 'subcategory']
+    # Признак превышения ведется по итогам (dds_app.budgets)
+    readonly_fields = ['overrun_at']
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        refresh_budget(obj)
+
+@admin.register(MonthlyAggregate)
+class MonthlyAggregateAdmin(admin.ModelAdmin):
+    list_display = ['month', 'category', 'subcategory', 'total_cents', 'count']
+    list_filter = ['month']
+    list_select_related = ['category', 'subcategory']
+
+    def get_queryset(self, request):
+        return scope(super().get_queryset(request), 'category__organization')
+
+    # Итоги ведутся автоматически, руками не правятся
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(SubcategoryStats)
+class SubcategoryStatsAdmin(admin.ModelAdmin):
+    list_display = ['subcategory', 'count', 'mean', 'min_amount', 'max_amount']
+    list_select_related = ['subcategory']
+    search_fields = ['subcategory__name']
+
+    def get_queryset(self, request):
+        return scope(super().get_queryset(request), 'subcategory__organization')
+
+    # Статистика ведется автоматически (dds_app.anomalies)
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(AmountAnomaly)
+class AmountAnomalyAdmin(admin.ModelAdmin):
+    list_display = ['transaction', 'z_score', 'mean', 'std', 'detected_at', 'reviewed_at']
+    list_filter = [('reviewed_at', admin.EmptyFieldListFilter)]
+    list_select_related = ['transaction__transaction_type']
+    raw_id_fields = ['transaction']
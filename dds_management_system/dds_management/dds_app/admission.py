@@ -0,0 +1,194 @@
+"""Ограничение одновременных запросов (admission control).
+
+SQLite допускает одного писателя, поэтому всплеск автоматических записей
+(транзакции, API) упирается в блокировки базы, и задержки растут для всех.
+Запросы к дорогим точкам проходят через пулы с ограничением числа
+одновременно выполняемых и ограниченной очередью ожидания: при переполнении
+клиент сразу получает 503 (страницы) или 429 (API и скрипты) с Retry-After,
+а не ждет блокировку базы.
+
+Интерактивные запросы (страницы из браузера) обслуживаются первыми: пока их
+ждет хотя бы один, фоновые клиенты не занимают освободившиеся места, кроме
+того, часть мест пула (reserved) и половина очереди им недоступны.
+
+Пулы и счетчики - в памяти процесса: у каждого воркера свои ограничения.
+"""
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.urls import Resolver404, resolve
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+DEFAULT_POOLS = {
+    # Все записи идут в один пул: писатель у SQLite один
+    'write': {'limit': 2, 'queue': 20, 'timeout': 5.0, 'reserved': 1},
+    'api': {'limit': 4, 'queue': 20, 'timeout': 2.0, 'reserved': 0},
+    'export': {'limit': 1, 'queue': 4, 'timeout': 1.0, 'reserved': 0},
+}
+# Имя маршрута -> пул; None - без ограничений
+DEFAULT_ENDPOINTS = {
+    'ledger_snapshot': 'export',
+    'changes_snapshot': 'export',
+    'autocomplete': None,
+    'job_status': None,
+    'cache_stats': None,
+    'admission_stats': None,
+}
+
+REJECT_QUEUE_FULL = 'queue_full'
+REJECT_TIMEOUT = 'timeout'
+
+
+class Pool:
+    def __init__(self, name, limit, queue, timeout, reserved=0):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.reserved = min(reserved, limit - 1)
+        self.active = 0
+        self.waiting = {True: 0, False: 0}
+        self.max_waiting = 0
+        self.admitted = 0
+        self.rejected = {REJECT_QUEUE_FULL: 0, REJECT_TIMEOUT: 0}
+        self.wait_time = 0.0
+        # Среднее время обслуживания (экспоненциальное) - для Retry-After
+        self.service_time = 0.0
+        self._condition = threading.Condition()
+
+    def can_enter(self, interactive):
+        if interactive:
+            return self.active < self.limit
+        return self.active < self.limit - self.reserved and not self.waiting[True]
+
+    def acquire(self, interactive):
+        """Занимает место в пуле. Возвращает None или причину отказа."""
+        with self._condition:
+            if not self.can_enter(interactive):
+                queued = self.waiting[True] + self.waiting[False]
+                bulk_limit = self.queue // 2
+                if queued >= self.queue or (not interactive and self.waiting[False] >= bulk_limit):
+                    self.rejected[REJECT_QUEUE_FULL] += 1
+                    return REJECT_QUEUE_FULL
+                started = time.monotonic()
+                deadline = started + self.timeout
+                self.waiting[interactive] += 1
+                self.max_waiting = max(self.max_waiting, queued + 1)
+                try:
+                    while not self.can_enter(interactive):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.rejected[REJECT_TIMEOUT] += 1
+                            return REJECT_TIMEOUT
+                        self._condition.wait(remaining)
+                finally:
+                    self.waiting[interactive] -= 1
+                    self.wait_time += time.monotonic() - started
+                    # Освободившееся место могло достаться не нам - разбудить остальных
+                    self._condition.notify_all()
+            self.active += 1
+            self.admitted += 1
+            return None
+
+    def release(self, duration):
+        with self._condition:
+            self.active -= 1
+            self.service_time = duration if not self.service_time else 0.8 * self.service_time + 0.2 * duration
+            self._condition.notify_all()
+
+    def retry_after(self):
+        """Оценка в секундах, когда очередь успеет разойтись."""
+        queued = self.waiting[True] + self.waiting[False] + 1
+        return max(1, math.ceil(self.service_time * queued / self.limit))
+
+    def stats(self):
+        with self._condition:
+            return {
+                'limit': self.limit,
+                'reserved': self.reserved,
+                'queue': self.queue,
+                'active': self.active,
+                'waiting_interactive': self.waiting[True],
+                'waiting_bulk': self.waiting[False],
+                'max_waiting': self.max_waiting,
+                'admitted': self.admitted,
+                'rejected': dict(self.rejected),
+                'avg_wait_ms': round(self.wait_time * 1000 / self.admitted, 2) if self.admitted else 0,
+                'avg_service_ms': round(self.service_time * 1000, 2),
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_config():
+    return (
+        getattr(settings, 'DDS_ADMISSION_POOLS', DEFAULT_POOLS),
+        getattr(settings, 'DDS_ADMISSION_ENDPOINTS', DEFAULT_ENDPOINTS),
+    )
+
+
+def get_pool(name):
+    config = get_config()[0][name]
+    key = (name, tuple(sorted(config.items())))
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(key, Pool(name, **config))
+    return pool
+
+
+def get_stats():
+    pools = get_config()[0]
+    return {name: get_pool(name).stats() for name in pools}
+
+
+def reset_pools():
+    with _pools_lock:
+        _pools.clear()
+
+
+def is_interactive(request):
+    """Страница из браузера (а не API или скрипт с Accept: */*)."""
+    return not request.path_info.startswith('/api/') and 'text/html' in request.headers.get('Accept', '')
+
+
+def classify(request):
+    """Пул для запроса или None, если запрос не ограничивается."""
+    pools, endpoints = get_config()
+    if not pools:
+        return None
+    try:
+        url_name = resolve(request.path_info).url_name
+    except Resolver404:
+        return None
+    if url_name in endpoints:
+        name = endpoints[url_name]
+    elif request.method not in SAFE_METHODS:
+        name = 'write'
+    elif request.path_info.startswith('/api/'):
+        name = 'api'
+    else:
+        name = None
+    return get_pool(name) if name in pools else None
+
+
+def reject(pool, reason, interactive):
+    retry_after = pool.retry_after()
+    if interactive:
+        response = HttpResponse(
+            'Сервер перегружен, повторите попытку через несколько секунд.',
+            status=503, content_type='text/plain; charset=utf-8',
+        )
+    else:
+        response = JsonResponse(
+            {'error': 'Слишком много запросов', 'reason': reason, 'retry_after': retry_after}, status=429,
+        )
+    response['Retry-After'] = str(retry_after)
+    return response
+
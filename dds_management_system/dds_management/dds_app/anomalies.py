@@ -0,0 +1,277 @@
+import math
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Max, Min
+from django.db.transaction import atomic
+
+from .models import AmountAnomaly, SubcategoryStats, Transaction
+
+# Необычно большие суммы.
+#
+# Для каждой подкатегории хранится распределение сумм (SubcategoryStats):
+# число, среднее и m2 по алгоритму Уэлфорда. Запись транзакции добавляет
+# сумму в распределение, удаление и изменение - вычитают прежнюю (обратный
+# шаг того же алгоритма), поэтому проверка стоит O(1) и история не
+# перечитывается. Минимум и максимум при удалении крайнего значения
+# находятся поиском по индексу (subcategory, base_amount). Все суммы - в
+# рублях (base_amount), чтобы транзакции в разных валютах были сравнимы.
+#
+# Новая сумма сравнивается с распределением без нее самой: если она больше
+# среднего на DDS_ANOMALY_Z стандартных отклонений (и в подкатегории не
+# меньше DDS_ANOMALY_MIN_SAMPLES транзакций), транзакция попадает в очередь
+# проверки (AmountAnomaly).
+#
+# Массовые операции сигналов не отправляют: для них есть apply_transactions,
+# для полного пересчета - rebuild_stats (команда rebuild_amount_stats).
+
+DEFAULT_Z = 3.0
+DEFAULT_MIN_SAMPLES = 10
+
+
+def get_threshold():
+    return getattr(settings, 'DDS_ANOMALY_Z', DEFAULT_Z)
+
+
+def get_min_samples():
+    return getattr(settings, 'DDS_ANOMALY_MIN_SAMPLES', DEFAULT_MIN_SAMPLES)
+
+
+def add_value(count, mean, m2, value):
+    count += 1
+    delta = value - mean
+    mean += delta / count
+    m2 += delta * (value - mean)
+    return count, mean, m2
+
+
+def remove_value(count, mean, m2, value):
+    if count <= 1:
+        return 0, 0.0, 0.0
+    new_mean = (count * mean - value) / (count - 1)
+    m2 -= (value - mean) * (value - new_mean)
+    # Ошибка округления не должна давать отрицательную дисперсию
+    return count - 1, new_mean, max(m2, 0.0)
+
+
+def merge(first, second):
+    """Объединение двух распределений (count, mean, m2) - формула Чана."""
+    count_a, mean_a, m2_a = first
+    count_b, mean_b, m2_b = second
+    count = count_a + count_b
+    if not count:
+        return 0, 0.0, 0.0
+    delta = mean_b - mean_a
+    mean = mean_a + delta * count_b / count
+    return count, mean, m2_a + m2_b + delta * delta * count_a * count_b / count
+
+
+def std(count, m2):
+    return math.sqrt(m2 / (count - 1)) if count > 1 else 0.0
+
+
+def z_score(stats, value):
+    """Отклонение суммы от распределения в стандартных отклонениях (None - мало данных)."""
+    if stats is None or stats.count < get_min_samples():
+        return None
+    deviation = std(stats.count, stats.m2)
+    if deviation == 0:
+        return math.inf if value > stats.mean else 0.0
+    return (value - stats.mean) / deviation
+
+
+def is_anomaly(score):
+    return score is not None and score >= get_threshold()
+
+
+def as_amount(value):
+    # Сумма могла быть присвоена числом с плавающей точкой
+    return Decimal(str(value)).quantize(Decimal('0.01'))
+
+
+def get_stats(subcategory_id):
+    stats = SubcategoryStats.objects.select_for_update().filter(subcategory_id=subcategory_id).first()
+    return stats or SubcategoryStats(subcategory_id=subcategory_id)
+
+
+def refresh_bounds(stats):
+    bounds = Transaction.objects.filter(subcategory_id=stats.subcategory_id).aggregate(
+        low=Min('base_amount'), high=Max('base_amount'),
+    )
+    stats.min_amount, stats.max_amount = bounds['low'], bounds['high']
+
+
+def include(stats, amount):
+    stats.count, stats.mean, stats.m2 = add_value(stats.count, stats.mean, stats.m2, float(amount))
+    if stats.min_amount is None or amount < stats.min_amount:
+        stats.min_amount = amount
+    if stats.max_amount is None or amount > stats.max_amount:
+        stats.max_amount = amount
+
+
+def exclude(stats, amount):
+    """Вычитает сумму. Вызывается после записи в таблицу, поэтому крайнее
+    значение, если ушло оно, берется из индекса уже без этой строки."""
+    stats.count, stats.mean, stats.m2 = remove_value(stats.count, stats.mean, stats.m2, float(amount))
+    if not stats.count:
+        stats.min_amount = stats.max_amount = None
+    elif amount in (stats.min_amount, stats.max_amount):
+        refresh_bounds(stats)
+
+
+def save_stats(stats):
+    # Новая строка статистики - сразу INSERT, без пробного UPDATE
+    stats.save(force_insert=stats._state.adding)
+
+
+def flag(transaction, stats, score, created):
+    """Ставит транзакцию в очередь проверки или снимает с нее флаг."""
+    if is_anomaly(score):
+        AmountAnomaly.objects.update_or_create(transaction=transaction, defaults={
+            'z_score': min(score, 1e9), 'mean': stats.mean, 'std': std(stats.count, stats.m2), 'reviewed_at': None,
+        })
+        return True
+    if not created:
+        AmountAnomaly.objects.filter(transaction=transaction).delete()
+    return False
+
+
+def record_save(transaction, previous):
+    """Учитывает сохранение транзакции; previous - прежние значения полей или None.
+
+    Возвращает True, если сумма признана необычной.
+    """
+    amount = as_amount(transaction.base_amount)
+    changed = previous is None or (
+        previous['subcategory_id'] != transaction.subcategory_id or previous['base_amount'] != amount
+    )
+    if not changed:
+        return None
+    with atomic():
+        stats = get_stats(transaction.subcategory_id)
+        if previous is not None:
+            if previous['subcategory_id'] == transaction.subcategory_id:
+                old_stats = stats
+            else:
+                old_stats = get_stats(previous['subcategory_id'])
+            exclude(old_stats, previous['base_amount'])
+            if old_stats is not stats:
+                save_stats(old_stats)
+        score = z_score(stats, float(amount))
+        include(stats, amount)
+        save_stats(stats)
+        return flag(transaction, stats, score, created=previous is None)
+
+
+def record_delete(transaction):
+    with atomic():
+        stats = get_stats(transaction.subcategory_id)
+        if stats.pk is None or not stats.count:
+            return
+        exclude(stats, as_amount(transaction.base_amount))
+        save_stats(stats)
+
+
+def apply_transactions(transactions):
+    """Учитывает транзакции, созданные в обход сигналов (bulk_create).
+
+    Суммы пачки сравниваются с распределением до нее.
+    """
+    by_subcategory = {}
+    for transaction in transactions:
+        by_subcategory.setdefault(transaction.subcategory_id, []).append(transaction)
+    anomalies = []
+    with atomic():
+        for subcategory_id, items in by_subcategory.items():
+            stats = get_stats(subcategory_id)
+            for transaction in items:
+                score = z_score(stats, float(transaction.base_amount))
+                if is_anomaly(score):
+                    anomalies.append(AmountAnomaly(
+                        transaction=transaction, z_score=min(score, 1e9), mean=stats.mean,
+                        std=std(stats.count, stats.m2),
+                    ))
+            amounts = [as_amount(transaction.base_amount) for transaction in items]
+            batch = (0, 0.0, 0.0)
+            for amount in amounts:
+                batch = add_value(*batch, float(amount))
+            stats.count, stats.mean, stats.m2 = merge((stats.count, stats.mean, stats.m2), batch)
+            stats.min_amount = min(amounts if stats.min_amount is None else [stats.min_amount, *amounts])
+            stats.max_amount = max(amounts if stats.max_amount is None else [stats.max_amount, *amounts])
+            save_stats(stats)
+        AmountAnomaly.objects.bulk_create(anomalies, batch_size=1000)
+    return anomalies
+
+
+def compute_stats(rows):
+    """Распределения по строкам (subcategory_id, base_amount) - один проход, Уэлфорд."""
+    result = {}
+    for subcategory_id, amount in rows:
+        count, mean, m2, low, high = result.get(subcategory_id, (0, 0.0, 0.0, amount, amount))
+        count, mean, m2 = add_value(count, mean, m2, float(amount))
+        result[subcategory_id] = (count, mean, m2, min(low, amount), max(high, amount))
+    return result
+
+
+def rebuild_stats(reflag=False):
+    """Пересчитывает распределения по всей таблице транзакций.
+
+    С reflag=True заново проверяет все транзакции по итоговым распределениям
+    (без самой транзакции); отметки о проверке сохраняются у тех, кто остался
+    в очереди.
+    """
+    rows = Transaction.objects.order_by().values_list('subcategory_id', 'base_amount').iterator(chunk_size=5000)
+    computed = compute_stats(rows)
+    with atomic():
+        SubcategoryStats.objects.all().delete()
+        SubcategoryStats.objects.bulk_create([
+            SubcategoryStats(subcategory_id=subcategory_id, count=count, mean=mean, m2=m2,
+                             min_amount=low, max_amount=high)
+            for subcategory_id, (count, mean, m2, low, high) in computed.items()
+        ], batch_size=1000)
+        flagged = 0
+        if reflag:
+            flagged = reflag_all(computed)
+    return len(computed), flagged
+
+
+def refresh_stats(subcategory_ids):
+    """Пересчитывает распределения нескольких подкатегорий (после пересчета курсов).
+
+    Флаги уже проверенных транзакций не меняются.
+    """
+    rows = (
+        Transaction._base_manager.filter(subcategory_id__in=subcategory_ids).order_by()
+        .values_list('subcategory_id', 'base_amount').iterator(chunk_size=5000)
+    )
+    computed = compute_stats(rows)
+    with atomic():
+        SubcategoryStats.objects.filter(subcategory_id__in=subcategory_ids).delete()
+        SubcategoryStats.objects.bulk_create([
+            SubcategoryStats(subcategory_id=subcategory_id, count=count, mean=mean, m2=m2,
+                             min_amount=low, max_amount=high)
+            for subcategory_id, (count, mean, m2, low, high) in computed.items()
+        ], batch_size=1000)
+    return len(computed)
+
+
+def reflag_all(computed):
+    reviewed = dict(
+        AmountAnomaly.objects.filter(reviewed_at__isnull=False).values_list('transaction_id', 'reviewed_at')
+    )
+    AmountAnomaly.objects.all().delete()
+    anomalies = []
+    rows = Transaction.objects.order_by().values_list('pk', 'subcategory_id', 'base_amount').iterator(chunk_size=5000)
+    for pk, subcategory_id, amount in rows:
+        count, mean, m2, _, _ = computed[subcategory_id]
+        # Распределение без самой транзакции
+        stats = SubcategoryStats(subcategory_id=subcategory_id)
+        stats.count, stats.mean, stats.m2 = remove_value(count, mean, m2, float(amount))
+        score = z_score(stats, float(amount))
+        if is_anomaly(score):
+            anomalies.append(AmountAnomaly(
+                transaction_id=pk, z_score=min(score, 1e9), mean=stats.mean, std=std(stats.count, stats.m2),
+                reviewed_at=reviewed.get(pk),
+            ))
+    AmountAnomaly.objects.bulk_create(anomalies, batch_size=1000)
+    return len(anomalies)
@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class DdsAppConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "dds_app"
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_migrate
+
+        from . import signals  # noqa: F401
+        from .metrics import install_query_counter
+        from .tenancy import reset
+
+        # После миграций и очистки базы (flush) id организаций могли измениться
+        post_migrate.connect(reset, sender=self, dispatch_uid='dds_organizations_migrate')
+        # Число SQL-запросов на запрос для /metrics
+        connection_created.connect(install_query_counter, dispatch_uid='dds_metrics_queries')
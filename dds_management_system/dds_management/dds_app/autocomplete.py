@@ -0,0 +1,217 @@
+"""Автодополнение по названиям категорий и подкатегорий.
+
+Индекс строится в памяти процесса: названия, приведенные к нижнему регистру,
+отсортированы, поэтому поиск по префиксу - двоичный поиск (bisect) по всему
+справочнику или по записям одного родителя (тип операции для категорий,
+категория для подкатегорий). Поиск по подстроке в пределах родителя
+просматривает его записи, по всему большому справочнику - идет через
+индекс триграмм.
+
+Индекс перестраивается, когда меняется поколение модели (dds_app.cache):
+запись в справочник в любом процессе видна здесь со следующего запроса.
+У каждой организации свой индекс со своим поколением.
+"""
+import threading
+from array import array
+from bisect import bisect_left
+
+from django import forms
+from django.conf import settings
+from django.urls import reverse
+
+from .cache import get_generation
+from .models import Category, Subcategory
+from .tenancy import current_organization_id
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+# С какого размера справочника формы переключаются с <select> на автодополнение
+DEFAULT_THRESHOLD = 500
+# До такого размера подстрока ищется перебором без индекса триграмм
+TRIGRAM_MIN_SIZE = 5000
+
+
+def normalize(text):
+    return text.casefold().replace('ё', 'е')
+
+
+def trigrams(text):
+    return {text[index:index + 3] for index in range(len(text) - 2)}
+
+
+class Snapshot:
+    """Неизменяемый индекс справочника на момент построения."""
+
+    def __init__(self, rows):
+        rows = sorted((normalize(name), name, pk, scope) for pk, name, scope in rows)
+        self.keys = [row[0] for row in rows]
+        self.names = [row[1] for row in rows]
+        self.pks = array('q', (row[2] for row in rows))
+        self.positions = {pk: position for position, pk in enumerate(self.pks)}
+        # Позиции записей каждого родителя, в порядке сортировки
+        self.scopes = {}
+        for position, row in enumerate(rows):
+            self.scopes.setdefault(row[3], array('I')).append(position)
+        self.scope_keys = {}
+        # Индекс триграмм большого справочника строится в фоне (около секунды
+        # на 100 тысяч записей); до его готовности подстрока ищется перебором
+        self.trigrams = None
+        self._trigrams_ready = threading.Event()
+        if len(self.keys) > TRIGRAM_MIN_SIZE:
+            threading.Thread(target=self.build_trigrams, daemon=True).start()
+        else:
+            self._trigrams_ready.set()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def build_trigrams(self):
+        postings = {}
+        for position, key in enumerate(self.keys):
+            for trigram in trigrams(key):
+                postings.setdefault(trigram, array('I')).append(position)
+        self.trigrams = postings
+        self._trigrams_ready.set()
+
+    def wait_trigrams(self, timeout=None):
+        return self._trigrams_ready.wait(timeout)
+
+    def get_scope_keys(self, scope):
+        keys = self.scope_keys.get(scope)
+        if keys is None:
+            keys = self.scope_keys[scope] = [self.keys[position] for position in self.scopes.get(scope, ())]
+        return keys
+
+    def prefix(self, query, scope, limit):
+        if scope is None:
+            keys, positions = self.keys, None
+        else:
+            keys, positions = self.get_scope_keys(scope), self.scopes.get(scope, ())
+        result = []
+        index = bisect_left(keys, query)
+        while index < len(keys) and len(result) < limit and keys[index].startswith(query):
+            result.append(index if positions is None else positions[index])
+            index += 1
+        return result
+
+    def substring(self, query, scope, limit, exclude):
+        if scope is not None:
+            candidates = self.scopes.get(scope, ())
+        elif len(self.keys) <= TRIGRAM_MIN_SIZE:
+            candidates = range(len(self.keys))
+        elif len(query) < 3:
+            # Одна-две буквы по большому справочнику ищутся только как префикс
+            return []
+        elif self.trigrams is None:
+            candidates = range(len(self.keys))
+        else:
+            # Перебираются записи с самой редкой триграммой запроса
+            candidates = None
+            for trigram in trigrams(query):
+                posting = self.trigrams.get(trigram)
+                if posting is None:
+                    return []
+                if candidates is None or len(posting) < len(candidates):
+                    candidates = posting
+        result = []
+        for position in candidates:
+            if position not in exclude and query in self.keys[position]:
+                result.append(position)
+                if len(result) == limit:
+                    break
+        return result
+
+    def search(self, query, scope=None, limit=DEFAULT_LIMIT):
+        query = normalize(query.strip())
+        found = self.prefix(query, scope, limit)
+        if query and len(found) < limit:
+            found += self.substring(query, scope, limit - len(found), set(found))
+        return [{'id': self.pks[position], 'name': self.names[position]} for position in found]
+
+    def get_name(self, pk):
+        position = self.positions.get(pk)
+        return self.names[position] if position is not None else None
+
+
+class AutocompleteIndex:
+    def __init__(self, model, scope_field):
+        self.model = model
+        self.scope_field = scope_field
+        # id организации -> (поколение, снимок)
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def get_snapshot(self):
+        organization_id = current_organization_id()
+        generation = get_generation(self.model)
+        cached = self._snapshots.get(organization_id)
+        if cached is None or cached[0] != generation:
+            with self._lock:
+                cached = self._snapshots.get(organization_id)
+                if cached is None or cached[0] != generation:
+                    rows = self.model.objects.filter(organization_id=organization_id).values_list(
+                        'pk', 'name', self.scope_field,
+                    )
+                    cached = self._snapshots[organization_id] = (generation, Snapshot(rows.iterator(chunk_size=10000)))
+        return cached[1]
+
+    def search(self, query, scope=None, limit=DEFAULT_LIMIT):
+        return self.get_snapshot().search(query, scope, limit)
+
+    def get_name(self, pk):
+        return self.get_snapshot().get_name(pk)
+
+    def __len__(self):
+        return len(self.get_snapshot())
+
+
+# Имя индекса -> (индекс, параметр запроса с id родителя, как в остальных /api/)
+INDEXES = {
+    'category': (AutocompleteIndex(Category, 'transaction_type_id'), 'transaction_type_id'),
+    'subcategory': (AutocompleteIndex(Subcategory, 'category_id'), 'category_id'),
+}
+
+
+def get_index(name):
+    return INDEXES[name][0]
+
+
+def get_threshold():
+    return getattr(settings, 'DDS_AUTOCOMPLETE_THRESHOLD', DEFAULT_THRESHOLD)
+
+
+def use_autocomplete(name):
+    return len(get_index(name)) > get_threshold()
+
+
+class AutocompleteWidget(forms.Widget):
+    """Текстовое поле с подсказками вместо <select> со всем справочником.
+
+    Выбранный id хранится в скрытом поле с именем поля формы; scope_id - id
+    элемента страницы, значение которого ограничивает подсказки.
+    """
+    template_name = 'dds_app/widgets/autocomplete.html'
+
+    def __init__(self, index_name, scope_id=None, attrs=None):
+        super().__init__(attrs)
+        self.index_name = index_name
+        self.scope_id = scope_id
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        label = ''
+        if value not in (None, ''):
+            try:
+                label = get_index(self.index_name).get_name(int(value)) or ''
+            except (TypeError, ValueError):
+                pass
+        context['widget'].update({
+            'label': label,
+            'url': reverse('autocomplete', args=[self.index_name]),
+            'scope_id': self.scope_id or '',
+            'scope_param': INDEXES[self.index_name][1],
+        })
+        return context
+
+    def id_for_label(self, id_):
+        return f'{id_}_search' if id_ else id_
@@ -0,0 +1,196 @@
+from datetime import date
+from decimal import Decimal
+
+from django.db import IntegrityError
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncMonth
+from django.db.transaction import atomic
+from django.utils import timezone
+
+from .models import Budget, MonthlyAggregate, Transaction
+
+# Бюджеты и факт по месяцам.
+#
+# Факт хранится в MonthlyAggregate и меняется на разницу при каждой записи
+# транзакции (сигналы в dds_app.signals): две строки итогов - подкатегория и
+# категория целиком. Там же проверяются не больше двух бюджетов этого
+# месяца, поэтому запись транзакции стоит O(1) запросов, а панель бюджетов
+# читает только итоги и не обращается к таблице транзакций. Суммы - в
+# рублях (base_amount, см. dds_app.currencies).
+#
+# Массовые операции сигналов не отправляют: для них есть apply_transactions,
+# а для полного пересчета - rebuild_aggregates (команда rebuild_budget_aggregates).
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def to_cents(amount):
+    return int(Decimal(amount).quantize(Decimal('0.01')) * 100)
+
+
+def from_cents(cents):
+    return Decimal(cents).scaleb(-2)
+
+
+def contributions(day, category_id, subcategory_id, cents, count):
+    """Вклад в итоги: {(месяц, категория, подкатегория или None): (копейки, число транзакций)}."""
+    month = month_start(day)
+    return {
+        (month, category_id, subcategory_id): (cents, count),
+        (month, category_id, None): (cents, count),
+    }
+
+
+def transaction_contributions(transaction, sign=1):
+    return contributions(
+        transaction.date, transaction.category_id, transaction.subcategory_id,
+        sign * to_cents(transaction.base_amount), sign,
+    )
+
+
+def merge_deltas(target, deltas):
+    for key, (cents, count) in deltas.items():
+        total = target.get(key, (0, 0))
+        target[key] = (total[0] + cents, total[1] + count)
+    return target
+
+
+def apply_deltas(deltas):
+    """Применяет изменения итогов и проверяет бюджеты затронутых месяцев.
+
+    Возвращает бюджеты, превышенные именно этим изменением.
+    """
+    deltas = {key: value for key, value in deltas.items() if value != (0, 0)}
+    if not deltas:
+        return []
+    for (month, category_id, subcategory_id), (cents, count) in deltas.items():
+        lookup = {'month': month, 'category_id': category_id, 'subcategory_id': subcategory_id}
+        updated = MonthlyAggregate.objects.filter(**lookup).update(
+            total_cents=F('total_cents') + cents, count=F('count') + count,
+        )
+        if not updated:
+            try:
+                with atomic():
+                    MonthlyAggregate.objects.create(total_cents=cents, count=count, **lookup)
+            except IntegrityError:
+                # Строку итогов успел создать параллельный запрос
+                MonthlyAggregate.objects.filter(**lookup).update(
+                    total_cents=F('total_cents') + cents, count=F('count') + count,
+                )
+    return check_budgets(deltas.keys())
+
+
+def check_budgets(keys):
+    """Сверяет бюджеты с итогами по ключам (месяц, категория, подкатегория)."""
+    condition = Q()
+    for month, category_id, subcategory_id in keys:
+        condition |= Q(month=month, category_id=category_id, subcategory_id=subcategory_id)
+    budgets = list(Budget.objects.filter(condition).order_by())
+    if not budgets:
+        return []
+    actuals = get_actuals(condition)
+
+    overrun = []
+    now = timezone.now()
+    for budget in budgets:
+        actual = actuals.get((budget.month, budget.category_id, budget.subcategory_id), 0)
+        exceeded = actual > to_cents(budget.amount)
+        if exceeded and budget.overrun_at is None:
+            budget.overrun_at = now
+            Budget.objects.filter(pk=budget.pk).update(overrun_at=now)
+            overrun.append(budget)
+        elif not exceeded and budget.overrun_at is not None:
+            budget.overrun_at = None
+            Budget.objects.filter(pk=budget.pk).update(overrun_at=None)
+    return overrun
+
+
+def get_actuals(condition):
+    return {
+        (month, category_id, subcategory_id): cents
+        for month, category_id, subcategory_id, cents in MonthlyAggregate.objects.filter(condition).values_list(
+            'month', 'category_id', 'subcategory_id', 'total_cents'
+        )
+    }
+
+
+def refresh_budget(budget):
+    """Пересчитывает признак превышения одного бюджета (после его создания или изменения)."""
+    check_budgets([(budget.month, budget.category_id, budget.subcategory_id)])
+    budget.refresh_from_db(fields=['overrun_at'])
+    return budget
+
+
+def apply_transactions(transactions, sign=1):
+    """Учитывает в итогах транзакции, записанные в обход сигналов (bulk_create)."""
+    deltas = {}
+    for transaction in transactions:
+        merge_deltas(deltas, transaction_contributions(transaction, sign))
+    return apply_deltas(deltas)
+
+
+def group_totals(transactions, field='base_amount'):
+    """Итоги по месяцам одним GROUP BY по переданному QuerySet транзакций.
+
+    field - суммируемая колонка (в миграциях до появления валют - amount).
+    """
+    groups = (
+        transactions.annotate(month=TruncMonth('date'))
+        .values('month', 'category_id', 'subcategory_id')
+        .annotate(total=Sum(field), rows=Count('pk'))
+        .order_by()
+    )
+    totals = {}
+    for group in groups:
+        merge_deltas(totals, contributions(
+            group['month'], group['category_id'], group['subcategory_id'], to_cents(group['total']), group['rows'],
+        ))
+    return totals
+
+
+def rebuild_aggregates():
+    """Пересчитывает все итоги по таблице транзакций и признаки превышения бюджетов."""
+    totals = group_totals(Transaction.objects.all())
+    with atomic():
+        MonthlyAggregate.objects.all().delete()
+        MonthlyAggregate.objects.bulk_create([
+            MonthlyAggregate(month=month, category_id=category_id, subcategory_id=subcategory_id,
+                             total_cents=cents, count=count)
+            for (month, category_id, subcategory_id), (cents, count) in totals.items()
+        ], batch_size=1000)
+        Budget.objects.update(overrun_at=None)
+        keys = Budget.objects.values_list('month', 'category_id', 'subcategory_id').distinct()
+        check_budgets(list(keys))
+    return len(totals)
+
+
+def budget_rows(month):
+    """Бюджеты месяца с фактом, остатком и процентом исполнения (без запросов к транзакциям)."""
+    budgets = list(Budget.objects.filter(month=month).select_related('category', 'subcategory'))
+    # Итоги только по категориям этих бюджетов (своей организации)
+    actuals = get_actuals(Q(month=month, category_id__in={budget.category_id for budget in budgets}))
+    rows = []
+    for budget in budgets:
+        cents = actuals.get((budget.month, budget.category_id, budget.subcategory_id), 0)
+        actual = from_cents(cents)
+        rows.append({
+            'budget': budget,
+            'actual': actual,
+            'remaining': budget.amount - actual,
+            'percent': int(actual * 100 / budget.amount) if budget.amount else None,
+            'overrun': budget.overrun_at is not None,
+        })
+    rows.sort(key=lambda row: (row['budget'].category.name, row['budget'].subcategory is not None,
+                               row['budget'].subcategory.name if row['budget'].subcategory else ''))
+    return rows
+
+
+def parse_month(value):
+    """'YYYY-MM' -> первое число месяца; текущий месяц, если значение пустое или некорректное."""
+    try:
+        year, month = value.split('-')
+        return date(int(year), int(month), 1)
+    except (AttributeError, ValueError):
+        return month_start(timezone.localdate())
@@ -0,0 +1,161 @@
+import hashlib
+import threading
+import time
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+from django.dispatch import Signal
+from django.http import HttpResponse
+
+from .models import VersionCounter
+from .tenancy import current_organization_id
+
+# Поколения записей по моделям. Каждая запись в модель увеличивает ее счетчик,
+# а ключи кэша включают текущие значения счетчиков, поэтому инвалидация -
+# это один инкремент: устаревшие записи становятся недостижимыми и со временем
+# вытесняются из кэша.
+#
+# Источник истины - таблица VersionCounter в базе: процессы gunicorn
+# сверяют с ней локальную копию в начале каждого запроса (sync_generations),
+# так что запись в одном процессе видна в остальных уже на следующем запросе.
+#
+# Поколения ведутся отдельно для каждой организации (счетчик "<id>:<модель>"),
+# ключи кэша включают id организации: запись в одной организации не сбрасывает
+# кэш других, а запрос сверяет только счетчики своей организации, поэтому
+# его стоимость не зависит от числа организаций. Общие для всех модели
+# (GLOBAL_LABELS) имеют один счетчик без префикса.
+_generations = {}
+_lock = threading.Lock()
+
+# Отправляется при обнаружении чужой записи; labels - метки изменившихся моделей.
+# Подписчики сбрасывают собственные внутрипроцессные структуры.
+generations_changed = Signal()
+
+KEY_PREFIX = 'dds'
+GLOBAL_LABELS = ('dds_app.organization', 'dds_app.exchangerate')
+
+
+def model_label(model):
+    if isinstance(model, str):
+        return model
+    return model._meta.label_lower
+
+
+def tenant_prefix(organization_id=None):
+    return f'{organization_id or current_organization_id()}:'
+
+
+def counter_name(model, organization_id=None):
+    label = model_label(model)
+    if label in GLOBAL_LABELS:
+        return label
+    return tenant_prefix(organization_id) + label
+
+
+def bump_generation(model, organization_id=None):
+    """Новое поколение модели в организации organization_id (по умолчанию - текущей)."""
+    label = counter_name(model, organization_id)
+    # Значение растет не меньше чем до текущего времени в наносекундах: после
+    # отката транзакции счетчик не вернется к уже использованному поколению,
+    # под которым мог быть закэширован незафиксированный результат.
+    new_value = Greatest(F('value') + 1, time.time_ns())
+    if not VersionCounter.objects.filter(name=label).update(value=new_value):
+        counter, created = VersionCounter.objects.get_or_create(name=label, defaults={'value': time.time_ns()})
+        if not created:
+            VersionCounter.objects.filter(name=label).update(value=new_value)
+    value = VersionCounter.objects.values_list('value', flat=True).get(name=label)
+    with _lock:
+        _generations[label] = value
+    return value
+
+
+def sync_generations():
+    """Сверяет локальные поколения текущей организации и общие с таблицей
+    версий одним запросом (диапазон по уникальному индексу имени).
+
+    Возвращает метки моделей, которые изменились в других процессах.
+    """
+    changed = []
+    prefix = tenant_prefix()
+    # ';' - следующий за ':' символ: диапазон покрывает все имена с префиксом
+    counters = VersionCounter.objects.filter(
+        Q(name__gte=prefix, name__lt=prefix[:-1] + ';') | Q(name__in=GLOBAL_LABELS)
+    ).values_list('name', 'value')
+    with _lock:
+        for label, value in counters:
+            if _generations.get(label) != value:
+                _generations[label] = value
+                changed.append(label)
+    if changed:
+        generations_changed.send(sender=VersionCounter, labels=changed)
+    return changed
+
+
+def get_generation(model):
+    return _generations.get(counter_name(model), 0)
+
+
+def generation_key(*models):
+    # Организация входит в ключ: поколения разных организаций могут совпасть
+    return tenant_prefix() + '.'.join(str(get_generation(model)) for model in models)
+
+
+def normalize_params(params, keys=None):
+    """Нормализует параметры запроса: без пустых значений, в порядке ключей."""
+    items = []
+    for key in sorted(params.keys()):
+        if keys is not None and key not in keys:
+            continue
+        for value in sorted(params.getlist(key) if hasattr(params, 'getlist') else [params[key]]):
+            if value not in ('', None):
+                items.append((key, value))
+    return urlencode(items)
+
+
+def make_key(name, params='', models=()):
+    digest = hashlib.md5(params.encode('utf-8')).hexdigest()
+    return f'{KEY_PREFIX}:{name}:{generation_key(*models)}:{digest}'
+
+
+def cached_response(*models, keys=None, timeout=None):
+    """Кэширует ответ GET-представления до записи в одну из моделей.
+
+    Ключ строится из имени представления, нормализованных параметров
+    запроса и поколений перечисленных моделей.
+    """
+    def decorator(view):
+        name = f'{view.__module__}.{view.__name__}'
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET':
+                return view(request, *args, **kwargs)
+            params = normalize_params(request.GET, keys)
+            if args or kwargs:
+                params += '|' + repr((args, sorted(kwargs.items())))
+            key = make_key(name, params, models)
+            cached = cache.get(key)
+            if cached is not None:
+                content, content_type, status = cached
+                return HttpResponse(content, content_type=content_type, status=status)
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming:
+                cache.set(key, (response.content, response['Content-Type'], response.status_code), timeout)
+            return response
+        return wrapper
+    return decorator
+
+
+def get_stats():
+    stats = cache.get_stats() if hasattr(cache, 'get_stats') else {}
+    # Поколения текущей организации и общие
+    prefix = tenant_prefix()
+    stats['generations'] = {
+        label[len(prefix):] if label.startswith(prefix) else label: value
+        for label, value in _generations.items()
+        if label.startswith(prefix) or label in GLOBAL_LABELS
+    }
+    return stats
@@ -0,0 +1,45 @@
+from django.core.cache.backends.locmem import LocMemCache
+
+from .metrics import count_cache
+
+# Счетчики по имени кэша: экземпляры бэкенда создаются на каждый поток,
+# а данные LocMemCache общие для процесса, поэтому статистика хранится так же.
+_stats = {}
+_MISSING = object()
+
+
+class StatsLocMemCache(LocMemCache):
+    """LocMemCache со счетчиками попаданий, промахов и вытеснений."""
+
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        self._stats = _stats.setdefault(name, {'hits': 0, 'misses': 0, 'evictions': 0})
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _MISSING, version)
+        hit = value is not _MISSING
+        # += над общим словарем не атомарен: без блокировки потоки теряют счет
+        with self._lock:
+            self._stats['hits' if hit else 'misses'] += 1
+        count_cache(hit)
+        return value if hit else default
+
+    def _cull(self):
+        # Вызывается под блокировкой кэша из _set
+        size = len(self._cache)
+        super()._cull()
+        self._stats['evictions'] += size - len(self._cache)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._cache)
+        stats['max_entries'] = self._max_entries
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+    def reset_stats(self):
+        with self._lock:
+            for name in self._stats:
+                self._stats[name] = 0
@@ -0,0 +1,155 @@
+import json
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, models, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .metrics import add_rows
+from .models import ChangeLogEntry, VersionCounter, Transaction, Status, TransactionType, Category, Subcategory
+from .serialization import dumps, iter_json_array
+
+# Модели, изменения которых попадают в журнал
+SYNC_MODELS = (Status, TransactionType, Category, Subcategory, Transaction)
+
+# Номер последней записи, удаленной при сжатии журнала. Клиент, отставший
+# сильнее, должен заново загрузить снимок.
+FLOOR_COUNTER = 'changelog.floor'
+
+DEFAULT_BATCH_SIZE = 500
+MAX_BATCH_SIZE = 5000
+
+
+def serialize_instance(instance):
+    # Значения приводятся к виду, в котором их вернет база: так записи журнала
+    # совпадают со снимком (например, сумма 1500 -> "1500.00").
+    data = {}
+    for field in instance._meta.concrete_fields:
+        value = field.to_python(field.value_from_object(instance))
+        if isinstance(field, models.DecimalField) and value is not None:
+            value = value.quantize(Decimal(1).scaleb(-field.decimal_places))
+        data[field.attname] = value
+    return data
+
+
+def make_entry(instance, action):
+    return ChangeLogEntry(
+        organization_id=instance.organization_id,
+        model=instance._meta.model_name,
+        object_id=instance.pk,
+        action=action,
+        data=None if action == ChangeLogEntry.ACTION_DELETE else serialize_instance(instance),
+    )
+
+
+def record_change(instance, action):
+    make_entry(instance, action).save()
+
+
+def record_bulk(instances, action):
+    """Запись в журнал для массовых операций, которые не отправляют сигналы.
+
+    Строки вставляются одним executemany без создания объектов ChangeLogEntry:
+    при загрузке справочников это десятки тысяч записей.
+    """
+    ops = connection.ops
+    now = ops.adapt_datetimefield_value(timezone.now())
+    rows = [
+        (
+            instance.organization_id,
+            instance._meta.model_name,
+            instance.pk,
+            action,
+            None if action == ChangeLogEntry.ACTION_DELETE
+            else json.dumps(serialize_instance(instance), cls=DjangoJSONEncoder),
+            now,
+        )
+        for instance in instances
+    ]
+    if not rows:
+        return
+    columns = ', '.join(
+        ops.quote_name(ChangeLogEntry._meta.get_field(name).column)
+        for name in ('organization', 'model', 'object_id', 'action', 'data', 'created_at')
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {ops.quote_name(ChangeLogEntry._meta.db_table)} ({columns}) '
+            'VALUES (%s, %s, %s, %s, %s, %s)',
+            rows,
+        )
+
+
+def get_floor():
+    return VersionCounter.objects.filter(name=FLOOR_COUNTER).values_list('value', flat=True).first() or 0
+
+
+def get_last_seq():
+    # Номер общий для всех организаций
+    return ChangeLogEntry._base_manager.aggregate(last=Max('seq'))['last'] or 0
+
+
+def changes_since(since, limit=DEFAULT_BATCH_SIZE):
+    """Возвращает пачку изменений после since и признак наличия следующей."""
+    entries = list(
+        ChangeLogEntry.objects.filter(seq__gt=since)
+        .order_by('seq')
+        .values('seq', 'model', 'object_id', 'action', 'data')[:limit + 1]
+    )
+    add_rows(len(entries))
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    last_seq = entries[-1]['seq'] if entries else since
+    return entries, last_seq, has_more
+
+
+def write_snapshot(file):
+    """Пишет в file снимок всех синхронизируемых данных в JSON:
+    {"seq": <номер изменения>, "objects": {<модель>: [...]}}.
+
+    Снимок и номер читаются в одной транзакции, поэтому клиент может продолжить
+    синхронизацию с since=seq без пропусков. Строки читаются курсором и
+    кодируются пачками, в памяти весь журнал не собирается; транзакция
+    закрывается до того, как файл начнут отдавать клиенту.
+    """
+    with transaction.atomic():
+        seq = get_last_seq()
+        file.write(b'{"seq":%d,"objects":{' % seq)
+        for index, model in enumerate(SYNC_MODELS):
+            names = [field.attname for field in model._meta.concrete_fields]
+            file.write(b'%s%s:' % (b',' if index else b'', dumps(model._meta.model_name)))
+            for chunk in iter_json_array(names, model.objects.order_by('pk').values_list(*names)):
+                file.write(chunk)
+        file.write(b'}}')
+    return seq
+
+
+def compact(before):
+    """Сжимает журнал до момента before.
+
+    Для записей старше before остается только последняя запись по каждому
+    объекту - клиент получает итоговое состояние без промежуточных версий.
+    Записи об удалении старше before удаляются целиком, а их номер становится
+    новой нижней границей журнала.
+    """
+    with transaction.atomic():
+        old = ChangeLogEntry.objects.filter(created_at__lt=before)
+        cutoff = old.aggregate(last=Max('seq'))['last']
+        if cutoff is None:
+            return 0, 0
+        latest = (
+            ChangeLogEntry.objects.values('model', 'object_id')
+            .annotate(last_seq=Max('seq'))
+            .values('last_seq')
+        )
+        collapsed, _ = old.exclude(seq__in=latest).delete()
+        tombstones = ChangeLogEntry.objects.filter(seq__lte=cutoff, action=ChangeLogEntry.ACTION_DELETE)
+        floor = tombstones.aggregate(last=Max('seq'))['last']
+        dropped = 0
+        if floor is not None:
+            dropped, _ = tombstones.delete()
+            updated = VersionCounter.objects.filter(name=FLOOR_COUNTER, value__lt=floor).update(value=floor)
+            if not updated:
+                VersionCounter.objects.get_or_create(name=FLOOR_COUNTER, defaults={'value': floor})
+    return collapsed, dropped
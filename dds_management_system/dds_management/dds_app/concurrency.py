@@ -0,0 +1,127 @@
+from functools import reduce
+from operator import or_
+
+from django.db import models
+from django.db.models import Case, F, Q, Value, When
+from django.db.transaction import atomic, set_rollback
+
+# Оптимистичная блокировка.
+#
+# У транзакций и справочников есть номер версии. Запись - один UPDATE с
+# условием "WHERE pk = ? AND version = <прочитанная версия>", который
+# увеличивает версию; чтение ничего не блокирует. Если за время между
+# чтением (открытием формы) и записью строку изменил другой пользователь,
+# UPDATE не находит строку и save() бросает ConflictError - страница
+# редактирования показывает разницу между своими и текущими значениями.
+#
+# Массовые записи (bulk_update_versioned) проверяют версию каждой строки так
+# же: пачка - один UPDATE, а если часть строк уже изменена, пачка
+# откатывается до точки сохранения и записывается построчно, чтобы точно
+# знать, какие строки не записаны.
+
+# Параметров на строку: id и версия в условии, id и значение в CASE на поле;
+# SQLite принимает не больше 999 параметров в запросе
+MAX_QUERY_PARAMS = 900
+
+
+class ConflictError(Exception):
+    """Строку изменили после чтения: версия в базе не совпала с версией объекта."""
+
+    def __init__(self, instance):
+        super().__init__(f'{instance._meta.verbose_name} (id {instance.pk}) изменена другим пользователем')
+        self.instance = instance
+
+
+class VersionedModel(models.Model):
+    version = models.PositiveIntegerField(default=1, editable=False, verbose_name="Версия")
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'version'}
+        super().save(*args, **kwargs)
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        values = [
+            (field, model, F('version') + 1 if field.attname == 'version' else value)
+            for field, model, value in values
+        ]
+        if base_qs.filter(pk=pk_val, version=self.version)._update(values) > 0:
+            self.version += 1
+            return True
+        # Строки нет - Django вставит ее; есть - значит, версия устарела
+        if base_qs.filter(pk=pk_val).exists():
+            raise ConflictError(self)
+        return False
+
+
+def current_version(instance):
+    """Текущая строка из базы (без фильтра по организации) или None, если она удалена."""
+    return type(instance)._base_manager.filter(pk=instance.pk).first()
+
+
+def conflict_diff(form, current):
+    """Поля формы, у которых отправленное значение отличается от текущего в базе.
+
+    Список словарей label/mine/current со значениями для показа.
+    """
+    rows = []
+    for name, field in form.fields.items():
+        if name == 'version' or name not in form.cleaned_data:
+            continue
+        mine = form.cleaned_data[name]
+        theirs = getattr(current, name, None)
+        if mine != theirs:
+            rows.append({'label': field.label or name, 'mine': display(mine), 'current': display(theirs)})
+    return rows
+
+
+def display(value):
+    return '—' if value in (None, '') else str(value)
+
+
+def bulk_update_versioned(objs, fields, batch_size=None):
+    """Записывает fields объектов с проверкой версии каждой строки.
+
+    Возвращает (записанные, устаревшие): у записанных версия увеличена,
+    устаревшие изменены в базе после чтения и не записаны. Вызывается
+    внутри atomic(), как и bulk_update.
+    """
+    if not objs:
+        return [], []
+    model = type(objs[0])
+    manager = model._base_manager
+    model_fields = [model._meta.get_field(name) for name in fields]
+    batch_size = batch_size or max(MAX_QUERY_PARAMS // (2 + 2 * len(fields)), 1)
+    written, stale = [], []
+    for start in range(0, len(objs), batch_size):
+        batch = objs[start:start + batch_size]
+        with atomic():
+            condition = reduce(or_, (Q(pk=obj.pk, version=obj.version) for obj in batch))
+            values = {
+                field.attname: Case(
+                    *[When(pk=obj.pk, then=Value(getattr(obj, field.attname), output_field=field)) for obj in batch],
+                    output_field=field,
+                )
+                for field in model_fields
+            }
+            complete = manager.filter(condition).update(**values, version=F('version') + 1) == len(batch)
+            if not complete:
+                set_rollback(True)
+        if complete:
+            batch_written = batch
+        else:
+            batch_written = []
+            for obj in batch:
+                values = {field.attname: getattr(obj, field.attname) for field in model_fields}
+                if manager.filter(pk=obj.pk, version=obj.version).update(**values, version=F('version') + 1):
+                    batch_written.append(obj)
+                else:
+                    stale.append(obj)
+        for obj in batch_written:
+            obj.version += 1
+        written += batch_written
+    return written, stale
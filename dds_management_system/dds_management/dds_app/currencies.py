@@ -0,0 +1,261 @@
+import bisect
+import csv
+import threading
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.db.transaction import atomic
+
+# Валюты и пересчет в базовую валюту (рубли).
+#
+# У транзакции есть валюта и сумма в ней (amount); сумма в базовой валюте
+# (base_amount) считается один раз при записи по курсу на дату операции и
+# хранится в таблице. Итоги, отчеты, бюджеты и выгрузки суммируют
+# base_amount, поэтому чтение не конвертирует строки.
+#
+# Курсы (ExchangeRate) - сколько рублей стоит единица валюты на дату; для
+# даты без курса берется последний курс до нее. Таблица курсов целиком
+# держится в памяти процесса (RateTable): по каждой валюте отсортированные
+# даты и курсы, поиск - bisect. Таблица перечитывается при изменении
+# поколения модели ExchangeRate (общее для всех организаций).
+#
+# Изменение курса на дату D меняет пересчет транзакций с D до следующей даты
+# курса этой валюты: recompute перечитывает только этот диапазон по индексу
+# (currency, date) и пачками обновляет строки, у которых изменилась сумма,
+# вместе с месячными итогами бюджетов и распределениями сумм. Запись
+# проверяет версии строк (dds_app.concurrency) и не затирает правки,
+# сделанные во время пересчета.
+
+BASE_CURRENCY = 'RUB'
+CURRENCY_CHOICES = [
+    ('RUB', 'RUB - российский рубль'),
+    ('USD', 'USD - доллар США'),
+    ('EUR', 'EUR - евро'),
+]
+CURRENCY_SYMBOLS = {'RUB': 'руб.'}
+
+CENT = Decimal('0.01')
+RATE_MODEL = 'dds_app.exchangerate'
+
+
+class MissingRate(ValueError):
+    pass
+
+
+class RateTable:
+    """Курсы валют в памяти процесса, индексированные по дате."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = None
+        # валюта -> (порядковые номера дат по возрастанию, курсы)
+        self._rates = {}
+
+    def load(self):
+        from .models import ExchangeRate
+
+        rates = {}
+        rows = ExchangeRate.objects.order_by('currency', 'date').values_list('currency', 'date', 'rate')
+        for currency, day, rate in rows.iterator(chunk_size=5000):
+            ordinals, values = rates.setdefault(currency, ([], []))
+            ordinals.append(day.toordinal())
+            values.append(rate)
+        return rates
+
+    def get_rates(self):
+        from .cache import get_generation
+
+        generation = get_generation(RATE_MODEL)
+        if self._generation != generation:
+            with self._lock:
+                if self._generation != generation:
+                    self._rates = self.load()
+                    self._generation = generation
+        return self._rates
+
+    def reset(self):
+        with self._lock:
+            self._generation = None
+
+    def get(self, currency, day):
+        """Курс на дату: последний курс не позже day."""
+        ordinals, values = self.get_rates().get(currency, ((), ()))
+        index = bisect.bisect_right(ordinals, day.toordinal())
+        if not index:
+            raise MissingRate(f'Нет курса {currency} на {day:%d.%m.%Y}')
+        return values[index - 1]
+
+    def next_date(self, currency, day):
+        """Следующая после day дата курса или None."""
+        ordinals, _ = self.get_rates().get(currency, ((), ()))
+        index = bisect.bisect_right(ordinals, day.toordinal())
+        return date.fromordinal(ordinals[index]) if index < len(ordinals) else None
+
+
+rates = RateTable()
+
+
+def get_rate(currency, day):
+    if currency == BASE_CURRENCY:
+        return Decimal(1)
+    return rates.get(currency, day)
+
+
+def convert(amount, currency, day):
+    """Сумма в базовой валюте, округленная до копеек."""
+    amount = Decimal(str(amount))
+    if currency == BASE_CURRENCY:
+        return amount.quantize(CENT)
+    return (amount * get_rate(currency, day)).quantize(CENT)
+
+
+def fill_base_amounts(transactions):
+    """Заполняет base_amount у транзакций, сохраняемых в обход save() (bulk_create)."""
+    for transaction in transactions:
+        transaction.base_amount = convert(transaction.amount, transaction.currency, transaction.date)
+    return transactions
+
+
+def format_amount(amount, currency):
+    return f'{amount:.2f} {CURRENCY_SYMBOLS.get(currency, currency)}'
+
+
+def affected_range(currency, days):
+    """Диапазон [первая дата, следующая дата курса) для изменившихся курсов."""
+    return min(days), rates.next_date(currency, max(days))
+
+
+def recompute(currency, date_from, date_to=None, batch_size=1000):
+    """Пересчитывает base_amount транзакций валюты с датами в [date_from, date_to).
+
+    Вызывается после изменения курсов (поколение ExchangeRate уже новое).
+    Обновляются только строки, у которых изменилась сумма; вместе с ними -
+    месячные итоги бюджетов, распределения сумм подкатегорий, журнал
+    изменений и поколение кэша транзакций. Возвращает число обновленных строк.
+    """
+    from .tenancy import tenant_context
+
+    if currency == BASE_CURRENCY:
+        return 0
+    # Курсы общие для всех организаций: пересчет идет вне контекста организации
+    with tenant_context(None):
+        return recompute_rows(currency, date_from, date_to, batch_size)
+
+
+def recompute_rows(currency, date_from, date_to, batch_size):
+    from .anomalies import refresh_stats
+    from .budgets import apply_deltas, contributions, merge_deltas, to_cents
+    from .cache import bump_generation
+    from .changelog import record_bulk
+    from .concurrency import bulk_update_versioned
+    from .models import ChangeLogEntry, Transaction
+
+    transactions = Transaction._base_manager.filter(currency=currency, date__gte=date_from)
+    if date_to is not None:
+        transactions = transactions.filter(date__lt=date_to)
+    transactions = transactions.order_by('pk')
+
+    pending = [transaction for transaction in transactions.iterator(chunk_size=batch_size)
+               if recalculate(transaction)]
+    if not pending:
+        return 0
+
+    changed = []
+    with atomic():
+        # Строки записываются с проверкой версии: транзакцию, измененную после
+        # чтения, перечитываем и пересчитываем заново. После первой записи
+        # база заблокирована для других записей, поэтому повтор - один
+        while pending:
+            written, stale = bulk_update_versioned(pending, ['base_amount'])
+            changed += written
+            pending = [transaction for transaction in
+                       Transaction._base_manager.filter(pk__in=[transaction.pk for transaction in stale])
+                       if recalculate(transaction)]
+        deltas = {}
+        for transaction in changed:
+            merge_deltas(deltas, contributions(
+                transaction.date, transaction.category_id, transaction.subcategory_id,
+                to_cents(transaction.base_amount) - to_cents(transaction.previous_base_amount), 0,
+            ))
+        apply_deltas(deltas)
+        refresh_stats({transaction.subcategory_id for transaction in changed})
+        record_bulk(changed, ChangeLogEntry.ACTION_UPDATE)
+    for organization_id in {transaction.organization_id for transaction in changed}:
+        bump_generation(Transaction, organization_id)
+    return len(changed)
+
+
+def recalculate(transaction):
+    """Пересчитывает base_amount по текущим курсам; True, если сумма изменилась."""
+    try:
+        base_amount = convert(transaction.amount, transaction.currency, transaction.date)
+    except MissingRate:
+        # Курс до этой даты удален - прежняя сумма остается
+        return False
+    if base_amount == transaction.base_amount:
+        return False
+    transaction.previous_base_amount = transaction.base_amount
+    transaction.base_amount = base_amount
+    return True
+
+
+def rates_changed(changes):
+    """Пересчет после изменения курсов; changes - {валюта: даты изменившихся курсов}."""
+    from .cache import bump_generation
+
+    bump_generation(RATE_MODEL)
+    updated = 0
+    for currency, days in changes.items():
+        if days:
+            updated += recompute(currency, *affected_range(currency, days))
+    return updated
+
+
+def read_rates(file):
+    """Курсы из CSV со строками date,currency,rate (строка заголовка допускается)."""
+    currencies = {code for code, _ in CURRENCY_CHOICES if code != BASE_CURRENCY}
+    result = {}
+    for line, row in enumerate(csv.reader(file), start=1):
+        if not row or (line == 1 and row[0].strip().lower() == 'date'):
+            continue
+        try:
+            day, currency, rate = (value.strip() for value in row)
+            day, currency, rate = date.fromisoformat(day), currency.upper(), Decimal(rate)
+        except (ValueError, InvalidOperation) as error:
+            raise ValueError(f'Line {line}: {error}')
+        if currency not in currencies:
+            raise ValueError(f'Line {line}: unknown currency {currency}')
+        if rate <= 0:
+            raise ValueError(f'Line {line}: rate must be positive')
+        result[(currency, day)] = rate
+    return result
+
+
+def load_rates(rates_by_key, batch_size=1000):
+    """Записывает курсы одним upsert по (currency, date) и пересчитывает затронутые транзакции.
+
+    Возвращает (число курсов, число пересчитанных транзакций).
+    """
+    from .models import ExchangeRate
+
+    existing = {}
+    keys = list(rates_by_key)
+    for start in range(0, len(keys), batch_size):
+        chunk = keys[start:start + batch_size]
+        for currency in {currency for currency, _ in chunk}:
+            days = [day for code, day in chunk if code == currency]
+            existing.update(
+                ((currency, day), rate) for day, rate in
+                ExchangeRate.objects.filter(currency=currency, date__in=days).values_list('date', 'rate')
+            )
+    changes = {}
+    for (currency, day), rate in rates_by_key.items():
+        if existing.get((currency, day)) != rate:
+            changes.setdefault(currency, []).append(day)
+    with atomic():
+        ExchangeRate.objects.bulk_create(
+            [ExchangeRate(currency=currency, date=day, rate=rate) for (currency, day), rate in rates_by_key.items()],
+            batch_size=batch_size, update_conflicts=True, unique_fields=['currency', 'date'], update_fields=['rate'],
+        )
+        updated = rates_changed(changes) if changes else 0
+    return len(rates_by_key), updated
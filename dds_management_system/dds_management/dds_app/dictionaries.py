@@ -0,0 +1,68 @@
+from django.db.models import Count
+
+from .metrics import add_rows
+from .models import Status, TransactionType, Category, Subcategory, Transaction
+
+# Страница справочников.
+#
+# Сама страница содержит только заготовки панелей и не обращается к базе.
+# Строки панели загружаются, когда она появляется на экране, запросом к
+# /api/dictionaries/<справочник>/: поиск по названию, страницы по limit
+# строк в порядке названия (индекс (organization, name)), следующая
+# страница определяется лишней строкой выборки, без COUNT(*) по таблице.
+# Число транзакций для строк страницы считается одним GROUP BY по внешнему
+# ключу транзакции. Ответы кэшируются под поколениями справочников и
+# транзакций (dds_app.cache).
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class Dictionary:
+    def __init__(self, model, title, usage_field, parent=None, parent_title=''):
+        self.model = model
+        self.title = title
+        # Внешний ключ транзакции на этот справочник
+        self.usage_field = usage_field
+        # Путь к названию родителя (тип операции категории, категория подкатегории)
+        self.parent = parent
+        self.parent_title = parent_title
+
+    def page(self, query='', page=1, limit=PAGE_SIZE):
+        items = self.model.objects.order_by('name', 'pk')
+        if query:
+            items = items.filter(name__icontains=query)
+        fields = ['pk', 'name'] + ([self.parent] if self.parent else [])
+        start = (page - 1) * limit
+        rows = list(items.values_list(*fields)[start:start + limit + 1])
+        add_rows(len(rows))
+        has_next = len(rows) > limit
+        rows = rows[:limit]
+
+        usage = self.usage([row[0] for row in rows])
+        result = []
+        for pk, name, *parent in rows:
+            item = {'id': pk, 'name': name, 'usage': usage.get(pk, 0)}
+            if parent:
+                item['parent'] = parent[0]
+            result.append(item)
+        return {'items': result, 'page': page, 'has_next': has_next}
+
+    def usage(self, ids):
+        """Число транзакций по id строк - один GROUP BY."""
+        if not ids:
+            return {}
+        return dict(
+            Transaction.objects.filter(**{f'{self.usage_field}__in': ids})
+            .values_list(self.usage_field).annotate(count=Count('pk')).order_by()
+        )
+
+
+DICTIONARIES = {
+    'status': Dictionary(Status, 'Статусы', 'status_id'),
+    'transaction_type': Dictionary(TransactionType, 'Типы операций', 'transaction_type_id'),
+    'category': Dictionary(Category, 'Категории', 'category_id', 'transaction_type__name', 'Тип операции'),
+    'subcategory': Dictionary(Subcategory, 'Подкатегории', 'subcategory_id', 'category__name', 'Категория'),
+}
+
+DICTIONARY_MODELS = (Status, TransactionType, Category, Subcategory, Transaction)
@@ -0,0 +1,178 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.template.loader import render_to_string
+
+from .changelog import get_floor, get_last_seq
+from .filters import matches_filters
+from .models import ChangeLogEntry, Transaction
+
+# Рассылка изменений транзакций подписчикам Server-Sent Events.
+#
+# На процесс приходится одна фоновая задача, которая читает журнал изменений
+# (один запрос за интервал независимо от числа подключений), один раз рендерит
+# строку таблицы для каждого события и раскладывает события по очередям
+# подписчиков своей организации с подходящими фильтрами. Подключение - это только asyncio.Queue,
+# поэтому сотни простаивающих клиентов не занимают потоков.
+#
+# Переподключившийся клиент присылает Last-Event-ID - номер последнего
+# полученного изменения. Пропущенные изменения его организации, подходящие
+# под фильтры, досылаются из журнала (replay_events); перезагрузка страницы
+# нужна, только если журнал до этого номера уже сжат или пропущено больше
+# REPLAY_LIMIT записей.
+
+POLL_INTERVAL = getattr(settings, 'DDS_EVENTS_POLL_INTERVAL', 1.0)
+QUEUE_SIZE = 100
+BATCH_SIZE = 500
+REPLAY_LIMIT = 5000
+
+
+def format_event(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, ensure_ascii=False)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+class TransactionEvent:
+    def __init__(self, seq, object_id, action, data, html=None, organization_id=None):
+        self.seq = seq
+        self.organization_id = organization_id
+        self.object_id = object_id
+        self.action = action
+        self.data = data
+        self.html = html
+
+    def message_for(self, filters):
+        """Сообщение для подписчика с фильтрами filters или None."""
+        if self.action == ChangeLogEntry.ACTION_DELETE:
+            return format_event('delete', {'id': self.object_id}, self.seq)
+        if matches_filters(self.data, filters):
+            return format_event(self.action, {'id': self.object_id, 'html': self.html}, self.seq)
+        if self.action == ChangeLogEntry.ACTION_UPDATE:
+            # Транзакция больше не подходит под фильтры - строку нужно убрать
+            return format_event('delete', {'id': self.object_id}, self.seq)
+        return None
+
+
+def load_events(since, organization_id=None, until=None):
+    """Читает новые изменения транзакций и рендерит строки таблицы.
+
+    Журнал читается по всем организациям (_base_manager без фильтра по
+    текущей): фоновая задача общая для подписчиков разных организаций.
+    Для досылки пропущенного - только организации organization_id и до until.
+    """
+    entries = ChangeLogEntry._base_manager.filter(seq__gt=since, model='transaction')
+    if organization_id is not None:
+        entries = entries.filter(organization_id=organization_id)
+    if until is not None:
+        entries = entries.filter(seq__lte=until)
+    entries = list(
+        entries.order_by('seq')
+        .values_list('seq', 'object_id', 'action', 'data', 'organization_id')[:BATCH_SIZE]
+    )
+    if not entries:
+        return [], since
+    ids = {entry[1] for entry in entries if entry[2] != ChangeLogEntry.ACTION_DELETE}
+    rows = Transaction._base_manager.select_related(
+        'status', 'transaction_type', 'category', 'subcategory', 'anomaly'
+    ).in_bulk(ids)
+    events = []
+    for seq, object_id, action, data, organization_id in entries:
+        html = None
+        if action != ChangeLogEntry.ACTION_DELETE:
+            transaction = rows.get(object_id)
+            if transaction is None:
+                # Транзакция уже удалена, удаление придет следующим событием
+                continue
+            html = render_to_string('dds_app/transaction_row.html', {'transaction': transaction})
+        events.append(TransactionEvent(seq, object_id, action, data, html, organization_id))
+    return events, entries[-1][0]
+
+
+def replay_events(since, until, filters, organization_id=None):
+    """Сообщения о пропущенных изменениях (since, until] для подписчика или None,
+    если их уже не восстановить и клиенту нужно перезагрузить страницу."""
+    if since < get_floor():
+        # Часть журнала после since удалена при сжатии
+        return None
+    messages = []
+    for _ in range(REPLAY_LIMIT // BATCH_SIZE):
+        events, last_seq = load_events(since, organization_id, until)
+        if last_seq == since:
+            return messages
+        since = last_seq
+        messages += filter(None, (event.message_for(filters) for event in events))
+        if since >= until:
+            return messages
+    # Пропущено больше REPLAY_LIMIT записей - проще перезагрузить страницу
+    return None
+
+
+class Subscription:
+    def __init__(self, filters, organization_id=None, start_seq=None):
+        self.filters = filters
+        # None - события всех организаций
+        self.organization_id = organization_id
+        # Номер изменения, с которого подписчик получает события через очередь
+        self.start_seq = start_seq
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    def put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Клиент не успевает читать: просим перезагрузить страницу
+            # вместо того чтобы копить события в памяти.
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(format_event('reload', {}))
+
+
+class TransactionBroadcaster:
+    def __init__(self, poll_interval=POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self.subscribers = set()
+        self.last_seq = None
+        self.task = None
+
+    async def subscribe(self, filters, organization_id=None):
+        if self.last_seq is None:
+            self.last_seq = await sync_to_async(get_last_seq)()
+        subscription = Subscription(filters, organization_id, self.last_seq)
+        self.subscribers.add(subscription)
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            self.task = loop.create_task(self.run())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscribers.discard(subscription)
+
+    async def run(self):
+        while self.subscribers:
+            await asyncio.sleep(self.poll_interval)
+            await self.poll()
+        # Без подписчиков журнал не читается; следующий подписчик начнет
+        # с актуального номера изменения.
+        self.last_seq = None
+
+    async def poll(self):
+        events, self.last_seq = await sync_to_async(load_events)(self.last_seq)
+        for event in events:
+            self.publish(event)
+
+    def publish(self, event):
+        for subscription in list(self.subscribers):
+            if subscription.organization_id not in (None, event.organization_id):
+                continue
+            message = event.message_for(subscription.filters)
+            if message is not None:
+                subscription.put(message)
+
+
+broadcaster = TransactionBroadcaster()
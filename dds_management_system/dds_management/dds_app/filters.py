@@ -0,0 +1,95 @@
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection
+from django.db.models import F, Func
+
+# Фильтры списка транзакций: параметр запроса -> (поле модели, сравнение).
+# Используются и для запросов к базе, и для проверки уже загруженных данных
+# (например, событий журнала изменений) без обращения к базе.
+# Диапазон суммы - по сумме в базовой валюте.
+TRANSACTION_FILTERS = {
+    'date_from': ('date', 'gte'),
+    'date_to': ('date', 'lte'),
+    'status': ('status_id', 'exact'),
+    'transaction_type': ('transaction_type_id', 'exact'),
+    'category': ('category_id', 'exact'),
+    'subcategory': ('subcategory_id', 'exact'),
+    'amount_min': ('base_amount', 'gte'),
+    'amount_max': ('base_amount', 'lte'),
+}
+
+AMOUNT_FILTERS = ('amount_min', 'amount_max')
+
+
+def parse_amount(value):
+    """Граница суммы из запроса; нечисловое значение игнорируется."""
+    try:
+        amount = Decimal(value.strip().replace(',', '.'))
+    except (AttributeError, InvalidOperation):
+        return None
+    return str(amount) if amount.is_finite() else None
+
+
+def get_filters(params):
+    filters = {name: params.get(name) for name in TRANSACTION_FILTERS}
+    for name in AMOUNT_FILTERS:
+        filters[name] = parse_amount(filters[name])
+    return filters
+
+
+class NoIndex(Func):
+    # Унарный плюс в SQLite: значение то же, но условие не может использовать
+    # индекс и проверяется по строкам, выбранным другим индексом
+    template = '+%(expressions)s'
+
+
+def restrict(queryset, field, lookup, value, indexed=True):
+    """queryset.filter(field__lookup=value); при indexed=False на SQLite условие не выбирает индекс."""
+    if not indexed and connection.vendor == 'sqlite':
+        output_field = queryset.model._meta.get_field(field)
+        if output_field.is_relation:
+            output_field = output_field.target_field
+        alias = f'_{field}_{lookup}'
+        queryset = queryset.alias(**{alias: NoIndex(F(field), output_field=output_field)})
+        field = alias
+    return queryset.filter(**{f'{field}__{lookup}': value})
+
+
+def filter_transactions(queryset, filters, indexed_fields=None):
+    """Применяет фильтры к queryset.
+
+    indexed_fields - поля, условиям по которым разрешено выбирать индекс
+    (None - всем). Остальные условия на SQLite закрываются от планировщика,
+    чтобы он читал индекс, уже отдающий строки в порядке сортировки
+    (dds_app.ordering), а не сортировал выборку во временном B-дереве.
+    """
+    for name, value in filters.items():
+        if value:
+            field, lookup = TRANSACTION_FILTERS[name]
+            indexed = indexed_fields is None or field in indexed_fields
+            queryset = restrict(queryset, field, lookup, value, indexed)
+    return queryset
+
+
+def matches_filters(data, filters):
+    """Проверяет словарь полей транзакции (attname -> значение) на соответствие фильтрам.
+
+    Даты сравниваются в ISO-формате, как они приходят из формы и из журнала,
+    суммы - как числа.
+    """
+    for name, value in filters.items():
+        if not value:
+            continue
+        field, lookup = TRANSACTION_FILTERS[name]
+        actual = str(data.get(field))
+        if name in AMOUNT_FILTERS:
+            if data.get(field) is None:
+                return False
+            actual, value = Decimal(actual), Decimal(value)
+        if lookup == 'gte' and actual < value:
+            return False
+        if lookup == 'lte' and actual > value:
+            return False
+        if lookup == 'exact' and actual != value:
+            return False
+    return True
@@ -0,0 +1,157 @@
+import csv
+import hashlib
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from .currencies import BASE_CURRENCY, CURRENCY_CHOICES
+
+# Отпечаток содержимого транзакции для поиска дублей (повторный импорт
+# выписки, двойной ввод). В отпечаток входят дата, сумма, тип, категория,
+# подкатегория и комментарий без учета регистра и лишних пробелов, для сумм
+# не в рублях - валюта (отпечатки рублевых транзакций от нее не зависят);
+# статус не входит. Дубли ищутся в пределах организации по индексу
+# (organization, fingerprint), поэтому проверка - один поиск по индексу.
+#
+# Поле заполняется в Transaction.save() и в bulk_create_transactions
+# (импорт выписки командой import_transactions); QuerySet.update() его не
+# пересчитывает.
+
+FINGERPRINT_LENGTH = 32
+
+
+def normalize_comment(comment):
+    return ' '.join((comment or '').split()).casefold()
+
+
+def transaction_fingerprint(day, amount, transaction_type_id, category_id, subcategory_id, comment,
+                            currency=BASE_CURRENCY):
+    amount = Decimal(amount).quantize(Decimal('0.01'))
+    parts = [
+        day.isoformat(), str(amount), str(transaction_type_id), str(category_id), str(subcategory_id),
+        normalize_comment(comment),
+    ]
+    if currency != BASE_CURRENCY:
+        parts.append(currency)
+    value = '|'.join(parts)
+    return hashlib.blake2b(value.encode('utf-8'), digest_size=FINGERPRINT_LENGTH // 2).hexdigest()
+
+
+def instance_fingerprint(transaction):
+    return transaction_fingerprint(
+        transaction.date, transaction.amount, transaction.transaction_type_id,
+        transaction.category_id, transaction.subcategory_id, transaction.comment, transaction.currency,
+    )
+
+
+def find_duplicates(fingerprint, exclude_pk=None, organization_id=None):
+    from .models import Transaction
+    from .tenancy import current_organization_id
+
+    # Без сортировки: иначе планировщик может предпочесть индекс по дате
+    duplicates = Transaction.objects.filter(
+        organization_id=organization_id or current_organization_id(), fingerprint=fingerprint,
+    ).order_by()
+    if exclude_pk is not None:
+        duplicates = duplicates.exclude(pk=exclude_pk)
+    return duplicates
+
+
+def bulk_create_transactions(transactions, skip_duplicates=True, batch_size=1000):
+    """Массовое создание транзакций (импорт) с заполнением отпечатков.
+
+    С skip_duplicates=True пропускаются транзакции, уже имеющиеся в базе, и
+    повторы внутри самой пачки. Возвращает (созданные, пропущенные).
+    Сигналы не отправляются, поэтому сумма в рублях, поколение кэша, журнал
+    изменений, месячные итоги бюджетов и распределения сумм обновляются здесь же.
+    """
+    from .anomalies import apply_transactions as apply_amount_stats
+    from .budgets import apply_transactions as apply_budget_aggregates
+    from .cache import bump_generation
+    from .changelog import record_bulk
+    from .currencies import fill_base_amounts
+    from .models import ChangeLogEntry, Transaction
+
+    for transaction in transactions:
+        transaction.fingerprint = instance_fingerprint(transaction)
+    fill_base_amounts(transactions)
+
+    organizations = {transaction.organization_id for transaction in transactions}
+    skipped = []
+    if skip_duplicates:
+        # Дубль - тот же отпечаток в той же организации
+        fingerprints = {transaction.fingerprint for transaction in transactions}
+        existing = set()
+        chunk = list(fingerprints)
+        for start in range(0, len(chunk), batch_size):
+            existing.update(
+                Transaction.objects.filter(organization_id__in=organizations,
+                                           fingerprint__in=chunk[start:start + batch_size])
+                .values_list('organization_id', 'fingerprint')
+            )
+        unique = []
+        for transaction in transactions:
+            key = (transaction.organization_id, transaction.fingerprint)
+            if key in existing:
+                skipped.append(transaction)
+            else:
+                existing.add(key)
+                unique.append(transaction)
+        transactions = unique
+
+    if transactions:
+        Transaction.objects.bulk_create(transactions, batch_size=batch_size)
+        record_bulk(transactions, ChangeLogEntry.ACTION_CREATE)
+        apply_budget_aggregates(transactions)
+        apply_amount_stats(transactions)
+        for organization_id in organizations:
+            bump_generation(Transaction, organization_id)
+    return transactions, skipped
+
+
+def read_transactions(file):
+    """Транзакции текущей организации из CSV в формате выгрузки transactions_csv.
+
+    Колонки: дата, статус, тип, категория, подкатегория, сумма, валюта, сумма в
+    рублях (не читается - пересчитывается по курсам), комментарий; строка
+    заголовка допускается. Справочники ищутся по названиям.
+    """
+    from .models import Category, Status, Subcategory, Transaction, TransactionType
+
+    statuses = {name: pk for pk, name in Status.objects.values_list('pk', 'name')}
+    types = {name: pk for pk, name in TransactionType.objects.values_list('pk', 'name')}
+    categories = {
+        (type_id, name): pk for pk, type_id, name in Category.objects.values_list('pk', 'transaction_type_id', 'name')
+    }
+    subcategories = {
+        (category_id, name): pk for pk, category_id, name in Subcategory.objects.values_list('pk', 'category_id', 'name')
+    }
+    currencies = {code for code, _ in CURRENCY_CHOICES}
+    transactions = []
+    for line, row in enumerate(csv.reader(file), start=1):
+        if not row or (line == 1 and row[0].strip() == 'Дата'):
+            continue
+        try:
+            day, status, type_name, category, subcategory, amount, currency, _, comment = (
+                value.strip() for value in row
+            )
+            day, amount = date.fromisoformat(day), Decimal(amount)
+        except (ValueError, InvalidOperation) as error:
+            raise ValueError(f'Line {line}: {error}')
+        type_id = types.get(type_name)
+        category_id = categories.get((type_id, category))
+        values = {
+            'status': statuses.get(status),
+            'transaction type': type_id,
+            'category': category_id,
+            'subcategory': subcategories.get((category_id, subcategory)),
+        }
+        missing = [name for name, value in values.items() if value is None]
+        if missing:
+            raise ValueError(f'Line {line}: unknown {missing[0]}')
+        if currency not in currencies:
+            raise ValueError(f'Line {line}: unknown currency {currency}')
+        transactions.append(Transaction(
+            date=day, status_id=values['status'], transaction_type_id=type_id, category_id=category_id,
+            subcategory_id=values['subcategory'], amount=amount, currency=currency, comment=comment,
+        ))
+    return transactions
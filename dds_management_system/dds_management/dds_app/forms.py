@@ -1,12 +1,64 @@
 from django import forms
-from .models import Transaction, Status, TransactionType, Category, Subcategory
+from .models import Transaction, Status, TransactionType, Category, Subcategory, Budget
 from django.core.exceptions import ValidationError
+from .currencies import BASE_CURRENCY
+from .fingerprints import transaction_fingerprint, find_duplicates
+from .autocomplete import AutocompleteWidget, use_autocomplete
+from .budgets import month_start
+from .reports import get_max_months, month_count
+from .tenancy import scope
 from datetime import date
 
-class TransactionForm(forms.ModelForm):
+class TenantFormMixin:
+    """Выбор только из справочников текущей организации.
+
+    Queryset полей выбора создается вместе с классом формы, вне запроса,
+    поэтому ограничивается при создании каждой формы.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for field in self.fields.values():
+            if isinstance(field, forms.ModelChoiceField):
+                field.queryset = scope(field.queryset)
+
+    def validate_unique(self):
+        super().validate_unique()
+        # Организации нет среди полей формы, и Django пропускает ограничения
+        # уникальности с ней - они проверяются здесь, иначе дубль дошел бы до базы
+        instance = self.instance
+        exclude = self._get_validation_exclusions() - {'organization'}
+        for constraint in instance._meta.constraints:
+            if 'organization' in getattr(constraint, 'fields', ()):
+                try:
+                    constraint.validate(type(instance), instance, exclude=exclude)
+                except ValidationError as error:
+                    self.add_error(None, error)
+
+class VersionFormMixin:
+    """Версия записи на момент открытия формы (скрытое поле).
+
+    Сохранение запишет строку, только если ее версия не изменилась
+    (dds_app.concurrency); без поля проверяется версия, прочитанная при запросе.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.fields['version'] = forms.IntegerField(
+                widget=forms.HiddenInput, required=False, min_value=1, initial=self.instance.version,
+            )
+
+    def clean_version(self):
+        version = self.cleaned_data.get('version')
+        if version:
+            self.instance.version = version
+        return version
+
+class TransactionForm(VersionFormMixin, TenantFormMixin, forms.ModelForm):
     class Meta:
         model = Transaction
-        fields = ['date', 'status', 'transaction_type', 'category', 'subcategory', 'amount', 'comment']
+        fields = ['date', 'status', 'transaction_type', 'category', 'subcategory', 'amount', 'currency', 'comment']
         widgets = {
             'date': forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}),
             'status': forms.Select(attrs={'class': 'form-control'}),
@@ -14,14 +66,27 @@ class TransactionForm(forms.ModelForm):
             'category': forms.Select(attrs={'class': 'form-control', 'id': 'id_category'}),
             'subcategory': forms.Select(attrs={'class': 'form-control', 'id': 'id_subcategory'}),
             'amount': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}),
+            'currency': forms.Select(attrs={'class': 'form-control'}),
             'comment': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
         }
     
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, allow_duplicate=False, **kwargs):
         super().__init__(*args, **kwargs)
         if not self.instance.pk:  
             self.fields['date'].initial = date.today()
+        # Большие справочники выбираются автодополнением, а не <select> со всеми записями
+        for name, scope_id in (('category', 'id_transaction_type'), ('subcategory', 'id_category')):
+            if use_autocomplete(name):
+                self.fields[name].widget = AutocompleteWidget(name, scope_id, attrs={'id': f'id_{name}'})
+        # Без валюты (старые клиенты, импорт) - рубли
+        self.fields['currency'].required = False
+        # Похожие транзакции, найденные по отпечатку; сохранение требует подтверждения
+        self.allow_duplicate = allow_duplicate
+        self.duplicates = []
     
+    def clean_currency(self):
+        return self.cleaned_data['currency'] or BASE_CURRENCY
+
     def clean(self):
         cleaned_data = super().clean()
         category = cleaned_data.get('category')
@@ -34,9 +99,21 @@ class TransactionForm(forms.ModelForm):
         if subcategory and category and subcategory.category != category:
             raise ValidationError("Выбранная подкатегория не соответствует выбранной категории")
         
+        if not self.allow_duplicate and not self.errors:
+            fingerprint = transaction_fingerprint(
+                cleaned_data['date'], cleaned_data['amount'], transaction_type.pk, category.pk, subcategory.pk,
+                cleaned_data.get('comment'), cleaned_data['currency'],
+            )
+            self.duplicates = list(
+                find_duplicates(fingerprint, self.instance.pk, self.instance.organization_id)
+                .select_related('status')[:5]
+            )
+            if self.duplicates:
+                raise ValidationError("Похожая транзакция уже существует")
+        
         return cleaned_data
 
-class StatusForm(forms.ModelForm):
+class StatusForm(VersionFormMixin, TenantFormMixin, forms.ModelForm):
     class Meta:
         model = Status
         fields = ['name']
@@ -44,7 +121,7 @@ class StatusForm(forms.ModelForm):
             'name': forms.TextInput(attrs={'class': 'form-control'}),
         }
 
-class TransactionTypeForm(forms.ModelForm):
+class TransactionTypeForm(VersionFormMixin, TenantFormMixin, forms.ModelForm):
     class Meta:
         model = TransactionType
         fields = ['name']
@@ -52,7 +129,7 @@ class TransactionTypeForm(forms.ModelForm):
             'name': forms.TextInput(attrs={'class': 'form-control'}),
         }
 
-class CategoryForm(forms.ModelForm):
+class CategoryForm(VersionFormMixin, TenantFormMixin, forms.ModelForm):
     class Meta:
         model = Category
         fields = ['name', 'transaction_type']
@@ -61,11 +138,81 @@ class CategoryForm(forms.ModelForm):
             'transaction_type': forms.Select(attrs={'class': 'form-control'}),
         }
 
-class SubcategoryForm(forms.ModelForm):
+class SubcategoryForm(VersionFormMixin, TenantFormMixin, forms.ModelForm):
     class Meta:
         model = Subcategory
         fields = ['name', 'category']
         widgets = {
             'name': forms.TextInput(attrs={'class': 'form-control'}),
             'category': forms.Select(attrs={'class': 'form-control'}),
-        }
\ No newline at end of file
+        }
+class PivotReportForm(TenantFormMixin, forms.Form):
+    date_from = forms.DateField(
+        required=False, label='Дата с',
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}),
+    )
+    date_to = forms.DateField(
+        required=False, label='Дата по',
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}),
+    )
+    status = forms.ModelChoiceField(
+        queryset=Status.objects.all(), required=False, label='Статус', empty_label='Все',
+        widget=forms.Select(attrs={'class': 'form-control'}),
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        date_from = cleaned_data.get('date_from')
+        date_to = cleaned_data.get('date_to')
+
+        if date_from and date_to and date_from > date_to:
+            raise ValidationError("Дата начала периода позже даты окончания")
+
+        # Столбцы отчета - месяцы периода: открытая граница считается сегодняшней датой
+        if date_from or date_to:
+            months = month_count(date_from or date.today(), date_to or date.today())
+            if months > get_max_months():
+                raise ValidationError(f"Период отчета длиннее {get_max_months()} мес.")
+
+        return cleaned_data
+
+class BudgetForm(TenantFormMixin, forms.ModelForm):
+    month = forms.DateField(
+        label='Месяц', input_formats=['%Y-%m'],
+        widget=forms.DateInput(attrs={'type': 'month', 'class': 'form-control'}, format='%Y-%m'),
+    )
+
+    class Meta:
+        model = Budget
+        fields = ['month', 'category', 'subcategory', 'amount']
+        widgets = {
+            'category': forms.Select(attrs={'class': 'form-control', 'id': 'id_category'}),
+            'subcategory': forms.Select(attrs={'class': 'form-control', 'id': 'id_subcategory'}),
+            'amount': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}),
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['subcategory'].empty_label = 'Вся категория'
+        for name, scope_id in (('category', None), ('subcategory', 'id_category')):
+            if use_autocomplete(name):
+                self.fields[name].widget = AutocompleteWidget(name, scope_id, attrs={'id': f'id_{name}'})
+
+    def clean_month(self):
+        return month_start(self.cleaned_data['month'])
+
+    def clean_amount(self):
+        amount = self.cleaned_data['amount']
+        if amount <= 0:
+            raise ValidationError("Сумма бюджета должна быть больше нуля")
+        return amount
+
+    def clean(self):
+        cleaned_data = super().clean()
+        category = cleaned_data.get('category')
+        subcategory = cleaned_data.get('subcategory')
+
+        if subcategory and category and subcategory.category_id != category.pk:
+            raise ValidationError("Выбранная подкатегория не соответствует выбранной категории")
+
+        return cleaned_data
@@ -0,0 +1,278 @@
+"""Фоновые задачи без внешнего брокера.
+
+Очередь - таблица Job в основной базе. Обработчики (команда run_workers)
+забирают задачи условным UPDATE ... WHERE status='queued', поэтому одну
+задачу получает ровно один процесс. Результат пишется файлом в
+DDS_JOB_RESULTS_DIR и хранится DDS_JOB_RESULT_TTL секунд, после чего файл
+удаляется, а задача помечается как expired.
+
+Пока задача выполняется, обработчик раз в DDS_JOB_HEARTBEAT_INTERVAL секунд
+отмечается в ней (heartbeat_at). В очередь возвращаются только задачи без
+свежей отметки - их обработчик убит; долгая выгрузка живого обработчика
+остается за ним. Если задачу все же вернули и ее взял другой обработчик,
+прежний не перезапишет итог: статус меняется только условием
+worker=<свое имя> и status='running', а каждая попытка пишет свой файл,
+который публикуется в result_path только вместе с этим условным UPDATE.
+
+Задача принадлежит организации, в которой поставлена; обработчик
+выполняется в ее контексте (dds_app.tenancy) и видит только ее данные.
+Перед каждой задачей поколения кэша этой организации сверяются с базой,
+как в начале запроса (dds_app.cache.sync_generations).
+"""
+import csv
+import logging
+import os
+import re
+import socket
+import threading
+import traceback
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .cache import sync_generations
+from .filters import get_filters, filter_transactions
+from .models import Job, Transaction
+from .reports import get_pivot, pivot_rows
+from .tenancy import tenant_context
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESULT_TTL = 24 * 60 * 60
+DEFAULT_HEARTBEAT_INTERVAL = 30
+# Прогресс пишется в базу не чаще, чем раз в столько строк
+PROGRESS_STEP = 1000
+
+JOB_HANDLERS = {}
+
+
+def job_handler(kind, title):
+    def decorator(func):
+        JOB_HANDLERS[kind] = (func, title)
+        return func
+    return decorator
+
+
+def get_results_dir():
+    path = getattr(settings, 'DDS_JOB_RESULTS_DIR', settings.BASE_DIR / 'job_results')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def get_result_ttl():
+    return getattr(settings, 'DDS_JOB_RESULT_TTL', DEFAULT_RESULT_TTL)
+
+
+def get_heartbeat_interval():
+    return getattr(settings, 'DDS_JOB_HEARTBEAT_INTERVAL', DEFAULT_HEARTBEAT_INTERVAL)
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def enqueue(kind, params=None):
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f'Unknown job kind: {kind}')
+    return Job.objects.create(kind=kind, params=params or {})
+
+
+def claim_next(worker=None):
+    """Забирает самую старую задачу из очереди или возвращает None."""
+    worker = worker or worker_name()
+    while True:
+        pk = Job.objects.filter(status=Job.STATUS_QUEUED).order_by('created_at', 'pk').values_list('pk', flat=True).first()
+        if pk is None:
+            return None
+        now = timezone.now()
+        claimed = Job.objects.filter(pk=pk, status=Job.STATUS_QUEUED).update(
+            status=Job.STATUS_RUNNING, worker=worker, started_at=now, heartbeat_at=now, progress=0,
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+        # Задачу перехватил другой обработчик - берем следующую
+
+
+class Progress:
+    """Счетчик прогресса задачи; в базу пишется только изменение процента."""
+
+    def __init__(self, job, total):
+        self.job = job
+        self.total = total
+        self.done = 0
+        self.percent = 0
+
+    def advance(self, count=1):
+        self.done += count
+        if self.total and (self.done % PROGRESS_STEP == 0 or self.done == self.total):
+            self.set(self.done * 100 // self.total)
+
+    def set(self, percent):
+        percent = min(percent, 99)  # 100% ставит run_job вместе со статусом done
+        if percent != self.percent:
+            self.percent = percent
+            owned(self.job).update(progress=percent, heartbeat_at=timezone.now())
+
+
+def owned(job):
+    """Задача, пока она выполняется этим обработчиком (не возвращена в очередь и не взята другим)."""
+    return Job.objects.filter(pk=job.pk, worker=job.worker, status=Job.STATUS_RUNNING)
+
+
+class Heartbeat:
+    """Отметки обработчика в задаче из отдельного потока, пока выполняется обработчик."""
+
+    def __init__(self, job, interval):
+        self.job = job
+        self.interval = interval
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=f'job-{job.pk}-heartbeat', daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop.set()
+        self.thread.join()
+
+    def run(self):
+        try:
+            while not self.stop.wait(self.interval):
+                try:
+                    if not owned(self.job).update(heartbeat_at=timezone.now()):
+                        logger.warning('Job %s was taken over by another worker', self.job.pk)
+                except DatabaseError:
+                    # База занята записью - отметка будет в следующий раз
+                    logger.warning('Heartbeat of job %s failed', self.job.pk, exc_info=True)
+        finally:
+            connection.close()
+
+
+def run_job(job):
+    """Выполняет задачу, уже переведенную в running, и сохраняет итог."""
+    func, _ = JOB_HANDLERS[job.kind]
+    # Файл попытки: задачу, возвращенную в очередь, может одновременно выполнять другой обработчик
+    attempt = re.sub(r'[^\w.-]', '-', job.worker)
+    path = os.path.join(get_results_dir(), f'job-{job.pk}-{attempt}')
+    try:
+        with Heartbeat(job, get_heartbeat_interval()), tenant_context(job.organization_id):
+            # Как CacheCoherenceMiddleware перед запросом: обработчик живет долго,
+            # и без сверки кэш отдавал бы отчеты по поколениям до чужих записей
+            sync_generations()
+            result_name = func(job, path)
+    except Exception:
+        logger.exception('Job %s failed', job.pk)
+        if os.path.exists(path):
+            os.remove(path)
+        owned(job).update(
+            status=Job.STATUS_FAILED, error=traceback.format_exc(limit=5), finished_at=timezone.now(),
+        )
+    else:
+        now = timezone.now()
+        published = owned(job).update(
+            status=Job.STATUS_DONE, progress=100, result_path=path, result_name=result_name,
+            finished_at=now, expires_at=now + timedelta(seconds=get_result_ttl()),
+        )
+        if not published:
+            # Задачу забрал другой обработчик - итог за ним
+            logger.warning('Job %s was taken over by another worker, result discarded', job.pk)
+            os.remove(path)
+    job.refresh_from_db()
+    return job
+
+
+def run_pending(worker=None, limit=None):
+    """Выполняет задачи из очереди, пока она не опустеет; возвращает их число."""
+    count = 0
+    while limit is None or count < limit:
+        job = claim_next(worker)
+        if job is None:
+            break
+        run_job(job)
+        count += 1
+    return count
+
+
+def requeue_stale(timeout):
+    """Возвращает в очередь задачи, обработчик которых не отмечался дольше timeout
+    секунд (был убит, не завершив задачу)."""
+    before = timezone.now() - timedelta(seconds=timeout)
+    # Задачи, начатые до появления отметок, - по времени начала
+    expired = Q(heartbeat_at__lt=before) | Q(heartbeat_at__isnull=True, started_at__lt=before)
+    return Job.objects.filter(expired, status=Job.STATUS_RUNNING).update(
+        status=Job.STATUS_QUEUED, worker='', started_at=None, heartbeat_at=None, progress=0,
+    )
+
+
+def cleanup_expired(now=None):
+    """Удаляет файлы результатов с истекшим сроком хранения."""
+    now = now or timezone.now()
+    expired = Job.objects.filter(status=Job.STATUS_DONE, expires_at__lte=now)
+    count = 0
+    for job in expired.only('pk', 'result_path'):
+        if job.result_path and os.path.exists(job.result_path):
+            os.remove(job.result_path)
+        count += Job.objects.filter(pk=job.pk, status=Job.STATUS_DONE).update(
+            status=Job.STATUS_EXPIRED, result_path='',
+        )
+    return count
+
+
+def is_available(job):
+    return (
+        job.status == Job.STATUS_DONE
+        and job.expires_at > timezone.now()
+        and os.path.exists(job.result_path)
+    )
+
+
+def write_csv(path, rows):
+    # utf-8-sig, чтобы Excel корректно открывал кириллицу
+    with open(path, 'w', newline='', encoding='utf-8-sig') as file:
+        csv.writer(file).writerows(rows)
+
+
+# Обработчики
+
+@job_handler('transactions_csv', 'Экспорт транзакций в CSV')
+def export_transactions(job, path):
+    """Выгрузка списка транзакций с фильтрами из params (как у transaction_list)."""
+    transactions = filter_transactions(Transaction.objects.all(), get_filters(job.params)).select_related(
+        'status', 'transaction_type', 'category', 'subcategory'
+    ).order_by('-date', '-created_at')
+    progress = Progress(job, transactions.count())
+
+    def rows():
+        yield ['Дата', 'Статус', 'Тип', 'Категория', 'Подкатегория', 'Сумма', 'Валюта', 'Сумма в рублях',
+               'Комментарий']
+        for transaction in transactions.iterator(chunk_size=2000):
+            yield [
+                transaction.date.isoformat(), transaction.status.name, transaction.transaction_type.name,
+                transaction.category.name, transaction.subcategory.name, transaction.amount, transaction.currency,
+                transaction.base_amount, transaction.comment,
+            ]
+            progress.advance()
+
+    write_csv(path, rows())
+    return f'transactions-{job.pk}.csv'
+
+
+@job_handler('pivot_csv', 'Сводный отчет в CSV')
+def export_pivot(job, path):
+    params = job.params
+    report = get_pivot(
+        date.fromisoformat(params['date_from']) if params.get('date_from') else None,
+        date.fromisoformat(params['date_to']) if params.get('date_to') else None,
+        params.get('status'),
+    )
+    write_csv(path, pivot_rows(report))
+    return f'pivot-report-{job.pk}.csv'
+
+
+def job_title(job):
+    handler = JOB_HANDLERS.get(job.kind)
+    return handler[1] if handler else job.kind
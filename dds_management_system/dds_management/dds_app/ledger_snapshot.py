@@ -0,0 +1,268 @@
+"""Колоночный бинарный снимок журнала транзакций для офлайн-аналитики.
+
+Формат файла (порядок байт little-endian):
+
+    0   8 байт   сигнатура b'DDSLEDG1'
+    8   8 байт   длина JSON-заголовка (uint64)
+    16  N байт   JSON-заголовок: число строк, каталог колонок (тип array,
+                 смещение от начала данных, число элементов) и раздел
+                 справочников
+    ... данные колонок; начало данных и каждая колонка выровнены на 8 байт
+
+Строки упорядочены по дате (в заголовке "sorted": "date"), поэтому период
+находится двоичным поиском по колонке date. Колонки: id (int64), date
+(порядковый номер дня, date.toordinal, int32),
+amount и base_amount (сумма в валюте операции и в рублях, копейки, int64),
+status, transaction_type, category, subcategory (коды - индексы в списках
+справочников, uint16 или uint32). Валюта операции - код в списке
+справочника currency.
+
+Чтение не требует Django: файл отображается в память (mmap), колонки
+отдаются без копирования - массивами NumPy, если он установлен, иначе
+memoryview. Без NumPy суммы считаются по срезу периода итераторами
+(compress, map), без цикла по строкам в Python. Запись снимка
+(write_ledger_snapshot) использует ORM.
+"""
+import json
+import mmap
+import operator
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from decimal import Decimal
+from itertools import compress, repeat
+
+try:
+    import numpy
+except ImportError:  # NumPy не обязателен
+    numpy = None
+
+MAGIC = b'DDSLEDG1'
+ALIGNMENT = 8
+DICTIONARIES = ('status', 'transaction_type', 'category', 'subcategory')
+NUMPY_TYPES = {'q': '<i8', 'i': '<i4', 'H': '<u2', 'I': '<u4'}
+OPERATORS = {'>=': operator.ge, '<=': operator.le, '==': operator.eq}
+LITTLE_ENDIAN = sys.byteorder == 'little'
+
+
+def align(size):
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def code_type(size):
+    return 'H' if size <= 0xFFFF else 'I'
+
+
+def pack_snapshot(file, columns, dictionaries):
+    """Записывает колонки (имя -> array одинаковой длины, строки по возрастанию даты) и справочники."""
+    directory = {}
+    offset = 0
+    for name, values in columns.items():
+        directory[name] = {'type': values.typecode, 'offset': offset, 'count': len(values)}
+        offset += align(len(values) * values.itemsize)
+    header = json.dumps(
+        {'rows': len(columns['id']), 'sorted': 'date', 'columns': directory, 'dictionaries': dictionaries},
+        ensure_ascii=False,
+    ).encode('utf-8')
+    header = header.ljust(align(16 + len(header)) - 16)
+
+    file.write(MAGIC)
+    file.write(struct.pack('<Q', len(header)))
+    file.write(header)
+    for values in columns.values():
+        if not LITTLE_ENDIAN:
+            values = array(values.typecode, values)
+            values.byteswap()
+        data = values.tobytes()
+        file.write(data)
+        file.write(bytes(align(len(data)) - len(data)))
+
+
+def write_ledger_snapshot(file):
+    """Снимок всех транзакций; возвращает число строк."""
+    from django.db import transaction
+
+    from .currencies import CURRENCY_CHOICES
+    from .models import Transaction, Status, TransactionType, Category, Subcategory
+
+    # Справочники и транзакции читаются в одной транзакции - из одного снимка
+    # базы: иначе транзакция с новой категорией, созданная между чтениями,
+    # ссылалась бы на код, которого нет в справочнике
+    with transaction.atomic():
+        status_ids = list(Status.objects.order_by('pk').values_list('pk', 'name'))
+        type_ids = list(TransactionType.objects.order_by('pk').values_list('pk', 'name'))
+        category_ids = list(Category.objects.order_by('pk').values_list('pk', 'name', 'transaction_type_id'))
+        subcategory_ids = list(Subcategory.objects.order_by('pk').values_list('pk', 'name', 'category_id'))
+
+        codes = {
+            'status': {pk: code for code, (pk, *_) in enumerate(status_ids)},
+            'transaction_type': {pk: code for code, (pk, *_) in enumerate(type_ids)},
+            'category': {pk: code for code, (pk, *_) in enumerate(category_ids)},
+            'subcategory': {pk: code for code, (pk, *_) in enumerate(subcategory_ids)},
+        }
+        dictionaries = {
+            'status': [{'id': pk, 'name': name} for pk, name in status_ids],
+            'transaction_type': [{'id': pk, 'name': name} for pk, name in type_ids],
+            'category': [
+                {'id': pk, 'name': name, 'transaction_type': codes['transaction_type'][type_id]}
+                for pk, name, type_id in category_ids
+            ],
+            'subcategory': [
+                {'id': pk, 'name': name, 'category': codes['category'][category_id]}
+                for pk, name, category_id in subcategory_ids
+            ],
+        }
+
+        columns = {
+            'id': array('q'),
+            'date': array('i'),
+            'amount': array('q'),
+            'base_amount': array('q'),
+            'currency': array('H'),
+        }
+        for name in DICTIONARIES:
+            columns[name] = array(code_type(len(codes[name])))
+
+        currencies = {code: index for index, (code, _) in enumerate(CURRENCY_CHOICES)}
+        dictionaries['currency'] = [{'id': code} for code in currencies]
+
+        rows = Transaction.objects.order_by('date', 'pk').values_list(
+            'pk', 'date', 'amount', 'base_amount', 'currency',
+            'status_id', 'transaction_type_id', 'category_id', 'subcategory_id',
+        )
+        for pk, day, amount, base_amount, currency, *refs in rows.iterator(chunk_size=5000):
+            columns['id'].append(pk)
+            columns['date'].append(day.toordinal())
+            columns['amount'].append(int(amount * 100))
+            columns['base_amount'].append(int(base_amount * 100))
+            columns['currency'].append(currencies[currency])
+            for name, ref in zip(DICTIONARIES, refs):
+                columns[name].append(codes[name][ref])
+
+    pack_snapshot(file, columns, dictionaries)
+    return len(columns['id'])
+
+
+class LedgerSnapshot:
+    """Снимок, отображенный в память. Колонки читаются без копирования."""
+
+    def __init__(self, buffer):
+        if bytes(buffer[:8]) != MAGIC:
+            raise ValueError('Not a ledger snapshot')
+        (header_length,) = struct.unpack_from('<Q', buffer, 8)
+        header = json.loads(bytes(buffer[16:16 + header_length]).decode('utf-8'))
+        self.buffer = buffer
+        self.data_start = 16 + header_length
+        self.rows = header['rows']
+        # Снимки, записанные до сортировки по дате, упорядочены по id
+        self.sorted_by_date = header.get('sorted') == 'date'
+        self.directory = header['columns']
+        self.dictionaries = header['dictionaries']
+        self._columns = {}
+        self._codes = {}
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as file:
+            if not file.seek(0, 2):
+                raise ValueError('Not a ledger snapshot')
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    def close(self):
+        for values in self._columns.values():
+            if isinstance(values, memoryview):
+                values.release()
+        self._columns.clear()
+        if isinstance(self.buffer, mmap.mmap):
+            try:
+                self.buffer.close()
+            except BufferError:
+                # Вызывающий еще держит массивы NumPy или срезы колонок -
+                # отображение освободится вместе с последним из них
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def column(self, name):
+        if name not in self._columns:
+            info = self.directory[name]
+            start = self.data_start + info['offset']
+            typecode, count = info['type'], info['count']
+            if numpy is not None:
+                values = numpy.frombuffer(self.buffer, dtype=NUMPY_TYPES[typecode], count=count, offset=start)
+            else:
+                size = array(typecode).itemsize
+                values = memoryview(self.buffer)[start:start + count * size].cast(typecode)
+                if not LITTLE_ENDIAN:
+                    values = array(typecode, values)
+                    values.byteswap()
+            self._columns[name] = values
+        return self._columns[name]
+
+    def code(self, dictionary, pk):
+        """Код значения справочника по его id в базе (None, если его нет в снимке)."""
+        if dictionary not in self._codes:
+            self._codes[dictionary] = {item['id']: code for code, item in enumerate(self.dictionaries[dictionary])}
+        return self._codes[dictionary].get(pk)
+
+    def date_rows(self, date_from=None, date_to=None):
+        """Строки [start, stop) периода двоичным поиском по колонке date."""
+        dates = self.column('date')
+        search = numpy.searchsorted if numpy is not None else None
+        start, stop = 0, self.rows
+        if date_from is not None:
+            value = date_from.toordinal()
+            start = int(search(dates, value, 'left')) if search else bisect_left(dates, value)
+        if date_to is not None:
+            value = date_to.toordinal()
+            stop = int(search(dates, value, 'right')) if search else bisect_right(dates, value)
+        return start, max(start, stop)
+
+    def total(self, date_from=None, date_to=None, **filters):
+        """Сумма в рублях с фильтрами по датам и id справочников (status=..., category=...)."""
+        conditions = []
+        start, stop = 0, self.rows
+        if self.sorted_by_date:
+            start, stop = self.date_rows(date_from, date_to)
+        else:
+            if date_from is not None:
+                conditions.append(('date', '>=', date_from.toordinal()))
+            if date_to is not None:
+                conditions.append(('date', '<=', date_to.toordinal()))
+        for name, pk in filters.items():
+            if name not in DICTIONARIES:
+                raise TypeError(f'Unknown filter: {name}')
+            code = self.code(name, pk)
+            if code is None:
+                return Decimal('0.00')
+            conditions.append((name, '==', code))
+
+        # В снимках до появления валют колонки base_amount нет: все суммы в рублях
+        amount = self.column('base_amount' if 'base_amount' in self.directory else 'amount')[start:stop]
+        if numpy is not None:
+            mask = numpy.ones(stop - start, dtype=bool)
+            for name, op, value in conditions:
+                values = self.column(name)[start:stop]
+                if op == '>=':
+                    mask &= values >= value
+                elif op == '<=':
+                    mask &= values <= value
+                else:
+                    mask &= values == value
+            cents = int(amount[mask].sum())
+        else:
+            selected = amount
+            if conditions:
+                selectors = None
+                for name, op, value in conditions:
+                    matches = map(OPERATORS[op], self.column(name)[start:stop], repeat(value))
+                    selectors = matches if selectors is None else map(operator.and_, selectors, matches)
+                selected = compress(amount, selectors)
+            cents = sum(selected)
+        return Decimal(cents).scaleb(-2)
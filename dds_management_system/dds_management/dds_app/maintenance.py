@@ -0,0 +1,181 @@
+import statistics
+import time
+from datetime import date, timedelta
+
+from django.db import OperationalError, connection
+
+from .dictionaries import DICTIONARIES
+from .filters import get_filters
+from .ordering import SORTS, get_page
+from .reports import build_pivot
+from .tenancy import default_organization_id, tenant_context
+
+# Обслуживание файла SQLite (команда maintain_database, запускается из cron).
+#
+# Статистика планировщика (ANALYZE): после больших загрузок и удалений
+# устаревшая статистика sqlite_stat1 уводит планировщик на неудачные индексы.
+#
+# Инкрементальная очистка: при auto_vacuum=INCREMENTAL свободные страницы
+# возвращаются файлу порциями "PRAGMA incremental_vacuum(N)". Каждая порция -
+# отдельная короткая транзакция записи, между порциями пишут остальные
+# процессы; очистка останавливается по бюджету времени. В режиме
+# auto_vacuum=NONE (так создана база) порции невозможны: режим включается
+# один раз полным VACUUM (enable_incremental), который блокирует запись на
+# все время работы.
+#
+# Фрагментация объекта (таблицы или индекса) - доля страниц, которые в порядке
+# обхода B-дерева лежат в файле не сразу после предыдущей (как в
+# sqlite3_analyzer); заполненность - доля полезных байт страниц. Размеры
+# берутся из виртуальной таблицы dbstat, если SQLite собран с ней.
+
+DEFAULT_SLICE_PAGES = 256
+
+AUTO_VACUUM_MODES = {0: 'none', 1: 'full', 2: 'incremental'}
+
+
+def pragma(name):
+    with connection.cursor() as cursor:
+        cursor.execute(f'PRAGMA {name}')
+        return cursor.fetchone()[0]
+
+
+def file_stats():
+    page_size = pragma('page_size')
+    return {
+        'page_size': page_size,
+        'pages': pragma('page_count'),
+        'free_pages': pragma('freelist_count'),
+        'size': page_size * pragma('page_count'),
+        'auto_vacuum': AUTO_VACUUM_MODES.get(pragma('auto_vacuum'), 'unknown'),
+    }
+
+
+def object_stats():
+    """Размер, заполненность и фрагментация таблиц и индексов (по убыванию размера).
+
+    None, если SQLite собран без dbstat.
+    """
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute('SELECT name, pageno, pgsize, unused FROM dbstat')
+        except OperationalError:
+            return None
+        objects = {}
+        for name, pageno, size, unused in cursor:
+            item = objects.get(name)
+            if item is None:
+                item = objects[name] = {'name': name, 'pages': 0, 'size': 0, 'unused': 0, 'gaps': 0, 'last': None}
+            elif pageno != item['last'] + 1:
+                item['gaps'] += 1
+            item['pages'] += 1
+            item['size'] += size
+            item['unused'] += unused
+            item['last'] = pageno
+        cursor.execute('SELECT name, type, tbl_name FROM sqlite_schema')
+        schema = {name: (kind, table) for name, kind, table in cursor.fetchall()}
+    result = []
+    for item in objects.values():
+        kind, table = schema.get(item['name'], ('table', item['name']))
+        result.append({
+            'name': item['name'],
+            'type': kind,
+            'table': table,
+            'pages': item['pages'],
+            'size': item['size'],
+            'fill': 1 - item['unused'] / item['size'] if item['size'] else 0.0,
+            'fragmentation': item['gaps'] / (item['pages'] - 1) if item['pages'] > 1 else 0.0,
+        })
+    return sorted(result, key=lambda item: (-item['size'], item['name']))
+
+
+def analyze(limit=0):
+    """Обновляет статистику планировщика; limit - строк индекса на оценку (0 - все)."""
+    with connection.cursor() as cursor:
+        cursor.execute(f'PRAGMA analysis_limit = {int(limit)}')
+        cursor.execute('ANALYZE')
+
+
+def enable_incremental():
+    """Переводит базу в auto_vacuum=INCREMENTAL полным VACUUM (блокирует запись)."""
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        cursor.execute('VACUUM')
+
+
+def incremental_vacuum(seconds, slice_pages=DEFAULT_SLICE_PAGES, pause=0.0):
+    """Возвращает файлу свободные страницы порциями до исчерпания бюджета времени.
+
+    Возвращает (освобождено страниц, порций). Вызывается вне atomic(): каждая
+    порция - своя транзакция.
+    """
+    if pragma('auto_vacuum') != 2:
+        return 0, 0
+    deadline = time.monotonic() + seconds
+    freed = slices = 0
+    connection.ensure_connection()
+    while time.monotonic() < deadline:
+        free = pragma('freelist_count')
+        if not free:
+            break
+        # executescript выполняет прагму до конца; через execute модуль sqlite3
+        # делает один шаг, и порция освобождает одну страницу
+        connection.connection.executescript(f'PRAGMA incremental_vacuum({min(free, slice_pages)})')
+        freed += free - pragma('freelist_count')
+        slices += 1
+        if pause:
+            time.sleep(pause)
+    return freed, slices
+
+
+def check_integrity(full=False):
+    """Список найденных проблем (пустой, если база цела)."""
+    problems = []
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA integrity_check' if full else 'PRAGMA quick_check')
+        problems += [row[0] for row in cursor.fetchall() if row[0] != 'ok']
+        cursor.execute('PRAGMA foreign_key_check')
+        problems += [f'{table} rowid {rowid}: foreign key to missing {parent} row'
+                     for table, rowid, parent, _ in cursor.fetchall()]
+    return problems
+
+
+# Стандартный набор запросов для сравнения до и после обслуживания:
+# первые страницы списка в основных сортировках, сводный отчет за год и
+# страница справочника категорий
+
+def list_page(sort):
+    def run():
+        return get_page(SORTS[sort].transactions(get_filters({})), SORTS[sort])
+    return run
+
+
+def pivot_year():
+    return build_pivot(date.today() - timedelta(days=365), date.today())
+
+
+def category_page():
+    return DICTIONARIES['category'].page()
+
+
+STANDARD_QUERIES = [
+    ('list, newest first', list_page('-date')),
+    ('list, by amount', list_page('-amount')),
+    ('list, by category', list_page('category')),
+    ('pivot report, last year', pivot_year),
+    ('category dictionary', category_page),
+]
+
+
+def time_queries(repeat=5):
+    """Медиана времени каждого запроса набора в секундах (после прогрева)."""
+    timings = {}
+    with tenant_context(default_organization_id()):
+        for title, run in STANDARD_QUERIES:
+            run()
+            samples = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                run()
+                samples.append(time.perf_counter() - started)
+            timings[title] = statistics.median(samples)
+    return timings
@@ -0,0 +1,108 @@
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from dds_app.currencies import BASE_CURRENCY
+from dds_app.fingerprints import transaction_fingerprint
+from dds_app.models import Organization, Transaction, Status, TransactionType, Category, Subcategory
+from dds_app.tenancy import DEFAULT_NAME, DEFAULT_SLUG
+from dds_app.parallel_report import parallel_report
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the sharded report engine from 1 to N worker processes. '
+        'Runs on a temporary copy of the database filled with synthetic transactions.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=500000, help='Synthetic transactions to add to the copy')
+        parser.add_argument('--years', type=int, default=3, help='Length of the reported period')
+        parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per worker count (best is reported)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('The sharded report engine reads SQLite files directly')
+
+        date_to = date.today()
+        date_from = date_to - timedelta(days=365 * options['years'])
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_path = os.path.join(tmpdir, 'bench.sqlite3')
+            self.prepare_copy(db_path, options['rows'], date_from, date_to)
+
+            baseline = None
+            workers = 1
+            self.stdout.write(f'{"workers":>8} {"seconds":>10} {"speedup":>8}')
+            while workers <= options['max_workers']:
+                timings = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    report = parallel_report(date_from, date_to, workers=workers, db_path=db_path,
+                                             table=Transaction._meta.db_table)
+                    timings.append(time.perf_counter() - started)
+                best = min(timings)
+                baseline = baseline or best
+                self.stdout.write(f'{workers:>8} {best:>10.3f} {baseline / best:>7.2f}x')
+                workers *= 2
+
+        self.stdout.write(self.style.SUCCESS(f'Rows in period: {report["count"]}, total {report["amount"]}'))
+
+    def prepare_copy(self, db_path, rows_count, date_from, date_to):
+        connection.ensure_connection()
+        target = sqlite3.connect(db_path)
+        connection.connection.backup(target)
+
+        def first_id(model, insert_sql, params, where=''):
+            row = target.execute(f'SELECT id FROM {model._meta.db_table} {where} LIMIT 1').fetchone()
+            if row:
+                return row[0]
+            return target.execute(insert_sql.format(table=model._meta.db_table), params).lastrowid
+
+        organization_id = first_id(Organization, 'INSERT INTO {table} (name, slug) VALUES (?, ?)',
+                                   [DEFAULT_NAME, DEFAULT_SLUG])
+        # Справочники и транзакции - в одной организации
+        where = f'WHERE organization_id = {int(organization_id)}'
+        status_id = first_id(Status, 'INSERT INTO {table} (organization_id, name, version) VALUES (?, ?, 1)',
+                             [organization_id, 'Бизнес'], where)
+        type_id = first_id(TransactionType, 'INSERT INTO {table} (organization_id, name, version) VALUES (?, ?, 1)',
+                           [organization_id, 'Списание'], where)
+        category_id = first_id(
+            Category, 'INSERT INTO {table} (organization_id, name, transaction_type_id, version) VALUES (?, ?, ?, 1)',
+            [organization_id, 'Маркетинг', type_id], f'{where} AND transaction_type_id = {int(type_id)}',
+        )
+        subcategory_id = first_id(
+            Subcategory, 'INSERT INTO {table} (organization_id, name, category_id, version) VALUES (?, ?, ?, 1)',
+            [organization_id, 'Avito', category_id], f'{where} AND category_id = {int(category_id)}',
+        )
+
+        days = (date_to - date_from).days
+        now = datetime.now().isoformat(sep=' ')
+        generator = random.Random(42)
+
+        def rows():
+            for _ in range(rows_count):
+                day = date_from + timedelta(days=generator.randrange(days + 1))
+                amount = f'{generator.randrange(1, 10000000) / 100:.2f}'
+                fingerprint = transaction_fingerprint(day, amount, type_id, category_id, subcategory_id, '')
+                # Рубли: сумма в базовой валюте равна сумме операции
+                yield (organization_id, day.isoformat(), status_id, type_id, category_id, subcategory_id, amount,
+                       BASE_CURRENCY, amount, '', now, now, fingerprint)
+
+        target.executemany(
+            f'INSERT INTO {Transaction._meta.db_table} '
+            '(organization_id, date, status_id, transaction_type_id, category_id, subcategory_id, amount, currency, '
+            'base_amount, comment, created_at, updated_at, fingerprint, version) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)',
+            rows(),
+        )
+        target.commit()
+        target.execute('ANALYZE')
+        target.close()
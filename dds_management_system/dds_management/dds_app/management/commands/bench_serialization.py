@@ -0,0 +1,98 @@
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db.transaction import atomic, set_rollback
+from django.http import JsonResponse
+
+from dds_app.currencies import fill_base_amounts
+from dds_app.models import Transaction, Status, TransactionType, Category, Subcategory
+from dds_app.serialization import TRANSACTION, dumps, iter_json_array, orjson
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark JSON serialization of transactions: model instances with JsonResponse versus '
+        'column tuples with the stdlib and orjson encoders, full and sparse field sets. '
+        'Synthetic rows are inserted in a transaction that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=50000, help='Synthetic transactions to add')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per approach (best is reported)')
+        parser.add_argument('--fields', default='id,date,amount,category', help='Sparse field set')
+
+    def handle(self, *args, **options):
+        with atomic():
+            self.fill(options['rows'])
+            queryset = Transaction.objects.all()
+            total = queryset.count()
+            full = TRANSACTION.default
+            sparse = TRANSACTION.parse_fields(options['fields'])
+
+            approaches = [
+                ('model instances + JsonResponse', lambda: self.instances(queryset)),
+                ('tuples + json, all fields', lambda: self.tuples(queryset, full, fast=False)),
+                (f'tuples + json, {",".join(sparse)}', lambda: self.tuples(queryset, sparse, fast=False)),
+            ]
+            if orjson is not None:
+                approaches += [
+                    ('tuples + orjson, all fields', lambda: self.tuples(queryset, full, fast=True)),
+                    (f'tuples + orjson, {",".join(sparse)}', lambda: self.tuples(queryset, sparse, fast=True)),
+                    ('streamed, all fields', lambda: b''.join(iter_json_array(full, TRANSACTION.rows(queryset, full)))),
+                ]
+            else:
+                self.stdout.write(self.style.WARNING('orjson is not installed, fast encoder rows are skipped'))
+
+            self.stdout.write(f'{"approach":<44} {"seconds":>9} {"bytes":>12} {"speedup":>8}')
+            baseline = None
+            for title, run in approaches:
+                timings = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    payload = run()
+                    timings.append(time.perf_counter() - started)
+                best = min(timings)
+                baseline = baseline or best
+                self.stdout.write(f'{title:<44} {best:>9.3f} {len(payload):>12} {baseline / best:>7.2f}x')
+            set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS(f'Rows serialized: {total}'))
+
+    def instances(self, queryset):
+        # Прежний подход: объекты моделей, затем словари и JsonResponse
+        data = [
+            {
+                'id': transaction.id,
+                'date': transaction.date,
+                'status': transaction.status.name,
+                'transaction_type': transaction.transaction_type.name,
+                'category': transaction.category.name,
+                'subcategory': transaction.subcategory.name,
+                'amount': transaction.amount,
+                'comment': transaction.comment,
+            }
+            for transaction in queryset.select_related('status', 'transaction_type', 'category', 'subcategory')
+        ]
+        return JsonResponse(data, safe=False).content
+
+    def tuples(self, queryset, names, fast):
+        return dumps([dict(zip(names, row)) for row in TRANSACTION.rows(queryset, names)], fast=fast)
+
+    def fill(self, rows_count):
+        status = Status.objects.create(name='bench status')
+        transaction_type = TransactionType.objects.create(name='bench type')
+        category = Category.objects.create(name='bench category', transaction_type=transaction_type)
+        subcategory = Subcategory.objects.create(name='bench subcategory', category=category)
+        generator = random.Random(42)
+        start = date.today() - timedelta(days=365)
+        Transaction.objects.bulk_create(fill_base_amounts([
+            Transaction(
+                date=start + timedelta(days=generator.randrange(366)), status=status,
+                transaction_type=transaction_type, category=category, subcategory=subcategory,
+                amount=Decimal(generator.randrange(1, 10000000)) / 100, comment='Оплата по счету',
+            )
+            for _ in range(rows_count)
+        ]), batch_size=5000)
@@ -0,0 +1,101 @@
+import random
+import statistics
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.transaction import atomic, set_rollback
+
+from dds_app.cache import bump_generation, sync_generations
+from dds_app.currencies import fill_base_amounts
+from dds_app.filters import filter_transactions
+from dds_app.models import Organization, Transaction, Status, TransactionType, Category, Subcategory
+from dds_app.reports import build_pivot
+from dds_app.tenancy import tenant_context
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark per-tenant latency as the number of organizations grows: the transaction list page, '
+        'the pivot report, the dictionary list and the cache coherence check of one organization. '
+        'Synthetic organizations are inserted in a transaction that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tenants', default='1,10,50', help='Comma-separated organization counts')
+        parser.add_argument('--rows', type=int, default=2000, help='Transactions per organization')
+        parser.add_argument('--samples', type=int, default=5, help='Organizations measured at each step')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per operation (median is reported)')
+
+    def handle(self, *args, **options):
+        steps = sorted({int(value) for value in options['tenants'].split(',') if value.strip()})
+        operations = [
+            ('list page', self.list_page),
+            ('pivot report', self.pivot),
+            ('dictionaries', self.dictionaries),
+            ('cache check', sync_generations),
+        ]
+        generator = random.Random(42)
+        self.stdout.write(f'{"tenants":>8} {"rows":>10} ' + ' '.join(f'{title:>14}' for title, _ in operations))
+        with atomic():
+            organizations = []
+            for count in steps:
+                while len(organizations) < count:
+                    organizations.append(self.fill(len(organizations), options['rows'], generator))
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE')
+                sample = generator.sample(organizations, min(options['samples'], len(organizations)))
+                timings = {title: [] for title, _ in operations}
+                for organization_id in sample:
+                    with tenant_context(organization_id):
+                        for title, run in operations:
+                            run()  # прогрев кэшей процесса
+                            for _ in range(options['repeat']):
+                                started = time.perf_counter()
+                                run()
+                                timings[title].append(time.perf_counter() - started)
+                medians = ' '.join(
+                    f'{statistics.median(timings[title]) * 1000:>11.2f} ms' for title, _ in operations
+                )
+                self.stdout.write(f'{count:>8} {count * options["rows"]:>10} {medians}')
+            set_rollback(True)
+        self.stdout.write(self.style.SUCCESS('Latencies are medians for one organization at each step'))
+
+    def list_page(self):
+        # Первая страница списка за месяц, как в transaction_list
+        month_ago = date.today() - timedelta(days=30)
+        transactions = filter_transactions(Transaction.objects.all(), {'date_from': month_ago.isoformat()})
+        return list(transactions.select_related('status', 'transaction_type', 'category', 'subcategory')[:50])
+
+    def pivot(self):
+        return build_pivot(date.today() - timedelta(days=365), date.today())
+
+    def dictionaries(self):
+        return list(Category.objects.order_by('name').values_list('pk', 'name'))
+
+    def fill(self, number, rows_count, generator):
+        organization = Organization.objects.create(name=f'Bench organization {number}', slug=f'bench-{number}')
+        with tenant_context(organization.pk):
+            status = Status.objects.create(name='Бизнес')
+            transaction_type = TransactionType.objects.create(name='Списание')
+            categories = Category.objects.bulk_create(
+                Category(name=f'Категория {index}', transaction_type=transaction_type) for index in range(10)
+            )
+            subcategories = Subcategory.objects.bulk_create(
+                Subcategory(name=f'Подкатегория {index}', category=category)
+                for category in categories for index in range(5)
+            )
+            start = date.today() - timedelta(days=730)
+            Transaction.objects.bulk_create(fill_base_amounts([
+                Transaction(
+                    date=start + timedelta(days=generator.randrange(731)), status=status,
+                    transaction_type=transaction_type, category=subcategory.category, subcategory=subcategory,
+                    amount=Decimal(generator.randrange(1, 10000000)) / 100,
+                )
+                for subcategory in (generator.choice(subcategories) for _ in range(rows_count))
+            ]), batch_size=5000)
+            for model in (Status, TransactionType, Category, Subcategory, Transaction):
+                bump_generation(model)
+        return organization.pk
@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from dds_app.changelog import compact, get_floor
+
+
+class Command(BaseCommand):
+    help = 'Compact the change log: keep only the latest entry per object older than --days'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='Entries older than this are compacted')
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['days'])
+        collapsed, dropped = compact(before)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Change log compacted: {collapsed} superseded entries removed, '
+                f'{dropped} tombstones removed, floor seq {get_floor()}'
+            )
+        )
@@ -0,0 +1,33 @@
+import time
+
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dds_app.ledger_snapshot import write_ledger_snapshot
+from dds_app.tenancy import organization_by_slug, tenant_context
+
+
+class Command(BaseCommand):
+    help = 'Write a columnar binary snapshot of all transactions (see dds_app.ledger_snapshot)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Output file')
+        parser.add_argument('--organization', help='Slug of the organization to export (default: all)')
+
+    def handle(self, *args, **options):
+        context = nullcontext()
+        if options['organization']:
+            organization_id = organization_by_slug(options['organization'])
+            if organization_id is None:
+                raise CommandError(f'Unknown organization: {options["organization"]}')
+            context = tenant_context(organization_id)
+        started = time.perf_counter()
+        with context, open(options['path'], 'wb') as file:
+            rows = write_ledger_snapshot(file)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Ledger snapshot written: {rows} rows to {options["path"]} '
+                f'in {time.perf_counter() - started:.2f}s'
+            )
+        )
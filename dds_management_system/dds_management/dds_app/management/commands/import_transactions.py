@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from dds_app.fingerprints import bulk_create_transactions, read_transactions
+from dds_app.tenancy import DEFAULT_SLUG, organization_by_slug, tenant_context
+
+
+class Command(BaseCommand):
+    help = (
+        'Import transactions from a CSV file in the format of the transactions export. '
+        'Rows that duplicate existing transactions (same content fingerprint) are skipped'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file with transactions')
+        parser.add_argument('--allow-duplicates', action='store_true',
+                            help='Import rows even if the same transaction already exists')
+        parser.add_argument('--organization', default=DEFAULT_SLUG,
+                            help='Slug of the organization to import into')
+
+    def handle(self, *args, **options):
+        organization_id = organization_by_slug(options['organization'])
+        if organization_id is None:
+            raise CommandError(f'Unknown organization: {options["organization"]}')
+        started = time.perf_counter()
+        try:
+            with tenant_context(organization_id), transaction.atomic():
+                with open(options['path'], newline='', encoding='utf-8-sig') as file:
+                    transactions = read_transactions(file)
+                created, skipped = bulk_create_transactions(
+                    transactions, skip_duplicates=not options['allow_duplicates'],
+                )
+        except (OSError, ValueError) as error:
+            raise CommandError(f'{options["path"]}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(created)} transactions imported in {time.perf_counter() - started:.2f}s, '
+            f'{len(skipped)} duplicates skipped'
+        ))
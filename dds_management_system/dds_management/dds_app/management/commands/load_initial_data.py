@@ -0,0 +1,21 @@
+from pathlib import Path
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from dds_app.tenancy import DEFAULT_SLUG
+
+INITIAL_TAXONOMY = Path(__file__).resolve().parents[2] / 'data' / 'initial_taxonomy.json'
+
+
+class Command(BaseCommand):
+    help = 'Load initial data for DDS application'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Print the changes without applying them')
+        parser.add_argument('--organization', default=DEFAULT_SLUG, help='Slug of the organization to fill')
+
+    def handle(self, *args, **options):
+        call_command('load_taxonomy', str(INITIAL_TAXONOMY), dry_run=options['dry_run'],
+                     organization=options['organization'],
+                     verbosity=options['verbosity'], stdout=self.stdout, stderr=self.stderr)
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dds_app.currencies import load_rates, read_rates
+
+
+class Command(BaseCommand):
+    help = (
+        'Load exchange rates from CSV files with date,currency,rate rows (rate is roubles per unit). '
+        'Existing rates for the same currency and date are replaced; base-currency amounts of the '
+        'transactions affected by changed rates are recomputed'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='CSV files with exchange rates')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rates_by_key = {}
+        for path in options['paths']:
+            try:
+                with open(path, newline='', encoding='utf-8-sig') as file:
+                    rates_by_key.update(read_rates(file))
+            except (OSError, ValueError) as error:
+                raise CommandError(f'{path}: {error}')
+        loaded, updated = load_rates(rates_by_key)
+        self.stdout.write(self.style.SUCCESS(
+            f'{loaded} rates loaded in {time.perf_counter() - started:.2f}s, {updated} transactions recomputed'
+        ))
@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import ProtectedError
+
+from dds_app.taxonomy import TaxonomyError, load_taxonomy, read_taxonomy
+from dds_app.tenancy import DEFAULT_SLUG, organization_by_slug, tenant_context
+
+
+class Command(BaseCommand):
+    help = (
+        'Load statuses, transaction types, categories and subcategories from a JSON/YAML '
+        'taxonomy file (see dds_app.taxonomy for the format)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Taxonomy file (.json, .yaml or .yml)')
+        parser.add_argument('--dry-run', action='store_true', help='Print the changes without applying them')
+        parser.add_argument('--prune', action='store_true',
+                            help='Remove dictionary entries that are missing from the file')
+        parser.add_argument('--organization', default=DEFAULT_SLUG,
+                            help='Slug of the organization whose dictionaries are loaded')
+
+    def handle(self, *args, **options):
+        organization_id = organization_by_slug(options['organization'])
+        if organization_id is None:
+            raise CommandError(f'Unknown organization: {options["organization"]}')
+        started = time.perf_counter()
+        try:
+            with tenant_context(organization_id):
+                diff = load_taxonomy(read_taxonomy(options['path']), prune=options['prune'],
+                                     dry_run=options['dry_run'])
+        except (OSError, ValueError) as error:
+            raise CommandError(str(error))
+        except ProtectedError as error:
+            used = ', '.join(sorted({str(obj) for obj in error.protected_objects})[:10])
+            raise CommandError(f'Cannot remove entries that are used by transactions: {used}')
+
+        if options['dry_run'] or options['verbosity'] > 1:
+            for line in diff.lines:
+                self.stdout.write(line)
+        counts = ', '.join(
+            f'{model}: +{counts["create"]} ~{counts["rename"]} -{counts["delete"]}'
+            for model, counts in diff.summary().items()
+        )
+        if options['dry_run']:
+            self.stdout.write(f'Dry run, nothing changed. {counts}')
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'Taxonomy loaded in {time.perf_counter() - started:.2f}s. {counts}'
+            ))
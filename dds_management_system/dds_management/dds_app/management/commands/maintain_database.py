@@ -0,0 +1,101 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from dds_app.maintenance import (
+    DEFAULT_SLICE_PAGES, analyze, check_integrity, enable_incremental, file_stats, incremental_vacuum,
+    object_stats, time_queries,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'SQLite maintenance for cron: refresh planner statistics (ANALYZE), return free pages in short '
+        'incremental vacuum slices within a time budget, check integrity, and report table and index '
+        'sizes, fragmentation and standard query timings before and after. Exits with an error if the '
+        'integrity check fails.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vacuum-seconds', type=float, default=30.0,
+                            help='Time budget for incremental vacuum (0 skips it)')
+        parser.add_argument('--slice-pages', type=int, default=DEFAULT_SLICE_PAGES,
+                            help='Pages freed per vacuum slice (one short write transaction each)')
+        parser.add_argument('--pause', type=float, default=0.05, help='Seconds between vacuum slices')
+        parser.add_argument('--analysis-limit', type=int, default=0,
+                            help='Rows sampled per index by ANALYZE (0 scans everything)')
+        parser.add_argument('--enable-incremental', action='store_true',
+                            help='Switch auto_vacuum to INCREMENTAL with a one-time full VACUUM (blocks writers)')
+        parser.add_argument('--full-check', action='store_true',
+                            help='Run integrity_check instead of the faster quick_check')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per standard query (median is reported)')
+        parser.add_argument('--skip-analyze', action='store_true', help='Do not run ANALYZE')
+        parser.add_argument('--skip-timings', action='store_true', help='Do not time the standard queries')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('maintain_database supports SQLite databases only')
+
+        before = time_queries(options['repeat']) if not options['skip_timings'] else None
+        stats = file_stats()
+        self.stdout.write(
+            f'Database: {stats["pages"]} pages of {stats["page_size"]} bytes ({self.size(stats["size"])}), '
+            f'{stats["free_pages"]} free, auto_vacuum={stats["auto_vacuum"]}'
+        )
+
+        if not options['skip_analyze']:
+            self.stdout.write(f'ANALYZE: {self.timed(analyze, options["analysis_limit"]):.2f} s')
+
+        if options['enable_incremental'] and stats['auto_vacuum'] != 'incremental':
+            elapsed = self.timed(enable_incremental)
+            self.stdout.write(f'VACUUM: auto_vacuum switched to incremental in {elapsed:.2f} s')
+        elif options['vacuum_seconds'] > 0:
+            if file_stats()['auto_vacuum'] == 'incremental':
+                freed, slices = incremental_vacuum(options['vacuum_seconds'], options['slice_pages'],
+                                                   options['pause'])
+                self.stdout.write(f'Incremental vacuum: {freed} pages freed in {slices} slices, '
+                                  f'{file_stats()["free_pages"]} free pages left')
+            else:
+                self.stdout.write(self.style.WARNING(
+                    'Incremental vacuum skipped: auto_vacuum is not incremental (run once with --enable-incremental)'
+                ))
+
+        self.report_objects()
+
+        if before is not None:
+            after = time_queries(options['repeat'])
+            self.stdout.write(f'{"query":<28} {"before":>12} {"after":>12}')
+            for title, elapsed in before.items():
+                self.stdout.write(f'{title:<28} {elapsed * 1000:>9.2f} ms {after[title] * 1000:>9.2f} ms')
+
+        problems = check_integrity(options['full_check'])
+        if problems:
+            for problem in problems:
+                self.stderr.write(problem)
+            raise CommandError(f'Integrity check failed: {len(problems)} problems')
+        self.stdout.write(self.style.SUCCESS('Integrity check passed'))
+
+    def report_objects(self):
+        objects = object_stats()
+        if objects is None:
+            self.stdout.write(self.style.WARNING('Size report skipped: SQLite is built without dbstat'))
+            return
+        self.stdout.write(f'{"type":<6} {"pages":>8} {"size":>10} {"fill":>6} {"fragmented":>10}  object')
+        for item in objects:
+            self.stdout.write(
+                f'{item["type"]:<6} {item["pages"]:>8} {self.size(item["size"]):>10} '
+                f'{item["fill"]:>6.0%} {item["fragmentation"]:>10.0%}  {item["name"]}'
+            )
+
+    def timed(self, function, *args):
+        started = time.perf_counter()
+        function(*args)
+        return time.perf_counter() - started
+
+    def size(self, value):
+        for unit in ('B', 'KB', 'MB'):
+            if value < 1024:
+                return f'{value:.0f} {unit}'
+            value /= 1024
+        return f'{value:.1f} GB'
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from dds_app.anomalies import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild per-subcategory amount statistics from the transactions table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reflag', action='store_true',
+                            help='Recheck every transaction against the rebuilt statistics and refill the review queue')
+
+    def handle(self, *args, **options):
+        subcategories, flagged = rebuild_stats(reflag=options['reflag'])
+        message = f'Amount statistics rebuilt for {subcategories} subcategories'
+        if options['reflag']:
+            message += f', {flagged} transactions flagged'
+        self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from dds_app.budgets import rebuild_aggregates
+from dds_app.models import Budget
+
+
+class Command(BaseCommand):
+    help = 'Rebuild monthly budget aggregates from the transactions table and recheck budget overruns'
+
+    def handle(self, *args, **options):
+        rows = rebuild_aggregates()
+        overrun = Budget.objects.filter(overrun_at__isnull=False).count()
+        self.stdout.write(
+            self.style.SUCCESS(f'Budget aggregates rebuilt: {rows} aggregate rows, {overrun} budgets over limit')
+        )
@@ -0,0 +1,82 @@
+import multiprocessing
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from dds_app.jobs import claim_next, run_job, run_pending, requeue_stale, cleanup_expired, worker_name
+
+
+def worker_loop(poll_interval, stop):
+    # Соединения родителя не должны использоваться после fork
+    connections.close_all()
+    # Остановкой управляет родительский процесс через stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    name = worker_name()
+    while not stop.is_set():
+        job = claim_next(name)
+        if job is None:
+            stop.wait(poll_interval)
+            continue
+        run_job(job)
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Run background job workers (exports and reports queued in the Job table)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='Number of worker processes')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between queue checks when idle')
+        parser.add_argument('--stale-after', type=int, default=300,
+                            help='Requeue running jobs whose worker has not reported for this many seconds')
+        parser.add_argument('--cleanup-interval', type=int, default=300,
+                            help='Seconds between removals of expired result files')
+        parser.add_argument('--once', action='store_true',
+                            help='Process the queued jobs in this process and exit')
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale(options['stale_after'])
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} stale jobs')
+
+        if options['once']:
+            count = run_pending()
+            expired = cleanup_expired()
+            self.stdout.write(self.style.SUCCESS(f'Processed {count} jobs, expired {expired} results'))
+            return
+
+        stop = multiprocessing.Event()
+        connections.close_all()
+        workers = [
+            multiprocessing.Process(target=worker_loop, args=(options['poll_interval'], stop), daemon=True)
+            for _ in range(options['workers'])
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(self.style.SUCCESS(f'Started {len(workers)} workers, press Ctrl+C to stop'))
+
+        self.stopping = False
+
+        def shutdown(signum, frame):
+            # Event.set из обработчика сигнала может заблокироваться на его же замке
+            self.stopping = True
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+        try:
+            last_cleanup = 0
+            while not self.stopping:
+                if time.monotonic() - last_cleanup >= options['cleanup_interval']:
+                    cleanup_expired()
+                    requeue_stale(options['stale_after'])
+                    last_cleanup = time.monotonic()
+                time.sleep(options['poll_interval'])
+        finally:
+            stop.set()
+            # Текущие задачи дорабатываются до конца
+            for worker in workers:
+                worker.join()
+        self.stdout.write('Workers stopped')
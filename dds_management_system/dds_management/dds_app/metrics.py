@@ -0,0 +1,331 @@
+import atexit
+import glob
+import os
+import pickle
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from django.conf import settings
+
+# Метрики запросов в текстовом формате Prometheus (/metrics).
+#
+# Счетчики и гистограммы с фиксированными корзинами хранятся по потокам:
+# каждый поток пишет только в свой словарь, поэтому увеличение счетчика не
+# берет блокировок. Выдача складывает словари всех потоков процесса; строки,
+# которые поток меняет в этот момент, могут отстать на одно наблюдение.
+#
+# По каждому представлению (имя маршрута, для админки - admin:<...>)
+# собираются: число запросов по методу и коду ответа, время ответа, число
+# SQL-запросов (обертка выполнения запросов каждого соединения), число строк,
+# прочитанных из базы для ответа, и доля попаданий в кэш (dds_app.cache_backend).
+# Для потоковых ответов замер заканчивается, когда отдана последняя часть.
+#
+# Между процессами gunicorn (DDS_METRICS_DIR) каждый процесс раз в
+# DDS_METRICS_FLUSH_INTERVAL секунд и при выходе записывает свои суммы в
+# отдельный файл каталога, /metrics складывает все файлы. Файлы завершенных
+# процессов остаются - счетчики не уменьшаются; каталог очищается при
+# развертывании. Без каталога /metrics показывает только свой процесс.
+
+DEFAULT_FLUSH_INTERVAL = 5.0
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+ROW_BUCKETS = (0, 1, 10, 50, 100, 200, 500, 1000, 5000, 10000)
+RATIO_BUCKETS = (0.0, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 1.0)
+
+_local = threading.local()
+_shards = []
+_shards_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_last_flush = 0.0
+# Имя файла процесса в каталоге метрик
+_process = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+
+_request = ContextVar('dds_metrics_request', default=None)
+
+
+def get_dir():
+    return getattr(settings, 'DDS_METRICS_DIR', None)
+
+
+def get_flush_interval():
+    return getattr(settings, 'DDS_METRICS_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+
+
+def shard():
+    """Словарь значений текущего потока: (метрика, метки) -> список чисел."""
+    try:
+        return _local.samples
+    except AttributeError:
+        samples = _local.samples = {}
+        with _shards_lock:
+            _shards.append(samples)
+        return samples
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        REGISTRY[name] = self
+
+    def values(self, labels):
+        key = (self.name, tuple(labels[name] for name in self.labels))
+        samples = shard()
+        values = samples.get(key)
+        if values is None:
+            values = samples[key] = self.empty()
+        return values
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def empty(self):
+        return [0]
+
+    def inc(self, amount=1, **labels):
+        self.values(labels)[0] += amount
+
+    def lines(self, labels, values):
+        return [f'{self.name}{format_labels(labels)} {format_value(values[0])}']
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels, buckets):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+
+    def empty(self):
+        # Корзины (последняя - +Inf), сумма, число наблюдений
+        return [0] * (len(self.buckets) + 3)
+
+    def observe(self, value, **labels):
+        values = self.values(labels)
+        values[bisect_left(self.buckets, value)] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    def lines(self, labels, values):
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), values):
+            total += count
+            le = bound if bound == '+Inf' else repr(float(bound))
+            lines.append(f'{self.name}_bucket{format_labels(labels + [("le", le)])} {total}')
+        lines.append(f'{self.name}_sum{format_labels(labels)} {format_value(values[-2])}')
+        lines.append(f'{self.name}_count{format_labels(labels)} {values[-1]}')
+        return lines
+
+
+REGISTRY = {}
+
+REQUESTS = Counter('dds_http_requests_total', 'Запросы по представлениям', ('view', 'method', 'status'))
+LATENCY = Histogram('dds_http_request_duration_seconds', 'Время ответа', ('view',), LATENCY_BUCKETS)
+QUERIES = Histogram('dds_db_queries_per_request', 'SQL-запросов на запрос', ('view',), QUERY_BUCKETS)
+ROWS = Histogram('dds_db_rows_per_request', 'Строк, прочитанных из базы для ответа', ('view',), ROW_BUCKETS)
+CACHE_LOOKUPS = Counter('dds_cache_lookups_total', 'Обращения к кэшу', ('view', 'result'))
+CACHE_HIT_RATIO = Histogram('dds_cache_hit_ratio', 'Доля попаданий в кэш за запрос', ('view',), RATIO_BUCKETS)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels) + '}'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+# Счетчики текущего запроса
+
+class RequestStats:
+    __slots__ = ('queries', 'rows', 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+def count_query(execute, sql, params, many, context):
+    """Обертка выполнения запросов (connection.execute_wrappers)."""
+    stats = _request.get()
+    if stats is not None:
+        stats.queries += 1
+    return execute(sql, params, many, context)
+
+
+def install_query_counter(sender, connection, **kwargs):
+    # Обработчик connection_created: обертка ставится на каждое новое соединение
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+def add_rows(count):
+    stats = _request.get()
+    if stats is not None:
+        stats.rows += count
+
+
+def count_cache(hit):
+    stats = _request.get()
+    if stats is not None:
+        if hit:
+            stats.cache_hits += 1
+        else:
+            stats.cache_misses += 1
+
+
+def start_request():
+    stats = RequestStats()
+    return stats, _request.set(stats)
+
+
+def resume_request(stats):
+    # Части потокового ответа отдаются после выхода из middleware
+    return _request.set(stats)
+
+
+def end_request(token):
+    _request.reset(token)
+
+
+def observe(request, status, stats, duration):
+    match = getattr(request, 'resolver_match', None)
+    view = match.view_name if match else 'unmatched'
+    REQUESTS.inc(view=view, method=request.method, status=str(status))
+    LATENCY.observe(duration, view=view)
+    QUERIES.observe(stats.queries, view=view)
+    ROWS.observe(stats.rows, view=view)
+    lookups = stats.cache_hits + stats.cache_misses
+    if lookups:
+        CACHE_LOOKUPS.inc(stats.cache_hits, view=view, result='hit')
+        CACHE_LOOKUPS.inc(stats.cache_misses, view=view, result='miss')
+        CACHE_HIT_RATIO.observe(stats.cache_hits / lookups, view=view)
+    maybe_flush()
+
+
+# Сбор значений и общий каталог процессов
+
+def collect_local():
+    with _shards_lock:
+        shards = list(_shards)
+    return merge({}, (samples.copy() for samples in shards))
+
+
+def merge(result, sources):
+    for samples in sources:
+        for key, values in samples.items():
+            total = result.get(key)
+            if total is None:
+                result[key] = list(values)
+            else:
+                for index, value in enumerate(values):
+                    total[index] += value
+    return result
+
+
+def flush(directory=None):
+    """Записывает суммы процесса в его файл каталога метрик."""
+    global _last_flush
+    directory = directory or get_dir()
+    if directory is None:
+        return
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{_process}.metrics')
+    temporary = f'{path}.tmp'
+    with open(temporary, 'wb') as file:
+        pickle.dump(collect_local(), file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, path)
+    _last_flush = time.monotonic()
+
+
+def maybe_flush():
+    directory = get_dir()
+    if directory is None or time.monotonic() - _last_flush < get_flush_interval():
+        return
+    # Запись уже идет в другом потоке - этот запрос ее не ждет
+    if not _flush_lock.acquire(blocking=False):
+        return
+    try:
+        flush(directory)
+    except OSError:
+        pass
+    finally:
+        _flush_lock.release()
+
+
+def read_dir(directory):
+    for path in glob.glob(os.path.join(directory, '*.metrics')):
+        try:
+            with open(path, 'rb') as file:
+                yield pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            continue
+
+
+def collect():
+    """Значения всех процессов (с каталогом метрик) или текущего процесса."""
+    directory = get_dir()
+    if directory is None:
+        return collect_local()
+    with _flush_lock:
+        flush(directory)
+    return merge({}, read_dir(directory))
+
+
+def render():
+    samples = collect()
+    by_metric = {}
+    for (name, labels), values in samples.items():
+        by_metric.setdefault(name, []).append((labels, values))
+    lines = []
+    for name, metric in REGISTRY.items():
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        for labels, values in sorted(by_metric.get(name, [])):
+            lines += metric.lines(list(zip(metric.labels, labels)), values)
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """Обнуляет значения процесса (тесты)."""
+    global _local, _shards, _process
+    _local = threading.local()
+    _shards = []
+    _process = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+
+
+def after_fork():
+    # Воркер, порожденный после импорта (gunicorn --preload), начинает с нуля;
+    # блокировки могли остаться занятыми потоками родителя
+    global _shards_lock, _flush_lock
+    _shards_lock = threading.Lock()
+    _flush_lock = threading.Lock()
+    reset()
+
+
+def flush_at_exit():
+    if settings.configured and get_dir():
+        flush()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=after_fork)
+
+atexit.register(flush_at_exit)
@@ -0,0 +1,224 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.http import HttpResponseNotFound
+from django.utils.deprecation import MiddlewareMixin
+
+from . import metrics
+from .admission import classify, is_interactive, reject
+from .cache import sync_generations
+from .tenancy import activate, deactivate, resolve_organization
+
+
+class TenantMiddleware:
+    """Выбирает организацию запроса (dds_app.tenancy) и делает ее текущей,
+    пока представление строит ответ. Стоит после SessionMiddleware и перед
+    CacheCoherenceMiddleware: поколения кэша сверяются по организации.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        organization_id, error = resolve_organization(request)
+        if error:
+            return HttpResponseNotFound(error, content_type='text/plain; charset=utf-8')
+        request.organization_id = organization_id
+        token = activate(organization_id)
+        try:
+            return self.get_response(request)
+        finally:
+            deactivate(token)
+
+    async def __acall__(self, request):
+        # Сессия и список организаций читаются из базы синхронно
+        organization_id, error = await sync_to_async(resolve_organization)(request)
+        if error:
+            return HttpResponseNotFound(error, content_type='text/plain; charset=utf-8')
+        request.organization_id = organization_id
+        token = activate(organization_id)
+        try:
+            return await self.get_response(request)
+        finally:
+            deactivate(token)
+
+
+class CacheCoherenceMiddleware(MiddlewareMixin):
+    """Сверяет поколения кэша с базой перед обработкой запроса.
+
+    MiddlewareMixin позволяет работать и под WSGI, и под ASGI без перевода
+    асинхронных представлений (поток событий) в синхронный режим.
+    """
+
+    def process_request(self, request):
+        sync_generations()
+
+
+def releaser(pool):
+    """Освобождение места в пуле, срабатывающее один раз."""
+    started = time.monotonic()
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            pool.release(time.monotonic() - started)
+    return release
+
+
+class AdmissionControlMiddleware:
+    """Пропускает запросы к ограниченным точкам через пулы (dds_app.admission).
+
+    Место в пуле занято, пока представление строит ответ, а для потокового
+    ответа - пока не отдана последняя часть тела (тело читает базу) или ответ
+    не закрыт, если клиент отключился раньше.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        pool = classify(request)
+        if pool is None:
+            return self.get_response(request)
+        interactive = is_interactive(request)
+        reason = pool.acquire(interactive)
+        if reason:
+            return reject(pool, reason, interactive)
+        release = releaser(pool)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            release()
+            raise
+        return self.finish(response, release)
+
+    async def __acall__(self, request):
+        pool = classify(request)
+        if pool is None:
+            return await self.get_response(request)
+        interactive = is_interactive(request)
+        # Ожидание места блокирует поток, а не цикл событий
+        reason = await sync_to_async(pool.acquire, thread_sensitive=False)(interactive)
+        if reason:
+            return reject(pool, reason, interactive)
+        release = releaser(pool)
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            release()
+            raise
+        return self.finish(response, release)
+
+    def finish(self, response, release):
+        if not response.streaming:
+            release()
+            return response
+        wrap = self.astream if response.is_async else self.stream
+        response.streaming_content = wrap(response.streaming_content, release)
+        # Генератор, который не начали читать, при закрытии не выполняет finally
+        response._resource_closers.append(release)
+        return response
+
+    def stream(self, chunks, release):
+        try:
+            yield from chunks
+        finally:
+            release()
+
+    async def astream(self, chunks, release):
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            release()
+
+
+class MetricsMiddleware:
+    """Счетчики и гистограммы запроса по представлению (dds_app.metrics).
+
+    Стоит первым, чтобы время включало остальные middleware. Для потокового
+    ответа замер заканчивается после последней части тела; пока тело
+    отдается, запросы к базе и строки считаются в тот же замер.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        stats, token = metrics.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self.finish(request, response, stats, started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        stats, token = metrics.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self.finish(request, response, stats, started)
+
+    def finish(self, request, response, stats, started):
+        if not response.streaming:
+            metrics.observe(request, response.status_code, stats, time.perf_counter() - started)
+            return response
+        wrap = self.astream if response.is_async else self.stream
+        response.streaming_content = wrap(response.streaming_content, request, response.status_code, stats, started)
+        return response
+
+    def stream(self, chunks, request, status, stats, started):
+        chunks = iter(chunks)
+        try:
+            while True:
+                token = metrics.resume_request(stats)
+                try:
+                    chunk = next(chunks, None)
+                finally:
+                    metrics.end_request(token)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            metrics.observe(request, status, stats, time.perf_counter() - started)
+
+    async def astream(self, chunks, request, status, stats, started):
+        chunks = aiter(chunks)
+        try:
+            while True:
+                token = metrics.resume_request(stats)
+                try:
+                    chunk = await anext(chunks, None)
+                finally:
+                    metrics.end_request(token)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            metrics.observe(request, status, stats, time.perf_counter() - started)
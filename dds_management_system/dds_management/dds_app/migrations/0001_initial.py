@@ -0,0 +1,91 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:04
+
+import datetime
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Category',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Название категории')),
+            ],
+            options={
+                'verbose_name': 'Категория',
+                'verbose_name_plural': 'Категории',
+            },
+        ),
+        migrations.CreateModel(
+            name='Status',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Название статуса')),
+            ],
+            options={
+                'verbose_name': 'Статус',
+                'verbose_name_plural': 'Статусы',
+            },
+        ),
+        migrations.CreateModel(
+            name='TransactionType',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Название типа')),
+            ],
+            options={
+                'verbose_name': 'Тип операции',
+                'verbose_name_plural': 'Типы операций',
+            },
+        ),
+        migrations.CreateModel(
+            name='Subcategory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Название подкатегории')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dds_app.category', verbose_name='Категория')),
+            ],
+            options={
+                'verbose_name': 'Подкатегория',
+                'verbose_name_plural': 'Подкатегории',
+                'unique_together': {('name', 'category')},
+            },
+        ),
+        migrations.CreateModel(
+            name='Transaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(default=datetime.date.today, verbose_name='Дата операции')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Сумма')),
+                ('comment', models.TextField(blank=True, verbose_name='Комментарий')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания записи')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления записи')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='dds_app.category', verbose_name='Категория')),
+                ('status', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='dds_app.status', verbose_name='Статус')),
+                ('subcategory', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='dds_app.subcategory', verbose_name='Подкатегория')),
+                ('transaction_type', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='dds_app.transactiontype', verbose_name='Тип операции')),
+            ],
+            options={
+                'verbose_name': 'Транзакция',
+                'verbose_name_plural': 'Транзакции',
+                'ordering': ['-date', '-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='transaction_type',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dds_app.transactiontype', verbose_name='Тип операции'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='category',
+            unique_together={('name', 'transaction_type')},
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:31
+
+import hashlib
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+# Копия dds_app.fingerprints на момент этой миграции: исторической модели
+# неизвестны поля, добавленные позже (валюта), а отпечатки, посчитанные
+# здесь, должны совпадать с записанными кодом той же версии
+
+def normalize_comment(comment):
+    return ' '.join((comment or '').split()).casefold()
+
+
+def instance_fingerprint(transaction):
+    amount = Decimal(transaction.amount).quantize(Decimal('0.01'))
+    value = '|'.join([
+        transaction.date.isoformat(), str(amount), str(transaction.transaction_type_id),
+        str(transaction.category_id), str(transaction.subcategory_id), normalize_comment(transaction.comment),
+    ])
+    return hashlib.blake2b(value.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def fill_fingerprints(apps, schema_editor):
+    Transaction = apps.get_model('dds_app', 'Transaction')
+    batch = []
+    for transaction in Transaction.objects.only(
+        'date', 'amount', 'transaction_type_id', 'category_id', 'subcategory_id', 'comment'
+    ).iterator(chunk_size=2000):
+        transaction.fingerprint = instance_fingerprint(transaction)
+        batch.append(transaction)
+        if len(batch) == 2000:
+            Transaction.objects.bulk_update(batch, ['fingerprint'])
+            batch = []
+    if batch:
+        Transaction.objects.bulk_update(batch, ['fingerprint'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dds_app', '0005_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='fingerprint',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=32, verbose_name='Отпечаток'),
+        ),
+        migrations.RunPython(fill_fingerprints, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from dds_app.budgets import group_totals
+
+
+def fill_aggregates(apps, schema_editor):
+    Transaction = apps.get_model('dds_app', 'Transaction')
+    MonthlyAggregate = apps.get_model('dds_app', 'MonthlyAggregate')
+    totals = group_totals(Transaction.objects.all(), field='amount')
+    MonthlyAggregate.objects.bulk_create([
+        MonthlyAggregate(month=month, category_id=category_id, subcategory_id=subcategory_id,
+                         total_cents=cents, count=count)
+        for (month, category_id, subcategory_id), (cents, count) in totals.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dds_app', '0006_transaction_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Budget',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='Месяц')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Сумма бюджета')),
+                ('overrun_at', models.DateTimeField(blank=True, null=True, verbose_name='Превышен')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dds_app.category', verbose_name='Категория')),
+                ('subcategory', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='dds_app.subcategory', verbose_name='Подкатегория')),
+            ],
+            options={
+                'verbose_name': 'Бюджет',
+                'verbose_name_plural': 'Бюджеты',
+                'ordering': ['-month', 'category__name'],
+                'constraints': [models.UniqueConstraint(fields=('month', 'category', 'subcategory'), name='budget_unique_subcategory', violation_error_message='Бюджет на этот месяц уже задан'), models.UniqueConstraint(condition=models.Q(('subcategory__isnull', True)), fields=('month', 'category'), name='budget_unique_category', violation_error_message='Бюджет на этот месяц уже задан')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MonthlyAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='Месяц')),
+                ('total_cents', models.BigIntegerField(default=0, verbose_name='Сумма, коп.')),
+                ('count', models.IntegerField(default=0, verbose_name='Число транзакций')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dds_app.category', verbose_name='Категория')),
+                ('subcategory', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='dds_app.subcategory', verbose_name='Подкатегория')),
+            ],
+            options={
+                'verbose_name': 'Месячный итог',
+                'verbose_name_plural': 'Месячные итоги',
+                'constraints': [models.UniqueConstraint(fields=('month', 'category', 'subcategory'), name='aggregate_unique_subcategory'), models.UniqueConstraint(condition=models.Q(('subcategory__isnull', True)), fields=('month', 'category'), name='aggregate_unique_category')],
+            },
+        ),
+        migrations.RunPython(fill_aggregates, migrations.RunPython.noop),
+    ]
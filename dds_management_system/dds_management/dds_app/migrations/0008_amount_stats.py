@@ -0,0 +1,72 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from dds_app.anomalies import compute_stats
+
+
+def fill_stats(apps, schema_editor):
+    Transaction = apps.get_model('dds_app', 'Transaction')
+    SubcategoryStats = apps.get_model('dds_app', 'SubcategoryStats')
+    rows = Transaction.objects.order_by().values_list('subcategory_id', 'amount').iterator(chunk_size=5000)
+    SubcategoryStats.objects.bulk_create([
+        SubcategoryStats(subcategory_id=subcategory_id, count=count, mean=mean, m2=m2,
+                         min_amount=low, max_amount=high)
+        for subcategory_id, (count, mean, m2, low, high) in compute_stats(rows).items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dds_app', '0007_budgets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AmountAnomaly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('z_score', models.FloatField(verbose_name='Отклонение, сигм')),
+                ('mean', models.FloatField(verbose_name='Среднее')),
+                ('std', models.FloatField(verbose_name='Стандартное отклонение')),
+                ('detected_at', models.DateTimeField(auto_now_add=True, verbose_name='Обнаружено')),
+                ('reviewed_at', models.DateTimeField(blank=True, null=True, verbose_name='Проверено')),
+            ],
+            options={
+                'verbose_name': 'Необычная сумма',
+                'verbose_name_plural': 'Необычные суммы',
+                'ordering': ['-detected_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SubcategoryStats',
+            fields=[
+                ('subcategory', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='amount_stats', serialize=False, to='dds_app.subcategory', verbose_name='Подкатегория')),
+                ('count', models.BigIntegerField(default=0, verbose_name='Число транзакций')),
+                ('mean', models.FloatField(default=0, verbose_name='Среднее')),
+                ('m2', models.FloatField(default=0, verbose_name='Сумма квадратов отклонений')),
+                ('min_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True, verbose_name='Минимум')),
+                ('max_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True, verbose_name='Максимум')),
+            ],
+            options={
+                'verbose_name': 'Статистика сумм',
+                'verbose_name_plural': 'Статистика сумм',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['subcategory', 'amount'], name='transaction_sub_amount_idx'),
+        ),
+        migrations.AddField(
+            model_name='amountanomaly',
+            name='transaction',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='anomaly', to='dds_app.transaction', verbose_name='Транзакция'),
+        ),
+        migrations.AddIndex(
+            model_name='amountanomaly',
+            index=models.Index(fields=['reviewed_at', 'detected_at'], name='anomaly_queue_idx'),
+        ),
+        migrations.RunPython(fill_stats, migrations.RunPython.noop),
+    ]
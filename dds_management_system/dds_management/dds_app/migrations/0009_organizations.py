@@ -0,0 +1,158 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:52
+
+import dds_app.tenancy
+import django.db.models.deletion
+from django.db import migrations, models
+
+TENANT_MODELS = ('Status', 'TransactionType', 'Category', 'Subcategory', 'Transaction', 'ChangeLogEntry', 'Job')
+
+
+def assign_default_organization(apps, schema_editor):
+    # Существующие данные принадлежат организации по умолчанию
+    Organization = apps.get_model('dds_app', 'Organization')
+    organization, _ = Organization.objects.get_or_create(
+        slug=dds_app.tenancy.DEFAULT_SLUG, defaults={'name': dds_app.tenancy.DEFAULT_NAME},
+    )
+    for name in TENANT_MODELS:
+        apps.get_model('dds_app', name).objects.update(organization=organization)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dds_app', '0008_amount_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Organization',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, unique=True, verbose_name='Название')),
+                ('slug', models.SlugField(unique=True, verbose_name='Код')),
+            ],
+            options={
+                'verbose_name': 'Организация',
+                'verbose_name_plural': 'Организации',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='transaction_date_idx',
+        ),
+        migrations.AlterField(
+            model_name='status',
+            name='name',
+            field=models.CharField(max_length=100, verbose_name='Название статуса'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='fingerprint',
+            field=models.CharField(default='', editable=False, max_length=32, verbose_name='Отпечаток'),
+        ),
+        migrations.AlterField(
+            model_name='transactiontype',
+            name='name',
+            field=models.CharField(max_length=100, verbose_name='Название типа'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='organization',
+            field=models.ForeignKey(db_index=False, null=True, editable=False, on_delete=django.db.models.deletion.PROTECT, related_name='categories', to='dds_app.organization', verbose_name='Организация'),
+        ),
+        migrations.AddField(
+            model_name='changelogentry',
+            name='organization',
+            field=models.ForeignKey(db_index=False, null=True, editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='dds_app.organization', verbose_name='Организация'),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='organization',
+            field=models.ForeignKey(null=True, editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='dds_app.organization', verbose_name='Организация'),
+        ),
+        migrations.AddField(
+            model_name='status',
+            name='organization',
+            field=models.ForeignKey(db_index=False, null=True, editable=False, on_delete=django.db.models.deletion.PROTECT, related_name='statuses', to='dds_app.organization', verbose_name='Организация'),
+        ),
+        migrations.AddField(
+            model_name='subcategory',
+            name='organization',
+            field=models.ForeignKey(db_index=False, null=True, editable=False, on_delete=django.db.models.deletion.PROTECT, related_name='subcategories', to='dds_app.organization', verbose_name='Организация'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='organization',
+            field=models.ForeignKey(db_index=False, null=True, editable=False, on_delete=django.db.models.deletion.PROTECT, related_name='transactions', to='dds_app.organization', verbose_name='Организация'),
+        ),
+        migrations.AddField(
+            model_name='transactiontype',
+            name='organization',
+            field=models.ForeignKey(db_index=False, null=True, editable=False, on_delete=django.db.models.deletion.PROTECT, related_name='transaction_types', to='dds_app.organization', verbose_name='Организация'),
+        ),
+        migrations.RunPython(assign_default_organization, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='category',
+            name='organization',
+            field=models.ForeignKey(db_index=False, default=dds_app.tenancy.current_organization_id, editable=False, on_delete=django.db.models.deletion.PROTECT, related_name='categories', to='dds_app.organization', verbose_name='Организация'),
+        ),
+        migrations.AlterField(
+            model_name='changelogentry',
+            name='organization',
+            field=models.ForeignKey(db_index=False, default=dds_app.tenancy.current_organization_id, editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='dds_app.organization', verbose_name='Организация'),
+        ),
+        migrations.AlterField(
+            model_name='job',
+            name='organization',
+            field=models.ForeignKey(default=dds_app.tenancy.current_organization_id, editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='dds_app.organization', verbose_name='Организация'),
+        ),
+        migrations.AlterField(
+            model_name='status',
+            name='organization',
+            field=models.ForeignKey(db_index=False, default=dds_app.tenancy.current_organization_id, editable=False, on_delete=django.db.models.deletion.PROTECT, related_name='statuses', to='dds_app.organization', verbose_name='Организация'),
+        ),
+        migrations.AlterField(
+            model_name='subcategory',
+            name='organization',
+            field=models.ForeignKey(db_index=False, default=dds_app.tenancy.current_organization_id, editable=False, on_delete=django.db.models.deletion.PROTECT, related_name='subcategories', to='dds_app.organization', verbose_name='Организация'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='organization',
+            field=models.ForeignKey(db_index=False, default=dds_app.tenancy.current_organization_id, editable=False, on_delete=django.db.models.deletion.PROTECT, related_name='transactions', to='dds_app.organization', verbose_name='Организация'),
+        ),
+        migrations.AlterField(
+            model_name='transactiontype',
+            name='organization',
+            field=models.ForeignKey(db_index=False, default=dds_app.tenancy.current_organization_id, editable=False, on_delete=django.db.models.deletion.PROTECT, related_name='transaction_types', to='dds_app.organization', verbose_name='Организация'),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['organization', 'name'], name='category_org_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='changelogentry',
+            index=models.Index(fields=['organization', 'seq'], name='changelog_org_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subcategory',
+            index=models.Index(fields=['organization', 'name'], name='subcategory_org_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['organization', 'date'], name='transaction_org_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['organization', 'fingerprint'], name='transaction_org_fp_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='status',
+            constraint=models.UniqueConstraint(fields=('organization', 'name'), name='status_unique_name', violation_error_message='Статус с таким названием уже существует'),
+        ),
+        migrations.AddConstraint(
+            model_name='transactiontype',
+            constraint=models.UniqueConstraint(fields=('organization', 'name'), name='transaction_type_unique_name', violation_error_message='Тип операции с таким названием уже существует'),
+        ),
+    ]
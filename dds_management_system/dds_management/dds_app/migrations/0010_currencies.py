@@ -0,0 +1,63 @@
+# Generated by Django 5.2.6 on 2026-10-19 08:14
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_base_amount(apps, schema_editor):
+    # До появления валют все суммы - в рублях
+    Transaction = apps.get_model('dds_app', 'Transaction')
+    Transaction.objects.update(base_amount=F('amount'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dds_app', '0009_organizations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(choices=[('USD', 'USD - доллар США'), ('EUR', 'EUR - евро')], max_length=3, verbose_name='Валюта')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('rate', models.DecimalField(decimal_places=6, max_digits=14, verbose_name='Курс')),
+            ],
+            options={
+                'verbose_name': 'Курс валюты',
+                'verbose_name_plural': 'Курсы валют',
+                'ordering': ['currency', '-date'],
+                'constraints': [models.UniqueConstraint(fields=('currency', 'date'), name='exchange_rate_unique_date')],
+            },
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='currency',
+            field=models.CharField(choices=[('RUB', 'RUB - российский рубль'), ('USD', 'USD - доллар США'), ('EUR', 'EUR - евро')], default='RUB', max_length=3, verbose_name='Валюта'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='base_amount',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=14, null=True, verbose_name='Сумма в рублях'),
+        ),
+        migrations.RunPython(fill_base_amount, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='transaction',
+            name='base_amount',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=14, verbose_name='Сумма в рублях'),
+        ),
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='transaction_sub_amount_idx',
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['subcategory', 'base_amount'], name='transaction_sub_amount_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['currency', 'date'], name='transaction_currency_date_idx'),
+        ),
+    ]
@@ -1,10 +1,41 @@
 from django.db import models
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from datetime import date
 
+from .concurrency import VersionedModel
+from .currencies import BASE_CURRENCY, CURRENCY_CHOICES, MissingRate, convert, format_amount
+from .fingerprints import instance_fingerprint, FINGERPRINT_LENGTH
+from .tenancy import TenantManager, current_organization_id
+
+# Организация (юридическое лицо); данные организаций разделены (см. dds_app.tenancy)
+class Organization(models.Model):
+    name = models.CharField(max_length=200, unique=True, verbose_name="Название")
+    slug = models.SlugField(max_length=50, unique=True, verbose_name="Код")
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        verbose_name = "Организация"
+        verbose_name_plural = "Организации"
+        ordering = ['name']
+
+
+def organization_field(related_name):
+    # Индекс по одной организации не нужен: ее ведут составные индексы модели
+    return models.ForeignKey(Organization, on_delete=models.PROTECT, default=current_organization_id,
+                             editable=False, db_index=False, related_name=related_name,
+                             verbose_name="Организация")
+
+# Справочники и транзакции записываются с проверкой версии (см. dds_app.concurrency)
+
 # Статусы
-class Status(models.Model):
-    name = models.CharField(max_length=100, unique=True, verbose_name="Название статуса")
+class Status(VersionedModel):
+    organization = organization_field('statuses')
+    name = models.CharField(max_length=100, verbose_name="Название статуса")
+
+    objects = TenantManager()
     
     def __str__(self):
         return self.name
@@ -12,10 +43,17 @@ class Status(models.Model):
     class Meta:
         verbose_name = "Статус"
         verbose_name_plural = "Статусы"
+        constraints = [
+            models.UniqueConstraint(fields=['organization', 'name'], name='status_unique_name',
+                                    violation_error_message="Статус с таким названием уже существует"),
+        ]
 
 # Тип транзакции
-class TransactionType(models.Model):
-    name = models.CharField(max_length=100, unique=True, verbose_name="Название типа")
+class TransactionType(VersionedModel):
+    organization = organization_field('transaction_types')
+    name = models.CharField(max_length=100, verbose_name="Название типа")
+
+    objects = TenantManager()
     
     def __str__(self):
         return self.name
@@ -23,11 +61,18 @@ class TransactionType(models.Model):
     class Meta:
         verbose_name = "Тип операции"
         verbose_name_plural = "Типы операций"
+        constraints = [
+            models.UniqueConstraint(fields=['organization', 'name'], name='transaction_type_unique_name',
+                                    violation_error_message="Тип операции с таким названием уже существует"),
+        ]
 
 # Категория транзакции
-class Category(models.Model):
+class Category(VersionedModel):
+    organization = organization_field('categories')
     name = models.CharField(max_length=100, verbose_name="Название категории")
     transaction_type = models.ForeignKey(TransactionType, on_delete=models.CASCADE, verbose_name="Тип операции")
+
+    objects = TenantManager()
     
     def __str__(self):
         return self.name  
@@ -36,11 +81,23 @@ class Category(models.Model):
         verbose_name = "Категория"
         verbose_name_plural = "Категории"
         unique_together = ['name', 'transaction_type']
+        indexes = [
+            models.Index(fields=['organization', 'name'], name='category_org_name_idx'),
+        ]
+        constraints = [
+            # Следует из уникальности (name, transaction_type); нужно как уникальный
+            # индекс для сортировки списка транзакций по категории (dds_app.ordering)
+            models.UniqueConstraint(fields=['organization', 'name', 'transaction_type'],
+                                    name='category_unique_org_name'),
+        ]
 
 # Подкатегория транзакции
-class Subcategory(models.Model):
+class Subcategory(VersionedModel):
+    organization = organization_field('subcategories')
     name = models.CharField(max_length=100, verbose_name="Название подкатегории")
     category = models.ForeignKey(Category, on_delete=models.CASCADE, verbose_name="Категория")
+
+    objects = TenantManager()
     
     def __str__(self):
         return self.name  
@@ -49,19 +106,48 @@ class Subcategory(models.Model):
         verbose_name = "Подкатегория"
         verbose_name_plural = "Подкатегории"
         unique_together = ['name', 'category']
+        indexes = [
+            models.Index(fields=['organization', 'name'], name='subcategory_org_name_idx'),
+        ]
 
 # Транзакция
-class Transaction(models.Model):
+class Transaction(VersionedModel):
+    organization = organization_field('transactions')
     date = models.DateField(default=date.today, verbose_name="Дата операции")
     status = models.ForeignKey(Status, on_delete=models.PROTECT, verbose_name="Статус")
     transaction_type = models.ForeignKey(TransactionType, on_delete=models.PROTECT, verbose_name="Тип операции")
     category = models.ForeignKey(Category, on_delete=models.PROTECT, verbose_name="Категория")
     subcategory = models.ForeignKey(Subcategory, on_delete=models.PROTECT, verbose_name="Подкатегория")
     amount = models.DecimalField(max_digits=12, decimal_places=2, verbose_name="Сумма")
+    currency = models.CharField(max_length=3, choices=CURRENCY_CHOICES, default=BASE_CURRENCY,
+                                verbose_name="Валюта")
+    # Сумма в базовой валюте по курсу на дату операции (см. dds_app.currencies)
+    base_amount = models.DecimalField(max_digits=14, decimal_places=2, editable=False,
+                                      verbose_name="Сумма в рублях")
     comment = models.TextField(blank=True, verbose_name="Комментарий")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания записи")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления записи")
+    # Отпечаток содержимого для поиска дублей (см. dds_app.fingerprints)
+    fingerprint = models.CharField(max_length=FINGERPRINT_LENGTH, default="", editable=False,
+                                   verbose_name="Отпечаток")
+
+    objects = TenantManager()
     
+    FINGERPRINT_FIELDS = {'date', 'amount', 'currency', 'transaction_type', 'category', 'subcategory', 'comment'}
+    BASE_AMOUNT_FIELDS = {'date', 'amount', 'currency'}
+
+    def save(self, *args, **kwargs):
+        self.fingerprint = instance_fingerprint(self)
+        self.base_amount = convert(self.amount, self.currency, self.date)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            if self.FINGERPRINT_FIELDS.intersection(update_fields):
+                update_fields = {*update_fields, 'fingerprint'}
+            if self.BASE_AMOUNT_FIELDS.intersection(update_fields):
+                update_fields = {*update_fields, 'base_amount'}
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+
     def clean(self):
         # Проверяем только если все связанные объекты существуют
         if hasattr(self, 'subcategory') and self.subcategory and hasattr(self, 'category') and self.category:
@@ -71,11 +157,245 @@ class Transaction(models.Model):
         if hasattr(self, 'category') and self.category and hasattr(self, 'transaction_type') and self.transaction_type:
             if self.category.transaction_type != self.transaction_type:
                 raise ValidationError("Выбранная категория не принадлежит выбранному типу операции")
+
+        if self.amount is not None and self.date and self.currency:
+            try:
+                convert(self.amount, self.currency, self.date)
+            except MissingRate as error:
+                raise ValidationError({'currency': str(error)})
     
+    @property
+    def display_amount(self):
+        return format_amount(self.amount, self.currency)
+
+    @property
+    def in_base_currency(self):
+        return self.currency == BASE_CURRENCY
+
     def __str__(self):
-        return f"{self.date} - {self.transaction_type} - {self.amount:.2f} руб."  # Исправлено форматирование
+        return f"{self.date} - {self.transaction_type} - {self.display_amount}"
     
     class Meta:
         verbose_name = "Транзакция"
         verbose_name_plural = "Транзакции"
-        ordering = ['-date', '-created_at']
\ No newline at end of file
+        ordering = ['-date', '-created_at']
+        indexes = [
+            # Запросы идут в пределах организации, поэтому она - первая колонка индексов
+            models.Index(fields=['organization', 'date'], name='transaction_org_date_idx'),
+            models.Index(fields=['organization', 'fingerprint'], name='transaction_org_fp_idx'),
+            # Минимум и максимум суммы по подкатегории - поиск по индексу (dds_app.anomalies)
+            models.Index(fields=['subcategory', 'base_amount'], name='transaction_sub_amount_idx'),
+            # Пересчет base_amount после изменения курса (dds_app.currencies)
+            models.Index(fields=['currency', 'date'], name='transaction_currency_date_idx'),
+            # Сортировки и фильтры списка транзакций (dds_app.ordering)
+            models.Index(fields=['organization', 'base_amount'], name='transaction_org_amount_idx'),
+            models.Index(fields=['category', 'date'], name='transaction_cat_date_idx'),
+            models.Index(fields=['status', 'date'], name='transaction_status_date_idx'),
+        ]
+
+# Курс валюты к базовой: сколько рублей стоит единица валюты на дату.
+# Курсы общие для всех организаций.
+class ExchangeRate(models.Model):
+    currency = models.CharField(max_length=3, choices=[
+        (code, name) for code, name in CURRENCY_CHOICES if code != BASE_CURRENCY
+    ], verbose_name="Валюта")
+    date = models.DateField(verbose_name="Дата")
+    rate = models.DecimalField(max_digits=14, decimal_places=6, verbose_name="Курс")
+
+    def __str__(self):
+        return f"{self.currency} {self.date}: {self.rate}"
+
+    class Meta:
+        verbose_name = "Курс валюты"
+        verbose_name_plural = "Курсы валют"
+        ordering = ['currency', '-date']
+        constraints = [
+            models.UniqueConstraint(fields=['currency', 'date'], name='exchange_rate_unique_date'),
+        ]
+
+# Счетчики версий данных, общие для всех процессов приложения
+class VersionCounter(models.Model):
+    name = models.CharField(max_length=100, unique=True, verbose_name="Имя счетчика")
+    value = models.BigIntegerField(default=0, verbose_name="Значение")
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+    class Meta:
+        verbose_name = "Счетчик версии"
+        verbose_name_plural = "Счетчики версий"
+
+# Журнал изменений для инкрементальной синхронизации клиентов
+class ChangeLogEntry(models.Model):
+    ACTION_CREATE = 'create'
+    ACTION_UPDATE = 'update'
+    ACTION_DELETE = 'delete'
+    ACTION_CHOICES = [
+        (ACTION_CREATE, 'Создание'),
+        (ACTION_UPDATE, 'Изменение'),
+        (ACTION_DELETE, 'Удаление'),
+    ]
+
+    seq = models.BigAutoField(primary_key=True, verbose_name="Номер изменения")
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE, default=current_organization_id,
+                                     editable=False, db_index=False, related_name='+', verbose_name="Организация")
+    model = models.CharField(max_length=50, verbose_name="Модель")
+    object_id = models.BigIntegerField(verbose_name="ID объекта")
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES, verbose_name="Действие")
+    data = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder, verbose_name="Данные")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Время изменения")
+
+    objects = TenantManager()
+
+    def __str__(self):
+        return f"#{self.seq} {self.action} {self.model}:{self.object_id}"
+
+    class Meta:
+        verbose_name = "Запись журнала изменений"
+        verbose_name_plural = "Журнал изменений"
+        ordering = ['seq']
+        indexes = [
+            models.Index(fields=['organization', 'seq'], name='changelog_org_seq_idx'),
+            models.Index(fields=['model', 'object_id'], name='changelog_object_idx'),
+            models.Index(fields=['created_at'], name='changelog_created_idx'),
+        ]
+
+# Фоновые задачи (экспорт, отчеты), выполняемые командой run_workers
+class Job(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_EXPIRED = 'expired'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Готово'),
+        (STATUS_FAILED, 'Ошибка'),
+        (STATUS_EXPIRED, 'Результат удален'),
+    ]
+
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE, default=current_organization_id,
+                                     editable=False, related_name='+', verbose_name="Организация")
+    kind = models.CharField(max_length=50, verbose_name="Вид задачи")
+    params = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder, verbose_name="Параметры")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED, verbose_name="Статус")
+    progress = models.PositiveSmallIntegerField(default=0, verbose_name="Прогресс, %")
+    result_path = models.CharField(max_length=500, blank=True, verbose_name="Файл результата")
+    result_name = models.CharField(max_length=200, blank=True, verbose_name="Имя файла для скачивания")
+    error = models.TextField(blank=True, verbose_name="Ошибка")
+    worker = models.CharField(max_length=100, blank=True, verbose_name="Обработчик")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создана")
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="Начата")
+    # Обработчик отмечается, пока выполняет задачу; по ней находятся задачи убитых обработчиков
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name="Последняя отметка обработчика")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Завершена")
+    expires_at = models.DateTimeField(null=True, blank=True, verbose_name="Результат хранится до")
+
+    # Обработчики очереди работают вне контекста организации и видят все задачи
+    objects = TenantManager()
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.get_status_display()})"
+
+    class Meta:
+        verbose_name = "Фоновая задача"
+        verbose_name_plural = "Фоновые задачи"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='job_queue_idx'),
+        ]
+
+# Месячный бюджет по категории (subcategory пустая) или подкатегории
+class Budget(models.Model):
+    month = models.DateField(verbose_name="Месяц")  # первое число месяца
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, verbose_name="Категория")
+    subcategory = models.ForeignKey(Subcategory, on_delete=models.CASCADE, null=True, blank=True,
+                                    verbose_name="Подкатегория")
+    amount = models.DecimalField(max_digits=12, decimal_places=2, verbose_name="Сумма бюджета")
+    # Когда факт впервые превысил бюджет (пусто - превышения нет)
+    overrun_at = models.DateTimeField(null=True, blank=True, verbose_name="Превышен")
+
+    objects = TenantManager('category__organization')
+
+    def __str__(self):
+        target = self.subcategory or self.category
+        return f"{self.month:%Y-%m} - {target}: {self.amount:.2f} руб."
+
+    class Meta:
+        verbose_name = "Бюджет"
+        verbose_name_plural = "Бюджеты"
+        ordering = ['-month', 'category__name']
+        constraints = [
+            models.UniqueConstraint(fields=['month', 'category', 'subcategory'], name='budget_unique_subcategory',
+                                    violation_error_message="Бюджет на этот месяц уже задан"),
+            models.UniqueConstraint(fields=['month', 'category'], condition=models.Q(subcategory__isnull=True),
+                                    name='budget_unique_category',
+                                    violation_error_message="Бюджет на этот месяц уже задан"),
+        ]
+
+# Факт по месяцам: сумма и число транзакций по подкатегории и (subcategory
+# пустая) по категории целиком. Ведется инкрементально при записи транзакций
+# (dds_app.budgets), суммы - в копейках.
+class MonthlyAggregate(models.Model):
+    month = models.DateField(verbose_name="Месяц")
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, verbose_name="Категория")
+    subcategory = models.ForeignKey(Subcategory, on_delete=models.CASCADE, null=True, blank=True,
+                                    verbose_name="Подкатегория")
+    total_cents = models.BigIntegerField(default=0, verbose_name="Сумма, коп.")
+    count = models.IntegerField(default=0, verbose_name="Число транзакций")
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} - {self.subcategory or self.category}: {self.total_cents / 100:.2f}"
+
+    class Meta:
+        verbose_name = "Месячный итог"
+        verbose_name_plural = "Месячные итоги"
+        constraints = [
+            models.UniqueConstraint(fields=['month', 'category', 'subcategory'], name='aggregate_unique_subcategory'),
+            models.UniqueConstraint(fields=['month', 'category'], condition=models.Q(subcategory__isnull=True),
+                                    name='aggregate_unique_category'),
+        ]
+
+# Распределение сумм по подкатегории: число, среднее и сумма квадратов
+# отклонений (m2) по алгоритму Уэлфорда, ведутся инкрементально при записи
+# транзакций (dds_app.anomalies)
+class SubcategoryStats(models.Model):
+    subcategory = models.OneToOneField(Subcategory, on_delete=models.CASCADE, primary_key=True,
+                                       related_name='amount_stats', verbose_name="Подкатегория")
+    count = models.BigIntegerField(default=0, verbose_name="Число транзакций")
+    mean = models.FloatField(default=0, verbose_name="Среднее")
+    m2 = models.FloatField(default=0, verbose_name="Сумма квадратов отклонений")
+    min_amount = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True, verbose_name="Минимум")
+    max_amount = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True, verbose_name="Максимум")
+
+    def __str__(self):
+        return f"{self.subcategory}: {self.count} шт., среднее {self.mean:.2f}"
+
+    class Meta:
+        verbose_name = "Статистика сумм"
+        verbose_name_plural = "Статистика сумм"
+
+# Транзакция с необычно большой суммой для своей подкатегории - очередь проверки
+class AmountAnomaly(models.Model):
+    transaction = models.OneToOneField(Transaction, on_delete=models.CASCADE, related_name='anomaly',
+                                       verbose_name="Транзакция")
+    z_score = models.FloatField(verbose_name="Отклонение, сигм")
+    # Распределение подкатегории на момент проверки
+    mean = models.FloatField(verbose_name="Среднее")
+    std = models.FloatField(verbose_name="Стандартное отклонение")
+    detected_at = models.DateTimeField(auto_now_add=True, verbose_name="Обнаружено")
+    reviewed_at = models.DateTimeField(null=True, blank=True, verbose_name="Проверено")
+
+    objects = TenantManager('transaction__organization')
+
+    def __str__(self):
+        return f"{self.transaction} ({self.z_score:.1f} сигм)"
+
+    class Meta:
+        verbose_name = "Необычная сумма"
+        verbose_name_plural = "Необычные суммы"
+        ordering = ['-detected_at']
+        indexes = [
+            models.Index(fields=['reviewed_at', 'detected_at'], name='anomaly_queue_idx'),
+        ]
@@ -0,0 +1,143 @@
+import base64
+import binascii
+import json
+from functools import reduce
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+from .filters import filter_transactions, restrict
+from .models import Transaction
+from .tenancy import get_active
+
+# Сортировка и постраничный вывод списка транзакций.
+#
+# Каждая сортировка читает строки готовым индексом, без сортировки выборки
+# во временном B-дереве:
+#   дата       - (organization, date), дальше по id;
+#   сумма      - (organization, base_amount), с фильтром по подкатегории -
+#                (subcategory, base_amount);
+#   категория, - перебор справочника по уникальному индексу (organization,
+#   статус       name[, transaction_type]) и для каждой записи - транзакции
+#                по индексу (<справочник>, date).
+# Условия на поля, которые индекс сортировки не покрывает, закрываются от
+# планировщика (dds_app.filters.restrict) и проверяются по уже прочитанным
+# строкам. При сортировке по справочнику закрыто и условие на организацию
+# транзакции: иначе планировщик начинает с транзакций и сортирует их.
+# Фильтры по статусу и категории при сортировке по дате идут индексами
+# (status|category, date).
+#
+# Страницы - по ключу (keyset): ссылка на следующую страницу содержит
+# значения сортировки последней строки, и выборка продолжается условием
+# "после этих значений" по тому же индексу, без OFFSET. Последняя колонка
+# ключа - id, поэтому порядок полный и строки не повторяются и не теряются.
+
+DEFAULT_SORT = '-date'
+DEFAULT_PAGE_SIZE = 100
+
+
+def get_page_size():
+    return getattr(settings, 'DDS_LIST_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+
+
+def get_field(path):
+    model = Transaction
+    *relations, name = path.split('__')
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    return model._meta.get_field(name)
+
+
+class Sort:
+    def __init__(self, title, keys, indexed_fields, dictionary=None):
+        self.title = title
+        # (путь к полю, по убыванию) - порядок строк, последним идет id
+        self.keys = keys
+        # Поля фильтров, которые могут выбирать индекс вместе с этой сортировкой
+        self.indexed_fields = indexed_fields
+        # Справочник, по названию записей которого идет сортировка
+        self.dictionary = dictionary
+
+    def transactions(self, filters):
+        """Транзакции текущей организации по фильтрам в порядке сортировки."""
+        # Условие на организацию ставится здесь, а не менеджером модели:
+        # для сортировки по справочнику оно не должно выбирать индекс
+        queryset = Transaction._base_manager.all()
+        organization_id = get_active()
+        if organization_id is not None:
+            indexed = 'organization_id' in self.indexed_fields
+            queryset = restrict(queryset, 'organization_id', 'exact', organization_id, indexed)
+            if self.dictionary:
+                # Перебор начинается с уникального индекса справочника
+                queryset = queryset.filter(**{f'{self.dictionary}__organization_id': organization_id})
+        queryset = filter_transactions(queryset, filters, self.indexed_fields)
+        return queryset.order_by(*[f'-{path}' if descending else path for path, descending in self.keys])
+
+    def values(self, transaction):
+        return [reduce(getattr, path.split('__'), transaction) for path, descending in self.keys]
+
+    def encode(self, transaction):
+        data = json.dumps(self.values(transaction), cls=DjangoJSONEncoder, ensure_ascii=False)
+        return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+    def decode(self, cursor):
+        """Значения ключа из параметра after или None, если он поврежден."""
+        try:
+            data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            values = json.loads(data.decode('utf-8'))
+            if not isinstance(values, list) or len(values) != len(self.keys):
+                return None
+            return [get_field(path).to_python(value) for (path, descending), value in zip(self.keys, values)]
+        except (binascii.Error, UnicodeDecodeError, ValueError, ValidationError):
+            return None
+
+    def after(self, values):
+        """Условие "строка после values" в порядке сортировки."""
+        condition = None
+        equal = Q()
+        for (path, descending), value in zip(self.keys, values):
+            step = equal & Q(**{f'{path}__{"lt" if descending else "gt"}': value})
+            condition = step if condition is None else condition | step
+            equal &= Q(**{path: value})
+        # Отдельное условие на первую колонку - граница диапазона в индексе
+        path, descending = self.keys[0]
+        return Q(**{f'{path}__{"lte" if descending else "gte"}': values[0]}) & condition
+
+
+def dictionary_sort(title, dictionary, unique_fields, descending):
+    # unique_fields - колонки уникального индекса справочника после организации:
+    # в их порядке каждой записи справочника соответствует одна позиция
+    keys = [(f'{dictionary}__{field}', descending) for field in unique_fields] + [('date', True), ('id', True)]
+    return Sort(title, keys, {f'{dictionary}_id', 'date'}, dictionary)
+
+
+DATE_FIELDS = {'organization_id', 'date', 'status_id', 'category_id'}
+AMOUNT_FIELDS = {'organization_id', 'base_amount', 'subcategory_id'}
+
+SORTS = {
+    '-date': Sort('Сначала новые', [('date', True), ('id', True)], DATE_FIELDS),
+    'date': Sort('Сначала старые', [('date', False), ('id', False)], DATE_FIELDS),
+    '-amount': Sort('Сумма по убыванию', [('base_amount', True), ('id', True)], AMOUNT_FIELDS),
+    'amount': Sort('Сумма по возрастанию', [('base_amount', False), ('id', False)], AMOUNT_FIELDS),
+    'category': dictionary_sort('Категория А-Я', 'category', ['name', 'transaction_type_id'], False),
+    '-category': dictionary_sort('Категория Я-А', 'category', ['name', 'transaction_type_id'], True),
+    'status': dictionary_sort('Статус А-Я', 'status', ['name'], False),
+    '-status': dictionary_sort('Статус Я-А', 'status', ['name'], True),
+}
+
+
+def get_sort(name):
+    return SORTS.get(name) or SORTS[DEFAULT_SORT]
+
+
+def get_page(transactions, sort, cursor=None, page_size=None):
+    """Строки страницы после cursor и ключ следующей страницы (или None)."""
+    page_size = page_size or get_page_size()
+    values = sort.decode(cursor) if cursor else None
+    if values is not None:
+        transactions = transactions.filter(sort.after(values))
+    rows = list(transactions[:page_size + 1])
+    next_cursor = sort.encode(rows[page_size - 1]) if len(rows) > page_size else None
+    return rows[:page_size], next_cursor
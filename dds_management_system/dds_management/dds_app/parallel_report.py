@@ -0,0 +1,121 @@
+"""Параллельный расчет отчетов по диапазонам дат.
+
+Запрошенный период делится на шарды по датам, каждый шард агрегируется
+в отдельном процессе своим read-only соединением SQLite (суммы и количество
+по типам операций, категориям, подкатегориям и месяцам), затем частичные
+результаты складываются. Сводный отчет (dds_app.reports.build_pivot) берет
+слитые суммы отсюда для периодов от DDS_PARALLEL_REPORT_MIN_DAYS дней. Суммы (в рублях, колонка base_amount) считаются в целых
+копейках, поэтому порядок сложения не влияет на результат.
+
+Функции шардов не импортируют Django: дочерние процессы запускаются и при
+методе spawn, не поднимая приложение целиком.
+"""
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+
+SHARD_SQL = '''
+    SELECT transaction_type_id, category_id, subcategory_id, substr(date, 1, 7),
+           COUNT(*), SUM(CAST(ROUND(base_amount * 100) AS INTEGER))
+    FROM {table}
+    WHERE date >= ? AND date <= ? {filters}
+    GROUP BY transaction_type_id, category_id, subcategory_id, substr(date, 1, 7)
+'''
+
+
+def split_range(date_from, date_to, shards):
+    """Делит [date_from, date_to] на не более чем shards непересекающихся отрезков."""
+    days = (date_to - date_from).days + 1
+    shards = max(1, min(shards, days))
+    size, extra = divmod(days, shards)
+    ranges = []
+    start = date_from
+    for index in range(shards):
+        length = size + (1 if index < extra else 0)
+        end = start + timedelta(days=length - 1)
+        ranges.append((start, end))
+        start = end + timedelta(days=1)
+    return ranges
+
+
+def compute_shard(db_path, table, date_from, date_to, status_id=None, organization_id=None):
+    """Частичный агрегат по одному шарду: {(тип, категория, подкатегория, месяц): [count, cents]}."""
+    connection = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        params = [date_from.isoformat(), date_to.isoformat()]
+        filters = ''
+        for column, value in (('status_id', status_id), ('organization_id', organization_id)):
+            if value is not None:
+                filters += f' AND {column} = ?'
+                params.append(value)
+        rows = connection.execute(SHARD_SQL.format(table=table, filters=filters), params)
+        return {
+            (type_id, category_id, subcategory_id, month): [count, cents]
+            for type_id, category_id, subcategory_id, month, count, cents in rows
+        }
+    finally:
+        connection.close()
+
+
+def merge(partials):
+    totals = {}
+    for partial in partials:
+        for key, (count, cents) in partial.items():
+            total = totals.setdefault(key, [0, 0])
+            total[0] += count
+            total[1] += cents
+    return totals
+
+
+def summarize(totals):
+    """Разбивки по типам операций, категориям, подкатегориям и месяцам из слитых агрегатов."""
+    summary = {'count': 0, 'amount': 0, 'by_type': {}, 'by_category': {}, 'by_subcategory': {}, 'by_month': {}}
+    for (type_id, category_id, subcategory_id, month), (count, cents) in totals.items():
+        summary['count'] += count
+        summary['amount'] += cents
+        for group, key in (('by_type', type_id), ('by_category', category_id),
+                           ('by_subcategory', subcategory_id), ('by_month', month)):
+            bucket = summary[group].setdefault(key, {'count': 0, 'amount': 0})
+            bucket['count'] += count
+            bucket['amount'] += cents
+
+    def money(cents):
+        return Decimal(cents).scaleb(-2)
+
+    summary['amount'] = money(summary['amount'])
+    for group in ('by_type', 'by_category', 'by_subcategory', 'by_month'):
+        for bucket in summary[group].values():
+            bucket['amount'] = money(bucket['amount'])
+    summary['by_month'] = dict(sorted(summary['by_month'].items()))
+    return summary
+
+
+def parallel_totals(date_from, date_to, status_id=None, workers=1, shards=None, db_path=None, table=None,
+                    organization_id=None):
+    """Слитые суммы за период по шардам дат в пуле из workers процессов.
+
+    При workers=1 шарды считаются в текущем процессе без пула. organization_id
+    ограничивает отчет одной организацией (по умолчанию - все).
+    """
+    if db_path is None or table is None:
+        from django.db import connection
+        from .models import Transaction
+
+        db_path = db_path or connection.settings_dict['NAME']
+        table = table or Transaction._meta.db_table
+    ranges = split_range(date_from, date_to, shards or workers)
+    args = [(str(db_path), table, start, end, status_id, organization_id) for start, end in ranges]
+    if workers == 1:
+        partials = [compute_shard(*arg) for arg in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            partials = list(pool.map(compute_shard, *zip(*args)))
+    return merge(partials)
+
+
+def parallel_report(date_from, date_to, status_id=None, workers=1, shards=None, db_path=None, table=None,
+                    organization_id=None):
+    """Отчет за период (итоги и разбивки) по шардам дат, см. parallel_totals."""
+    return summarize(parallel_totals(date_from, date_to, status_id, workers, shards, db_path, table,
+                                     organization_id))
@@ -0,0 +1,275 @@
+from array import array
+from datetime import date
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Max, Min, Sum
+from django.db.models.functions import TruncMonth
+
+from . import singleflight
+from .cache import make_key, normalize_params
+from .models import Transaction, TransactionType, Category, Subcategory
+from .parallel_report import parallel_totals
+from .tenancy import get_active
+
+# Сводный отчет "категории x месяцы".
+#
+# Транзакции агрегируются одним GROUP BY-запросом (тип, категория, подкатегория,
+# месяц), после чего суммы раскладываются в плотную матрицу: один массив
+# целых копеек на тип операции, строка - подкатегория, столбец - месяц.
+# Итоги по строкам, категориям и столбцам считаются по массиву без запросов.
+# Суммируется сохраненная сумма в рублях (base_amount), без пересчета курсов.
+#
+# Периоды от DDS_PARALLEL_REPORT_MIN_DAYS дней при DDS_REPORT_WORKERS > 1
+# агрегируются по шардам дат в пуле процессов (dds_app.parallel_report) -
+# только для файла SQLite; дальше отчет строится так же.
+
+PIVOT_MODELS = (Transaction, TransactionType, Category, Subcategory)
+
+DEFAULT_PARALLEL_MIN_DAYS = 730
+DEFAULT_MAX_MONTHS = 120
+
+
+def get_report_workers():
+    return getattr(settings, 'DDS_REPORT_WORKERS', 1)
+
+
+def get_parallel_min_days():
+    return getattr(settings, 'DDS_PARALLEL_REPORT_MIN_DAYS', DEFAULT_PARALLEL_MIN_DAYS)
+
+
+def get_max_months():
+    return getattr(settings, 'DDS_PIVOT_MAX_MONTHS', DEFAULT_MAX_MONTHS)
+
+
+def month_count(first, last):
+    return (last.year - first.year) * 12 + last.month - first.month + 1
+
+
+def month_range(first, last):
+    months = []
+    year, month = first.year, first.month
+    while (year, month) <= (last.year, last.month):
+        months.append(date(year, month, 1))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def to_cents(amount):
+    return int(amount * 100)
+
+
+def from_cents(cents):
+    return Decimal(cents).scaleb(-2)
+
+
+def parallel_span(transactions, date_from, date_to, workers, db_path=None):
+    """Период для расчета в пуле процессов или None, если хватит одного запроса."""
+    if workers < 2:
+        return None
+    if db_path is None and (connection.vendor != 'sqlite' or connection.is_in_memory_db()):
+        # Процессы пула открывают файл базы сами
+        return None
+    if not (date_from and date_to):
+        bounds = transactions.aggregate(first=Min('date'), last=Max('date'))
+        date_from = date_from or bounds['first']
+        date_to = date_to or bounds['last']
+        if date_from is None or date_to is None:
+            return None
+    if (date_to - date_from).days + 1 < get_parallel_min_days():
+        return None
+    return date_from, date_to
+
+
+def parallel_groups(date_from, date_to, status, workers, db_path=None):
+    """Группы в том же виде, что и у GROUP BY в build_pivot, из сумм шардов."""
+    totals = parallel_totals(date_from, date_to, int(status) if status else None, workers=workers, db_path=db_path,
+                             organization_id=get_active())
+    names = {}
+    for position, model in enumerate((TransactionType, Category, Subcategory)):
+        ids = {key[position] for key in totals}
+        names[model] = dict(model._base_manager.filter(pk__in=ids).values_list('pk', 'name'))
+    return [
+        {
+            'month': date(int(month[:4]), int(month[5:7]), 1),
+            'transaction_type_id': type_id, 'transaction_type__name': names[TransactionType][type_id],
+            'category_id': category_id, 'category__name': names[Category][category_id],
+            'subcategory_id': subcategory_id, 'subcategory__name': names[Subcategory][subcategory_id],
+            'total': from_cents(cents),
+        }
+        for (type_id, category_id, subcategory_id, month), (count, cents) in totals.items()
+    ]
+
+
+def build_pivot(date_from=None, date_to=None, status=None, workers=None, db_path=None):
+    """Строит отчет за период [date_from, date_to] (даты или None) по статусу.
+
+    workers - процессов для длинных периодов (по умолчанию DDS_REPORT_WORKERS),
+    db_path - файл базы для них (по умолчанию - файл текущего соединения).
+    """
+    transactions = Transaction.objects.all()
+    if date_from:
+        transactions = transactions.filter(date__gte=date_from)
+    if date_to:
+        transactions = transactions.filter(date__lte=date_to)
+    if status:
+        transactions = transactions.filter(status_id=status)
+
+    workers = get_report_workers() if workers is None else workers
+    span = parallel_span(transactions, date_from, date_to, workers, db_path)
+    if span:
+        groups = parallel_groups(*span, status, workers, db_path)
+    else:
+        groups = list(
+            transactions.annotate(month=TruncMonth('date'))
+            .values(
+                'month',
+                'transaction_type_id', 'transaction_type__name',
+                'category_id', 'category__name',
+                'subcategory_id', 'subcategory__name',
+            )
+            .annotate(total=Sum('base_amount'))
+            .order_by()
+        )
+
+    if groups or (date_from and date_to):
+        months = month_range(
+            date_from or min(group['month'] for group in groups),
+            date_to or max(group['month'] for group in groups),
+        )
+    else:
+        months = []
+    column = {month: index for index, month in enumerate(months)}
+    width = len(months)
+
+    # Индексы строк: тип операции -> (категория, подкатегория) -> номер строки
+    sections = {}
+    for group in groups:
+        section = sections.setdefault(group['transaction_type_id'], {
+            'name': group['transaction_type__name'],
+            'rows': {},
+        })
+        key = (group['category__name'], group['category_id'], group['subcategory__name'], group['subcategory_id'])
+        section['rows'].setdefault(key, None)
+
+    for section in sections.values():
+        keys = sorted(section['rows'])
+        section['rows'] = {key: index for index, key in enumerate(keys)}
+        section['cells'] = array('q', bytes(8 * len(keys) * width))
+
+    for group in groups:
+        section = sections[group['transaction_type_id']]
+        key = (group['category__name'], group['category_id'], group['subcategory__name'], group['subcategory_id'])
+        col = column[group['month']]
+        section['cells'][section['rows'][key] * width + col] += to_cents(group['total'])
+
+    return PivotReport(months, sections)
+
+
+class PivotReport:
+    def __init__(self, months, sections):
+        self.months = months
+        self.sections = []
+        for type_id, section in sorted(sections.items(), key=lambda item: item[1]['name']):
+            self.sections.append(self.build_section(type_id, section))
+
+    def build_section(self, type_id, section):
+        width = len(self.months)
+        cells = section['cells']
+        column_totals = [0] * width
+        rows = []
+        category_rows = {}
+        for (category, category_id, subcategory, subcategory_id), index in section['rows'].items():
+            values = cells[index * width:(index + 1) * width]
+            if category_id not in category_rows:
+                category_rows[category_id] = {
+                    'category_id': category_id,
+                    'category': category,
+                    'cells': [0] * width,
+                    'subcategories': [],
+                }
+                rows.append(category_rows[category_id])
+            category_row = category_rows[category_id]
+            for col, value in enumerate(values):
+                category_row['cells'][col] += value
+                column_totals[col] += value
+            category_row['subcategories'].append({
+                'subcategory_id': subcategory_id,
+                'subcategory': subcategory,
+                'cells': list(values),
+                'total': sum(values),
+            })
+        for category_row in rows:
+            category_row['total'] = sum(category_row['cells'])
+        return {
+            'transaction_type_id': type_id,
+            'transaction_type': section['name'],
+            'categories': rows,
+            'totals': column_totals,
+            'total': sum(column_totals),
+        }
+
+    def to_dict(self):
+        def money(values):
+            return [str(from_cents(value)) for value in values]
+
+        return {
+            'months': [month.strftime('%Y-%m') for month in self.months],
+            'sections': [
+                {
+                    'transaction_type_id': section['transaction_type_id'],
+                    'transaction_type': section['transaction_type'],
+                    'categories': [
+                        {
+                            'category_id': row['category_id'],
+                            'category': row['category'],
+                            'cells': money(row['cells']),
+                            'total': str(from_cents(row['total'])),
+                            'subcategories': [
+                                {
+                                    'subcategory_id': sub['subcategory_id'],
+                                    'subcategory': sub['subcategory'],
+                                    'cells': money(sub['cells']),
+                                    'total': str(from_cents(sub['total'])),
+                                }
+                                for sub in row['subcategories']
+                            ],
+                        }
+                        for row in section['categories']
+                    ],
+                    'totals': money(section['totals']),
+                    'total': str(from_cents(section['total'])),
+                }
+                for section in self.sections
+            ],
+        }
+
+
+def pivot_rows(data):
+    """Строки CSV из словаря отчета (to_dict)."""
+    yield ['Тип операции', 'Категория', 'Подкатегория', *data['months'], 'Итого']
+    for section in data['sections']:
+        for category in section['categories']:
+            for sub in category['subcategories']:
+                yield [section['transaction_type'], category['category'], sub['subcategory'], *sub['cells'], sub['total']]
+            yield [section['transaction_type'], category['category'], 'Итого', *category['cells'], category['total']]
+        yield [section['transaction_type'], 'Итого', '', *section['totals'], section['total']]
+
+
+def get_pivot(date_from=None, date_to=None, status=None):
+    """Отчет в виде словаря, закэшированный по набору параметров и поколениям моделей."""
+    params = {'date_from': date_from, 'date_to': date_to, 'status': status}
+    key = make_key('pivot', normalize_params({name: str(value) for name, value in params.items() if value}), PIVOT_MODELS)
+    data = cache.get(key)
+    if data is None:
+        # Одновременные промахи по одному ключу строят отчет один раз
+        data = singleflight.run(key, lambda: build_and_store(key, params))
+    return data
+
+
+def build_and_store(key, params):
+    data = build_pivot(**params).to_dict()
+    cache.set(key, data)
+    return data
@@ -0,0 +1,141 @@
+"""Сериализация JSON-ответов API с выбором полей.
+
+Клиент перечисляет нужные поля (?fields=id,date,amount,category), из базы
+читаются только соответствующие колонки (values_list - кортежи, без
+создания объектов моделей), ответ кодируется orjson, если он установлен,
+иначе стандартным json. Большие массивы отдаются потоком пачками строк.
+"""
+import json
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+
+from .metrics import add_rows
+from .models import Category, Subcategory, Transaction
+from .streaming import aiter_sync
+
+try:
+    import orjson
+except ImportError:  # orjson не обязателен, без него работает стандартный json
+    orjson = None
+
+CHUNK_SIZE = 1000
+
+
+class FieldsError(ValueError):
+    pass
+
+
+class Resource:
+    """Поля, доступные клиенту: имя в ответе -> путь для values_list."""
+
+    def __init__(self, model, fields, default):
+        self.model = model
+        self.fields = fields
+        self.default = tuple(default)
+
+    def parse_fields(self, value):
+        if not value:
+            return self.default
+        names = tuple(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+        unknown = [name for name in names if name not in self.fields]
+        if unknown or not names:
+            raise FieldsError(
+                f'Неизвестные поля: {", ".join(unknown) or value}. Доступны: {", ".join(self.fields)}'
+            )
+        return names
+
+    def rows(self, queryset, names):
+        return queryset.values_list(*(self.fields[name] for name in names))
+
+
+CATEGORY = Resource(Category, {
+    'id': 'id',
+    'name': 'name',
+    'transaction_type_id': 'transaction_type_id',
+}, default=['id', 'name'])
+
+SUBCATEGORY = Resource(Subcategory, {
+    'id': 'id',
+    'name': 'name',
+    'category_id': 'category_id',
+}, default=['id', 'name'])
+
+TRANSACTION = Resource(Transaction, {
+    'id': 'id',
+    'date': 'date',
+    'status': 'status__name',
+    'status_id': 'status_id',
+    'transaction_type': 'transaction_type__name',
+    'transaction_type_id': 'transaction_type_id',
+    'category': 'category__name',
+    'category_id': 'category_id',
+    'subcategory': 'subcategory__name',
+    'subcategory_id': 'subcategory_id',
+    'amount': 'amount',
+    'currency': 'currency',
+    'base_amount': 'base_amount',
+    'comment': 'comment',
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+}, default=['id', 'date', 'status', 'transaction_type', 'category', 'subcategory', 'amount', 'comment'])
+
+
+def use_fast_encoder():
+    return orjson is not None and getattr(settings, 'DDS_FAST_JSON', True)
+
+
+DJANGO_ENCODER = DjangoJSONEncoder()
+
+
+def orjson_default(value):
+    # Как DjangoJSONEncoder: Decimal - строкой без потери точности, даты и время -
+    # в его формате (миллисекунды, Z для UTC), чтобы ответ не зависел от orjson
+    return DJANGO_ENCODER.default(value)
+
+
+def dumps(data, fast=None):
+    """JSON в байтах: orjson или стандартный json с DjangoJSONEncoder."""
+    if fast is None:
+        fast = use_fast_encoder()
+    if fast:
+        return orjson.dumps(data, default=orjson_default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+    return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def iter_json_array(names, rows, chunk_size=CHUNK_SIZE):
+    """Части JSON-массива объектов: строки читаются курсором и кодируются пачками."""
+    yield b'['
+    first = True
+    batch = []
+    for row in rows.iterator(chunk_size=chunk_size):
+        batch.append(dict(zip(names, row)))
+        if len(batch) >= chunk_size:
+            add_rows(len(batch))
+            # Пачка кодируется как массив, скобки отбрасываются
+            yield (b'' if first else b',') + dumps(batch)[1:-1]
+            first = False
+            batch = []
+    if batch:
+        add_rows(len(batch))
+        yield (b'' if first else b',') + dumps(batch)[1:-1]
+    yield b']'
+
+
+def json_rows_response(request, queryset, resource, stream=False):
+    """Ответ с полями из ?fields= (или полями по умолчанию) для строк queryset."""
+    try:
+        names = resource.parse_fields(request.GET.get('fields'))
+    except FieldsError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    rows = resource.rows(queryset, names)
+    if stream:
+        chunks = iter_json_array(names, rows)
+        if isinstance(request, ASGIRequest):
+            chunks = aiter_sync(chunks)
+        return StreamingHttpResponse(chunks, content_type='application/json')
+    rows = list(rows)
+    add_rows(len(rows))
+    return HttpResponse(dumps([dict(zip(names, row)) for row in rows]), content_type='application/json')
@@ -0,0 +1,119 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+
+from .anomalies import record_delete, record_save
+from .budgets import apply_deltas, merge_deltas, transaction_contributions
+from .cache import bump_generation, generations_changed
+from .changelog import record_change
+from .currencies import rates_changed
+from .models import (
+    ChangeLogEntry, ExchangeRate, Organization, Transaction, Status, TransactionType, Category, Subcategory,
+)
+from .tenancy import reset as reset_organizations
+
+TRACKED_MODELS = (Transaction, Status, TransactionType, Category, Subcategory)
+
+
+# Инвалидация кэша и журнал изменений: любая запись в модель увеличивает
+# ее поколение и добавляет запись в журнал. Массовые операции
+# (QuerySet.update, bulk_create) сигналы не отправляют, для них
+# bump_generation и record_bulk нужно вызывать явно.
+def on_save(sender, instance, created, **kwargs):
+    bump_generation(sender, instance.organization_id)
+    record_change(instance, ChangeLogEntry.ACTION_CREATE if created else ChangeLogEntry.ACTION_UPDATE)
+
+
+def on_delete(sender, instance, **kwargs):
+    bump_generation(sender, instance.organization_id)
+    record_change(instance, ChangeLogEntry.ACTION_DELETE)
+
+
+# Обработчики подключаются к конкретным моделям: обработчик без sender
+# отключил бы быстрое удаление (fast delete) для всех остальных моделей.
+for model in TRACKED_MODELS:
+    post_save.connect(on_save, sender=model, dispatch_uid=f'dds_save_{model._meta.model_name}')
+    post_delete.connect(on_delete, sender=model, dispatch_uid=f'dds_delete_{model._meta.model_name}')
+
+
+# Месячные итоги для бюджетов (dds_app.budgets) и распределения сумм по
+# подкатегориям (dds_app.anomalies) меняются на разницу между новым и
+# прежним состоянием транзакции. Прежнее состояние читается перед
+# сохранением одним запросом по первичному ключу.
+PREVIOUS_FIELDS = ('date', 'category_id', 'subcategory_id', 'amount', 'base_amount')
+
+
+def remember_previous_state(sender, instance, **kwargs):
+    instance._previous_state = None
+    if instance.pk is not None:
+        instance._previous_state = sender.objects.filter(pk=instance.pk).values(*PREVIOUS_FIELDS).first()
+
+
+def update_budget_aggregates(sender, instance, **kwargs):
+    deltas = merge_deltas({}, transaction_contributions(instance))
+    previous = getattr(instance, '_previous_state', None)
+    if previous is not None:
+        merge_deltas(deltas, transaction_contributions(sender(**previous), sign=-1))
+    # Бюджеты, превышенные этим сохранением, - для предупреждения в интерфейсе
+    instance.budget_overruns = apply_deltas(deltas)
+
+
+def remove_budget_aggregates(sender, instance, **kwargs):
+    apply_deltas(transaction_contributions(instance, sign=-1))
+
+
+def update_amount_stats(sender, instance, **kwargs):
+    # None - сумма и подкатегория не менялись, флаг прежний
+    instance.amount_anomaly = record_save(instance, getattr(instance, '_previous_state', None))
+
+
+def remove_amount_stats(sender, instance, **kwargs):
+    record_delete(instance)
+
+
+pre_save.connect(remember_previous_state, sender=Transaction, dispatch_uid='dds_previous_state')
+post_save.connect(update_budget_aggregates, sender=Transaction, dispatch_uid='dds_budget_save')
+post_delete.connect(remove_budget_aggregates, sender=Transaction, dispatch_uid='dds_budget_delete')
+post_save.connect(update_amount_stats, sender=Transaction, dispatch_uid='dds_amount_stats_save')
+post_delete.connect(remove_amount_stats, sender=Transaction, dispatch_uid='dds_amount_stats_delete')
+
+
+# Список организаций кэшируется в памяти процесса (dds_app.tenancy): он
+# сбрасывается при записи здесь и при изменении поколения в другом процессе.
+def on_organization_change(sender, **kwargs):
+    bump_generation(Organization)
+    reset_organizations()
+
+
+def on_generations_changed(sender, labels, **kwargs):
+    if Organization._meta.label_lower in labels:
+        reset_organizations()
+
+
+post_save.connect(on_organization_change, sender=Organization, dispatch_uid='dds_organization_save')
+post_delete.connect(on_organization_change, sender=Organization, dispatch_uid='dds_organization_delete')
+generations_changed.connect(on_generations_changed, dispatch_uid='dds_organizations_reset')
+
+
+# Курсы валют: запись одного курса (админка) пересчитывает суммы в рублях
+# транзакций, для которых он действует, - и по новой дате, и по прежней.
+# Массовая загрузка (load_rates) вызывает rates_changed сама.
+def remember_previous_rate(sender, instance, **kwargs):
+    instance._previous_rate = None
+    if instance.pk is not None:
+        instance._previous_rate = sender.objects.filter(pk=instance.pk).values_list('currency', 'date').first()
+
+
+def on_rate_save(sender, instance, **kwargs):
+    changes = {instance.currency: [instance.date]}
+    previous = getattr(instance, '_previous_rate', None)
+    if previous is not None:
+        changes.setdefault(previous[0], []).append(previous[1])
+    rates_changed(changes)
+
+
+def on_rate_delete(sender, instance, **kwargs):
+    rates_changed({instance.currency: [instance.date]})
+
+
+pre_save.connect(remember_previous_rate, sender=ExchangeRate, dispatch_uid='dds_rate_previous')
+post_save.connect(on_rate_save, sender=ExchangeRate, dispatch_uid='dds_rate_save')
+post_delete.connect(on_rate_delete, sender=ExchangeRate, dispatch_uid='dds_rate_delete')
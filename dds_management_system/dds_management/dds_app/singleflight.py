@@ -0,0 +1,172 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # блокировки файлов есть не везде, тогда - только потоки процесса
+    fcntl = None
+
+# Объединение одинаковых тяжелых чтений (single-flight).
+#
+# Утром десятки клиентов одновременно открывают один и тот же список
+# транзакций и отчет. Вычисление регистрируется по ключу (имя, нормализованные
+# параметры, поколения моделей - см. dds_app.cache.make_key): первый запрос
+# с ключом выполняет его, остальные запросы процесса с тем же ключом ждут и
+# получают тот же результат. Результат общий, изменять его нельзя.
+#
+# Между процессами (DDS_SINGLEFLIGHT_LOCK_DIR) ведущий запрос процесса
+# берет блокировку файла (flock) в каталоге: процесс, не получивший ее, ждет
+# освобождения и читает результат, который владелец записал рядом с
+# блокировкой (pickle). Файлов фиксированное число (BUCKETS): ключи,
+# попавшие в один файл, выполняются по очереди, а результат чужого ключа не
+# используется. Без каталога или без fcntl объединяются только потоки.
+#
+# Если ведущий не успел за DDS_SINGLEFLIGHT_TIMEOUT секунд, ожидающий
+# запрос выполняет вычисление сам.
+
+DEFAULT_TIMEOUT = 30
+BUCKETS = 256
+POLL_INTERVAL = 0.01
+
+_calls = {}
+_lock = threading.Lock()
+_stats = {'executions': 0, 'shared': 0, 'shared_workers': 0, 'timeouts': 0}
+
+
+def is_enabled():
+    return getattr(settings, 'DDS_SINGLEFLIGHT', True)
+
+
+def get_timeout():
+    return getattr(settings, 'DDS_SINGLEFLIGHT_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+def get_lock_dir():
+    if fcntl is None:
+        return None
+    return getattr(settings, 'DDS_SINGLEFLIGHT_LOCK_DIR', None)
+
+
+class Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+def run(key, compute):
+    """Результат compute(), общий для одновременных вызовов с одинаковым key."""
+    if not is_enabled():
+        count('executions')
+        return compute()
+    with _lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = Call()
+    if not leader:
+        if not call.done.wait(get_timeout()):
+            count('timeouts')
+            count('executions')
+            return compute()
+        count('shared')
+        if call.error is not None:
+            raise call.error
+        return call.result
+    try:
+        call.result = execute(key, compute)
+    except Exception as error:
+        call.error = error
+        raise
+    finally:
+        with _lock:
+            del _calls[key]
+        call.done.set()
+    return call.result
+
+
+def execute(key, compute):
+    directory = get_lock_dir()
+    if directory is None:
+        count('executions')
+        return compute()
+    os.makedirs(directory, exist_ok=True)
+    bucket = int(hashlib.md5(key.encode('utf-8')).hexdigest(), 16) % BUCKETS
+    path = os.path.join(directory, f'{bucket:03d}')
+    started = time.time()
+    with open(path + '.lock', 'a+b') as lock_file:
+        if not try_lock(lock_file):
+            # Другой процесс вычисляет: ждем, затем берем его результат
+            deadline = time.monotonic() + get_timeout()
+            while not try_lock(lock_file):
+                if time.monotonic() >= deadline:
+                    count('timeouts')
+                    count('executions')
+                    return compute()
+                time.sleep(POLL_INTERVAL)
+            found, result = read_result(path + '.result', key, started)
+            if found:
+                count('shared_workers')
+                return result
+        # Блокировка снимается при закрытии файла
+        count('executions')
+        result = compute()
+        write_result(path + '.result', key, result)
+        return result
+
+
+def try_lock(file):
+    try:
+        fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+
+def read_result(path, key, since):
+    try:
+        with open(path, 'rb') as file:
+            stored_key, written_at, result = pickle.load(file)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return False, None
+    # Результат другого ключа того же файла или записанный до начала ожидания
+    if stored_key != key or written_at < since:
+        return False, None
+    return True, result
+
+
+def write_result(path, key, result):
+    temporary = f'{path}.{os.getpid()}'
+    try:
+        with open(temporary, 'wb') as file:
+            pickle.dump((key, time.time(), result), file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+    except (OSError, pickle.PicklingError, TypeError, AttributeError):
+        # Непереводимый в pickle результат другим процессам не достанется
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def get_stats():
+    with _lock:
+        stats = dict(_stats)
+        stats['in_flight'] = len(_calls)
+    stats['saved'] = stats['shared'] + stats['shared_workers']
+    stats['cross_worker'] = get_lock_dir() is not None
+    return stats
+
+
+def reset_stats():
+    with _lock:
+        for name in _stats:
+            _stats[name] = 0
@@ -0,0 +1,63 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import QuerySet
+from django.template.loader import get_template, render_to_string
+
+from .metrics import add_rows
+
+# Потоковый рендеринг списка транзакций.
+#
+# Страница рендерится обычным шаблоном, в котором вместо строк таблицы стоит
+# маркер ROWS_MARKER. Все до маркера (шапка и форма фильтров) отправляется
+# сразу, затем строки рендерятся пачками по мере чтения курсора
+# (QuerySet.iterator), и в конце отправляется остаток страницы. В памяти
+# одновременно находится не больше одной пачки строк.
+
+ROWS_MARKER = '<!-- transaction-rows -->'
+EMPTY_ROW = '<tr><td colspan="8" class="text-center text-muted py-4">Транзакции не найдены</td></tr>'
+
+
+def get_chunk_size():
+    return getattr(settings, 'DDS_STREAM_CHUNK_SIZE', 500)
+
+
+def render_rows(transactions, chunk_size):
+    """Строки таблицы пачками; transactions - QuerySet (читается курсором) или список."""
+    template = get_template('dds_app/transaction_row.html')
+    if isinstance(transactions, QuerySet):
+        transactions = transactions.iterator(chunk_size=chunk_size)
+    chunk = []
+    for transaction in transactions:
+        chunk.append(template.render({'transaction': transaction}))
+        if len(chunk) >= chunk_size:
+            add_rows(len(chunk))
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        add_rows(len(chunk))
+        yield ''.join(chunk)
+
+
+def stream_page(request, template_name, context, transactions):
+    """Части страницы: все до маркера строк, пачки строк, остаток страницы."""
+    page = render_to_string(template_name, context, request)
+    head, tail = page.split(ROWS_MARKER, 1)
+    yield head
+    empty = True
+    for chunk in render_rows(transactions, get_chunk_size()):
+        empty = False
+        yield chunk
+    if empty:
+        yield EMPTY_ROW
+    yield tail
+
+
+async def aiter_sync(iterator):
+    """Асинхронная обертка: под ASGI синхронный итератор был бы прочитан целиком."""
+    iterator = iter(iterator)
+    sentinel = object()
+    while True:
+        chunk = await sync_to_async(next)(iterator, sentinel)
+        if chunk is sentinel:
+            return
+        yield chunk
@@ -0,0 +1,269 @@
+"""Декларативная загрузка справочников (статусы, типы, категории, подкатегории).
+
+Файл таксономии (JSON или YAML):
+
+    statuses:
+      - Бизнес
+      - {name: Личное, was: [Персональное]}
+    transaction_types:
+      - name: Списание
+        categories:
+          - name: Маркетинг
+            was: Реклама
+            subcategories: [Avito, Farpost]
+
+Строка - краткая запись {name: ...}. Поле was перечисляет прежние названия:
+запись с таким названием в базе переименовывается, а не создается заново
+(в том числе два названия можно поменять местами).
+Категории и подкатегории сопоставляются в пределах родителя.
+
+Файл сравнивается с базой в памяти (по одному запросу на справочник),
+создания и переименования применяются массовыми запросами в одной
+транзакции. Переименование проверяет версию записи (dds_app.concurrency):
+если запись изменили после чтения, загрузка отменяется. Удаление записей, которых нет в файле, - только с prune=True;
+оно идет через обычный QuerySet.delete(), поэтому справочники, на которые
+ссылаются транзакции, удалить нельзя (ProtectedError).
+"""
+import json
+from dataclasses import dataclass, field
+
+from django.db.transaction import atomic
+
+from .cache import bump_generation
+from .changelog import record_bulk
+from .concurrency import bulk_update_versioned
+from .models import ChangeLogEntry, Status, TransactionType, Category, Subcategory
+
+try:
+    import yaml
+except ImportError:  # PyYAML не обязателен, JSON читается всегда
+    yaml = None
+
+BATCH_SIZE = 1000
+
+
+class TaxonomyError(ValueError):
+    pass
+
+
+@dataclass
+class Node:
+    name: str
+    was: tuple = ()
+    children: list = field(default_factory=list)
+
+
+def parse_node(item, children_key=None, path=''):
+    if isinstance(item, str):
+        item = {'name': item}
+    if not isinstance(item, dict) or not isinstance(item.get('name'), str) or not item['name'].strip():
+        raise TaxonomyError(f'{path}: ожидается строка или объект с полем name')
+    was = item.get('was', ())
+    if isinstance(was, str):
+        was = (was,)
+    node = Node(item['name'].strip(), tuple(name.strip() for name in was))
+    if children_key:
+        node.children = item.get(children_key) or []
+        if not isinstance(node.children, list):
+            raise TaxonomyError(f'{path}/{node.name}: {children_key} должен быть списком')
+    return node
+
+
+def parse_level(items, children_key, path, parse_children=None):
+    nodes = []
+    names = set()
+    for item in items or []:
+        node = parse_node(item, children_key, path)
+        if node.name in names:
+            raise TaxonomyError(f'{path}: повторяется "{node.name}"')
+        names.add(node.name)
+        if parse_children:
+            node.children = parse_children(node.children, f'{path}/{node.name}')
+        nodes.append(node)
+    return nodes
+
+
+def parse_taxonomy(data):
+    """Проверяет и нормализует таксономию: (статусы, типы операций) - списки Node."""
+    if not isinstance(data, dict):
+        raise TaxonomyError('Таксономия должна быть объектом с разделами statuses и transaction_types')
+
+    def parse_categories(items, path):
+        return parse_level(items, 'subcategories', path, lambda sub, sub_path: parse_level(sub, None, sub_path))
+
+    statuses = parse_level(data.get('statuses'), None, 'statuses')
+    types = parse_level(data.get('transaction_types'), 'categories', 'transaction_types', parse_categories)
+    return statuses, types
+
+
+def read_taxonomy(path):
+    with open(path, encoding='utf-8') as file:
+        if str(path).endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise TaxonomyError('Для YAML-файлов нужен пакет PyYAML')
+            return yaml.safe_load(file)
+        return json.load(file)
+
+
+@dataclass
+class TaxonomyDiff:
+    """Изменения по справочникам: создаваемые и переименовываемые объекты, id к удалению."""
+    creates: dict = field(default_factory=dict)
+    renames: dict = field(default_factory=dict)
+    deletes: dict = field(default_factory=dict)
+    lines: list = field(default_factory=list)
+
+    def __bool__(self):
+        return any(self.creates.values()) or any(self.renames.values()) or any(self.deletes.values())
+
+    def summary(self):
+        return {
+            model._meta.model_name: {
+                'create': len(self.creates[model]),
+                'rename': len(self.renames[model]),
+                'delete': len(self.deletes[model]),
+            }
+            for model in (Status, TransactionType, Category, Subcategory)
+        }
+
+
+class Level:
+    """Записи одного справочника из базы, сгруппированные по родителю."""
+
+    def __init__(self, model, parent_field=None):
+        self.model = model
+        self.parent_field = parent_field
+        fields = ['pk', 'version', 'name'] + ([parent_field] if parent_field else [])
+        self.existing = {}
+        # Версии на момент планирования: переименование не затрет правку, сделанную после
+        self.versions = {}
+        for pk, version, name, *parent in model.objects.values_list(*fields):
+            self.existing[(parent[0] if parent else None, name)] = pk
+            self.versions[pk] = version
+        self.seen = set()
+
+
+def match(level, parent, node, diff, label, renamed_away=()):
+    """Находит запись для узла (по имени или прежнему имени) и планирует изменение.
+
+    renamed_away - прежние имена соседних узлов: запись с таким именем уходит
+    под другое название, поэтому по текущему имени узел ее не занимает
+    (так меняются местами два названия). Возвращает объект модели:
+    существующий (pk задан) или новый.
+    """
+    relation = {level.parent_field.removesuffix('_id'): parent} if level.parent_field else {}
+    # У нового родителя детей в базе еще нет
+    if parent is None or parent.pk is not None:
+        parent_key = parent.pk if parent is not None else None
+        for name in (node.name, *node.was):
+            if name == node.name and name in renamed_away:
+                continue
+            pk = level.existing.get((parent_key, name))
+            if pk is None or pk in level.seen:
+                continue
+            level.seen.add(pk)
+            obj = level.model(pk=pk, version=level.versions[pk], name=node.name, **relation)
+            if name != node.name:
+                diff.renames[level.model].append(obj)
+                diff.lines.append(f'~ {label} {name} -> {node.name}')
+            return obj
+
+    obj = level.model(name=node.name, **relation)
+    diff.creates[level.model].append(obj)
+    diff.lines.append(f'+ {label} {node.name}')
+    return obj
+
+
+def previous_names(nodes):
+    return {name for node in nodes for name in node.was}
+
+
+def plan_taxonomy(statuses, types, prune=False):
+    """Сравнивает таксономию с базой, ничего не записывая."""
+    diff = TaxonomyDiff()
+    for model in (Status, TransactionType, Category, Subcategory):
+        diff.creates[model] = []
+        diff.renames[model] = []
+        diff.deletes[model] = []
+
+    status_level = Level(Status)
+    type_level = Level(TransactionType)
+    category_level = Level(Category, 'transaction_type_id')
+    subcategory_level = Level(Subcategory, 'category_id')
+
+    for node in statuses:
+        match(status_level, None, node, diff, 'status:', previous_names(statuses))
+    for type_node in types:
+        transaction_type = match(type_level, None, type_node, diff, 'transaction_type:', previous_names(types))
+        for category_node in type_node.children:
+            category = match(category_level, transaction_type, category_node, diff,
+                             f'category: {type_node.name} /', previous_names(type_node.children))
+            for sub_node in category_node.children:
+                match(subcategory_level, category, sub_node, diff,
+                      f'subcategory: {type_node.name} / {category_node.name} /',
+                      previous_names(category_node.children))
+
+    if prune:
+        for level in (subcategory_level, category_level, type_level, status_level):
+            for (parent, name), pk in level.existing.items():
+                if pk not in level.seen:
+                    diff.deletes[level.model].append(pk)
+                    diff.lines.append(f'- {level.model._meta.model_name}: {name} (id {pk})')
+    return diff
+
+
+def rename(model, objs):
+    """Переименовывает записи в два шага.
+
+    Названия уникальны в пределах организации (и родителя), а один UPDATE
+    проверяет уникальность построчно: при обмене названиями A <-> B или
+    цепочке A -> B -> C первая же строка столкнется с еще не
+    переименованной. Поэтому сначала записи получают временные имена по pk
+    (с проверкой версии), затем - итоговые.
+    """
+    names = [obj.name for obj in objs]
+    for obj in objs:
+        obj.name = f'\x00rename-{obj.pk}'
+    _, stale = bulk_update_versioned(objs, ['name'])
+    for obj, name in zip(objs, names):
+        obj.name = name
+    if stale:
+        names = ', '.join(obj.name for obj in stale[:5])
+        raise TaxonomyError(f'{model._meta.verbose_name_plural} изменены после чтения ({names}); '
+                            'повторите загрузку')
+    model._base_manager.bulk_update(objs, ['name'], batch_size=BATCH_SIZE)
+
+
+def apply_taxonomy(diff):
+    """Применяет план одной транзакцией. Поколения кэша и журнал изменений
+    обновляются явно: массовые операции не отправляют сигналов."""
+    with atomic():
+        # Сначала удаления: освободившиеся имена могут занять переименования
+        for model in (Subcategory, Category, TransactionType, Status):
+            if diff.deletes[model]:
+                model.objects.filter(pk__in=diff.deletes[model]).delete()
+
+        for model in (Status, TransactionType, Category, Subcategory):
+            renamed = diff.renames[model]
+            if renamed:
+                rename(model, renamed)
+                record_bulk(renamed, ChangeLogEntry.ACTION_UPDATE)
+
+            created = diff.creates[model]
+            if created:
+                # id родителей, созданных уровнем выше, bulk_create берет из самих объектов
+                model.objects.bulk_create(created, batch_size=BATCH_SIZE)
+                record_bulk(created, ChangeLogEntry.ACTION_CREATE)
+
+            if renamed or created:
+                bump_generation(model)
+    return diff
+
+
+def load_taxonomy(data, prune=False, dry_run=False):
+    """Разбирает таксономию, строит план и (кроме dry_run) применяет его."""
+    statuses, types = parse_taxonomy(data)
+    diff = plan_taxonomy(statuses, types, prune)
+    if diff and not dry_run:
+        apply_taxonomy(diff)
+    return diff
@@ -0,0 +1,169 @@
+"""Организации (тенанты) на одной установке.
+
+Справочники, транзакции, журнал изменений и фоновые задачи принадлежат
+организации (поле organization). Текущая организация хранится в
+contextvar: TenantMiddleware выбирает ее для запроса, обработчики задач
+и команды - через tenant_context. Менеджер TenantManager добавляет фильтр
+по текущей организации к каждому запросу модели, поэтому представления и
+админка видят только данные своей организации. Вне контекста (команды
+пересчета, обработчики очереди) запросы не ограничиваются.
+
+Производные таблицы (бюджеты, месячные итоги, распределения сумм)
+привязаны к категориям и подкатегориям и ограничиваются через них.
+
+Список организаций кэшируется в памяти процесса и сбрасывается при
+изменении поколения модели Organization (dds_app.cache).
+"""
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import models
+
+DEFAULT_SLUG = 'default'
+DEFAULT_NAME = 'Основная организация'
+SESSION_KEY = 'dds_organization'
+QUERY_PARAM = 'organization'
+HEADER = 'X-Organization'
+
+_current = ContextVar('dds_organization', default=None)
+# id -> (slug, name)
+_organizations = None
+_lock = threading.Lock()
+
+
+def get_active():
+    """id организации из контекста или None вне контекста."""
+    return _current.get()
+
+
+def activate(organization_id):
+    return _current.set(organization_id)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+@contextmanager
+def tenant_context(organization_id):
+    token = activate(organization_id)
+    try:
+        yield organization_id
+    finally:
+        deactivate(token)
+
+
+def get_organizations():
+    global _organizations
+    organizations = _organizations
+    if organizations is None:
+        from .models import Organization
+
+        with _lock:
+            organizations = _organizations = {
+                pk: (slug, name) for pk, slug, name in Organization.objects.values_list('pk', 'slug', 'name')
+            }
+    return organizations
+
+
+def reset(**kwargs):
+    global _organizations
+    with _lock:
+        _organizations = None
+
+
+def get_by_slug(slug):
+    for pk, (organization_slug, _) in get_organizations().items():
+        if organization_slug == slug:
+            return pk
+    return None
+
+
+def get_name(organization_id):
+    organization = get_organizations().get(organization_id)
+    return organization[1] if organization else ''
+
+
+def default_organization_id():
+    organization_id = get_by_slug(DEFAULT_SLUG)
+    if organization_id is None:
+        from .models import Organization
+
+        Organization.objects.get_or_create(slug=DEFAULT_SLUG, defaults={'name': DEFAULT_NAME})
+        reset()
+        organization_id = get_by_slug(DEFAULT_SLUG)
+    return organization_id
+
+
+def organization_by_slug(slug):
+    """id организации по коду или None; организация по умолчанию создается при необходимости."""
+    return default_organization_id() if slug == DEFAULT_SLUG else get_by_slug(slug)
+
+
+def current_organization_id():
+    """Организация из контекста, вне контекста - организация по умолчанию.
+
+    Используется как значение поля organization по умолчанию.
+    """
+    organization_id = _current.get()
+    return default_organization_id() if organization_id is None else organization_id
+
+
+def scope(queryset, field='organization'):
+    """Ограничивает queryset текущей организацией (вне контекста - без изменений)."""
+    organization_id = _current.get()
+    if organization_id is None:
+        return queryset
+    return queryset.filter(**{field: organization_id})
+
+
+class TenantManager(models.Manager):
+    """Менеджер, видящий только записи текущей организации.
+
+    tenant_field - путь к организации: 'organization' для моделей с
+    собственным полем, например 'category__organization' для бюджетов.
+    """
+
+    def __init__(self, tenant_field='organization'):
+        super().__init__()
+        self.tenant_field = tenant_field
+
+    def get_queryset(self):
+        return scope(super().get_queryset(), self.tenant_field)
+
+
+def resolve_organization(request):
+    """id организации для запроса: ?organization=<slug> (запоминается в сессии),
+    заголовок X-Organization, сессия, иначе организация по умолчанию.
+
+    Возвращает (id, ошибка): для неизвестной организации id - None.
+    """
+    slug = request.GET.get(QUERY_PARAM) or request.headers.get(HEADER)
+    if slug:
+        organization_id = organization_by_slug(slug)
+        if organization_id is None:
+            return None, f'Организация {slug} не найдена'
+        if QUERY_PARAM in request.GET and hasattr(request, 'session'):
+            request.session[SESSION_KEY] = organization_id
+        return organization_id, None
+    if hasattr(request, 'session'):
+        organization_id = request.session.get(SESSION_KEY)
+        if organization_id in get_organizations():
+            return organization_id, None
+    return default_organization_id(), None
+
+
+def organizations(request):
+    """Контекстный процессор: переключатель организаций (если их больше одной).
+
+    Список берется из кэша процесса, запросов к базе нет.
+    """
+    items = get_organizations()
+    if len(items) < 2:
+        return {}
+    current = items.get(getattr(request, 'organization_id', None), ('', ''))[0]
+    return {
+        'organizations': sorted(((slug, name) for slug, name in items.values()), key=lambda item: item[1]),
+        'current_organization': current,
+    }
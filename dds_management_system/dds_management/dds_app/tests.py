@@ -1,9 +1,67 @@
-from django.test import TestCase, Client
+import asyncio
+import hashlib
+import importlib
+import json
+import os
+import random
+import re
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from io import StringIO
+from types import SimpleNamespace
+from urllib.parse import urlencode
+from unittest import mock, skipUnless
+from asgiref.sync import sync_to_async
+from django.contrib.admin import site as admin_site
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.transaction import atomic
+from django.test import TestCase, SimpleTestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
-from datetime import date
-from .models import Status, TransactionType, Category, Subcategory, Transaction
-from .forms import TransactionForm, StatusForm, TransactionTypeForm, CategoryForm, SubcategoryForm
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from django.db.models import Count, F, Sum
+from .models import (
+    Organization, Status, TransactionType, Category, Subcategory, Transaction, ChangeLogEntry, Job, Budget, MonthlyAggregate,
+    SubcategoryStats, AmountAnomaly, ExchangeRate, VersionCounter,
+)
+from .forms import TransactionForm, StatusForm, TransactionTypeForm, CategoryForm, SubcategoryForm, PivotReportForm
+from django.core.cache import cache
+from .cache import bump_generation, get_generation, sync_generations
+from . import cache_backend
+from .cache_backend import StatsLocMemCache
+from .changelog import FLOOR_COUNTER, compact, get_floor, get_last_seq
+from .events import TransactionBroadcaster, replay_events
+from .reports import build_pivot, get_pivot
+from .ledger_snapshot import LedgerSnapshot, write_ledger_snapshot
+from .parallel_report import parallel_report, parallel_totals, split_range
+from .admin import EstimatedCountPaginator, PeriodListFilter, TransactionAdmin
+from .taxonomy import TaxonomyError, apply_taxonomy, load_taxonomy, parse_taxonomy, plan_taxonomy
+from .autocomplete import Snapshot, get_index
+from .fingerprints import bulk_create_transactions, find_duplicates, instance_fingerprint
+from .admission import Pool, get_pool, reset_pools
+from .anomalies import add_value, merge, remove_value, std
+from .currencies import MissingRate, convert, fill_base_amounts, rates
+from .dictionaries import DICTIONARIES
+from .filters import TRANSACTION_FILTERS, get_filters, matches_filters
+from .ordering import SORTS
+from .concurrency import ConflictError, bulk_update_versioned
+from . import concurrency
+from . import metrics, singleflight
+from .budgets import budget_rows, rebuild_aggregates
+from .serialization import TRANSACTION, dumps, iter_json_array, orjson
+from .tenancy import default_organization_id, tenant_context
+from .jobs import Heartbeat, enqueue, claim_next, run_job, run_pending, requeue_stale, cleanup_expired
 
 class ModelTests(TestCase):
     def setUp(self):
@@ -464,9 +522,9 @@ class IntegrationTests(TestCase):
         self.assertEqual(response.status_code, 302)
         self.assertEqual(Status.objects.count(), 2)
 
-        # 2. Проверка отображения в справочниках
-        response = self.client.get(reverse('dictionaries'))
-        self.assertContains(response, 'Новый тестовый статус')
+        # 2. Проверка отображения в справочниках (строки панели загружаются из API)
+        response = self.client.get(reverse('dictionary_items', args=['status']))
+        self.assertIn('Новый тестовый статус', [item['name'] for item in response.json()['items']])
 
         # 3. Редактирование статуса
         new_status = Status.objects.get(name='Новый тестовый статус')
@@ -627,3 +685,2827 @@ class SecurityTests(TestCase):
         # Должен вернуть 403 Forbidden или перенаправить
         self.assertIn(response.status_code, [403, 302])
 
+
+
+class CacheTests(TestCase):
+    """Тесты кэширования по поколениям моделей"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.status = Status.objects.create(name='Бизнес')
+        self.transaction_type = TransactionType.objects.create(name='Списание')
+        self.category = Category.objects.create(
+            name='Маркетинг',
+            transaction_type=self.transaction_type
+        )
+        self.subcategory = Subcategory.objects.create(
+            name='Avito',
+            category=self.category
+        )
+
+    def test_generation_bumped_on_write(self):
+        """Тест увеличения поколения при записи и удалении"""
+        before = get_generation(Category)
+        category = Category.objects.create(name='Продажи', transaction_type=self.transaction_type)
+        created = get_generation(Category)
+        self.assertGreater(created, before)
+        category.delete()
+        self.assertGreater(get_generation(Category), created)
+
+    def test_api_response_cached_until_write(self):
+        """Тест кэширования ответа API до изменения модели"""
+        url = reverse('get_categories_by_type')
+        params = {'transaction_type_id': self.transaction_type.id}
+        self.assertEqual(len(self.client.get(url, params).json()), 1)
+
+        # Единственный запрос - сверка поколений в CacheCoherenceMiddleware
+        with self.assertNumQueries(1):
+            response = self.client.get(url, params)
+        self.assertEqual(len(response.json()), 1)
+
+        Category.objects.create(name='Инфраструктура', transaction_type=self.transaction_type)
+        self.assertEqual(len(self.client.get(url, params).json()), 2)
+
+    def test_api_params_normalized(self):
+        """Тест нормализации параметров запроса в ключе кэша"""
+        url = reverse('get_subcategories_by_category')
+        self.client.get(url, {'category_id': self.category.id})
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'category_id': self.category.id, 'unused': 'x'})
+        self.assertEqual(response.json()[0]['name'], 'Avito')
+
+    def test_dictionary_panel_cached(self):
+        """Тест кэширования строк панели справочника до изменения"""
+        url = reverse('dictionary_items', args=['subcategory'])
+        self.client.get(url)
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.json()['items'][0]['name'], 'Avito')
+
+        self.subcategory.name = 'Farpost'
+        self.subcategory.save()
+        self.assertEqual(self.client.get(url).json()['items'][0]['name'], 'Farpost')
+
+    def test_filters_fragment_keeps_selection(self):
+        """Тест кэша блока фильтров с учетом выбранных значений"""
+        self.client.get(reverse('transaction_list'))
+        response = self.client.get(reverse('transaction_list'), {'status': self.status.id})
+        self.assertContains(response, f'<option value="{self.status.id}" selected>')
+
+    def test_stats_endpoint(self):
+        """Тест счетчиков попаданий и промахов"""
+        url = reverse('get_categories_by_type')
+        self.client.get(url, {'transaction_type_id': self.transaction_type.id})
+        self.client.get(url, {'transaction_type_id': self.transaction_type.id})
+        stats = self.client.get(reverse('cache_stats')).json()
+        self.assertGreaterEqual(stats['hits'], 1)
+        self.assertGreaterEqual(stats['misses'], 1)
+        self.assertIn('dds_app.category', stats['generations'])
+
+    def test_evictions_counted(self):
+        """Тест учета вытесненных записей"""
+        backend = StatsLocMemCache('test-evictions', {'OPTIONS': {'MAX_ENTRIES': 2, 'CULL_FREQUENCY': 2}})
+        for i in range(5):
+            backend.set(f'key{i}', i)
+        self.assertGreater(backend.get_stats()['evictions'], 0)
+
+
+    def test_counters_thread_safe(self):
+        """Тест: счетчики не теряют обращения из параллельных потоков"""
+
+        class SlowDict(dict):
+            # Переключает поток между чтением и записью счетчика в +=
+            def __getitem__(self, key):
+                value = super().__getitem__(key)
+                time.sleep(0)
+                return value
+
+        self.addCleanup(cache_backend._stats.pop, 'test-threads', None)
+        cache_backend._stats['test-threads'] = SlowDict(hits=0, misses=0, evictions=0)
+        backend = StatsLocMemCache('test-threads', {})
+        backend.set('key', 1)
+        self.addCleanup(backend.clear)
+
+        def worker():
+            local = StatsLocMemCache('test-threads', {})
+            for _ in range(500):
+                local.get('key')
+                local.get('missing')
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = backend.get_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2000, 2000))
+
+# Процесс-обработчик запросов для проверки согласованности кэша между воркерами:
+# читает команды [метод, url, данные] из stdin и печатает [статус, тело].
+WORKER_SCRIPT = '''
+import json, os, sys
+import django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dds_management.settings')
+django.setup()
+from django.test import Client
+from django.test.utils import setup_test_environment
+setup_test_environment()
+client = Client()
+for line in sys.stdin:
+    method, url, data = json.loads(line)
+    response = getattr(client, method)(url, data)
+    print(json.dumps([response.status_code, response.content.decode()]), flush=True)
+'''
+
+
+class CrossWorkerCoherenceTests(SimpleTestCase):
+    """Тест согласованности кэша между процессами через таблицу версий"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.env = dict(os.environ, DDS_DB_PATH=os.path.join(self.tmpdir.name, 'db.sqlite3'))
+        subprocess.run(
+            [sys.executable, 'manage.py', 'migrate', '--noinput'],
+            cwd=settings.BASE_DIR, env=self.env, check=True, capture_output=True,
+        )
+        self.workers = [self.start_worker(), self.start_worker()]
+
+    def tearDown(self):
+        for worker in self.workers:
+            worker.stdin.close()
+            worker.wait(timeout=10)
+            worker.stdout.close()
+        self.tmpdir.cleanup()
+
+    def start_worker(self):
+        return subprocess.Popen(
+            [sys.executable, '-c', WORKER_SCRIPT], cwd=settings.BASE_DIR, env=self.env,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+        )
+
+    def request(self, worker, method, url, data=None):
+        worker.stdin.write(json.dumps([method, url, data or {}]) + '\n')
+        worker.stdin.flush()
+        return json.loads(worker.stdout.readline())
+
+    def test_write_in_one_worker_visible_in_another(self):
+        """Запись в одном воркере видна в другом на следующем запросе"""
+        writer, reader = self.workers
+        status, _ = self.request(writer, 'post', '/dictionaries/transaction_type/add/', {'name': 'Списание'})
+        self.assertEqual(status, 302)
+
+        url = '/api/categories/by-type/'
+        status, body = self.request(reader, 'get', url, {'transaction_type_id': 1})
+        self.assertEqual(json.loads(body), [])
+        # Ответ закэширован в процессе-читателе
+        self.request(reader, 'get', url, {'transaction_type_id': 1})
+        _, stats = self.request(reader, 'get', '/api/cache/stats/')
+        self.assertGreaterEqual(json.loads(stats)['hits'], 1)
+        _, body = self.request(reader, 'get', '/api/dictionaries/category/')
+        self.assertEqual(json.loads(body)['items'], [])
+
+        status, _ = self.request(writer, 'post', '/dictionaries/category/add/', {
+            'name': 'Маркетинг', 'transaction_type': 1,
+        })
+        self.assertEqual(status, 302)
+
+        _, body = self.request(reader, 'get', url, {'transaction_type_id': 1})
+        self.assertEqual([item['name'] for item in json.loads(body)], ['Маркетинг'])
+        _, body = self.request(reader, 'get', '/api/dictionaries/category/')
+        self.assertEqual([item['name'] for item in json.loads(body)['items']], ['Маркетинг'])
+
+
+class ChangeFeedTests(TestCase):
+    """Тесты журнала изменений и эндпоинта инкрементальной синхронизации"""
+
+    def setUp(self):
+        self.client = Client()
+        self.status = Status.objects.create(name='Бизнес')
+        self.transaction_type = TransactionType.objects.create(name='Списание')
+        self.category = Category.objects.create(
+            name='Маркетинг',
+            transaction_type=self.transaction_type
+        )
+        self.subcategory = Subcategory.objects.create(
+            name='Avito',
+            category=self.category
+        )
+        self.transaction = Transaction.objects.create(
+            date=date.today(),
+            status=self.status,
+            transaction_type=self.transaction_type,
+            category=self.category,
+            subcategory=self.subcategory,
+            amount=1000.00
+        )
+
+    def test_changes_recorded(self):
+        """Тест записи создания, изменения и удаления в журнал"""
+        self.transaction.amount = 1500
+        self.transaction.save()
+        pk = self.transaction.pk
+        self.transaction.delete()
+
+        entries = ChangeLogEntry.objects.filter(model='transaction', object_id=pk)
+        self.assertEqual([entry.action for entry in entries], ['create', 'update', 'delete'])
+        self.assertEqual(entries[1].data['amount'], '1500.00')
+        self.assertIsNone(entries[2].data)
+
+    def test_changes_since(self):
+        """Тест выдачи изменений после заданного номера пачками"""
+        url = reverse('changes_feed')
+        data = self.client.get(url, {'since': 0, 'limit': 3}).json()
+        self.assertEqual(len(data['changes']), 3)
+        self.assertTrue(data['has_more'])
+
+        data = self.client.get(url, {'since': data['last_seq']}).json()
+        self.assertEqual([c['model'] for c in data['changes']], ['subcategory', 'transaction'])
+        self.assertFalse(data['has_more'])
+
+        last_seq = data['last_seq']
+        self.subcategory.name = 'Farpost'
+        self.subcategory.save()
+        data = self.client.get(url, {'since': last_seq}).json()
+        self.assertEqual(len(data['changes']), 1)
+        self.assertEqual(data['changes'][0]['data']['name'], 'Farpost')
+
+    def test_invalid_since(self):
+        """Тест невалидного параметра since"""
+        response = self.client.get(reverse('changes_feed'), {'since': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_snapshot_plus_tail(self):
+        """Тест начальной загрузки: снимок и продолжение по журналу"""
+        response = self.client.get(reverse('changes_snapshot'))
+        # Снимок отдается потоком, а не одним ответом в памяти
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        snapshot = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(snapshot['objects']['transaction']), 1)
+        # Строки снимка в том же виде, что и данные записей журнала
+        entry = ChangeLogEntry.objects.filter(model='transaction').latest('seq')
+        self.assertEqual(snapshot['objects']['transaction'][0], json.loads(json.dumps(entry.data)))
+        self.assertEqual(snapshot['objects']['category'][0]['name'], 'Маркетинг')
+
+        Status.objects.create(name='Личное')
+        data = self.client.get(reverse('changes_feed'), {'since': snapshot['seq']}).json()
+        self.assertEqual(len(data['changes']), 1)
+        self.assertEqual(data['changes'][0]['data']['name'], 'Личное')
+
+    def test_compaction(self):
+        """Тест сжатия журнала и нижней границы"""
+        self.transaction.amount = 1500
+        self.transaction.save()
+        temp_status = Status.objects.create(name='Временный')
+        temp_status.delete()
+
+        compact(timezone.now() + timedelta(seconds=1))
+
+        entries = ChangeLogEntry.objects.filter(model='transaction')
+        self.assertEqual([entry.action for entry in entries], ['update'])
+        self.assertFalse(ChangeLogEntry.objects.filter(action='delete').exists())
+
+        response = self.client.get(reverse('changes_feed'), {'since': 0})
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(response.json()['floor'], get_floor())
+
+        response = self.client.get(reverse('changes_feed'), {'since': get_floor()})
+        self.assertEqual(response.status_code, 200)
+
+
+class TransactionEventsTests(TestCase):
+    """Тесты рассылки изменений списка транзакций через Server-Sent Events"""
+
+    def setUp(self):
+        self.status = Status.objects.create(name='Бизнес')
+        self.transaction_type = TransactionType.objects.create(name='Списание')
+        self.category = Category.objects.create(
+            name='Маркетинг',
+            transaction_type=self.transaction_type
+        )
+        self.subcategory = Subcategory.objects.create(
+            name='Avito',
+            category=self.category
+        )
+
+    def create_transaction(self, amount):
+        return Transaction.objects.create(
+            date=date.today(),
+            status=self.status,
+            transaction_type=self.transaction_type,
+            category=self.category,
+            subcategory=self.subcategory,
+            amount=amount
+        )
+
+    async def test_fan_out_by_filters(self):
+        """Тест рассылки событий только подписчикам с подходящими фильтрами"""
+        broadcaster = TransactionBroadcaster(poll_interval=3600)
+        matching = await broadcaster.subscribe({'status': str(self.status.id)})
+        other = await broadcaster.subscribe({'status': '999'})
+        try:
+            transaction = await sync_to_async(self.create_transaction)(1234)
+            await broadcaster.poll()
+            message = matching.queue.get_nowait()
+            self.assertIn('event: create', message)
+            self.assertIn(f'transaction-{transaction.pk}', message)
+            self.assertIn('1234.00', message)
+            self.assertTrue(other.queue.empty())
+
+            await sync_to_async(transaction.delete)()
+            await broadcaster.poll()
+            self.assertIn('event: delete', matching.queue.get_nowait())
+            self.assertIn('event: delete', other.queue.get_nowait())
+        finally:
+            broadcaster.task.cancel()
+
+    async def test_update_out_of_filter_removes_row(self):
+        """Тест удаления строки, когда транзакция перестала подходить под фильтры"""
+        broadcaster = TransactionBroadcaster(poll_interval=3600)
+        transaction = await sync_to_async(self.create_transaction)(100)
+        subscription = await broadcaster.subscribe({'date_from': str(date.today())})
+        try:
+            transaction.date = date(2020, 1, 1)
+            await sync_to_async(transaction.save)()
+            await broadcaster.poll()
+            self.assertIn('event: delete', subscription.queue.get_nowait())
+        finally:
+            broadcaster.task.cancel()
+
+    async def test_event_stream(self):
+        """Тест потока событий через ASGI"""
+        response = await self.async_client.get(reverse('transaction_events'), {'status': self.status.id})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = response.streaming_content
+        try:
+            self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+            await sync_to_async(self.create_transaction)(555)
+            message = await asyncio.wait_for(anext(stream), 5)
+            self.assertIn(b'event: create', message)
+            self.assertIn(b'555.00', message)
+        finally:
+            await stream.aclose()
+
+    def test_replay_missed_events(self):
+        """Тест досылки пропущенных изменений своей организации по своим фильтрам"""
+        since = get_last_seq()
+        matching = self.create_transaction(100)
+        other_status = Status.objects.create(name='Личное')
+        excluded = self.create_transaction(200)
+        excluded.status = other_status
+        excluded.save()
+        other = Organization.objects.create(name='ООО Вторая', slug='second')
+        with tenant_context(other.pk):
+            status = Status.objects.create(name='Бизнес')
+            transaction_type = TransactionType.objects.create(name='Списание')
+            category = Category.objects.create(name='Маркетинг', transaction_type=transaction_type)
+            Transaction.objects.create(
+                date=date.today(), status=status, transaction_type=transaction_type, category=category,
+                subcategory=Subcategory.objects.create(name='Avito', category=category), amount=300,
+            )
+        until = get_last_seq()
+
+        messages = replay_events(since, until, {'status': str(self.status.pk)}, matching.organization_id)
+        # Изменения второй организации не досылаются; строка, переставшая
+        # подходить под фильтр, удаляется у клиента
+        self.assertEqual(len(messages), 3)
+        self.assertIn('event: create', messages[0])
+        self.assertIn(f'transaction-{matching.pk}', messages[0])
+        self.assertIn('event: create', messages[1])
+        self.assertIn('event: delete', messages[2])
+        self.assertIn(f'"id": {excluded.pk}', messages[2])
+        self.assertEqual(replay_events(until, until, {}, matching.organization_id), [])
+
+        # Журнал сжат после since - восстановить нельзя
+        VersionCounter.objects.update_or_create(name=FLOOR_COUNTER, defaults={'value': since + 1})
+        self.assertIsNone(replay_events(since, until, {}, matching.organization_id))
+
+    async def test_reconnect_replays_instead_of_reload(self):
+        """Тест: при переподключении пропущенное досылается, перезагрузка - только без журнала"""
+        since = await sync_to_async(get_last_seq)()
+        await sync_to_async(self.create_transaction)(777)
+        response = await self.async_client.get(reverse('transaction_events'), headers={'Last-Event-ID': str(since)})
+        stream = response.streaming_content
+        try:
+            self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+            message = await anext(stream)
+            self.assertIn(b'event: create', message)
+            self.assertIn(b'777.00', message)
+        finally:
+            await stream.aclose()
+
+        response = await self.async_client.get(reverse('transaction_events'), headers={'Last-Event-ID': 'abc'})
+        stream = response.streaming_content
+        try:
+            await anext(stream)
+            self.assertIn(b'event: reload', await anext(stream))
+        finally:
+            await stream.aclose()
+
+    def test_event_stream_requires_asgi(self):
+        """Тест отказа в потоке событий под WSGI"""
+        response = self.client.get(reverse('transaction_events'))
+        self.assertEqual(response.status_code, 501)
+
+
+class PivotReportTests(TestCase):
+    """Тесты сводного отчета категории x месяцы"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.status = Status.objects.create(name='Бизнес')
+        self.other_status = Status.objects.create(name='Личное')
+        self.income = TransactionType.objects.create(name='Пополнение')
+        self.expense = TransactionType.objects.create(name='Списание')
+        self.sales = Category.objects.create(name='Продажи', transaction_type=self.income)
+        self.online = Subcategory.objects.create(name='Онлайн', category=self.sales)
+        self.marketing = Category.objects.create(name='Маркетинг', transaction_type=self.expense)
+        self.avito = Subcategory.objects.create(name='Avito', category=self.marketing)
+        self.farpost = Subcategory.objects.create(name='Farpost', category=self.marketing)
+
+        self.create(date(2024, 1, 10), self.expense, self.marketing, self.avito, '100.50')
+        self.create(date(2024, 1, 20), self.expense, self.marketing, self.avito, '200.00')
+        self.create(date(2024, 3, 5), self.expense, self.marketing, self.farpost, '50.00')
+        self.create(date(2024, 2, 1), self.income, self.sales, self.online, '1000.00')
+        self.create(date(2024, 2, 1), self.income, self.sales, self.online, '10.00', self.other_status)
+
+    def create(self, day, transaction_type, category, subcategory, amount, status=None):
+        Transaction.objects.create(
+            date=day,
+            status=status or self.status,
+            transaction_type=transaction_type,
+            category=category,
+            subcategory=subcategory,
+            amount=amount
+        )
+
+    def test_pivot_matrix(self):
+        """Тест плотной матрицы с итогами по строкам и столбцам"""
+        data = get_pivot(date(2024, 1, 1), date(2024, 3, 31), self.status.pk)
+        self.assertEqual(data['months'], ['2024-01', '2024-02', '2024-03'])
+        sections = {section['transaction_type']: section for section in data['sections']}
+
+        expense = sections['Списание']
+        marketing = expense['categories'][0]
+        self.assertEqual(marketing['cells'], ['300.50', '0.00', '50.00'])
+        self.assertEqual(marketing['total'], '350.50')
+        self.assertEqual(
+            [(sub['subcategory'], sub['cells']) for sub in marketing['subcategories']],
+            [('Avito', ['300.50', '0.00', '0.00']), ('Farpost', ['0.00', '0.00', '50.00'])]
+        )
+        self.assertEqual(expense['totals'], ['300.50', '0.00', '50.00'])
+
+        # Транзакция со статусом "Личное" не учитывается
+        self.assertEqual(sections['Пополнение']['total'], '1000.00')
+
+    def test_single_grouped_query(self):
+        """Тест построения отчета одним запросом к базе"""
+        with self.assertNumQueries(1):
+            build_pivot(date(2024, 1, 1), date(2024, 12, 31))
+
+    def test_cached_per_parameters(self):
+        """Тест кэширования отчета по набору параметров"""
+        get_pivot(date(2024, 1, 1), date(2024, 3, 31))
+        with self.assertNumQueries(0):
+            get_pivot(date(2024, 1, 1), date(2024, 3, 31))
+        self.create(date(2024, 3, 6), self.expense, self.marketing, self.farpost, '1.00')
+        data = get_pivot(date(2024, 1, 1), date(2024, 3, 31))
+        self.assertEqual(data['sections'][1]['total'], '351.50')
+
+    def test_report_formats(self):
+        """Тест HTML, JSON и CSV представлений отчета"""
+        url = reverse('pivot_report')
+        params = {'date_from': '2024-01-01', 'date_to': '2024-03-31'}
+        response = self.client.get(url, params)
+        self.assertContains(response, 'Farpost')
+        self.assertContains(response, '300.50')
+
+        data = self.client.get(url, {**params, 'format': 'json'}).json()
+        self.assertEqual(len(data['sections']), 2)
+
+        response = self.client.get(url, {**params, 'format': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('Списание,Маркетинг,Avito,300.50,0.00,0.00,300.50', response.content.decode())
+
+    def test_invalid_period(self):
+        """Тест невалидного периода"""
+        response = self.client.get(reverse('pivot_report'), {
+            'date_from': '2024-03-01', 'date_to': '2024-01-01', 'format': 'json',
+        })
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(DDS_PIVOT_MAX_MONTHS=12)
+    def test_period_too_long(self):
+        """Тест ограничения длины периода, в том числе с открытой границей"""
+        url = reverse('pivot_report')
+        for params in (
+            {'date_from': '0001-01-01'},
+            {'date_to': '9999-12-31'},
+            {'date_from': '2023-01-01', 'date_to': '2024-01-31'},
+        ):
+            with self.subTest(params=params):
+                response = self.client.get(url, {**params, 'format': 'json'})
+                self.assertEqual(response.status_code, 400)
+        form = PivotReportForm({'date_from': '2023-01-01', 'date_to': '2024-01-31'})
+        self.assertIn('Период отчета длиннее 12 мес.', form.non_field_errors())
+
+        response = self.client.get(url, {'date_from': '2024-01-01', 'date_to': '2024-12-31', 'format': 'json'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['months']), 12)
+
+
+@override_settings(DDS_STREAM_CHUNK_SIZE=2)
+class StreamingListTests(TestCase):
+    """Тесты потокового рендеринга списка транзакций"""
+
+    def setUp(self):
+        self.client = Client()
+        self.status = Status.objects.create(name='Бизнес')
+        self.transaction_type = TransactionType.objects.create(name='Списание')
+        self.category = Category.objects.create(
+            name='Маркетинг',
+            transaction_type=self.transaction_type
+        )
+        self.subcategory = Subcategory.objects.create(
+            name='Avito',
+            category=self.category
+        )
+
+    def create_transactions(self, count):
+        Transaction.objects.bulk_create([
+            Transaction(
+                date=date(2024, 1, 1) + timedelta(days=i),
+                status=self.status,
+                transaction_type=self.transaction_type,
+                category=self.category,
+                subcategory=self.subcategory,
+                amount=100 + i,
+                base_amount=100 + i
+            )
+            for i in range(count)
+        ])
+
+    def stream(self, params):
+        response = self.client.get(reverse('transaction_list'), {'stream': '1', **params})
+        self.assertTrue(response.streaming)
+        return [chunk.decode() for chunk in response.streaming_content]
+
+    def test_rows_streamed_in_chunks(self):
+        """Тест отправки шапки отдельно и строк пачками"""
+        self.create_transactions(5)
+        chunks = self.stream({})
+        self.assertIn('Список транзакций', chunks[0])
+        self.assertNotIn('<td>2024-01-01</td>', chunks[0])
+        # Шапка, три пачки строк (2 + 2 + 1) и остаток страницы
+        self.assertEqual(len(chunks), 5)
+        page = ''.join(chunks)
+        self.assertEqual(page.count('<tr id="transaction-'), 5)
+        self.assertIn('104.00 руб.', page)
+        self.assertTrue(page.rstrip().endswith('</html>'))
+
+    def test_query_count_independent_of_rows(self):
+        """Тест постоянного числа запросов независимо от числа строк"""
+        self.create_transactions(3)
+        self.stream({})
+        with CaptureQueriesContext(connection) as small:
+            self.stream({})
+        self.create_transactions(30)
+        with CaptureQueriesContext(connection) as large:
+            self.stream({})
+        self.assertEqual(len(small), len(large))
+
+    def test_filters_and_empty_result(self):
+        """Тест фильтрации и пустого результата в потоковом режиме"""
+        self.create_transactions(3)
+        page = ''.join(self.stream({'date_from': '2024-01-03'}))
+        self.assertEqual(page.count('<tr id="transaction-'), 1)
+
+        page = ''.join(self.stream({'status': 999}))
+        self.assertIn('Транзакции не найдены', page)
+
+    async def test_streamed_under_asgi(self):
+        """Тест потоковой отдачи асинхронным итератором под ASGI"""
+        await sync_to_async(self.create_transactions)(3)
+        response = await self.async_client.get(reverse('transaction_list'), {'stream': '1'})
+        self.assertTrue(response.is_async)
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(b''.join(chunks).count(b'<tr id="transaction-'), 3)
+
+
+class LedgerSnapshotTests(TestCase):
+    """Тесты колоночного снимка транзакций"""
+
+    def setUp(self):
+        self.status = Status.objects.create(name='Бизнес')
+        self.other_status = Status.objects.create(name='Личное')
+        self.transaction_type = TransactionType.objects.create(name='Списание')
+        self.category = Category.objects.create(
+            name='Маркетинг',
+            transaction_type=self.transaction_type
+        )
+        self.subcategory = Subcategory.objects.create(
+            name='Avito',
+            category=self.category
+        )
+        for i, status in enumerate([self.status, self.status, self.other_status]):
+            Transaction.objects.create(
+                date=date(2024, 1, 1) + timedelta(days=i * 40),
+                status=status,
+                transaction_type=self.transaction_type,
+                category=self.category,
+                subcategory=self.subcategory,
+                amount=Decimal('100.25') * (i + 1)
+            )
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'ledger.ddsl')
+        with open(self.path, 'wb') as file:
+            write_ledger_snapshot(file)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_reads_from_one_transaction(self):
+        """Тест: справочники и транзакции читаются внутри одной транзакции"""
+        depths = []
+
+        def record(execute, sql, params, many, context):
+            if sql.startswith('SELECT'):
+                depths.append(len(connection.savepoint_ids))
+            return execute(sql, params, many, context)
+
+        outside = len(connection.savepoint_ids)
+        with connection.execute_wrapper(record), tempfile.TemporaryFile() as file:
+            write_ledger_snapshot(file)
+        self.assertEqual(len(depths), 5)
+        self.assertEqual(set(depths), {outside + 1})
+
+    def test_columns_and_dictionaries(self):
+        """Тест колонок и раздела справочников"""
+        with LedgerSnapshot.open(self.path) as snapshot:
+            self.assertEqual(snapshot.rows, 3)
+            self.assertEqual(list(snapshot.column('amount')), [10025, 20050, 30075])
+            self.assertEqual(snapshot.column('date')[0], date(2024, 1, 1).toordinal())
+            statuses = snapshot.dictionaries['status']
+            self.assertEqual(
+                [statuses[code]['name'] for code in snapshot.column('status')],
+                ['Бизнес', 'Бизнес', 'Личное']
+            )
+            self.assertEqual(snapshot.directory['date']['offset'] % 8, 0)
+
+    def test_filtered_totals_match_orm(self):
+        """Тест сумм с фильтрами в сравнении с агрегатом ORM"""
+        with LedgerSnapshot.open(self.path) as snapshot:
+            self.assertEqual(snapshot.total(), Decimal('601.50'))
+            self.assertEqual(snapshot.total(status=self.status.pk), Decimal('300.75'))
+            self.assertEqual(
+                snapshot.total(date_from=date(2024, 2, 1), category=self.category.pk),
+                Transaction.objects.filter(date__gte=date(2024, 2, 1)).aggregate(total=Sum('amount'))['total']
+            )
+            self.assertEqual(snapshot.total(status=999), Decimal('0.00'))
+
+    def test_totals_by_date_range(self):
+        """Тест: строки упорядочены по дате, период ищется двоичным поиском (и без NumPy)"""
+        # Созданная позже транзакция с более ранней датой
+        Transaction.objects.create(
+            date=date(2023, 12, 15), status=self.other_status, transaction_type=self.transaction_type,
+            category=self.category, subcategory=self.subcategory, amount=Decimal('5.00'),
+        )
+        with open(self.path, 'wb') as file:
+            write_ledger_snapshot(file)
+        ranges = [
+            (None, None), (date(2023, 12, 15), date(2023, 12, 15)), (date(2024, 1, 1), None),
+            (None, date(2024, 2, 9)), (date(2024, 2, 10), date(2024, 3, 1)), (date(2025, 1, 1), None),
+        ]
+        with mock.patch('dds_app.ledger_snapshot.numpy', None), LedgerSnapshot.open(self.path) as snapshot:
+            self.assertTrue(snapshot.sorted_by_date)
+            dates = list(snapshot.column('date'))
+            self.assertEqual(dates, sorted(dates))
+            for date_from, date_to in ranges:
+                for status in (None, self.status):
+                    transactions = Transaction.objects.all()
+                    if date_from:
+                        transactions = transactions.filter(date__gte=date_from)
+                    if date_to:
+                        transactions = transactions.filter(date__lte=date_to)
+                    filters = {}
+                    if status:
+                        transactions = transactions.filter(status=status)
+                        filters['status'] = status.pk
+                    expected = transactions.aggregate(total=Sum('base_amount'))['total'] or Decimal('0.00')
+                    with self.subTest(date_from=date_from, date_to=date_to, status=status):
+                        self.assertEqual(snapshot.total(date_from, date_to, **filters), expected)
+
+    def test_close_after_total(self):
+        """Тест закрытия снимка после расчетов, в том числе с удержанной колонкой"""
+        snapshot = LedgerSnapshot.open(self.path)
+        self.assertEqual(snapshot.total(date_from=date(2024, 2, 1)), Decimal('501.25'))
+        self.assertEqual(snapshot.total(status=self.status.pk), Decimal('300.75'))
+        snapshot.close()
+        self.assertTrue(snapshot.buffer.closed)
+
+        # Срез колонки у вызывающего не мешает закрытию: отображение
+        # освобождается вместе с ним
+        snapshot = LedgerSnapshot.open(self.path)
+        head = snapshot.column('amount')[:1]
+        snapshot.close()
+        self.assertEqual(head[0], 10025)
+
+    def test_snapshot_endpoint(self):
+        """Тест выгрузки снимка через API"""
+        response = self.client.get(reverse('ledger_snapshot'))
+        self.assertEqual(response['Content-Type'], 'application/octet-stream')
+        snapshot = LedgerSnapshot(b''.join(response.streaming_content))
+        self.assertEqual(snapshot.rows, 3)
+        self.assertEqual(snapshot.total(), Decimal('601.50'))
+
+
+class ParallelReportTests(TransactionTestCase):
+    """Тесты параллельного расчета отчета по шардам дат"""
+
+    def setUp(self):
+        self.status = Status.objects.create(name='Бизнес')
+        self.other_status = Status.objects.create(name='Личное')
+        self.transaction_type = TransactionType.objects.create(name='Списание')
+        self.category = Category.objects.create(
+            name='Маркетинг',
+            transaction_type=self.transaction_type
+        )
+        self.subcategory = Subcategory.objects.create(
+            name='Avito',
+            category=self.category
+        )
+        for i in range(30):
+            Transaction.objects.create(
+                date=date(2023, 1, 1) + timedelta(days=i * 25),
+                status=self.status if i % 3 else self.other_status,
+                transaction_type=self.transaction_type,
+                category=self.category,
+                subcategory=self.subcategory,
+                amount=Decimal('10.10') * (i + 1)
+            )
+        # Тестовая база хранится в памяти - копируем ее в файл для процессов пула.
+        # TransactionTestCase: резервное копирование ждет завершения открытой транзакции.
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, 'db.sqlite3')
+        target = sqlite3.connect(self.db_path)
+        connection.connection.backup(target)
+        target.close()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_split_range(self):
+        """Тест разбиения периода на непересекающиеся шарды"""
+        ranges = split_range(date(2024, 1, 1), date(2024, 1, 10), 3)
+        self.assertEqual(ranges, [
+            (date(2024, 1, 1), date(2024, 1, 4)),
+            (date(2024, 1, 5), date(2024, 1, 7)),
+            (date(2024, 1, 8), date(2024, 1, 10)),
+        ])
+        self.assertEqual(len(split_range(date(2024, 1, 1), date(2024, 1, 2), 8)), 2)
+
+    def test_parallel_matches_orm(self):
+        """Тест совпадения результатов пула процессов с агрегатом ORM"""
+        date_from, date_to = date(2023, 3, 1), date(2024, 12, 31)
+        expected = Transaction.objects.filter(
+            date__range=(date_from, date_to), status=self.status
+        ).aggregate(total=Sum('amount'), count=Count('id'))
+
+        sequential = parallel_report(date_from, date_to, self.status.pk, workers=1, shards=5,
+                                     db_path=self.db_path, table=Transaction._meta.db_table)
+        parallel = parallel_report(date_from, date_to, self.status.pk, workers=2, shards=5,
+                                   db_path=self.db_path, table=Transaction._meta.db_table)
+        self.assertEqual(parallel, sequential)
+        self.assertEqual(parallel['amount'], expected['total'])
+        self.assertEqual(parallel['count'], expected['count'])
+        self.assertEqual(parallel['by_category'][self.category.pk]['count'], expected['count'])
+        self.assertEqual(sum(m['count'] for m in parallel['by_month'].values()), expected['count'])
+
+    @override_settings(DDS_PARALLEL_REPORT_MIN_DAYS=365)
+    def test_pivot_uses_parallel_for_long_periods(self):
+        """Тест: сводный отчет за длинный период считается в пуле и совпадает с ORM"""
+        cases = [
+            (date(2023, 3, 1), date(2024, 12, 31), self.status.pk),
+            (None, None, None),
+            (date(2023, 6, 1), None, self.other_status.pk),
+        ]
+        for date_from, date_to, status in cases:
+            with self.subTest(date_from=date_from, date_to=date_to, status=status):
+                sequential = build_pivot(date_from, date_to, status, workers=1).to_dict()
+                with mock.patch('dds_app.reports.parallel_totals', wraps=parallel_totals) as totals, \
+                        tenant_context(default_organization_id()):
+                    parallel = build_pivot(date_from, date_to, status, workers=2, db_path=self.db_path).to_dict()
+                totals.assert_called_once()
+                self.assertEqual(parallel, sequential)
+
+        # Короткий период - одним запросом
+        with mock.patch('dds_app.reports.parallel_totals') as totals:
+            build_pivot(date(2024, 1, 1), date(2024, 3, 31), workers=2, db_path=self.db_path)
+        totals.assert_not_called()
+
+
+class JobQueueTests(TestCase):
+    """Тесты фоновых задач: очередь, обработчики, статус и срок хранения результата"""
+
+    def setUp(self):
+        self.results_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.results_dir.cleanup)
+        settings_override = override_settings(DDS_JOB_RESULTS_DIR=self.results_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+
+        self.client = Client()
+        self.status = Status.objects.create(name='Бизнес')
+        self.other_status = Status.objects.create(name='Личное')
+        self.transaction_type = TransactionType.objects.create(name='Списание')
+        self.category = Category.objects.create(name='Маркетинг', transaction_type=self.transaction_type)
+        self.subcategory = Subcategory.objects.create(name='Avito', category=self.category)
+        for status, amount in ((self.status, '100.00'), (self.status, '250.50'), (self.other_status, '7.00')):
+            Transaction.objects.create(
+                date=date(2024, 5, 1),
+                status=status,
+                transaction_type=self.transaction_type,
+                category=self.category,
+                subcategory=self.subcategory,
+                amount=amount
+            )
+
+    def read_result(self, job):
+        with open(job.result_path, encoding='utf-8-sig') as file:
+            return file.read().splitlines()
+
+    def test_export_filtered_transactions(self):
+        """Тест экспорта списка транзакций с фильтрами через очередь"""
+        response = self.client.post(reverse('job_create', args=['transactions_csv']), {'status': self.status.pk})
+        job = Job.objects.get()
+        self.assertRedirects(response, reverse('job_detail', args=[job.pk]))
+        self.assertEqual(job.status, Job.STATUS_QUEUED)
+        self.assertEqual(job.params, {'status': str(self.status.pk)})
+
+        self.assertEqual(run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_DONE)
+        self.assertEqual(job.progress, 100)
+        lines = self.read_result(job)
+        self.assertEqual(len(lines), 3)
+        self.assertIn('250.50', lines[1] + lines[2])
+
+        response = self.client.get(reverse('job_download', args=[job.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('attachment', response['Content-Disposition'])
+        response.close()
+
+    def test_pivot_report_job(self):
+        """Тест построения сводного отчета в фоне"""
+        self.client.post(reverse('job_create', args=['pivot_csv']), {
+            'date_from': '2024-05-01', 'date_to': '2024-05-31', 'status': self.status.pk,
+        })
+        job = run_job(claim_next('test'))
+        self.assertEqual(job.status, Job.STATUS_DONE)
+        lines = self.read_result(job)
+        self.assertEqual(lines[0].split(','), ['Тип операции', 'Категория', 'Подкатегория', '2024-05', 'Итого'])
+        self.assertIn('350.50', lines[-1])
+
+    def test_pivot_job_sees_other_process_writes(self):
+        """Тест: обработчик сверяет поколения кэша перед задачей и не отдает устаревший отчет"""
+        # Задачи ставятся без запросов: middleware сам сверил бы поколения
+        params = {'date_from': '2024-05-01', 'date_to': '2024-05-31', 'status': str(self.status.pk)}
+        enqueue('pivot_csv', params)
+        self.assertIn('350.50', self.read_result(run_job(claim_next('worker')))[-1])
+
+        # Запись в другом процессе: база и таблица версий изменились,
+        # а поколения обработчика остались прежними
+        with mock.patch.dict('dds_app.cache._generations'):
+            Transaction.objects.create(
+                date=date(2024, 5, 2), status=self.status, transaction_type=self.transaction_type,
+                category=self.category, subcategory=self.subcategory, amount='649.50',
+            )
+
+        enqueue('pivot_csv', params)
+        self.assertIn('1000.00', self.read_result(run_job(claim_next('worker')))[-1])
+
+    def test_status_endpoint(self):
+        """Тест опроса статуса задачи"""
+        job = enqueue('transactions_csv')
+        data = self.client.get(reverse('job_status', args=[job.pk])).json()
+        self.assertEqual(data['status'], 'queued')
+        self.assertIsNone(data['download'])
+
+        run_pending()
+        data = self.client.get(reverse('job_status', args=[job.pk])).json()
+        self.assertEqual(data['status'], 'done')
+        self.assertEqual(data['progress'], 100)
+        self.assertEqual(data['download'], reverse('job_download', args=[job.pk]))
+
+        response = self.client.get(reverse('job_detail', args=[job.pk]))
+        self.assertContains(response, 'Экспорт транзакций в CSV')
+
+    def test_claim_is_exclusive(self):
+        """Тест: задачу забирает только один обработчик"""
+        enqueue('transactions_csv')
+        first = claim_next('worker-1')
+        self.assertEqual(first.worker, 'worker-1')
+        self.assertIsNone(claim_next('worker-2'))
+
+    def test_failed_job(self):
+        """Тест задачи, завершившейся ошибкой"""
+        job = enqueue('transactions_csv', {'date_from': 'не дата'})
+        with self.assertLogs('dds_app.jobs', 'ERROR'):
+            job = run_job(claim_next())
+        self.assertEqual(job.status, Job.STATUS_FAILED)
+        self.assertTrue(job.error)
+        self.assertEqual(os.listdir(self.results_dir.name), [])
+        response = self.client.get(reverse('job_download', args=[job.pk]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_expired_results_removed(self):
+        """Тест удаления результатов с истекшим сроком хранения"""
+        job = enqueue('transactions_csv')
+        job = run_job(claim_next())
+        self.assertEqual(cleanup_expired(), 0)
+
+        self.assertEqual(cleanup_expired(now=job.expires_at + timedelta(seconds=1)), 1)
+        self.assertFalse(os.path.exists(job.result_path))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_EXPIRED)
+        response = self.client.get(reverse('job_download', args=[job.pk]))
+        self.assertEqual(response.status_code, 410)
+
+    def test_stale_jobs_requeued(self):
+        """Тест возврата в очередь задач, обработчик которых перестал отмечаться"""
+        job = enqueue('transactions_csv')
+        claim_next('dead-worker')
+        # Долгая задача живого обработчика остается за ним
+        Job.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(requeue_stale(300), 0)
+
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(minutes=10))
+        self.assertEqual(requeue_stale(300), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_QUEUED)
+        self.assertEqual(job.worker, '')
+
+    def test_heartbeat(self):
+        """Тест отметок обработчика из отдельного потока"""
+        enqueue('pivot_csv')
+        job = claim_next('worker-1')
+        with mock.patch('dds_app.jobs.owned') as owned, mock.patch('dds_app.jobs.connection.close'):
+            owned.return_value.update.return_value = 1
+            with Heartbeat(job, 0.01):
+                time.sleep(0.1)
+            self.assertGreaterEqual(owned.return_value.update.call_count, 2)
+
+            # Задачу забрал другой обработчик - предупреждение
+            owned.return_value.update.return_value = 0
+            with self.assertLogs('dds_app.jobs', 'WARNING'), Heartbeat(job, 0.01):
+                time.sleep(0.05)
+
+    def test_stale_attempt_does_not_overwrite(self):
+        """Тест: попытка, задачу которой вернули в очередь и отдали другому, не меняет итог"""
+        job = enqueue('transactions_csv')
+        first = claim_next('worker-1')
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        requeue_stale(300)
+        second = claim_next('worker-2')
+
+        self.assertEqual(run_job(first).status, Job.STATUS_RUNNING)
+        self.assertEqual(os.listdir(self.results_dir.name), [])
+
+        job = run_job(second)
+        self.assertEqual((job.status, job.worker), (Job.STATUS_DONE, 'worker-2'))
+        self.assertEqual(os.path.basename(job.result_path), f'job-{job.pk}-worker-2')
+        self.assertEqual(len(self.read_result(job)), 4)
+
+        # Ошибка устаревшей попытки тоже не меняет итог
+        first = Job.objects.get(pk=job.pk)
+        first.worker = 'worker-1'
+        with self.assertLogs('dds_app.jobs', 'ERROR'), \
+                mock.patch('dds_app.jobs.write_csv', side_effect=OSError('disk full')):
+            self.assertEqual(run_job(first).status, Job.STATUS_DONE)
+        self.assertTrue(os.path.exists(job.result_path))
+
+    def test_unknown_kind(self):
+        """Тест неизвестного вида задачи"""
+        response = self.client.post(reverse('job_create', args=['unknown']))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Job.objects.exists())
+        with self.assertRaises(ValueError):
+            enqueue('unknown')
+
+
+class TransactionAdminTests(TestCase):
+    """Тесты режима производительности списка транзакций в админке"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.status = Status.objects.create(name='Бизнес')
+        self.transaction_type = TransactionType.objects.create(name='Списание')
+        self.category = Category.objects.create(name='Маркетинг', transaction_type=self.transaction_type)
+        self.subcategory = Subcategory.objects.create(name='Avito', category=self.category)
+        for day in (date(2023, 11, 3), date(2024, 2, 10), date(2024, 5, 1), date(2024, 5, 20)):
+            Transaction.objects.create(
+                date=day,
+                status=self.status,
+                transaction_type=self.transaction_type,
+                category=self.category,
+                subcategory=self.subcategory,
+                amount='100.00'
+            )
+        self.url = reverse('admin:dds_app_transaction_changelist')
+
+    def test_changelist_queries_cached(self):
+        """Тест: повторное открытие списка не пересчитывает счетчик и фильтры"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(self.url)
+        sql = ' '.join(query['sql'] for query in first.captured_queries)
+        self.assertNotIn('COUNT(', sql)
+        self.assertNotIn('MIN(', sql)
+        self.assertNotIn('FROM "dds_app_status"', sql)
+
+    def test_period_filter(self):
+        """Тест фильтра по периоду вместо date_hierarchy"""
+        response = self.client.get(self.url, {'period': '2024'})
+        self.assertEqual(response.context['cl'].result_count, 3)
+        response = self.client.get(self.url, {'period': '2024-05'})
+        self.assertEqual(response.context['cl'].result_count, 2)
+        self.assertContains(response, '?period=2024-02')
+        self.assertNotContains(response, '?period=2023-11')
+        response = self.client.get(self.url, {'period': '2024-13'})
+        self.assertEqual(response.context['cl'].result_count, 0)
+
+    def test_counts_invalidated_on_write(self):
+        """Тест сброса закэшированного счетчика после записи"""
+        paginator = EstimatedCountPaginator(Transaction.objects.order_by('pk'), 100)
+        self.assertEqual(paginator.count, 4)
+        Transaction.objects.first().delete()
+        paginator = EstimatedCountPaginator(Transaction.objects.order_by('pk'), 100)
+        self.assertEqual(paginator.count, 3)
+
+    def test_estimated_count(self):
+        """Тест оценки числа строк из статистики для списка без фильтров"""
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        with mock.patch('dds_app.admin.ESTIMATE_THRESHOLD', 1):
+            with self.assertNumQueries(2):
+                self.assertEqual(EstimatedCountPaginator(Transaction.objects.order_by('pk'), 100).count, 4)
+            # С фильтром - точный счетчик
+            filtered = Transaction.objects.filter(date__year=2024).order_by('pk')
+            self.assertEqual(EstimatedCountPaginator(filtered, 100).count, 3)
+
+    def test_admin_configuration(self):
+        """Тест настроек списка транзакций"""
+        model_admin = admin_site._registry[Transaction]
+        self.assertIsInstance(model_admin, TransactionAdmin)
+        self.assertIsNone(model_admin.date_hierarchy)
+        self.assertIn('subcategory', model_admin.list_select_related)
+        self.assertIn(PeriodListFilter, model_admin.get_list_filter(None))
+
+    @override_settings(DDS_ADMIN_PERFORMANCE_MODE=False)
+    def test_performance_mode_off(self):
+        """Тест: без режима производительности - точные счетчики и date_hierarchy"""
+        response = self.client.get(self.url)
+        cl = response.context['cl']
+        self.assertEqual(cl.date_hierarchy, 'date')
+        self.assertTrue(cl.show_full_result_count)
+        self.assertNotIsInstance(cl.paginator, EstimatedCountPaginator)
+        self.assertEqual(cl.full_result_count, 4)
+        self.assertFalse(any(isinstance(spec, PeriodListFilter) for spec in cl.filter_specs))
+        response = self.client.get(self.url, {'date__year': '2024', 'date__month': '5'})
+        self.assertEqual(response.context['cl'].result_count, 2)
+
+
+class TaxonomyLoaderTests(TestCase):
+    """Тесты декларативной загрузки справочников"""
+
+    TAXONOMY = {
+        'statuses': ['Бизнес', 'Личное'],
+        'transaction_types': [
+            {'name': 'Списание', 'categories': [
+                {'name': 'Маркетинг', 'subcategories': ['Avito', 'Farpost']},
+            ]},
+        ],
+    }
+
+    def test_load_initial_data(self):
+        """Тест команды load_initial_data: повторный запуск ничего не меняет"""
+        call_command('load_initial_data', stdout=StringIO())
+        self.assertEqual(Status.objects.count(), 3)
+        self.assertEqual(TransactionType.objects.count(), 2)
+        self.assertEqual(Category.objects.count(), 3)
+        self.assertTrue(Subcategory.objects.filter(name='VPS', category__name='Инфраструктура').exists())
+
+        with self.assertNumQueries(4):
+            diff = load_taxonomy(self.TAXONOMY)
+        self.assertFalse(diff)
+
+    def test_rename_and_create(self):
+        """Тест переименования по прежнему имени и добавления новых записей"""
+        load_taxonomy(self.TAXONOMY)
+        avito = Subcategory.objects.get(name='Avito')
+        generation = get_generation(Subcategory)
+
+        data = json.loads(json.dumps(self.TAXONOMY))
+        data['transaction_types'][0]['categories'][0]['subcategories'] = [
+            {'name': 'Авито', 'was': 'Avito'}, 'Farpost', 'VK',
+        ]
+        diff = load_taxonomy(data)
+        self.assertIn('~ subcategory: Списание / Маркетинг / Avito -> Авито', diff.lines)
+        self.assertEqual(Subcategory.objects.get(pk=avito.pk).name, 'Авито')
+        self.assertEqual(Subcategory.objects.count(), 3)
+        self.assertNotEqual(get_generation(Subcategory), generation)
+        entry = ChangeLogEntry.objects.filter(model='subcategory', object_id=avito.pk).last()
+        self.assertEqual(entry.action, ChangeLogEntry.ACTION_UPDATE)
+        self.assertEqual(entry.data['name'], 'Авито')
+
+    def test_swap_names(self):
+        """Тест обмена названиями и цепочки переименований в одной загрузке"""
+        load_taxonomy(self.TAXONOMY)
+        business = Status.objects.get(name='Бизнес')
+        personal = Status.objects.get(name='Личное')
+        avito = Subcategory.objects.get(name='Avito')
+        farpost = Subcategory.objects.get(name='Farpost')
+
+        data = json.loads(json.dumps(self.TAXONOMY))
+        data['statuses'] = [{'name': 'Личное', 'was': 'Бизнес'}, {'name': 'Бизнес', 'was': 'Личное'}]
+        data['transaction_types'][0]['categories'][0]['subcategories'] = [
+            {'name': 'Farpost', 'was': 'Avito'}, {'name': 'VK', 'was': 'Farpost'},
+        ]
+        diff = load_taxonomy(data)
+        self.assertEqual(diff.summary()['status'], {'create': 0, 'rename': 2, 'delete': 0})
+        self.assertEqual(Status.objects.get(pk=business.pk).name, 'Личное')
+        self.assertEqual(Status.objects.get(pk=personal.pk).name, 'Бизнес')
+        self.assertEqual(Subcategory.objects.get(pk=avito.pk).name, 'Farpost')
+        self.assertEqual(Subcategory.objects.get(pk=farpost.pk).name, 'VK')
+        self.assertEqual(Status.objects.get(pk=business.pk).version, business.version + 1)
+        self.assertFalse(load_taxonomy({
+            'statuses': ['Личное', 'Бизнес'],
+            'transaction_types': [{'name': 'Списание', 'categories': [
+                {'name': 'Маркетинг', 'subcategories': ['Farpost', 'VK']},
+            ]}],
+        }))
+
+    def test_dry_run(self):
+        """Тест режима dry-run: изменения выводятся, но не применяются"""
+        with tempfile.NamedTemporaryFile('w', suffix='.json', encoding='utf-8', delete=False) as file:
+            json.dump(self.TAXONOMY, file, ensure_ascii=False)
+        self.addCleanup(os.remove, file.name)
+        out = StringIO()
+        call_command('load_taxonomy', file.name, dry_run=True, stdout=out)
+        self.assertIn('+ category: Списание / Маркетинг', out.getvalue())
+        self.assertFalse(Status.objects.exists())
+
+    def test_yaml(self):
+        """Тест загрузки из YAML"""
+        with tempfile.NamedTemporaryFile('w', suffix='.yaml', encoding='utf-8', delete=False) as file:
+            file.write('statuses:\n  - Бизнес\ntransaction_types:\n  - name: Пополнение\n    categories:\n'
+                       '      - name: Продажи\n        subcategories: [Онлайн]\n')
+        self.addCleanup(os.remove, file.name)
+        call_command('load_taxonomy', file.name, stdout=StringIO())
+        self.assertTrue(Subcategory.objects.filter(name='Онлайн', category__transaction_type__name='Пополнение').exists())
+
+    def test_prune(self):
+        """Тест удаления записей, которых нет в файле"""
+        load_taxonomy(self.TAXONOMY)
+        data = json.loads(json.dumps(self.TAXONOMY))
+        data['statuses'] = ['Бизнес']
+        data['transaction_types'][0]['categories'][0]['subcategories'] = ['Avito']
+
+        diff = load_taxonomy(data)
+        self.assertFalse(diff)
+        load_taxonomy(data, prune=True)
+        self.assertFalse(Status.objects.filter(name='Личное').exists())
+        self.assertFalse(Subcategory.objects.filter(name='Farpost').exists())
+
+    def test_prune_used_entries(self):
+        """Тест: справочники, используемые транзакциями, не удаляются"""
+        load_taxonomy(self.TAXONOMY)
+        Transaction.objects.create(
+            status=Status.objects.get(name='Личное'),
+            transaction_type=TransactionType.objects.get(),
+            category=Category.objects.get(),
+            subcategory=Subcategory.objects.get(name='Farpost'),
+            amount='10.00'
+        )
+        with tempfile.NamedTemporaryFile('w', suffix='.json', encoding='utf-8', delete=False) as file:
+            json.dump({'statuses': ['Бизнес', 'Налог'], 'transaction_types': []}, file, ensure_ascii=False)
+        self.addCleanup(os.remove, file.name)
+        with self.assertRaises(CommandError):
+            call_command('load_taxonomy', file.name, prune=True, stdout=StringIO())
+        # Изменения откатываются целиком
+        self.assertFalse(Status.objects.filter(name='Налог').exists())
+        self.assertEqual(Subcategory.objects.count(), 2)
+
+    def test_bulk_load(self):
+        """Тест загрузки 10 тысяч записей фиксированным числом запросов"""
+        data = {
+            'statuses': ['Бизнес'],
+            'transaction_types': [
+                {'name': f'Тип {t}', 'categories': [
+                    {'name': f'Категория {c}', 'subcategories': [f'Подкатегория {s}' for s in range(50)]}
+                    for c in range(50)
+                ]}
+                for t in range(4)
+            ],
+        }
+        with CaptureQueriesContext(connection) as queries:
+            load_taxonomy(data)
+        self.assertEqual(Subcategory.objects.count(), 10000)
+        # Пачки INSERT ограничены числом параметров SQLite (999): с колонками
+        # организации и версии в пачку помещается 249 подкатегорий вместо 499
+        self.assertLess(len(queries), 85)
+        self.assertEqual(ChangeLogEntry.objects.filter(model='subcategory').count(), 10000)
+
+    def test_invalid_taxonomy(self):
+        """Тест проверки структуры файла"""
+        with self.assertRaises(TaxonomyError):
+            load_taxonomy({'statuses': ['Бизнес', 'Бизнес']})
+        with self.assertRaises(TaxonomyError):
+            load_taxonomy({'transaction_types': [{'categories': []}]})
+        with self.assertRaises(TaxonomyError):
+            load_taxonomy([])
+
+
+class DuplicateDetectionTests(TestCase):
+    """Тесты поиска дублей транзакций по отпечатку"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.status = Status.objects.create(name='Бизнес')
+        self.other_status = Status.objects.create(name='Личное')
+        self.transaction_type = TransactionType.objects.create(name='Списание')
+        self.category = Category.objects.create(name='Маркетинг', transaction_type=self.transaction_type)
+        self.subcategory = Subcategory.objects.create(name='Avito', category=self.category)
+        self.transaction = Transaction.objects.create(
+            date=date(2024, 5, 1),
+            status=self.status,
+            transaction_type=self.transaction_type,
+            category=self.category,
+            subcategory=self.subcategory,
+            amount='1500',
+            comment='Оплата  рекламы '
+        )
+        self.form_data = {
+            'date': '2024-05-01',
+            'status': self.other_status.pk,
+            'transaction_type': self.transaction_type.pk,
+            'category': self.category.pk,
+            'subcategory': self.subcategory.pk,
+            'amount': '1500.00',
+            'comment': 'оплата рекламы',
+        }
+
+    def build(self, **kwargs):
+        values = {
+            'date': date(2024, 5, 1),
+            'status': self.status,
+            'transaction_type': self.transaction_type,
+            'category': self.category,
+            'subcategory': self.subcategory,
+            'amount': Decimal('1500.00'),
+            'comment': 'Оплата рекламы',
+        }
+        values.update(kwargs)
+        return Transaction(**values)
+
+    def test_fingerprint_maintained_on_save(self):
+        """Тест заполнения отпечатка при сохранении"""
+        self.assertEqual(len(self.transaction.fingerprint), 32)
+        # Регистр и пробелы в комментарии, формат суммы и статус не влияют на отпечаток
+        self.assertEqual(instance_fingerprint(self.build(status=self.other_status)), self.transaction.fingerprint)
+        self.assertNotEqual(instance_fingerprint(self.build(amount=Decimal('1500.01'))), self.transaction.fingerprint)
+
+        self.transaction.comment = 'Другая оплата'
+        self.transaction.save(update_fields=['comment'])
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.fingerprint, instance_fingerprint(self.transaction))
+
+    def test_migration_fingerprint_frozen(self):
+        """Тест: миграция 0006 считает отпечатки без полей, добавленных позже, как текущий код для рублей"""
+        migration = importlib.import_module('dds_app.migrations.0006_transaction_fingerprint')
+        fields = ('date', 'amount', 'transaction_type_id', 'category_id', 'subcategory_id', 'comment')
+        historical = SimpleNamespace(**{field: getattr(self.transaction, field) for field in fields})
+        self.assertEqual(migration.instance_fingerprint(historical), self.transaction.fingerprint)
+
+    def test_lookup_uses_index(self):
+        """Тест: поиск дубля - запрос по индексу"""
+        plan = find_duplicates(self.transaction.fingerprint).explain()
+        self.assertIn('fingerprint', plan)
+        self.assertIn('INDEX', plan)
+
+    def test_create_duplicate_requires_confirmation(self):
+        """Тест предупреждения о дубле при создании транзакции"""
+        response = self.client.post(reverse('transaction_create'), self.form_data)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Похожая транзакция уже существует')
+        self.assertContains(response, 'confirm_duplicate')
+        self.assertEqual(Transaction.objects.count(), 1)
+
+        response = self.client.post(reverse('transaction_create'), {**self.form_data, 'confirm_duplicate': '1'})
+        self.assertRedirects(response, reverse('transaction_list'))
+        self.assertEqual(Transaction.objects.count(), 2)
+
+    def test_edit_is_not_own_duplicate(self):
+        """Тест: транзакция не считается дублем самой себя"""
+        response = self.client.post(reverse('transaction_edit', args=[self.transaction.pk]), self.form_data)
+        self.assertRedirects(response, reverse('transaction_list'))
+
+    def test_import_command_skips_duplicates(self):
+        """Тест импорта выписки в формате выгрузки CSV с пропуском дублей"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'transactions.csv')
+        with open(path, 'w', encoding='utf-8-sig', newline='') as file:
+            file.write(
+                'Дата,Статус,Тип,Категория,Подкатегория,Сумма,Валюта,Сумма в рублях,Комментарий\n'
+                '2024-05-01,Личное,Списание,Маркетинг,Avito,1500.00,RUB,1500.00,оплата рекламы\n'
+                '2024-05-02,Бизнес,Списание,Маркетинг,Avito,10.00,RUB,10.00,\n'
+                '2024-05-02,Бизнес,Списание,Маркетинг,Avito,10,RUB,10.00,\n'
+            )
+
+        out = StringIO()
+        call_command('import_transactions', path, stdout=out)
+        self.assertIn('1 transactions imported', out.getvalue())
+        self.assertIn('2 duplicates skipped', out.getvalue())
+        imported = Transaction.objects.get(date=date(2024, 5, 2))
+        self.assertEqual((imported.status, imported.base_amount), (self.status, Decimal('10.00')))
+        self.assertEqual(imported.fingerprint, instance_fingerprint(imported))
+
+        out = StringIO()
+        call_command('import_transactions', path, allow_duplicates=True, stdout=out)
+        self.assertIn('3 transactions imported', out.getvalue())
+        self.assertEqual(Transaction.objects.count(), 5)
+
+        # Неизвестный справочник - ничего не записывается
+        with open(path, 'a', encoding='utf-8', newline='') as file:
+            file.write('2024-05-03,Бизнес,Списание,Маркетинг,Яндекс,1.00,RUB,1.00,\n')
+        with self.assertRaisesMessage(CommandError, 'Line 5: unknown subcategory'):
+            call_command('import_transactions', path, allow_duplicates=True, stdout=StringIO())
+        self.assertEqual(Transaction.objects.count(), 5)
+
+    def test_bulk_import_skips_duplicates(self):
+        """Тест массового импорта с пропуском дублей"""
+        batch = [
+            self.build(),
+            self.build(amount=Decimal('10.00')),
+            self.build(amount=Decimal('10.00'), comment='оплата   РЕКЛАМЫ'),
+        ]
+        # + две строки месячных итогов, проверка бюджетов и статистика сумм (в точке сохранения)
+        with self.assertNumQueries(12):
+            created, skipped = bulk_create_transactions(batch)
+        self.assertEqual(len(created), 1)
+        self.assertEqual(len(skipped), 2)
+        self.assertEqual(Transaction.objects.count(), 2)
+        imported = Transaction.objects.get(amount=Decimal('10.00'))
+        self.assertEqual(imported.fingerprint, instance_fingerprint(imported))
+        self.assertTrue(ChangeLogEntry.objects.filter(model='transaction', object_id=imported.pk).exists())
+
+
+class AutocompleteTests(TestCase):
+    """Тесты автодополнения по справочникам"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.income = TransactionType.objects.create(name='Пополнение')
+        self.expense = TransactionType.objects.create(name='Списание')
+        self.marketing = Category.objects.create(name='Маркетинг', transaction_type=self.expense)
+        self.infra = Category.objects.create(name='Инфраструктура', transaction_type=self.expense)
+        self.sales = Category.objects.create(name='Продажи', transaction_type=self.income)
+        self.avito = Subcategory.objects.create(name='Avito', category=self.marketing)
+        self.yolka = Subcategory.objects.create(name='Ёлочная реклама', category=self.marketing)
+        self.vps = Subcategory.objects.create(name='VPS', category=self.infra)
+
+    def search(self, name, **params):
+        response = self.client.get(reverse('autocomplete', args=[name]), params)
+        self.assertEqual(response.status_code, 200)
+        return [item['name'] for item in response.json()]
+
+    def test_prefix_and_substring(self):
+        """Тест поиска по префиксу и подстроке без учета регистра"""
+        self.assertEqual(self.search('category', q='ма'), ['Маркетинг'])
+        self.assertEqual(self.search('category', q='СТРУК'), ['Инфраструктура'])
+        self.assertEqual(self.search('subcategory', q='елоч'), ['Ёлочная реклама'])
+        self.assertEqual(self.search('subcategory', q='реклам'), ['Ёлочная реклама'])
+        self.assertEqual(self.search('category', q=''), ['Инфраструктура', 'Маркетинг', 'Продажи'])
+        self.assertEqual(self.search('category', q='', limit=1), ['Инфраструктура'])
+
+    def test_scope(self):
+        """Тест ограничения подсказок родителем, как в остальных /api/"""
+        self.assertEqual(self.search('category', q='', transaction_type_id=self.income.pk), ['Продажи'])
+        self.assertEqual(self.search('subcategory', q='v', category_id=self.infra.pk), ['VPS'])
+        self.assertEqual(self.search('subcategory', q='v', category_id=self.marketing.pk), ['Avito'])
+
+    def test_rebuilt_on_change(self):
+        """Тест перестроения индекса после изменения справочника"""
+        self.assertEqual(self.search('subcategory', q='prox'), [])
+        Subcategory.objects.create(name='Proxy', category=self.infra)
+        self.assertEqual(self.search('subcategory', q='prox'), ['Proxy'])
+        self.vps.name = 'Серверы'
+        self.vps.save()
+        self.assertEqual(self.search('subcategory', q='vps'), [])
+
+    def test_search_without_queries(self):
+        """Тест: построенный индекс отвечает без запросов к базе"""
+        index = get_index('subcategory')
+        index.search('a')
+        with self.assertNumQueries(0):
+            self.assertEqual(index.search('avi'), [{'id': self.avito.pk, 'name': 'Avito'}])
+
+    def test_invalid_params(self):
+        """Тест некорректных параметров"""
+        response = self.client.get(reverse('autocomplete', args=['category']), {'transaction_type_id': 'x'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('autocomplete', args=['status']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_large_snapshot_trigrams(self):
+        """Тест поиска по подстроке через индекс триграмм на большом справочнике"""
+        words = ['Маркетинг', 'Реклама', 'Аренда', 'Сервер', 'Доставка']
+        rows = [(pk, f'{words[pk % 5]} {words[pk // 5 % 5]} {pk}', pk % 50) for pk in range(6000)]
+        snapshot = Snapshot(rows)
+        self.assertTrue(snapshot.wait_trigrams(10))
+
+        def brute(query, limit=20):
+            matches = sorted((name.casefold(), pk, name) for pk, name, scope in rows if query in name.casefold())
+            prefix = [item for item in matches if item[0].startswith(query)]
+            other = [item for item in matches if not item[0].startswith(query)]
+            return [name for _, _, name in (prefix + other)[:limit]]
+
+        for query in ('ренда сер', '599', 'доставка 12', 'кла'):
+            self.assertEqual([item['name'] for item in snapshot.search(query)], brute(query))
+        self.assertEqual(snapshot.search('zzz'), [])
+        self.assertEqual(len(snapshot.search('', scope=7, limit=200)), 120)
+
+    @override_settings(DDS_AUTOCOMPLETE_THRESHOLD=2)
+    def test_widgets_switch(self):
+        """Тест переключения форм на автодополнение для больших справочников"""
+        response = self.client.get(reverse('transaction_create'))
+        self.assertContains(response, 'data-autocomplete-url="%s"' % reverse('autocomplete', args=['subcategory']))
+        self.assertContains(response, 'data-autocomplete-url="%s"' % reverse('autocomplete', args=['category']))
+        self.assertNotContains(response, '<option value="%d"' % self.vps.pk)
+
+        response = self.client.get(reverse('transaction_list'), {'category': self.marketing.pk})
+        self.assertContains(response, 'value="Маркетинг"')
+        self.assertContains(response, 'data-autocomplete-target="filter_category"')
+
+    def test_form_accepts_autocomplete_value(self):
+        """Тест сохранения транзакции через поле автодополнения"""
+        status = Status.objects.create(name='Бизнес')
+        with override_settings(DDS_AUTOCOMPLETE_THRESHOLD=1):
+            response = self.client.post(reverse('transaction_create'), {
+                'date': '2024-05-01',
+                'status': status.pk,
+                'transaction_type': self.expense.pk,
+                'category': self.marketing.pk,
+                'subcategory': self.avito.pk,
+                'amount': '100.00',
+            })
+        self.assertRedirects(response, reverse('transaction_list'))
+        self.assertTrue(Transaction.objects.filter(subcategory=self.avito).exists())
+
+
+class BudgetTests(TestCase):
+    def setUp(self):
+        self.status = Status.objects.create(name='Бизнес')
+        self.expense = TransactionType.objects.create(name='Списание')
+        self.marketing = Category.objects.create(name='Маркетинг', transaction_type=self.expense)
+        self.avito = Subcategory.objects.create(name='Avito', category=self.marketing)
+        self.farpost = Subcategory.objects.create(name='Farpost', category=self.marketing)
+        self.may = date(2024, 5, 1)
+
+    def create(self, amount, subcategory=None, day=None):
+        return Transaction.objects.create(
+            date=day or date(2024, 5, 10), status=self.status, transaction_type=self.expense,
+            category=self.marketing, subcategory=subcategory or self.avito, amount=amount,
+        )
+
+    def totals(self):
+        return {
+            (row.month, row.category_id, row.subcategory_id): (row.total_cents, row.count)
+            for row in MonthlyAggregate.objects.exclude(count=0)
+        }
+
+    def test_aggregates_follow_writes(self):
+        """Тест инкрементального ведения месячных итогов при создании, изменении и удалении"""
+        first = self.create('100.50')
+        self.create('20.00', self.farpost)
+        self.assertEqual(self.totals(), {
+            (self.may, self.marketing.pk, self.avito.pk): (10050, 1),
+            (self.may, self.marketing.pk, self.farpost.pk): (2000, 1),
+            (self.may, self.marketing.pk, None): (12050, 2),
+        })
+
+        # Перенос в другой месяц и подкатегорию
+        first.date = date(2024, 6, 3)
+        first.subcategory = self.farpost
+        first.amount = Decimal('50.00')
+        first.save()
+        self.assertEqual(self.totals(), {
+            (self.may, self.marketing.pk, self.farpost.pk): (2000, 1),
+            (self.may, self.marketing.pk, None): (2000, 1),
+            (date(2024, 6, 1), self.marketing.pk, self.farpost.pk): (5000, 1),
+            (date(2024, 6, 1), self.marketing.pk, None): (5000, 1),
+        })
+
+        first.delete()
+        self.assertEqual(self.totals(), {
+            (self.may, self.marketing.pk, self.farpost.pk): (2000, 1),
+            (self.may, self.marketing.pk, None): (2000, 1),
+        })
+
+    def test_overrun_flag(self):
+        """Тест установки и снятия признака превышения бюджета"""
+        budget = Budget.objects.create(month=self.may, category=self.marketing, amount=Decimal('100.00'))
+        sub_budget = Budget.objects.create(month=self.may, category=self.marketing, subcategory=self.avito,
+                                           amount=Decimal('500.00'))
+        transaction = self.create('80.00')
+        self.assertEqual(transaction.budget_overruns, [])
+
+        second = self.create('30.00', self.farpost)
+        self.assertEqual(second.budget_overruns, [budget])
+        budget.refresh_from_db()
+        self.assertIsNotNone(budget.overrun_at)
+        sub_budget.refresh_from_db()
+        self.assertIsNone(sub_budget.overrun_at)
+
+        second.delete()
+        budget.refresh_from_db()
+        self.assertIsNone(budget.overrun_at)
+
+    def test_write_path_queries(self):
+        """Тест постоянного числа запросов на проверку бюджетов при записи"""
+        Budget.objects.create(month=self.may, category=self.marketing, amount=Decimal('100.00'))
+        self.create('10.00')
+        with CaptureQueriesContext(connection) as small:
+            self.create('10.00')
+        for day in range(1, 28):
+            self.create('10.00', day=date(2024, 5, day))
+        with CaptureQueriesContext(connection) as large:
+            self.create('10.00')
+        self.assertEqual(len(small), len(large))
+
+    def test_dashboard_does_not_scan_transactions(self):
+        """Тест панели бюджетов без запросов к таблице транзакций"""
+        Budget.objects.create(month=self.may, category=self.marketing, amount=Decimal('100.00'))
+        Budget.objects.create(month=self.may, category=self.marketing, subcategory=self.avito,
+                              amount=Decimal('40.00'))
+        self.create('50.00')
+        self.create('30.00', self.farpost)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('budget_dashboard'), {'month': '2024-05'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in queries if 'dds_app_transaction' in q['sql']])
+
+        rows = response.context['rows']
+        self.assertEqual([(row['actual'], row['remaining'], row['overrun']) for row in rows], [
+            (Decimal('80.00'), Decimal('20.00'), False),
+            (Decimal('50.00'), Decimal('-10.00'), True),
+        ])
+        self.assertContains(response, 'превышен')
+
+    def test_create_budget_view(self):
+        """Тест добавления бюджета с проверкой факта и повторов"""
+        self.create('150.00')
+        data = {'month': '2024-05', 'category': self.marketing.pk, 'subcategory': '', 'amount': '100.00'}
+        response = self.client.post(reverse('budget_dashboard'), data)
+        self.assertRedirects(response, reverse('budget_dashboard') + '?month=2024-05')
+        budget = Budget.objects.get()
+        self.assertEqual(budget.month, self.may)
+        self.assertIsNotNone(budget.overrun_at)
+
+        response = self.client.post(reverse('budget_dashboard'), data)
+        self.assertContains(response, 'Бюджет на этот месяц уже задан')
+
+        response = self.client.post(reverse('budget_edit', args=[budget.pk]), dict(data, amount='200.00'))
+        self.assertEqual(response.status_code, 302)
+        budget.refresh_from_db()
+        self.assertIsNone(budget.overrun_at)
+
+    def test_transaction_view_warns_on_overrun(self):
+        """Тест предупреждения о превышении бюджета при сохранении транзакции"""
+        Budget.objects.create(month=self.may, category=self.marketing, amount=Decimal('100.00'))
+        response = self.client.post(reverse('transaction_create'), {
+            'date': '2024-05-02', 'status': self.status.pk, 'transaction_type': self.expense.pk,
+            'category': self.marketing.pk, 'subcategory': self.avito.pk, 'amount': '150.00',
+        }, follow=True)
+        self.assertContains(response, 'Превышен бюджет: Маркетинг за 05.2024')
+
+    def test_bulk_import_and_rebuild(self):
+        """Тест итогов после массового импорта и полного пересчета"""
+        budget = Budget.objects.create(month=self.may, category=self.marketing, amount=Decimal('100.00'))
+        self.create('40.00')
+        bulk_create_transactions([
+            Transaction(date=date(2024, 5, day), status=self.status, transaction_type=self.expense,
+                        category=self.marketing, subcategory=self.farpost, amount=Decimal('10.00'))
+            for day in range(1, 8)
+        ])
+        incremental = self.totals()
+        self.assertEqual(incremental[(self.may, self.marketing.pk, None)], (11000, 8))
+        budget.refresh_from_db()
+        self.assertIsNotNone(budget.overrun_at)
+
+        MonthlyAggregate.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_budget_aggregates', stdout=out)
+        self.assertIn('1 budgets over limit', out.getvalue())
+        self.assertEqual(self.totals(), incremental)
+        self.assertEqual(rebuild_aggregates(), 3)
+        self.assertEqual(len(budget_rows(self.may)), 1)
+
+
+class AdmissionControlTests(TestCase):
+    def setUp(self):
+        reset_pools()
+        self.addCleanup(reset_pools)
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.005)
+
+    def test_bounded_queue_and_timeout(self):
+        """Тест отказа при переполненной очереди и по таймауту ожидания"""
+        pool = Pool('test', limit=1, queue=2, timeout=0.05)
+        self.assertIsNone(pool.acquire(True))
+        self.assertEqual(pool.acquire(True), 'timeout')
+
+        # Фоновым клиентам доступна только половина очереди
+        waiter = threading.Thread(target=pool.acquire, args=(False,))
+        pool.timeout = 5
+        waiter.start()
+        self.wait_for(lambda: pool.waiting[False] == 1)
+        self.assertEqual(pool.acquire(False), 'queue_full')
+        pool.release(0.1)
+        waiter.join()
+        self.assertEqual(pool.stats()['rejected'], {'queue_full': 1, 'timeout': 1})
+        self.assertEqual(pool.stats()['admitted'], 2)
+
+    def test_interactive_priority(self):
+        """Тест приоритета страниц над фоновыми клиентами"""
+        pool = Pool('test', limit=1, queue=10, timeout=5)
+        pool.acquire(True)
+        order = []
+
+        def enter(interactive):
+            pool.acquire(interactive)
+            order.append(interactive)
+
+        bulk = threading.Thread(target=enter, args=(False,))
+        bulk.start()
+        self.wait_for(lambda: pool.waiting[False] == 1)
+        interactive = threading.Thread(target=enter, args=(True,))
+        interactive.start()
+        self.wait_for(lambda: pool.waiting[True] == 1)
+
+        pool.release(0.01)
+        interactive.join()
+        self.assertEqual(order, [True])
+        pool.release(0.01)
+        bulk.join()
+        self.assertEqual(order, [True, False])
+
+    def test_reserved_slots(self):
+        """Тест мест пула, зарезервированных для страниц"""
+        pool = Pool('test', limit=2, queue=0, timeout=0, reserved=1)
+        self.assertIsNone(pool.acquire(False))
+        self.assertEqual(pool.acquire(False), 'queue_full')
+        self.assertIsNone(pool.acquire(True))
+
+    @override_settings(DDS_ADMISSION_POOLS={'write': {'limit': 1, 'queue': 0, 'timeout': 0}})
+    def test_middleware_rejects_when_saturated(self):
+        """Тест быстрых ответов 503/429 с Retry-After при занятом пуле"""
+        pool = get_pool('write')
+        pool.acquire(True)
+
+        response = self.client.post(reverse('transaction_create'), {}, HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+        response = self.client.post(reverse('transaction_create'), {})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()['reason'], 'queue_full')
+
+        # Чтение не ограничивается, а статистика отдается всегда
+        self.assertEqual(self.client.get(reverse('transaction_list')).status_code, 200)
+        stats = self.client.get(reverse('admission_stats')).json()
+        self.assertEqual(stats['write']['active'], 1)
+        self.assertEqual(stats['write']['rejected']['queue_full'], 2)
+
+        pool.release(0.01)
+        response = self.client.post(reverse('transaction_create'), {}, HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(pool.stats()['active'], 0)
+
+    @override_settings(DDS_ADMISSION_POOLS={'api': {'limit': 1, 'queue': 0, 'timeout': 0}})
+    def test_streaming_response_holds_slot(self):
+        """Тест: место в пуле занято, пока отдается тело потокового ответа"""
+        pool = get_pool('api')
+        response = self.client.get(reverse('transactions_feed'))
+        self.assertTrue(response.streaming)
+        self.assertEqual(pool.stats()['active'], 1)
+        self.assertEqual(self.client.get(reverse('transactions_feed')).status_code, 429)
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), [])
+        self.assertEqual(pool.stats()['active'], 0)
+
+        # Клиент отключился, не дочитав тело
+        response = self.client.get(reverse('transactions_feed'))
+        self.assertEqual(pool.stats()['active'], 1)
+        response.close()
+        self.assertEqual(pool.stats()['active'], 0)
+        self.assertEqual(pool.stats()['admitted'], 2)
+
+
+class SerializationTests(TestCase):
+    def setUp(self):
+        self.status = Status.objects.create(name='Бизнес')
+        self.expense = TransactionType.objects.create(name='Списание')
+        self.marketing = Category.objects.create(name='Маркетинг', transaction_type=self.expense)
+        self.avito = Subcategory.objects.create(name='Avito', category=self.marketing)
+        for day in range(1, 6):
+            Transaction.objects.create(
+                date=date(2024, 5, day), status=self.status, transaction_type=self.expense,
+                category=self.marketing, subcategory=self.avito, amount=Decimal(f'{day}0.50'), comment='Реклама',
+            )
+
+    def test_dictionary_fields(self):
+        """Тест выбора полей в API справочников"""
+        url = reverse('get_categories_by_type')
+        response = self.client.get(url, {'transaction_type_id': self.expense.pk})
+        self.assertEqual(response.json(), [{'id': self.marketing.pk, 'name': 'Маркетинг'}])
+        response = self.client.get(url, {'transaction_type_id': self.expense.pk, 'fields': 'id'})
+        self.assertEqual(response.json(), [{'id': self.marketing.pk}])
+
+        response = self.client.get(reverse('get_subcategories_by_category'), {
+            'category_id': self.marketing.pk, 'fields': 'name,secret',
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('secret', response.json()['error'])
+
+    def test_transactions_feed_sparse_columns(self):
+        """Тест потоковой ленты транзакций с чтением только выбранных колонок"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('transactions_feed'), {
+                'fields': 'id,date,amount,category', 'date_from': '2024-05-02',
+            })
+            self.assertTrue(response.streaming)
+            data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(data), 4)
+        self.assertEqual(data[-1], {
+            'id': data[-1]['id'], 'date': '2024-05-02', 'amount': '20.50', 'category': 'Маркетинг',
+        })
+        sql = [query['sql'] for query in queries if 'dds_app_transaction' in query['sql']]
+        self.assertEqual(len(sql), 1)
+        self.assertNotIn('comment', sql[0])
+        self.assertNotIn('dds_app_status', sql[0])
+
+    @skipUnless(orjson, 'orjson не установлен')
+    def test_encoders_agree(self):
+        """Тест одинакового результата orjson и стандартного json"""
+        data = [{'date': date(2024, 5, 1), 'amount': Decimal('10.50'), 'name': 'Маркетинг', 'none': None}]
+        self.assertEqual(json.loads(dumps(data, fast=False)), json.loads(dumps(data, fast=True)))
+        self.assertEqual(json.loads(dumps(data, fast=False))[0]['amount'], '10.50')
+
+    @skipUnless(orjson, 'orjson не установлен')
+    def test_encoders_same_bytes(self):
+        """Тест: даты, время и Decimal кодируются обоими кодировщиками в одинаковые байты"""
+        moment = datetime(2024, 5, 1, 10, 0, 0, 123456, tzinfo=dt_timezone.utc)
+        data = [{
+            'date': date(2024, 5, 1), 'created_at': moment, 'naive': datetime(2024, 5, 1, 10, 0, 0, 5000),
+            'time': moment.time(), 'amount': Decimal('10.50'),
+            'precise': Decimal('0.10000000000000000001'), 'name': 'Маркетинг',
+        }]
+        self.assertEqual(dumps(data, fast=True), dumps(data, fast=False))
+        self.assertIn(b'"2024-05-01T10:00:00.123Z"', dumps(data, fast=True))
+
+    def test_streamed_array_chunks(self):
+        """Тест сборки JSON-массива из пачек"""
+        names = ('id', 'amount')
+        rows = TRANSACTION.rows(Transaction.objects.order_by('date'), names)
+        for chunk_size in (1, 2, 5, 10):
+            chunks = list(iter_json_array(names, rows, chunk_size))
+            data = json.loads(b''.join(chunks))
+            self.assertEqual([row['amount'] for row in data], ['10.50', '20.50', '30.50', '40.50', '50.50'])
+        empty = b''.join(iter_json_array(names, TRANSACTION.rows(Transaction.objects.none(), names)))
+        self.assertEqual(json.loads(empty), [])
+
+
+class AmountAnomalyTests(TestCase):
+    def setUp(self):
+        self.status = Status.objects.create(name='Бизнес')
+        self.expense = TransactionType.objects.create(name='Списание')
+        self.marketing = Category.objects.create(name='Маркетинг', transaction_type=self.expense)
+        self.avito = Subcategory.objects.create(name='Avito', category=self.marketing)
+        self.farpost = Subcategory.objects.create(name='Farpost', category=self.marketing)
+
+    def create(self, amount, subcategory=None):
+        return Transaction.objects.create(
+            date=date(2024, 5, 1), status=self.status, transaction_type=self.expense,
+            category=self.marketing, subcategory=subcategory or self.avito, amount=Decimal(amount),
+        )
+
+    def assertStatsMatch(self, subcategory):
+        amounts = [float(amount) for amount in
+                   Transaction.objects.filter(subcategory=subcategory).values_list('amount', flat=True)]
+        stats = SubcategoryStats.objects.get(subcategory=subcategory)
+        self.assertEqual(stats.count, len(amounts))
+        self.assertAlmostEqual(stats.mean, statistics.fmean(amounts), places=6)
+        self.assertAlmostEqual(std(stats.count, stats.m2), statistics.stdev(amounts) if len(amounts) > 1 else 0.0,
+                               places=6)
+        self.assertEqual(stats.min_amount, Decimal(str(min(amounts))).quantize(Decimal('0.01')))
+        self.assertEqual(stats.max_amount, Decimal(str(max(amounts))).quantize(Decimal('0.01')))
+
+    def test_welford_reversal(self):
+        """Тест добавления, вычитания и объединения распределений"""
+        generator = random.Random(7)
+        values = [generator.uniform(1, 1000) for _ in range(200)]
+        state = (0, 0.0, 0.0)
+        for value in values:
+            state = add_value(*state, value)
+        for value in values[150:]:
+            state = remove_value(*state, value)
+        self.assertEqual(state[0], 150)
+        self.assertAlmostEqual(state[1], statistics.fmean(values[:150]), places=6)
+        self.assertAlmostEqual(std(state[0], state[2]), statistics.stdev(values[:150]), places=6)
+
+        left = right = (0, 0.0, 0.0)
+        for value in values[:80]:
+            left = add_value(*left, value)
+        for value in values[80:150]:
+            right = add_value(*right, value)
+        merged = merge(left, right)
+        self.assertEqual(merged[0], 150)
+        self.assertAlmostEqual(merged[1], state[1], places=6)
+        self.assertAlmostEqual(merged[2], state[2], places=3)
+
+    def test_stats_follow_writes(self):
+        """Тест статистики при создании, изменении и удалении транзакций"""
+        transactions = [self.create(f'{100 + index * 7}.25') for index in range(15)]
+        self.assertStatsMatch(self.avito)
+
+        transactions[0].amount = Decimal('55.10')
+        transactions[0].save()
+        transactions[1].subcategory = self.farpost
+        transactions[1].save()
+        transactions[14].delete()  # максимум
+        transactions[0].delete()  # минимум
+        self.assertStatsMatch(self.avito)
+        self.assertStatsMatch(self.farpost)
+
+        rebuilt = {row.pk: (row.count, row.mean, row.m2) for row in SubcategoryStats.objects.all()}
+        call_command('rebuild_amount_stats', stdout=StringIO())
+        for row in SubcategoryStats.objects.all():
+            self.assertEqual(row.count, rebuilt[row.pk][0])
+            self.assertAlmostEqual(row.mean, rebuilt[row.pk][1], places=6)
+            self.assertAlmostEqual(row.m2, rebuilt[row.pk][2], places=3)
+
+    def test_write_path_queries(self):
+        """Тест постоянного числа запросов на проверку при записи"""
+        for index in range(12):
+            self.create(f'{100 + index}.00')
+        with CaptureQueriesContext(connection) as small:
+            self.create('105.00')
+        for index in range(100):
+            self.create(f'{100 + index % 12}.00')
+        with CaptureQueriesContext(connection) as large:
+            self.create('105.00')
+        self.assertEqual(len(small), len(large))
+        self.assertFalse([q for q in large if 'FROM "dds_app_transaction"' in q['sql'] and 'MIN' not in q['sql']
+                          and 'WHERE "dds_app_transaction"."id"' not in q['sql']])
+
+    def test_flag_and_review(self):
+        """Тест отметки необычной суммы, очереди проверки и снятия флага"""
+        for index in range(12):
+            self.create(f'{100 + index}.00')
+        response = self.client.post(reverse('transaction_create'), {
+            'date': '2024-05-02', 'status': self.status.pk, 'transaction_type': self.expense.pk,
+            'category': self.marketing.pk, 'subcategory': self.avito.pk, 'amount': '5000.00',
+        }, follow=True)
+        self.assertContains(response, 'Необычно большая сумма для подкатегории Avito')
+        self.assertContains(response, 'fa-exclamation-triangle text-warning')
+        anomaly = AmountAnomaly.objects.get()
+        self.assertEqual(anomaly.transaction.amount, Decimal('5000.00'))
+        self.assertGreater(anomaly.z_score, 3)
+
+        response = self.client.get(reverse('anomaly_queue'))
+        self.assertContains(response, '5000.00 руб.')
+        self.client.post(reverse('anomaly_review', args=[anomaly.pk]))
+        anomaly.refresh_from_db()
+        self.assertIsNotNone(anomaly.reviewed_at)
+        self.assertNotContains(self.client.get(reverse('anomaly_queue')), '5000.00 руб.')
+
+        # Исправленная сумма снимает флаг
+        transaction = anomaly.transaction
+        transaction.amount = Decimal('104.00')
+        transaction.save()
+        self.assertFalse(AmountAnomaly.objects.exists())
+
+    def test_bulk_import_and_reflag(self):
+        """Тест статистики и флагов при массовом импорте и полном пересчете"""
+        for index in range(12):
+            self.create(f'{100 + index}.00')
+        created, _ = bulk_create_transactions([
+            Transaction(date=date(2024, 5, 3), status=self.status, transaction_type=self.expense,
+                        category=self.marketing, subcategory=self.avito, amount=Decimal(amount))
+            for amount in ('103.00', '9000.00')
+        ])
+        self.assertStatsMatch(self.avito)
+        self.assertEqual(list(AmountAnomaly.objects.values_list('transaction__amount', flat=True)),
+                         [Decimal('9000.00')])
+
+        AmountAnomaly.objects.all().delete()
+        SubcategoryStats.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_amount_stats', '--reflag', stdout=out)
+        self.assertIn('1 transactions flagged', out.getvalue())
+        self.assertStatsMatch(self.avito)
+
+
+class TenancyTests(TestCase):
+    """Тесты разделения данных организаций"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.other = Organization.objects.create(name='ООО Вторая', slug='second')
+        self.default_data = self.create_ledger('Avito', '100.00')
+        with tenant_context(self.other.pk):
+            self.other_data = self.create_ledger('Farpost', '200.00')
+
+    def create_ledger(self, subcategory_name, amount):
+        status = Status.objects.create(name='Бизнес')
+        transaction_type = TransactionType.objects.create(name='Списание')
+        category = Category.objects.create(name='Маркетинг', transaction_type=transaction_type)
+        subcategory = Subcategory.objects.create(name=subcategory_name, category=category)
+        transaction = Transaction.objects.create(
+            date=date(2024, 5, 1), status=status, transaction_type=transaction_type, category=category,
+            subcategory=subcategory, amount=amount,
+        )
+        return {'status': status, 'type': transaction_type, 'category': category, 'subcategory': subcategory,
+                'transaction': transaction}
+
+    def test_same_names_in_different_organizations(self):
+        """Тест: названия уникальны в пределах организации"""
+        self.assertEqual(self.other_data['status'].organization, self.other)
+        self.assertNotEqual(self.default_data['status'].organization_id, self.other.pk)
+        self.assertEqual(Status.objects.filter(name='Бизнес').count(), 2)
+        with tenant_context(self.other.pk):
+            form = StatusForm({'name': 'Бизнес'})
+            self.assertFalse(form.is_valid())
+            self.assertIn('Статус с таким названием уже существует', str(form.errors))
+            self.assertTrue(StatusForm({'name': 'Личное'}).is_valid())
+
+    def test_views_scoped_to_organization(self):
+        """Тест: список и API показывают только данные выбранной организации"""
+        response = self.client.get(reverse('transaction_list'))
+        self.assertContains(response, 'Avito')
+        self.assertNotContains(response, 'Farpost')
+
+        response = self.client.get(reverse('transaction_list'), {'organization': 'second'})
+        self.assertContains(response, 'Farpost')
+        self.assertNotContains(response, 'Avito')
+        # Выбор запоминается в сессии
+        self.assertContains(self.client.get(reverse('transaction_list')), 'Farpost')
+
+        api = Client(headers={'X-Organization': 'second'})
+        feed = api.get(reverse('transactions_feed'), {'fields': 'id,subcategory'})
+        self.assertEqual(json.loads(b''.join(feed.streaming_content)),
+                         [{'id': self.other_data['transaction'].pk, 'subcategory': 'Farpost'}])
+        self.assertEqual(api.get(reverse('transaction_edit', args=[self.default_data['transaction'].pk])).status_code,
+                         404)
+        self.assertEqual(api.get(reverse('transaction_list'), {'organization': 'missing'}).status_code, 404)
+
+    def test_form_choices_scoped(self):
+        """Тест: в форме нельзя выбрать справочник другой организации"""
+        with tenant_context(self.other.pk):
+            form = TransactionForm({
+                'date': '2024-05-02', 'status': self.default_data['status'].pk,
+                'transaction_type': self.other_data['type'].pk, 'category': self.other_data['category'].pk,
+                'subcategory': self.other_data['subcategory'].pk, 'amount': '10.00',
+            })
+            self.assertFalse(form.is_valid())
+            self.assertIn('status', form.errors)
+
+    def test_cache_partitioned(self):
+        """Тест: ответы и поколения кэша разделены по организациям"""
+        url = reverse('get_subcategories_by_category')
+        default = self.client.get(url, {'category_id': self.default_data['category'].pk})
+        self.assertEqual(default.json()[0]['name'], 'Avito')
+
+        api = Client(headers={'X-Organization': 'second'})
+        self.assertEqual(api.get(url, {'category_id': self.default_data['category'].pk}).json(), [])
+        api.get(url, {'category_id': self.other_data['category'].pk})
+        with self.assertNumQueries(1):
+            response = api.get(url, {'category_id': self.other_data['category'].pk})
+        self.assertEqual(response.json()[0]['name'], 'Farpost')
+
+        # Запись в одной организации не меняет поколение другой
+        generation = get_generation(Subcategory)
+        with tenant_context(self.other.pk):
+            Subcategory.objects.create(name='VK', category=self.other_data['category'])
+        self.assertEqual(get_generation(Subcategory), generation)
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'category_id': self.default_data['category'].pk})
+        self.assertEqual(response.json()[0]['name'], 'Avito')
+
+    def test_coherence_reads_own_counters(self):
+        """Тест: сверка поколений читает счетчики только своей организации"""
+        with tenant_context(self.other.pk), CaptureQueriesContext(connection) as queries:
+            sync_generations()
+        self.assertEqual(len(queries), 1)
+        self.assertIn(f"'{self.other.pk}:'", queries[0]['sql'])
+
+    def test_tenant_leading_indexes(self):
+        """Тест: запросы организации идут по индексам, начинающимся с организации"""
+        with tenant_context(self.other.pk):
+            plan = Transaction.objects.filter(date__gte=date(2024, 1, 1)).explain()
+            duplicates = find_duplicates(self.other_data['transaction'].fingerprint).explain()
+        self.assertIn('transaction_org_date_idx', plan)
+        self.assertIn('transaction_org_fp_idx', duplicates)
+
+    def test_duplicates_per_organization(self):
+        """Тест: одинаковая транзакция в другой организации не считается дублем"""
+        data = self.default_data
+        created, skipped = bulk_create_transactions([
+            Transaction(date=date(2024, 5, 1), status=data['status'], transaction_type=data['type'],
+                        category=data['category'], subcategory=data['subcategory'], amount=Decimal('100.00')),
+        ])
+        self.assertEqual((len(created), len(skipped)), (0, 1))
+        with tenant_context(self.other.pk):
+            self.assertFalse(find_duplicates(data['transaction'].fingerprint).exists())
+
+    def test_changes_and_jobs_scoped(self):
+        """Тест: журнал изменений и фоновые задачи видны только своей организации"""
+        api = Client(headers={'X-Organization': 'second'})
+        changes = api.get(reverse('changes_feed')).json()['changes']
+        self.assertTrue(changes)
+        self.assertEqual({change['data']['organization_id'] for change in changes if change['data']}, {self.other.pk})
+
+        with tenant_context(self.other.pk):
+            job = enqueue('transactions_csv', {})
+        self.assertEqual(self.client.get(reverse('job_status', args=[job.pk])).status_code, 404)
+        results_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(results_dir.cleanup)
+        with override_settings(DDS_JOB_RESULTS_DIR=results_dir.name):
+            job = run_job(claim_next('test-worker'))
+        with open(job.result_path, encoding='utf-8-sig') as file:
+            content = file.read()
+        self.assertIn('Farpost', content)
+        self.assertNotIn('Avito', content)
+
+    def test_bench_command(self):
+        """Тест команды сравнения задержек при росте числа организаций"""
+        out = StringIO()
+        call_command('bench_tenants', tenants='1,3', rows=50, samples=2, repeat=1, stdout=out)
+        self.assertIn('cache check', out.getvalue())
+        self.assertFalse(Organization.objects.filter(slug__startswith='bench-').exists())
+
+
+class CurrencyTests(TestCase):
+    """Тесты валют и сумм в рублях"""
+
+    def setUp(self):
+        cache.clear()
+        # Таблица курсов процесса могла остаться от другого теста
+        rates.reset()
+        self.addCleanup(rates.reset)
+        self.status = Status.objects.create(name='Бизнес')
+        self.expense = TransactionType.objects.create(name='Списание')
+        self.marketing = Category.objects.create(name='Маркетинг', transaction_type=self.expense)
+        self.avito = Subcategory.objects.create(name='Avito', category=self.marketing)
+        ExchangeRate.objects.create(currency='USD', date=date(2024, 1, 1), rate=Decimal('90'))
+        ExchangeRate.objects.create(currency='USD', date=date(2024, 2, 1), rate=Decimal('100'))
+
+    def create(self, day, amount, currency='USD'):
+        return Transaction.objects.create(
+            date=day, status=self.status, transaction_type=self.expense, category=self.marketing,
+            subcategory=self.avito, amount=Decimal(amount), currency=currency,
+        )
+
+    def test_rate_lookup(self):
+        """Тест: курс на дату - последний курс не позже нее, из памяти процесса"""
+        convert(1, 'USD', date(2024, 1, 1))
+        with self.assertNumQueries(0):
+            self.assertEqual(convert('10.00', 'USD', date(2024, 1, 31)), Decimal('900.00'))
+            self.assertEqual(convert('10.00', 'USD', date(2024, 3, 15)), Decimal('1000.00'))
+            self.assertEqual(convert('10.50', 'RUB', date(2020, 1, 1)), Decimal('10.50'))
+            with self.assertRaises(MissingRate):
+                convert(1, 'USD', date(2023, 12, 31))
+            with self.assertRaises(MissingRate):
+                convert(1, 'EUR', date(2024, 1, 1))
+
+    def test_base_amount_on_write(self):
+        """Тест: сумма в рублях считается при записи и попадает в итоги"""
+        transaction = self.create(date(2024, 1, 15), '10.00')
+        self.create(date(2024, 1, 20), '500.00', currency='RUB')
+        self.assertEqual(transaction.base_amount, Decimal('900.00'))
+        self.assertEqual(str(transaction), '2024-01-15 - Списание - 10.00 USD')
+
+        aggregate = MonthlyAggregate.objects.get(month=date(2024, 1, 1), subcategory=self.avito)
+        self.assertEqual(aggregate.total_cents, 140000)
+        report = build_pivot(date(2024, 1, 1), date(2024, 1, 31)).to_dict()
+        self.assertEqual(report['sections'][0]['total'], '1400.00')
+        self.assertEqual(SubcategoryStats.objects.get(subcategory=self.avito).max_amount, Decimal('900.00'))
+
+        transaction.date = date(2024, 2, 5)
+        transaction.save(update_fields=['date'])
+        transaction.refresh_from_db()
+        self.assertEqual(transaction.base_amount, Decimal('1000.00'))
+
+    def test_form_requires_rate(self):
+        """Тест: транзакцию в валюте без курса сохранить нельзя"""
+        data = {
+            'date': '2024-01-15', 'status': self.status.pk, 'transaction_type': self.expense.pk,
+            'category': self.marketing.pk, 'subcategory': self.avito.pk, 'amount': '10.00', 'currency': 'EUR',
+        }
+        form = TransactionForm(data)
+        self.assertFalse(form.is_valid())
+        self.assertIn('Нет курса EUR', str(form.errors['currency']))
+        data['currency'] = 'USD'
+        self.assertTrue(TransactionForm(data).is_valid())
+        # Без валюты - рубли
+        del data['currency']
+        form = TransactionForm(data)
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.save().base_amount, Decimal('10.00'))
+
+    def test_rate_change_recomputes_affected_rows(self):
+        """Тест: изменение курса пересчитывает только транзакции, для которых он действует"""
+        january = [self.create(date(2024, 1, 10), '10.00'), self.create(date(2024, 1, 20), '20.00')]
+        february = self.create(date(2024, 2, 10), '30.00')
+        rouble = self.create(date(2024, 1, 10), '100.00', currency='RUB')
+        generation = get_generation(Transaction)
+        changes = ChangeLogEntry.objects.count()
+
+        rate = ExchangeRate.objects.get(currency='USD', date=date(2024, 1, 1))
+        rate.rate = Decimal('95')
+        rate.save()
+
+        self.assertEqual(
+            [item.base_amount for item in Transaction.objects.filter(pk__in=[item.pk for item in january])
+             .order_by('date')],
+            [Decimal('950.00'), Decimal('1900.00')],
+        )
+        february.refresh_from_db()
+        rouble.refresh_from_db()
+        self.assertEqual((february.base_amount, rouble.base_amount), (Decimal('3000.00'), Decimal('100.00')))
+        self.assertEqual(ChangeLogEntry.objects.count() - changes, 2)
+        self.assertNotEqual(get_generation(Transaction), generation)
+
+        # Итоги и распределения совпадают с полным пересчетом
+        totals = MonthlyAggregate.objects.filter(subcategory=self.avito).order_by('month')
+        self.assertEqual([item.total_cents for item in totals], [295000, 300000])
+        stats = SubcategoryStats.objects.get(subcategory=self.avito)
+        self.assertEqual((stats.count, stats.max_amount), (4, Decimal('3000.00')))
+        self.assertAlmostEqual(stats.mean, (950 + 1900 + 3000 + 100) / 4, places=6)
+
+    def test_load_rates_command(self):
+        """Тест загрузки курсов из CSV с пересчетом затронутых транзакций"""
+        transaction = self.create(date(2024, 2, 10), '10.00')
+        self.create(date(2024, 3, 10), '10.00', currency='RUB')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'rates.csv')
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write('date,currency,rate\n2024-02-01,USD,101.5\n2024-02-15,USD,102\n2024-02-01,EUR,110\n')
+
+        out = StringIO()
+        call_command('load_rates', path, stdout=out)
+        self.assertIn('3 rates loaded', out.getvalue())
+        self.assertIn('1 transactions recomputed', out.getvalue())
+        transaction.refresh_from_db()
+        self.assertEqual(transaction.base_amount, Decimal('1015.00'))
+        self.assertEqual(ExchangeRate.objects.filter(currency='USD').count(), 3)
+        self.assertEqual(convert(1, 'EUR', date(2024, 2, 20)), Decimal('110.00'))
+
+        # Повторная загрузка ничего не пересчитывает
+        out = StringIO()
+        call_command('load_rates', path, stdout=out)
+        self.assertIn('0 transactions recomputed', out.getvalue())
+
+        with open(path, 'a', encoding='utf-8') as file:
+            file.write('2024-02-01,GBP,120\n')
+        with self.assertRaises(CommandError):
+            call_command('load_rates', path, stdout=StringIO())
+
+
+class DictionaryPanelsTests(TestCase):
+    """Тесты страницы справочников с загрузкой панелей по запросу"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.status = Status.objects.create(name='Бизнес')
+        self.expense = TransactionType.objects.create(name='Списание')
+        self.categories = Category.objects.bulk_create(
+            Category(name=f'Категория {index:03}', transaction_type=self.expense) for index in range(120)
+        )
+        bump_generation(Category)
+        self.subcategory = Subcategory.objects.create(name='Avito', category=self.categories[5])
+        for amount in ('100.00', '200.00'):
+            Transaction.objects.create(
+                date=date(2024, 5, 1), status=self.status, transaction_type=self.expense,
+                category=self.categories[5], subcategory=self.subcategory, amount=amount,
+            )
+
+    def test_page_renders_only_shells(self):
+        """Тест: страница не зависит от размера справочников"""
+        self.client.get(reverse('dictionaries'))
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('dictionaries'))
+        self.assertContains(response, 'Категории')
+        self.assertContains(response, reverse('dictionary_items', args=['category']))
+        self.assertNotContains(response, 'Категория 005')
+
+    def test_pagination_and_search(self):
+        """Тест страниц и поиска по названию"""
+        url = reverse('dictionary_items', args=['category'])
+        first = self.client.get(url).json()
+        self.assertEqual(len(first['items']), 50)
+        self.assertTrue(first['has_next'])
+        self.assertEqual(first['items'][0], {'id': self.categories[0].pk, 'name': 'Категория 000', 'usage': 0,
+                                             'parent': 'Списание'})
+        last = self.client.get(url, {'page': 3}).json()
+        self.assertEqual([item['name'] for item in last['items']][-1], 'Категория 119')
+        self.assertFalse(last['has_next'])
+
+        found = self.client.get(url, {'q': 'Категория 11', 'limit': 5}).json()
+        self.assertEqual([item['name'] for item in found['items']],
+                         ['Категория 110', 'Категория 111', 'Категория 112', 'Категория 113', 'Категория 114'])
+        self.assertTrue(found['has_next'])
+
+        self.assertEqual(self.client.get(url, {'page': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('dictionary_items', args=['missing'])).status_code, 404)
+
+    def test_usage_counts_single_query(self):
+        """Тест: число транзакций для страницы - один сгруппированный запрос"""
+        dictionary = DICTIONARIES['category']
+        with CaptureQueriesContext(connection) as queries:
+            page = dictionary.page(limit=10)
+        self.assertEqual(len(queries), 2)
+        self.assertIn('GROUP BY', queries[1]['sql'])
+        self.assertEqual({item['name']: item['usage'] for item in page['items']}['Категория 005'], 2)
+        self.assertEqual(DICTIONARIES['status'].page()['items'], [{'id': self.status.pk, 'name': 'Бизнес',
+                                                                   'usage': 2}])
+
+
+class SingleFlightTests(TestCase):
+    """Тесты объединения одинаковых одновременных вычислений"""
+
+    def setUp(self):
+        singleflight.reset_stats()
+        self.addCleanup(singleflight.reset_stats)
+
+    def run_concurrently(self, key, compute, count=8):
+        results = [None] * count
+        errors = [None] * count
+        barrier = threading.Barrier(count)
+
+        def worker(index):
+            barrier.wait()
+            try:
+                results[index] = singleflight.run(key, compute)
+            except Exception as error:
+                errors[index] = error
+
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=10)
+        return results, errors
+
+    def slow(self, calls, result=None, error=None):
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            if error is not None:
+                raise error
+            return result if result is not None else object()
+        return compute
+
+    def test_concurrent_calls_share_result(self):
+        """Тест: одновременные вызовы с одним ключом выполняют вычисление один раз"""
+        calls = []
+        results, errors = self.run_concurrently('report', self.slow(calls))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(errors, [None] * 8)
+        self.assertTrue(all(result is results[0] for result in results))
+        stats = singleflight.get_stats()
+        self.assertEqual((stats['executions'], stats['shared'], stats['saved'], stats['in_flight']), (1, 7, 7, 0))
+
+        # Следующий вызов после завершения вычисляет заново
+        singleflight.run('report', self.slow(calls))
+        self.assertEqual(len(calls), 2)
+
+    def test_error_shared(self):
+        """Тест: ошибка ведущего вызова получают все ожидающие"""
+        calls = []
+        _, errors = self.run_concurrently('failing', self.slow(calls, error=ValueError('boom')), count=4)
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(isinstance(error, ValueError) for error in errors))
+
+    @override_settings(DDS_SINGLEFLIGHT=False)
+    def test_disabled(self):
+        """Тест: с DDS_SINGLEFLIGHT=False каждый вызов выполняется"""
+        calls = []
+        self.run_concurrently('report', self.slow(calls), count=3)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(singleflight.get_stats()['saved'], 0)
+
+    @skipUnless(singleflight.fcntl is not None, 'Нет блокировок файлов (fcntl)')
+    def test_result_shared_across_workers(self):
+        """Тест: процесс, ждавший блокировку файла, берет результат ее владельца"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with override_settings(DDS_SINGLEFLIGHT_LOCK_DIR=directory.name):
+            calls = []
+            singleflight.run('warmup', self.slow(calls, result='warmup'))
+            bucket = int(hashlib.md5(b'report').hexdigest(), 16) % singleflight.BUCKETS
+            path = os.path.join(directory.name, f'{bucket:03d}')
+            # Блокировку держит "другой процесс" - отдельно открытый файл
+            holder = open(path + '.lock', 'a+b')
+            self.addCleanup(holder.close)
+            singleflight.fcntl.flock(holder, singleflight.fcntl.LOCK_EX)
+
+            results = []
+            waiter = threading.Thread(target=lambda: results.append(singleflight.run('report', self.slow(calls))))
+            waiter.start()
+            time.sleep(0.1)
+            singleflight.write_result(path + '.result', 'report', {'total': '10.00'})
+            holder.close()
+            waiter.join(timeout=10)
+
+        self.assertEqual(results, [{'total': '10.00'}])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(singleflight.get_stats()['shared_workers'], 1)
+
+    def test_views_use_normalized_key(self):
+        """Тест: список и отчет регистрируют вычисление по нормализованным параметрам"""
+        cache.clear()
+        status = Status.objects.create(name='Бизнес')
+        expense = TransactionType.objects.create(name='Списание')
+        category = Category.objects.create(name='Маркетинг', transaction_type=expense)
+        subcategory = Subcategory.objects.create(name='Avito', category=category)
+        Transaction.objects.create(date=date(2024, 5, 1), status=status, transaction_type=expense,
+                                   category=category, subcategory=subcategory, amount='100.00')
+        with mock.patch.object(singleflight, 'run', wraps=singleflight.run) as run:
+            response = self.client.get(reverse('transaction_list'), {'status': status.pk, 'category': ''})
+            self.assertContains(response, 'Avito')
+            self.client.get(reverse('transaction_list'), {'status': status.pk})
+            self.client.get(reverse('pivot_report'), {'date_from': '2024-01-01', 'date_to': '2024-12-31'})
+        keys = [call.args[0] for call in run.call_args_list]
+        self.assertEqual(len(keys), 3)
+        self.assertEqual(keys[0], keys[1])
+        self.assertIn(':pivot:', keys[2])
+        stats = self.client.get(reverse('singleflight_stats')).json()
+        self.assertEqual(stats['executions'], 3)
+
+
+class ListSortingTests(TestCase):
+    """Тесты сортировки, фильтра по сумме и страниц списка транзакций"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.statuses = [Status.objects.create(name=name) for name in ('Личное', 'Бизнес')]
+        self.expense = TransactionType.objects.create(name='Списание')
+        self.categories = [Category.objects.create(name=name, transaction_type=self.expense)
+                           for name in ('Маркетинг', 'Аренда')]
+        self.subcategories = [Subcategory.objects.create(name=f'Подкатегория {category.name}', category=category)
+                              for category in self.categories]
+        self.transactions = []
+        for index in range(10):
+            category = index % 2
+            self.transactions.append(Transaction.objects.create(
+                date=date(2024, 5, 1 + index // 3), status=self.statuses[index % 2 if index < 5 else 1 - index % 2],
+                transaction_type=self.expense, category=self.categories[category],
+                subcategory=self.subcategories[category], amount=Decimal(100 * ((index * 7) % 10 + 1)),
+            ))
+
+    def row_ids(self, response):
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return [int(pk) for pk in re.findall(r'id="transaction-(\d+)"', content.decode())]
+
+    def expected(self, key, reverse_order=False, transactions=None):
+        return [transaction.pk for transaction in sorted(transactions or self.transactions, key=key,
+                                                         reverse=reverse_order)]
+
+    def test_sorts(self):
+        """Тест порядка строк для каждой сортировки"""
+        by_date = lambda transaction: (transaction.date, transaction.pk)
+        by_amount = lambda transaction: (transaction.base_amount, transaction.pk)
+        cases = {
+            '-date': self.expected(by_date, True),
+            'date': self.expected(by_date),
+            '-amount': self.expected(by_amount, True),
+            'amount': self.expected(by_amount),
+        }
+        for name, order in cases.items():
+            with self.subTest(sort=name):
+                self.assertEqual(self.row_ids(self.client.get(reverse('transaction_list'), {'sort': name})), order)
+
+        # Внутри записи справочника - сначала новые
+        within = lambda transactions: sorted(transactions, key=by_date, reverse=True)
+        for name, field, names in (('category', 'category', ['Аренда', 'Маркетинг']),
+                                   ('status', 'status', ['Бизнес', 'Личное'])):
+            for descending in (False, True):
+                order = []
+                for dictionary_name in (reversed(names) if descending else names):
+                    order += [transaction.pk for transaction in within(self.transactions)
+                              if getattr(transaction, field).name == dictionary_name]
+                sort = f'-{name}' if descending else name
+                with self.subTest(sort=sort):
+                    response = self.client.get(reverse('transaction_list'), {'sort': sort})
+                    self.assertEqual(self.row_ids(response), order)
+
+        # Неизвестная сортировка - по умолчанию
+        response = self.client.get(reverse('transaction_list'), {'sort': 'comment'})
+        self.assertEqual(self.row_ids(response), cases['-date'])
+        self.assertEqual(response.context['sort'], '-date')
+
+    def test_amount_range_filter(self):
+        """Тест фильтра по диапазону суммы в базовой валюте"""
+        response = self.client.get(reverse('transaction_list'),
+                                   {'amount_min': '300', 'amount_max': '600,5', 'sort': 'amount'})
+        amounts = [Transaction.objects.get(pk=pk).base_amount for pk in self.row_ids(response)]
+        self.assertEqual(amounts, [Decimal('300.00'), Decimal('400.00'), Decimal('500.00'), Decimal('600.00')])
+        self.assertEqual(response.context['filters']['amount_max'], '600.5')
+
+        # Нечисловая граница игнорируется
+        self.assertIsNone(get_filters({'amount_min': 'abc', 'amount_max': 'NaN'})['amount_min'])
+        self.assertIsNone(get_filters({'amount_max': 'NaN'})['amount_max'])
+        response = self.client.get(reverse('transaction_list'), {'amount_min': 'abc'})
+        self.assertEqual(len(self.row_ids(response)), 10)
+
+        # Проверка событий журнала сравнивает суммы как числа
+        filters = get_filters({'amount_min': '90', 'amount_max': '1000'})
+        self.assertTrue(matches_filters({'base_amount': '100.00'}, filters))
+        self.assertFalse(matches_filters({'base_amount': '1000.01'}, filters))
+        self.assertFalse(matches_filters({'base_amount': '80.00'}, filters))
+
+    @override_settings(DDS_LIST_PAGE_SIZE=3)
+    def test_keyset_pages(self):
+        """Тест: страницы по ключу проходят все строки без повторов для каждой сортировки"""
+        for name in SORTS:
+            with self.subTest(sort=name):
+                full = self.row_ids(self.client.get(reverse('transaction_list'), {'sort': name, 'stream': '1'}))
+                self.assertEqual(len(full), 10)
+                pages = []
+                params = {'sort': name}
+                url = reverse('transaction_list') + '?' + urlencode(params)
+                while url:
+                    response = self.client.get(url)
+                    rows = self.row_ids(response)
+                    self.assertLessEqual(len(rows), 3)
+                    pages += rows
+                    next_query = response.context.get('next_query')
+                    url = reverse('transaction_list') + '?' + next_query if next_query else None
+                self.assertEqual(pages, full)
+
+        # Страница с фильтром продолжает его, поврежденный ключ - первая страница
+        response = self.client.get(reverse('transaction_list'), {'sort': 'amount', 'category': self.categories[0].pk})
+        self.assertIn('category=', response.context['next_query'])
+        first = self.row_ids(response)
+        self.assertEqual(self.row_ids(self.client.get(reverse('transaction_list'), {'after': '%%%'})),
+                         self.row_ids(self.client.get(reverse('transaction_list'))))
+        self.assertEqual(len(first), 3)
+
+    @skipUnless(connection.vendor == 'sqlite', 'План запроса SQLite')
+    def test_plans_without_temp_sort(self):
+        """Тест: каждая сортировка с каждым фильтром и ключом страницы читает индекс без сортировки выборки"""
+        values = {'date_from': '2024-01-01', 'date_to': '2024-12-31', 'status': str(self.statuses[0].pk),
+                  'transaction_type': str(self.expense.pk), 'category': str(self.categories[0].pk),
+                  'subcategory': str(self.subcategories[0].pk), 'amount_min': '100', 'amount_max': '900'}
+        self.assertEqual(set(values), set(TRANSACTION_FILTERS))
+        combinations = [{}] + [{name: value} for name, value in values.items()] + [values]
+        with tenant_context(default_organization_id()):
+            for name, sort in SORTS.items():
+                cursor_values = sort.values(self.transactions[4])
+                for filters in combinations:
+                    for cursor in (False, True):
+                        transactions = sort.transactions(filters).select_related(
+                            'status', 'transaction_type', 'category', 'subcategory', 'anomaly'
+                        )
+                        if cursor:
+                            transactions = transactions.filter(sort.after(cursor_values))
+                        plan = transactions[:101].explain()
+                        with self.subTest(sort=name, filters=sorted(filters), cursor=cursor):
+                            self.assertNotIn('TEMP B-TREE', plan)
+
+
+class OptimisticConcurrencyTests(TestCase):
+    """Тесты записи с проверкой версии"""
+
+    def setUp(self):
+        cache.clear()
+        rates.reset()
+        self.addCleanup(rates.reset)
+        self.client = Client()
+        self.status = Status.objects.create(name='Бизнес')
+        self.expense = TransactionType.objects.create(name='Списание')
+        self.marketing = Category.objects.create(name='Маркетинг', transaction_type=self.expense)
+        self.avito = Subcategory.objects.create(name='Avito', category=self.marketing)
+        self.transaction = Transaction.objects.create(
+            date=date(2024, 5, 1), status=self.status, transaction_type=self.expense, category=self.marketing,
+            subcategory=self.avito, amount=Decimal('100.00'), comment='Исходный',
+        )
+
+    def form_data(self, **changes):
+        data = {
+            'date': '2024-05-01', 'status': self.status.pk, 'transaction_type': self.expense.pk,
+            'category': self.marketing.pk, 'subcategory': self.avito.pk, 'amount': '100.00', 'currency': 'RUB',
+            'comment': 'Исходный', 'version': 1,
+        }
+        data.update(changes)
+        return data
+
+    def test_stale_save_conflicts(self):
+        """Тест: запись устаревшей копии - один условный UPDATE, который ничего не затирает"""
+        mine = Transaction.objects.get(pk=self.transaction.pk)
+        theirs = Transaction.objects.get(pk=self.transaction.pk)
+        theirs.comment = 'Чужая правка'
+        with CaptureQueriesContext(connection) as queries:
+            theirs.save()
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "dds_app_transaction"')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"version" = ', updates[0].split('WHERE')[1])
+        self.assertEqual(theirs.version, 2)
+
+        mine.amount = Decimal('500.00')
+        with self.assertRaises(ConflictError), atomic():
+            mine.save()
+        self.transaction.refresh_from_db()
+        self.assertEqual((self.transaction.amount, self.transaction.comment, self.transaction.version),
+                         (Decimal('100.00'), 'Чужая правка', 2))
+        # Итоги бюджета не изменились
+        self.assertEqual(MonthlyAggregate.objects.get(subcategory=self.avito).total_cents, 10000)
+
+        # Частичная запись тоже увеличивает версию
+        theirs.save(update_fields=['comment'])
+        self.assertEqual(Transaction.objects.get(pk=self.transaction.pk).version, 3)
+
+    def test_edit_conflict_shows_diff(self):
+        """Тест: правка поверх чужой показывает разницу, повторная отправка записывает свои значения"""
+        url = reverse('transaction_edit', args=[self.transaction.pk])
+        self.assertContains(self.client.get(url), 'name="version" value="1"')
+
+        # Другой оператор успел сохранить
+        response = self.client.post(url, self.form_data(comment='Чужая правка', amount='150.00'))
+        self.assertEqual(response.status_code, 302)
+
+        response = self.client.post(url, self.form_data(amount='200.00'))
+        self.assertEqual(response.status_code, 409)
+        self.assertContains(response, 'Запись изменил другой пользователь', status_code=409)
+        diff = {row['label']: (row['current'], row['mine']) for row in response.context['conflict']}
+        self.assertEqual(diff, {'Сумма': ('150.00', '200.00'), 'Комментарий': ('Чужая правка', 'Исходный')})
+        self.assertContains(response, 'name="version" value="2"', status_code=409)
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.amount, Decimal('150.00'))
+
+        # Подтверждение с новой версией
+        response = self.client.post(url, self.form_data(amount='200.00', version=2))
+        self.assertEqual(response.status_code, 302)
+        self.transaction.refresh_from_db()
+        self.assertEqual((self.transaction.amount, self.transaction.version), (Decimal('200.00'), 3))
+
+        # Без поля версии проверяется версия, прочитанная запросом
+        data = self.form_data(amount='250.00')
+        del data['version']
+        self.assertEqual(self.client.post(url, data).status_code, 302)
+
+    def test_dictionary_edit_conflict(self):
+        """Тест конфликта при правке записи справочника"""
+        url = reverse('edit_dictionary_item', args=['category', self.marketing.pk])
+        self.assertEqual(self.client.post(url, {'name': 'Реклама', 'transaction_type': self.expense.pk,
+                                                'version': 1}).status_code, 302)
+        response = self.client.post(url, {'name': 'Продвижение', 'transaction_type': self.expense.pk,
+                                          'version': 1})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.context['conflict'],
+                         [{'label': 'Название категории', 'mine': 'Продвижение', 'current': 'Реклама'}])
+        self.assertEqual(Category.objects.get(pk=self.marketing.pk).name, 'Реклама')
+
+        # Запись удалена после чтения - сообщение и возврат к справочникам
+        url = reverse('edit_dictionary_item', args=['status', self.status.pk])
+        with mock.patch.object(Status, '_do_update', side_effect=ConflictError(self.status)), \
+                mock.patch('dds_app.views.current_version', return_value=None):
+            response = self.client.post(url, {'name': 'Налоги', 'version': 1})
+        self.assertRedirects(response, reverse('dictionaries'))
+
+    def test_bulk_update_checks_versions(self):
+        """Тест массовой записи: пачка - один UPDATE, устаревшие строки не записываются"""
+        statuses = [self.status] + [Status.objects.create(name=f'Статус {index}') for index in range(4)]
+        for status in statuses:
+            status.name += ' (новое)'
+        with CaptureQueriesContext(connection) as queries:
+            written, stale = bulk_update_versioned(statuses[:2], ['name'])
+        self.assertEqual((len(written), stale), (2, []))
+        self.assertEqual(sum(query['sql'].startswith('UPDATE') for query in queries), 1)
+        self.assertEqual(Status.objects.get(pk=self.status.pk).version, 2)
+
+        Status.objects.filter(pk=statuses[3].pk).update(name='Чужое', version=F('version') + 1)
+        written, stale = bulk_update_versioned(statuses[2:], ['name'])
+        self.assertEqual([status.pk for status in stale], [statuses[3].pk])
+        self.assertEqual(len(written), 2)
+        self.assertEqual(Status.objects.get(pk=statuses[3].pk).name, 'Чужое')
+        self.assertEqual(Status.objects.get(pk=statuses[4].pk).name, 'Статус 3 (новое)')
+
+    def test_recompute_rereads_concurrent_edit(self):
+        """Тест: пересчет курса не затирает правку, сделанную после чтения"""
+        ExchangeRate.objects.create(currency='USD', date=date(2024, 1, 1), rate=Decimal('90'))
+        usd = Transaction.objects.create(
+            date=date(2024, 1, 15), status=self.status, transaction_type=self.expense, category=self.marketing,
+            subcategory=self.avito, amount=Decimal('10.00'), currency='USD',
+        )
+
+        def edit_then_write(objs, fields):
+            if write.call_count == 1:
+                # Правка со старым курсом между чтением и записью пересчета
+                Transaction._base_manager.filter(pk=usd.pk).update(
+                    amount=Decimal('20.00'), base_amount=Decimal('1800.00'), version=F('version') + 1,
+                )
+            return bulk_update_versioned(objs, fields)
+
+        rate = ExchangeRate.objects.get(currency='USD')
+        rate.rate = Decimal('100')
+        with mock.patch.object(concurrency, 'bulk_update_versioned', side_effect=edit_then_write) as write:
+            rate.save()
+        # Устаревшая строка перечитана и записана вторым проходом
+        self.assertEqual(write.call_count, 2)
+        usd.refresh_from_db()
+        self.assertEqual((usd.amount, usd.base_amount, usd.version), (Decimal('20.00'), Decimal('2000.00'), 3))
+
+    def test_taxonomy_rename_conflict(self):
+        """Тест: переименование из таксономии не затирает правку, сделанную после планирования"""
+        statuses, types = parse_taxonomy({'statuses': [{'name': 'Личное', 'was': ['Бизнес']}]})
+        diff = plan_taxonomy(statuses, types)
+        status = Status.objects.get(pk=self.status.pk)
+        status.name = 'Бизнес и налоги'
+        status.save()
+        with self.assertRaises(TaxonomyError):
+            apply_taxonomy(diff)
+        self.assertEqual(Status.objects.get(pk=self.status.pk).name, 'Бизнес и налоги')
+
+
+METRICS_SCRIPT = '''
+import os
+import django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dds_management.settings')
+django.setup()
+from dds_app import metrics
+metrics.REQUESTS.inc(5, view='transaction_list', method='GET', status='200')
+metrics.LATENCY.observe(0.3, view='transaction_list')
+'''
+
+
+class MetricsTests(TestCase):
+    """Тесты метрик запросов (/metrics)"""
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.client = Client()
+        status = Status.objects.create(name='Бизнес')
+        expense = TransactionType.objects.create(name='Списание')
+        category = Category.objects.create(name='Маркетинг', transaction_type=expense)
+        subcategory = Subcategory.objects.create(name='Avito', category=category)
+        for day in range(1, 4):
+            Transaction.objects.create(date=date(2024, 5, day), status=status, transaction_type=expense,
+                                       category=category, subcategory=subcategory, amount=Decimal('100'))
+
+    def samples(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_request_metrics(self):
+        """Тест счетчиков и гистограмм по представлениям"""
+        self.client.get(reverse('transaction_list'))
+        url = reverse('dictionary_items', args=['status'])
+        self.client.get(url)
+        self.client.get(url)
+        self.client.get('/missing/')
+        samples = self.samples()
+
+        self.assertEqual(samples['dds_http_requests_total{view="transaction_list",method="GET",status="200"}'], 1)
+        self.assertEqual(samples['dds_http_requests_total{view="dictionary_items",method="GET",status="200"}'], 2)
+        self.assertEqual(samples['dds_http_requests_total{view="unmatched",method="GET",status="404"}'], 1)
+        # Корзины накопительные, +Inf совпадает с числом наблюдений
+        buckets = [value for name, value in samples.items()
+                   if name.startswith('dds_http_request_duration_seconds_bucket{view="transaction_list"')]
+        self.assertEqual(buckets, sorted(buckets))
+        self.assertEqual(buckets[-1], samples['dds_http_request_duration_seconds_count{view="transaction_list"}'])
+        self.assertGreater(samples['dds_db_queries_per_request_sum{view="transaction_list"}'], 0)
+        self.assertEqual(samples['dds_db_rows_per_request_sum{view="transaction_list"}'], 3)
+        # Второй запрос панели - из кэша, строки не читаются
+        self.assertEqual(samples['dds_db_rows_per_request_sum{view="dictionary_items"}'], 1)
+        self.assertEqual(samples['dds_db_rows_per_request_bucket{view="dictionary_items",le="0.0"}'], 1)
+        self.assertGreaterEqual(samples['dds_cache_lookups_total{view="dictionary_items",result="hit"}'], 1)
+        self.assertEqual(samples['dds_cache_hit_ratio_bucket{view="dictionary_items",le="1.0"}'], 2)
+
+    def test_streaming_response(self):
+        """Тест: строки и запросы потокового ответа считаются после выхода из представления"""
+        response = self.client.get(reverse('transactions_feed'))
+        self.assertEqual(len(json.loads(b''.join(response.streaming_content))), 3)
+        samples = self.samples()
+        self.assertEqual(samples['dds_db_rows_per_request_sum{view="transactions_feed"}'], 3)
+        self.assertGreaterEqual(samples['dds_db_queries_per_request_sum{view="transactions_feed"}'], 1)
+        self.assertEqual(samples['dds_http_requests_total{view="transactions_feed",method="GET",status="200"}'], 1)
+
+    def test_threads_and_workers(self):
+        """Тест суммирования значений потоков и процессов"""
+        def work():
+            for _ in range(1000):
+                metrics.REQUESTS.inc(view='transaction_list', method='GET', status='200')
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        key = 'dds_http_requests_total{view="transaction_list",method="GET",status="200"}'
+        self.assertEqual(self.samples()[key], 4000)
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(DDS_METRICS_DIR=directory):
+            subprocess.run([sys.executable, '-c', METRICS_SCRIPT], cwd=settings.BASE_DIR, check=True,
+                           env=dict(os.environ, DDS_METRICS_DIR=directory))
+            samples = self.samples()
+        self.assertEqual(samples[key], 4005)
+        self.assertEqual(samples['dds_http_request_duration_seconds_bucket{view="transaction_list",le="0.25"}'], 0)
+        self.assertEqual(samples['dds_http_request_duration_seconds_bucket{view="transaction_list",le="0.5"}'], 1)
+
+
+class DatabaseMaintenanceTests(TransactionTestCase):
+    """Тесты команды обслуживания базы (maintain_database)"""
+
+    def setUp(self):
+        status = Status.objects.create(name='Бизнес')
+        expense = TransactionType.objects.create(name='Списание')
+        self.category = category = Category.objects.create(name='Маркетинг', transaction_type=expense)
+        subcategory = Subcategory.objects.create(name='Avito', category=category)
+        Transaction.objects.bulk_create(fill_base_amounts([
+            Transaction(date=date(2024, 1, 1) + timedelta(days=index % 365), status=status, transaction_type=expense,
+                        category=category, subcategory=subcategory, amount=Decimal(index + 1), comment='x' * 200)
+            for index in range(3000)
+        ]))
+
+    def maintain(self, *args):
+        out = StringIO()
+        call_command('maintain_database', '--repeat=1', *args, stdout=out)
+        return out.getvalue()
+
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_analyze_vacuum_and_report(self):
+        """Тест: статистика, очистка порциями и отчет по таблицам и индексам"""
+        output = self.maintain('--vacuum-seconds=0')
+        self.assertIn('Incremental vacuum', self.maintain('--skip-timings'))
+        self.assertIn('auto_vacuum=none', output)
+        self.assertIn('Integrity check passed', output)
+        self.assertRegex(output, r'(?m)^table .* dds_app_transaction$')
+        self.assertRegex(output, r'(?m)^index .* transaction_org_amount_idx$')
+        self.assertRegex(output, r'list, newest first\s+[\d.]+ ms\s+[\d.]+ ms')
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM sqlite_stat1 WHERE tbl = 'dds_app_transaction'")
+            self.assertGreater(cursor.fetchone()[0], 0)
+
+        self.assertIn('switched to incremental', self.maintain('--enable-incremental', '--skip-timings'))
+        self.assertEqual(self.pragma('auto_vacuum'), 2)
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM dds_app_transaction')
+        free = self.pragma('freelist_count')
+        self.assertGreater(free, 16)
+        output = self.maintain('--skip-analyze', '--skip-timings', '--slice-pages=8', '--pause=0')
+        slices = int(re.search(r'(\d+) pages freed in (\d+) slices', output).group(2))
+        self.assertGreaterEqual(slices, free // 8)
+        self.assertEqual(self.pragma('freelist_count'), 0)
+
+    def test_integrity_failure(self):
+        """Тест: нарушенный внешний ключ - ошибка команды"""
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA foreign_keys = OFF')
+            cursor.execute('UPDATE dds_app_subcategory SET category_id = 999999')
+            cursor.execute('PRAGMA foreign_keys = ON')
+        err = StringIO()
+        with self.assertRaisesMessage(CommandError, 'Integrity check failed: 1 problems'):
+            call_command('maintain_database', '--skip-timings', '--vacuum-seconds=0', stdout=StringIO(), stderr=err)
+        self.assertIn('dds_app_subcategory', err.getvalue())
+        Subcategory._base_manager.update(category_id=self.category.pk)
@@ -3,6 +3,7 @@ from . import views
 
 urlpatterns = [
     path('', views.transaction_list, name='transaction_list'),
+    path('transaction/events/', views.transaction_events, name='transaction_events'),
     path('transaction/create/', views.transaction_create, name='transaction_create'),
     path('transaction/<int:pk>/edit/', views.transaction_edit, name='transaction_edit'),
     path('transaction/<int:pk>/delete/', views.transaction_delete, name='transaction_delete'),
@@ -12,6 +13,31 @@ urlpatterns = [
     path('dictionaries/<str:model_name>/<int:pk>/edit/', views.edit_dictionary_item, name='edit_dictionary_item'),
     path('dictionaries/<str:model_name>/<int:pk>/delete/', views.delete_dictionary_item, name='delete_dictionary_item'),
     
+    path('reports/pivot/', views.pivot_report, name='pivot_report'),
+    
+    path('anomalies/', views.anomaly_queue, name='anomaly_queue'),
+    path('anomalies/<int:pk>/review/', views.anomaly_review, name='anomaly_review'),
+    
+    path('budgets/', views.budget_dashboard, name='budget_dashboard'),
+    path('budgets/<int:pk>/edit/', views.budget_edit, name='budget_edit'),
+    path('budgets/<int:pk>/delete/', views.budget_delete, name='budget_delete'),
+    
+    path('jobs/<str:kind>/create/', views.job_create, name='job_create'),
+    path('jobs/<int:pk>/', views.job_detail, name='job_detail'),
+    path('jobs/<int:pk>/download/', views.job_download, name='job_download'),
+    
     path('api/categories/by-type/', views.get_categories_by_type, name='get_categories_by_type'),
     path('api/subcategories/by-category/', views.get_subcategories_by_category, name='get_subcategories_by_category'),
+    path('api/transactions/', views.transactions_feed, name='transactions_feed'),
+    path('api/autocomplete/<str:name>/', views.autocomplete, name='autocomplete'),
+    path('api/dictionaries/<str:name>/', views.dictionary_items, name='dictionary_items'),
+    path('api/cache/stats/', views.cache_stats, name='cache_stats'),
+    path('api/admission/stats/', views.admission_stats, name='admission_stats'),
+    path('api/singleflight/stats/', views.singleflight_stats, name='singleflight_stats'),
+    path('api/changes/', views.changes_feed, name='changes_feed'),
+    path('api/changes/snapshot/', views.changes_snapshot, name='changes_snapshot'),
+    path('api/ledger/snapshot/', views.ledger_snapshot, name='ledger_snapshot'),
+    path('api/jobs/<int:pk>/', views.job_status, name='job_status'),
+    
+    path('metrics', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -1,33 +1,57 @@
+import asyncio
+import csv
+import tempfile
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
+from django.views.decorators.http import require_POST
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.db.models import Q
-from .models import Transaction, Status, TransactionType, Category, Subcategory
-from .forms import TransactionForm, StatusForm, TransactionTypeForm, CategoryForm, SubcategoryForm
+from django.db.transaction import atomic
+from django.urls import reverse
+from django.core.paginator import Paginator
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+from .models import Transaction, Status, TransactionType, Category, Subcategory, Job, Budget, AmountAnomaly
+from .forms import (
+    TransactionForm, StatusForm, TransactionTypeForm, CategoryForm, SubcategoryForm, PivotReportForm, BudgetForm,
+)
 from django.contrib import messages
+from .cache import cached_response, generation_key, get_stats, make_key, normalize_params
+from .filters import get_filters, filter_transactions
+from .ordering import DEFAULT_SORT, SORTS, get_page
+from .concurrency import ConflictError, conflict_diff, current_version
+from .reports import get_pivot, pivot_rows
+from .events import broadcaster, format_event, replay_events
+from .streaming import get_chunk_size, render_rows, stream_page, aiter_sync
+from . import metrics, singleflight
+from .ledger_snapshot import write_ledger_snapshot
+from .changelog import changes_since, write_snapshot, get_floor, DEFAULT_BATCH_SIZE, MAX_BATCH_SIZE
+from .jobs import enqueue, is_available, job_title
+from .autocomplete import INDEXES, DEFAULT_LIMIT, MAX_LIMIT, get_index, use_autocomplete
+from .budgets import budget_rows, parse_month, refresh_budget
+from .admission import get_stats as get_admission_stats
+from .serialization import CATEGORY, SUBCATEGORY, TRANSACTION, json_rows_response
+from .dictionaries import DICTIONARIES, DICTIONARY_MODELS, PAGE_SIZE, MAX_PAGE_SIZE
+
+# Модели, от которых зависят строки списка транзакций
+LIST_MODELS = (Transaction, Status, TransactionType, Category, Subcategory)
+
+def render_page(transactions, sort, cursor):
+    rows, next_cursor = get_page(transactions, sort, cursor)
+    return mark_safe(''.join(render_rows(rows, get_chunk_size()))), next_cursor
 
 def transaction_list(request):
-    transactions = Transaction.objects.all()
-    
-    # Фильтрация
-    date_from = request.GET.get('date_from')
-    date_to = request.GET.get('date_to')
-    status_id = request.GET.get('status')
-    transaction_type_id = request.GET.get('transaction_type')
-    category_id = request.GET.get('category')
-    subcategory_id = request.GET.get('subcategory')
-    
-    if date_from:
-        transactions = transactions.filter(date__gte=date_from)
-    if date_to:
-        transactions = transactions.filter(date__lte=date_to)
-    if status_id:
-        transactions = transactions.filter(status_id=status_id)
-    if transaction_type_id:
-        transactions = transactions.filter(transaction_type_id=transaction_type_id)
-    if category_id:
-        transactions = transactions.filter(category_id=category_id)
-    if subcategory_id:
-        transactions = transactions.filter(subcategory_id=subcategory_id)
+    # Фильтрация и сортировка по индексу (dds_app.ordering)
+    filters = get_filters(request.GET)
+    sort_name = request.GET.get('sort') if request.GET.get('sort') in SORTS else DEFAULT_SORT
+    sort = SORTS[sort_name]
+    transactions = sort.transactions(filters).select_related(
+        'status', 'transaction_type', 'category', 'subcategory', 'anomaly'
+    )
+    streaming = bool(request.GET.get('stream'))
     
     context = {
         'transactions': transactions,
@@ -35,23 +59,50 @@ def transaction_list(request):
         'transaction_types': TransactionType.objects.all(),
         'categories': Category.objects.all(),
         'subcategories': Subcategory.objects.all(),
-        'filters': {
-            'date_from': date_from,
-            'date_to': date_to,
-            'status': status_id,
-            'transaction_type': transaction_type_id,
-            'category': category_id,
-            'subcategory': subcategory_id,
-        }
+        # Блок фильтров кэшируется до изменения справочников (см. шаблон)
+        'filters_generation': generation_key(Status, TransactionType, Category),
+        'filters': filters,
+        'sort': sort_name,
+        'sorts': [(name, option.title) for name, option in SORTS.items()],
+        'streaming': streaming,
     }
+    if use_autocomplete('category'):
+        # Большой справочник: вместо <select> со всеми категориями - автодополнение
+        context['category_autocomplete'] = True
+        category = filters['category'] or ''
+        context['category_label'] = get_index('category').get_name(int(category)) if category.isdigit() else ''
+    if streaming:
+        # Потоковый режим для больших периодов: шапка уходит сразу,
+        # строки - пачками по мере чтения из базы
+        chunks = stream_page(request, 'dds_app/transaction_list.html', context, transactions)
+        if isinstance(request, ASGIRequest):
+            chunks = aiter_sync(chunks)
+        return StreamingHttpResponse(chunks, content_type='text/html; charset=utf-8')
+    # Строки страницы одинаковы для всех пользователей: одновременные запросы
+    # с теми же фильтрами, сортировкой и страницей ждут одно вычисление (dds_app.singleflight)
+    cursor = request.GET.get('after') or None
+    key = make_key('transaction_list', normalize_params(dict(filters, sort=sort_name, after=cursor)), LIST_MODELS)
+    context['rows'], next_cursor = singleflight.run(key, lambda: render_page(transactions, sort, cursor))
+    if next_cursor:
+        query = request.GET.copy()
+        query['after'] = next_cursor
+        context['next_query'] = query.urlencode()
+    if cursor:
+        query = request.GET.copy()
+        del query['after']
+        context['first_query'] = query.urlencode()
     return render(request, 'dds_app/transaction_list.html', context)
 
 def transaction_create(request):
     if request.method == 'POST':
-        form = TransactionForm(request.POST)
+        # Дубль по отпечатку сохраняется только после явного подтверждения
+        form = TransactionForm(request.POST, allow_duplicate=bool(request.POST.get('confirm_duplicate')))
         if form.is_valid():
-            form.save()
+            # Запись и журнал изменений фиксируются вместе
+            with atomic():
+                transaction = form.save()
             messages.success(request, 'Транзакция успешно создана!')
+            warn_budget_overruns(request, transaction)
             return redirect('transaction_list')
     else:
         form = TransactionForm()
@@ -62,15 +113,42 @@ def transaction_create(request):
     }
     return render(request, 'dds_app/transaction_form.html', context)
 
+def resolve_conflict(request, form, **kwargs):
+    """Форма после конфликта версий: отправленные значения поверх текущей версии записи.
+
+    Возвращает (форма, разница с текущими значениями) или None, если запись удалена.
+    """
+    current = current_version(form.instance)
+    if current is None:
+        return None
+    data = request.POST.copy()
+    data['version'] = current.version
+    return type(form)(data, instance=current, **kwargs), conflict_diff(form, current)
+
 # Редактирование транзакций
 def transaction_edit(request, pk):
     transaction = get_object_or_404(Transaction, pk=pk)
     
     if request.method == 'POST':
-        form = TransactionForm(request.POST, instance=transaction)
+        allow_duplicate = bool(request.POST.get('confirm_duplicate'))
+        form = TransactionForm(request.POST, instance=transaction, allow_duplicate=allow_duplicate)
         if form.is_valid():
-            form.save()
+            try:
+                # Запись и журнал изменений фиксируются вместе
+                with atomic():
+                    transaction = form.save()
+            except ConflictError:
+                # Транзакцию изменили после открытия формы - показываем разницу
+                resolved = resolve_conflict(request, form, allow_duplicate=allow_duplicate)
+                if resolved is None:
+                    messages.error(request, 'Транзакция удалена другим пользователем')
+                    return redirect('transaction_list')
+                form, conflict = resolved
+                context = {'form': form, 'title': 'Редактирование транзакции', 'transaction': form.instance,
+                           'conflict': conflict}
+                return render(request, 'dds_app/transaction_form.html', context, status=409)
             messages.success(request, 'Транзакция успешно обновлена!')
+            warn_budget_overruns(request, transaction)
             return redirect('transaction_list')
     else:
         form = TransactionForm(instance=transaction)
@@ -90,7 +168,8 @@ def transaction_delete(request, pk):
     transaction = get_object_or_404(Transaction, pk=pk)
     
     if request.method == 'POST':
-        transaction.delete()
+        with atomic():
+            transaction.delete()
         messages.success(request, 'Транзакция успешно удалена!')
         return redirect('transaction_list')
     
@@ -99,18 +178,19 @@ def transaction_delete(request, pk):
     }
     return render(request, 'dds_app/transaction_confirm_delete.html', context)
 
-# Справочники
+def warn_budget_overruns(request, transaction):
+    for budget in getattr(transaction, 'budget_overruns', ()):
+        messages.warning(request, f'Превышен бюджет: {budget.subcategory or budget.category} '
+                                  f'за {budget.month:%m.%Y} ({budget.amount:.2f} руб.)')
+    if getattr(transaction, 'amount_anomaly', None):
+        messages.warning(request, f'Необычно большая сумма для подкатегории {transaction.subcategory}: '
+                                  f'транзакция добавлена в очередь проверки')
+
+# Справочники: только заготовки панелей, строки загружает dictionary_items
 def dictionaries(request):
-    statuses = Status.objects.all().order_by('name')
-    transaction_types = TransactionType.objects.all().order_by('name')
-    categories = Category.objects.all().order_by('transaction_type__name', 'name')
-    subcategories = Subcategory.objects.all().order_by('category__name', 'name')
-    
     context = {
-        'statuses': statuses,
-        'transaction_types': transaction_types,
-        'categories': categories,
-        'subcategories': subcategories,
+        'dictionaries': [(name, dictionary) for name, dictionary in DICTIONARIES.items()],
+        'page_size': PAGE_SIZE,
     }
     return render(request, 'dds_app/dictionaries.html', context)
 
@@ -131,7 +211,9 @@ def add_dictionary_item(request, model_name):
     if request.method == 'POST':
         form = form_class(request.POST)
         if form.is_valid():
-            form.save()
+            # Запись и журнал изменений фиксируются вместе
+            with atomic():
+                form.save()
             messages.success(request, f'{model._meta.verbose_name} успешно добавлен!')
             return redirect('dictionaries')
     else:
@@ -162,7 +244,19 @@ def edit_dictionary_item(request, model_name, pk):
     if request.method == 'POST':
         form = form_class(request.POST, instance=item)
         if form.is_valid():
-            form.save()
+            try:
+                # Запись и журнал изменений фиксируются вместе
+                with atomic():
+                    form.save()
+            except ConflictError:
+                resolved = resolve_conflict(request, form)
+                if resolved is None:
+                    messages.error(request, f'{model._meta.verbose_name} удален другим пользователем')
+                    return redirect('dictionaries')
+                form, conflict = resolved
+                context = {'form': form, 'model_name': model_name, 'verbose_name': model._meta.verbose_name,
+                           'item': form.instance, 'conflict': conflict}
+                return render(request, 'dds_app/dictionary_form.html', context, status=409)
             messages.success(request, f'{model._meta.verbose_name} успешно обновлен!')
             return redirect('dictionaries')
     else:
@@ -192,7 +286,8 @@ def delete_dictionary_item(request, model_name, pk):
     item = get_object_or_404(model, pk=pk)
     
     if request.method == 'POST':
-        item.delete()
+        with atomic():
+            item.delete()
         messages.success(request, f'{model._meta.verbose_name} успешно удален!')
         return redirect('dictionaries')
     
@@ -203,15 +298,286 @@ def delete_dictionary_item(request, model_name, pk):
     }
     return render(request, 'dds_app/dictionary_confirm_delete.html', context)
 
+# Сводный отчет: категории x месяцы (HTML, ?format=json, ?format=csv)
+def pivot_report(request):
+    form = PivotReportForm(request.GET)
+    output = request.GET.get('format', 'html')
+    report = None
+
+    if form.is_valid():
+        status = form.cleaned_data['status']
+        report = get_pivot(
+            form.cleaned_data['date_from'],
+            form.cleaned_data['date_to'],
+            status.pk if status else None,
+        )
+        if output == 'json':
+            return JsonResponse(report)
+        if output == 'csv':
+            response = HttpResponse(content_type='text/csv; charset=utf-8')
+            response['Content-Disposition'] = 'attachment; filename="pivot_report.csv"'
+            writer = csv.writer(response)
+            writer.writerows(pivot_rows(report))
+            return response
+    elif output in ('json', 'csv'):
+        return JsonResponse({'errors': form.errors}, status=400)
+
+    context = {
+        'form': form,
+        'report': report,
+    }
+    return render(request, 'dds_app/pivot_report.html', context)
+
+# Очередь проверки необычно больших сумм
+def anomaly_queue(request):
+    anomalies = AmountAnomaly.objects.filter(reviewed_at__isnull=True).select_related(
+        'transaction__status', 'transaction__transaction_type', 'transaction__category', 'transaction__subcategory',
+    ).order_by('-detected_at')
+    page = Paginator(anomalies, 50).get_page(request.GET.get('page'))
+    return render(request, 'dds_app/anomaly_queue.html', {'page': page})
+
+@require_POST
+def anomaly_review(request, pk):
+    updated = AmountAnomaly.objects.filter(pk=pk, reviewed_at__isnull=True).update(reviewed_at=timezone.now())
+    if updated:
+        messages.success(request, 'Транзакция отмечена как проверенная')
+    return redirect('anomaly_queue')
+
+# Бюджеты: план и факт за месяц (факт - из месячных итогов, без запросов к транзакциям)
+def budget_dashboard(request):
+    month = parse_month(request.GET.get('month'))
+    if request.method == 'POST':
+        form = BudgetForm(request.POST)
+        if form.is_valid():
+            budget = refresh_budget(form.save())
+            messages.success(request, 'Бюджет успешно добавлен!')
+            return redirect(f"{reverse('budget_dashboard')}?month={budget.month:%Y-%m}")
+    else:
+        form = BudgetForm(initial={'month': month})
+
+    rows = budget_rows(month)
+    context = {
+        'form': form,
+        'month': month,
+        'previous_month': (month - timedelta(days=1)).replace(day=1),
+        'next_month': (month + timedelta(days=31)).replace(day=1),
+        'rows': rows,
+        'total_budget': sum(row['budget'].amount for row in rows if row['budget'].subcategory_id is None),
+        'total_actual': sum(row['actual'] for row in rows if row['budget'].subcategory_id is None),
+        'overrun_count': sum(row['overrun'] for row in rows),
+    }
+    return render(request, 'dds_app/budgets.html', context)
+
+def budget_edit(request, pk):
+    budget = get_object_or_404(Budget, pk=pk)
+
+    if request.method == 'POST':
+        form = BudgetForm(request.POST, instance=budget)
+        if form.is_valid():
+            budget = refresh_budget(form.save())
+            messages.success(request, 'Бюджет успешно обновлен!')
+            return redirect(f"{reverse('budget_dashboard')}?month={budget.month:%Y-%m}")
+    else:
+        form = BudgetForm(instance=budget)
+
+    context = {
+        'form': form,
+        'budget': budget,
+    }
+    return render(request, 'dds_app/budget_form.html', context)
+
+@require_POST
+def budget_delete(request, pk):
+    budget = get_object_or_404(Budget, pk=pk)
+    budget.delete()
+    messages.success(request, 'Бюджет успешно удален!')
+    return redirect(f"{reverse('budget_dashboard')}?month={budget.month:%Y-%m}")
+
+# Фоновые задачи: постановка в очередь, статус и скачивание результата
+@require_POST
+def job_create(request, kind):
+    if kind == 'transactions_csv':
+        params = {name: value for name, value in get_filters(request.POST).items() if value}
+    elif kind == 'pivot_csv':
+        form = PivotReportForm(request.POST)
+        if not form.is_valid():
+            messages.error(request, 'Некорректные параметры отчета')
+            return redirect('pivot_report')
+        status = form.cleaned_data['status']
+        params = {
+            'date_from': form.cleaned_data['date_from'],
+            'date_to': form.cleaned_data['date_to'],
+            'status': status.pk if status else None,
+        }
+    else:
+        return HttpResponse(status=404)
+    job = enqueue(kind, params)
+    messages.success(request, 'Задача поставлена в очередь')
+    return redirect('job_detail', pk=job.pk)
+
+def job_payload(job):
+    return {
+        'id': job.pk,
+        'kind': job.kind,
+        'title': job_title(job),
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'progress': job.progress,
+        'error': job.error,
+        'created_at': job.created_at,
+        'finished_at': job.finished_at,
+        'expires_at': job.expires_at,
+        'download': reverse('job_download', args=[job.pk]) if job.status == Job.STATUS_DONE else None,
+    }
+
+def job_detail(request, pk):
+    job = get_object_or_404(Job, pk=pk)
+    context = {
+        'job': job,
+        'title': job_title(job),
+    }
+    return render(request, 'dds_app/job_detail.html', context)
+
+def job_status(request, pk):
+    job = get_object_or_404(Job, pk=pk)
+    return JsonResponse(job_payload(job))
+
+def job_download(request, pk):
+    job = get_object_or_404(Job, pk=pk, status__in=[Job.STATUS_DONE, Job.STATUS_EXPIRED])
+    if not is_available(job):
+        return HttpResponse('Срок хранения результата истек', status=410)
+    return FileResponse(open(job.result_path, 'rb'), as_attachment=True, filename=job.result_name,
+                        content_type='text/csv; charset=utf-8')
+
 # API views
+@cached_response(Category, keys=['transaction_type_id', 'fields'])
 def get_categories_by_type(request):
     transaction_type_id = request.GET.get('transaction_type_id')
     categories = Category.objects.filter(transaction_type_id=transaction_type_id)
-    data = [{'id': cat.id, 'name': cat.name} for cat in categories]  
-    return JsonResponse(data, safe=False)
+    return json_rows_response(request, categories, CATEGORY)
 
+@cached_response(Subcategory, keys=['category_id', 'fields'])
 def get_subcategories_by_category(request):
     category_id = request.GET.get('category_id')
     subcategories = Subcategory.objects.filter(category_id=category_id)
-    data = [{'id': sub.id, 'name': sub.name} for sub in subcategories]  
-    return JsonResponse(data, safe=False)
\ No newline at end of file
+    return json_rows_response(request, subcategories, SUBCATEGORY)
+
+# Транзакции с фильтрами списка; массив отдается потоком
+def transactions_feed(request):
+    transactions = filter_transactions(Transaction.objects.all(), get_filters(request.GET))
+    return json_rows_response(request, transactions, TRANSACTION, stream=True)
+
+# Страница строк панели справочника с поиском и числом транзакций
+@cached_response(*DICTIONARY_MODELS, keys=['q', 'page', 'limit'])
+def dictionary_items(request, name):
+    if name not in DICTIONARIES:
+        return JsonResponse({'error': 'Неизвестный справочник'}, status=404)
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+        limit = min(max(int(request.GET.get('limit', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'error': 'Параметры page и limit должны быть целыми числами'}, status=400)
+    return JsonResponse(DICTIONARIES[name].page(request.GET.get('q', '').strip(), page, limit))
+
+# Подсказки по названиям из индекса в памяти (dds_app.autocomplete)
+def autocomplete(request, name):
+    if name not in INDEXES:
+        return JsonResponse({'error': 'Неизвестный справочник'}, status=404)
+    index, scope_param = INDEXES[name]
+    try:
+        scope = request.GET.get(scope_param)
+        scope = int(scope) if scope else None
+        limit = min(max(int(request.GET.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+    except ValueError:
+        return JsonResponse({'error': f'Параметры {scope_param} и limit должны быть целыми числами'}, status=400)
+    return JsonResponse(index.search(request.GET.get('q', ''), scope, limit), safe=False)
+
+def cache_stats(request):
+    return JsonResponse(get_stats())
+
+# Заполненность пулов и отказы (счетчики текущего процесса)
+def admission_stats(request):
+    return JsonResponse(get_admission_stats())
+
+# Выполненные и сэкономленные объединением вычисления (счетчики текущего процесса)
+def singleflight_stats(request):
+    return JsonResponse(singleflight.get_stats())
+
+# Счетчики и гистограммы запросов в текстовом формате Prometheus (dds_app.metrics)
+def metrics_view(request):
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# Колоночный снимок транзакций для аналитики (формат - dds_app.ledger_snapshot)
+def ledger_snapshot(request):
+    file = tempfile.TemporaryFile()
+    write_ledger_snapshot(file)
+    file.seek(0)
+    return FileResponse(file, as_attachment=True, filename='ledger.ddsl', content_type='application/octet-stream')
+
+# Журнал изменений для инкрементальной синхронизации
+def changes_feed(request):
+    try:
+        since = int(request.GET.get('since', 0))
+        limit = min(max(int(request.GET.get('limit', DEFAULT_BATCH_SIZE)), 1), MAX_BATCH_SIZE)
+    except ValueError:
+        return JsonResponse({'error': 'Параметры since и limit должны быть целыми числами'}, status=400)
+
+    floor = get_floor()
+    if since < floor:
+        # Часть журнала до since удалена при сжатии - нужен новый снимок
+        return JsonResponse({
+            'error': 'Журнал изменений сжат, загрузите снимок',
+            'floor': floor,
+            'snapshot': reverse('changes_snapshot'),
+        }, status=410)
+
+    changes, last_seq, has_more = changes_since(since, limit)
+    return JsonResponse({'changes': changes, 'last_seq': last_seq, 'has_more': has_more})
+
+def changes_snapshot(request):
+    # Снимок пишется во временный файл и отдается потоком, как колоночный снимок
+    file = tempfile.TemporaryFile()
+    write_snapshot(file)
+    file.seek(0)
+    return FileResponse(file, content_type='application/json')
+
+# Поток изменений списка транзакций (Server-Sent Events)
+EVENTS_HEARTBEAT = 15
+
+async def transaction_events(request):
+    # Под WSGI бесконечный асинхронный поток был бы прочитан целиком в память
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'Поток событий доступен только при запуске через ASGI'}, status=501)
+
+    filters = get_filters(request.GET)
+    last_event_id = request.headers.get('Last-Event-ID')
+    subscription = await broadcaster.subscribe(filters, request.organization_id)
+
+    async def stream():
+        try:
+            yield 'retry: 3000\n\n'
+            if last_event_id:
+                # Клиент переподключился: пропущенные изменения его организации
+                # по его фильтрам досылаются из журнала, если он сохранился
+                since = int(last_event_id) if last_event_id.isdigit() else -1
+                messages = []
+                if since < subscription.start_seq:
+                    messages = await sync_to_async(replay_events)(
+                        since, subscription.start_seq, filters, subscription.organization_id,
+                    )
+                if messages is None:
+                    yield format_event('reload', {})
+                for message in messages or []:
+                    yield message
+            while True:
+                try:
+                    yield await asyncio.wait_for(subscription.queue.get(), EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+        finally:
+            broadcaster.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,13 +42,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "dds_app.middleware.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "dds_app.middleware.AdmissionControlMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
+    "dds_app.middleware.TenantMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "dds_app.middleware.CacheCoherenceMiddleware",
 ]
 
 ROOT_URLCONF = "dds_management.urls"
@@ -63,6 +68,7 @@ TEMPLATES = [
                 "django.template.context_processors.request",
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
+                "dds_app.tenancy.organizations",
             ],
         },
     },
@@ -77,11 +83,80 @@ WSGI_APPLICATION = "dds_management.wsgi.application"
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "NAME": os.environ.get("DDS_DB_PATH", BASE_DIR / "db.sqlite3"),
     }
 }
 
 
+# Cache
+# Ключи кэша представлений и фрагментов включают поколения моделей (dds_app.cache),
+# поэтому записи хранятся без срока жизни и вытесняются по MAX_ENTRIES.
+
+CACHES = {
+    "default": {
+        "BACKEND": "dds_app.cache_backend.StatsLocMemCache",
+        "LOCATION": "dds",
+        "TIMEOUT": None,
+        "OPTIONS": {
+            "MAX_ENTRIES": 1000,
+        },
+    }
+}
+
+
+# Background jobs
+# Результаты фоновых задач (команда run_workers) хранятся на диске
+# DDS_JOB_RESULT_TTL секунд, затем удаляются.
+
+DDS_JOB_RESULTS_DIR = os.environ.get("DDS_JOB_RESULTS_DIR", BASE_DIR / "job_results")
+DDS_JOB_RESULT_TTL = 24 * 60 * 60
+# Обработчик отмечается в выполняемой задаче раз в столько секунд; задачи без
+# отметки дольше --stale-after (run_workers) возвращаются в очередь
+DDS_JOB_HEARTBEAT_INTERVAL = 30
+
+
+# Admission control
+# Ограничения одновременных запросов по пулам (dds_app.admission): limit -
+# одновременно выполняемых, queue - ждущих, timeout - секунд ожидания,
+# reserved - мест только для страниц из браузера. Пустой словарь отключает.
+
+DDS_ADMISSION_POOLS = {
+    "write": {"limit": 2, "queue": 20, "timeout": 5.0, "reserved": 1},
+    "api": {"limit": 4, "queue": 20, "timeout": 2.0, "reserved": 0},
+    "export": {"limit": 1, "queue": 4, "timeout": 1.0, "reserved": 0},
+}
+
+
+# Single-flight
+# Одновременные одинаковые тяжелые чтения (список транзакций, сводный отчет)
+# выполняются один раз (dds_app.singleflight). С каталогом блокировок
+# объединяются и запросы разных процессов.
+
+DDS_SINGLEFLIGHT = True
+DDS_SINGLEFLIGHT_TIMEOUT = 30
+DDS_SINGLEFLIGHT_LOCK_DIR = os.environ.get("DDS_SINGLEFLIGHT_LOCK_DIR") or None
+
+
+# Reports
+# Сводный отчет за период от DDS_PARALLEL_REPORT_MIN_DAYS дней считается по
+# шардам дат в DDS_REPORT_WORKERS процессах (dds_app.parallel_report);
+# 1 - всегда одним запросом. Период длиннее DDS_PIVOT_MAX_MONTHS месяцев
+# форма отчета отклоняет.
+
+DDS_REPORT_WORKERS = min(4, os.cpu_count() or 1)
+DDS_PARALLEL_REPORT_MIN_DAYS = 730
+DDS_PIVOT_MAX_MONTHS = 120
+
+
+# Metrics
+# Счетчики и гистограммы запросов для /metrics (dds_app.metrics). С каталогом
+# процессы gunicorn раз в DDS_METRICS_FLUSH_INTERVAL секунд записывают туда
+# свои значения, и /metrics показывает сумму по всем процессам.
+
+DDS_METRICS_DIR = os.environ.get("DDS_METRICS_DIR") or None
+DDS_METRICS_FLUSH_INTERVAL = 5.0
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -122,3 +197,17 @@ STATIC_URL = "static/"
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# Admin
+# Режим производительности списка транзакций в админке (dds_app.admin):
+# счетчик строк из статистики или кэша и фильтр по периоду вместо
+# date_hierarchy. False - стандартный список с точными счетчиками.
+
+DDS_ADMIN_PERFORMANCE_MODE = True
+
+
+# Transaction list
+# Строк на странице списка транзакций; страницы - по ключу сортировки (dds_app.ordering).
+
+DDS_LIST_PAGE_SIZE = 100